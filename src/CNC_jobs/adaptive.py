@@ -0,0 +1,244 @@
+"""
+Adaptive probing: a coarse grid first, then more points only where the surface isn't known well enough yet.
+
+The full grid (columns by rows, the probe job's grid) is split into cells with probed corners, starting with a
+lattice every `step` points. Between its corners the map is filled in bilinearly, so a cell's error is how far the
+surface bends inside it. Cells are refined by probing their edge midpoints and centre, splitting them in four:
+
+- Before a cell has been split its error is estimated from the curvature at its corners. A second difference on
+  the lattice is h^2 times the second derivative and a bilinear patch is off by about h^2 / 8 times it in the
+  middle, so the estimate is (|second difference in X| + |in Y|) / 8.
+- Once its points are probed the error is measured: how far they are from what the parent cell predicted. The
+  children start with that error. They are half the size so they are usually better than that, but a narrow
+  bump that fell between the parent's corners can make the first split look better than it is.
+
+Refining stops when every cell is below the target error, cells can't be split any more or the point budget is
+used up. The largest errors are refined first so a budget is spent where it helps most.
+"""
+from __future__ import annotations
+
+import heapq
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from src.CNC_jobs.engine import JobContext
+from src.CNC_jobs.paths import PATH_METHODS
+from src.CNC_jobs.paths import plan_path
+from src.CNC_jobs.paths import TOUCH_FEED
+
+COARSE_STEP = 4  # grid points between the first probes
+TARGET_ERROR = 0.002  # mm
+
+Index = Tuple[int, int]  # column, row
+Cell = Tuple[int, int, int, int]  # first column, first row, last column, last row
+
+
+def lattice(count: int, step: int) -> List[int]:
+    """Every step'th index of count, always with the last one"""
+    indices = list(range(0, count, step))
+    if indices[-1] != count - 1:
+        indices.append(count - 1)
+    return indices
+
+
+def spans(indices: List[int]) -> List[Tuple[int, int]]:
+    """Neighbouring pairs of indices, a single index spans itself"""
+    return list(zip(indices, indices[1:])) or [(indices[0], indices[0])]
+
+
+def split_cell(cell: Cell) -> List[Cell]:
+    """The cell split in half along each side that is longer than one grid spacing"""
+    c0, r0, c1, r1 = cell
+    columns = [(c0, (c0 + c1) // 2), ((c0 + c1) // 2, c1)] if c1 - c0 > 1 else [(c0, c1)]
+    rows = [(r0, (r0 + r1) // 2), ((r0 + r1) // 2, r1)] if r1 - r0 > 1 else [(r0, r1)]
+    return [(a, b, c, d) for a, c in columns for b, d in rows]
+
+
+def corners(cell: Cell) -> List[Index]:
+    c0, r0, c1, r1 = cell
+    return [(c0, r0), (c1, r0), (c0, r1), (c1, r1)]
+
+
+class AdaptiveGrid:
+    """
+    Decides which points of a columns by rows grid to probe.
+
+    Call next_points() for the next batch, add() every probed value and repeat until next_points() returns
+    nothing. map() fills in the rest of the grid.
+
+    Args:
+        columns: Columns of the full grid.
+        rows: Rows of the full grid.
+        target_error: Stop refining cells whose estimated error is below this.
+        budget: Most points to probe, None for no limit.
+        step: Grid points between the first probes.
+    """
+
+    def __init__(
+        self,
+        columns: int,
+        rows: int,
+        target_error: float = TARGET_ERROR,
+        budget: Optional[int] = None,
+        step: int = COARSE_STEP,
+    ) -> None:
+        self.columns = columns
+        self.rows = rows
+        self.target_error = target_error
+        self.budget = budget
+        self.step = step
+        self.values: Dict[Index, float] = {}
+        self.errors: Dict[Cell, float] = {}  # leaf cells and their estimated error, nan until estimated
+        self.pending: Dict[Cell, List[Cell]] = {}  # split cells waiting for their new points
+
+        xs, ys = lattice(columns, step), lattice(rows, step)
+        self.coarse = [(c, r) for r in ys for c in xs]
+        for r0, r1 in spans(ys):
+            for c0, c1 in spans(xs):
+                self.errors[(c0, r0, c1, r1)] = np.nan
+        self.started = False
+
+    def add(self, index: Index, value: float) -> None:
+        self.values[index] = value
+
+    def remaining(self) -> Optional[int]:
+        return None if self.budget is None else max(self.budget - len(self.values), 0)
+
+    def next_points(self) -> List[Index]:
+        """The next batch of grid points to probe, empty when done"""
+        if not self.started:
+            self.started = True
+            return self.limit(self.coarse)
+
+        self.measure_pending()
+        if any(np.isnan(error) for error in self.errors.values()):
+            self.estimate_from_curvature()
+
+        batch: List[Index] = []
+        queue = [(-error, cell) for cell, error in self.errors.items() if error > self.target_error]
+        heapq.heapify(queue)
+        while queue:
+            _, cell = heapq.heappop(queue)
+            children = split_cell(cell)
+            if children == [cell]:
+                continue  # already one grid spacing
+            new = sorted({p for child in children for p in corners(child)} - self.values.keys() - set(batch))
+            remaining = self.remaining()
+            if remaining is not None and len(batch) + len(new) > remaining:
+                continue  # a smaller cell might still fit
+            batch += new
+            del self.errors[cell]
+            self.pending[cell] = children
+        return batch
+
+    def limit(self, points: List[Index]) -> List[Index]:
+        remaining = self.remaining()
+        return points if remaining is None else points[:remaining]
+
+    def predict(self, cell: Cell, index: Index) -> float:
+        """Bilinear between the cell's corners"""
+        c0, r0, c1, r1 = cell
+        u = (index[0] - c0) / (c1 - c0) if c1 > c0 else 0.0
+        v = (index[1] - r0) / (r1 - r0) if r1 > r0 else 0.0
+        a, b, c, d = (self.values[corner] for corner in corners(cell))
+        return float((a * (1 - u) + b * u) * (1 - v) + (c * (1 - u) + d * u) * v)
+
+    def measure_pending(self) -> None:
+        """Gives the children of split cells their parent's measured error"""
+        for cell, children in self.pending.items():
+            new = {p for child in children for p in corners(child)} - set(corners(cell))
+            if not all(p in self.values for p in new | set(corners(cell))):
+                for child in children:  # some points weren't probed, ex the job stopped
+                    self.errors[child] = np.inf
+                continue
+            error = max((abs(self.values[p] - self.predict(cell, p)) for p in new), default=0.0)
+            for child in children:
+                self.errors[child] = error
+        self.pending.clear()
+
+    def estimate_from_curvature(self) -> None:
+        """Estimates the error of the coarse cells from the second differences at their corners"""
+        xs, ys = lattice(self.columns, self.step), lattice(self.rows, self.step)
+        known = [[self.values.get((c, r), np.nan) for c in xs] for r in ys]
+        z = np.array(known, dtype=np.float64)
+        curvature = np.abs(second_difference(z, 1)) + np.abs(second_difference(z, 0))
+        for cell, error in list(self.errors.items()):
+            if not np.isnan(error):
+                continue
+            c0, r0, c1, r1 = cell
+            rows = slice(ys.index(r0), ys.index(r1) + 1)
+            columns = slice(xs.index(c0), xs.index(c1) + 1)
+            self.errors[cell] = float(np.nanmax(curvature[rows, columns], initial=0.0)) / 8
+            if not np.isfinite(self.errors[cell]):
+                self.errors[cell] = np.inf
+
+    def leaves(self) -> List[Cell]:
+        return list(self.errors) + [child for children in self.pending.values() for child in children]
+
+    def map(self) -> npt.NDArray[np.float64]:
+        """(rows, columns) probed values, the rest filled in bilinearly from the cell it is in"""
+        data = np.full((self.rows, self.columns), np.nan, dtype=np.float64)
+        # Largest first so the values along the edges of smaller neighbours win
+        for cell in sorted(self.leaves(), key=lambda cell: (cell[2] - cell[0]) * (cell[3] - cell[1]), reverse=True):
+            if not all(corner in self.values for corner in corners(cell)):
+                continue
+            c0, r0, c1, r1 = cell
+            for r in range(r0, r1 + 1):
+                for c in range(c0, c1 + 1):
+                    data[r, c] = self.predict(cell, (c, r))
+        for (c, r), value in self.values.items():
+            data[r, c] = value
+        return data
+
+
+def second_difference(z: npt.NDArray[np.float64], axis: int) -> npt.NDArray[np.float64]:
+    """z[i - 1] - 2 z[i] + z[i + 1] along axis, the ends take their neighbour's"""
+    if z.shape[axis] < 3:
+        return np.zeros_like(z)
+    inner = np.diff(z, n=2, axis=axis)
+    return np.concatenate((inner.take([0], axis=axis), inner, inner.take([-1], axis=axis)), axis=axis)
+
+
+async def probe_adaptive(
+    job: JobContext, grid: AdaptiveGrid, dist: float, lift: float, method: str = PATH_METHODS[0]
+) -> None:
+    """
+    Probes the grid's points batch by batch, each batch in the path method's order. Samples are reported as they
+    come in, the filled in points once refining is done and marked as not measured (see JobContext.emit) so
+    they're drawn but not recorded. Values in um like the other probe jobs.
+    """
+    await job.move("G64")  # Path blending best possible speed
+    await job.move("G53 G0 W0Z0")
+    await job.move("G54 G0 X0Y0")
+    await job.move(f"G0 W{lift}")
+    await job.move(f"G1 F{TOUCH_FEED:g} W0")
+    await job.zero()
+    await job.move(f"G0 W{lift}")
+
+    batch = grid.next_points()
+    while batch:
+        indices = np.array(batch, dtype=np.int64)
+        points = indices.astype(np.float64) * dist
+        for point in plan_path(points, indices, method):
+            column, row = batch[point]
+            x, y = points[point]
+            await job.move(f"G0 X{x:g} Y{y:g}")
+            await job.move(f"G1 F{TOUCH_FEED:g} W0")
+            sample = await job.sample()
+            grid.add((column, row), sample)
+            job.emit(column, row, sample * 1000)  # convert sample mm to um
+            await job.move(f"G0 W{lift}")
+        batch = grid.next_points()
+
+    await job.move("G53 G0 W0Z0")
+
+    print(f"Probed {len(grid.values)} of {grid.columns * grid.rows} points")
+    data = grid.map()
+    for row, column in zip(*np.nonzero(np.isfinite(data))):
+        if (column, row) not in grid.values:
+            job.emit(int(column), int(row), float(data[row, column]) * 1000, measured=False)
@@ -0,0 +1,182 @@
+"""
+Checkpoints of probe jobs, so a job that stopped half way (stopped, the connection dropped, the driver closed)
+carries on from the first point it hasn't measured instead of starting again from X0 Y0.
+
+A checkpoint is a JSON lines file, one line appended and synced for every step:
+
+    {"kind": "job", ...}       what the job is, a checkpoint is only resumed by the same job (see job_key)
+    {"kind": "zero", ...}      the sensor was zeroed at X Y
+    {"kind": "resume", ...}    the job carried on, with the drift check's differences and the offset it took
+    {"kind": "drift", ...}     the drift check failed, with its differences, the checkpoint is done with
+    {"kind": "point", ...}     point index, column, row, X Y, value in um, offset taken off it and time
+
+Every line has the Unix time it was written. A line cut short by a crash is left out when the file is read.
+
+Values are all on the job's first zero. The sensor might have lost its zero when the job stopped (ex the sensor
+app was restarted), so a resumed job probes a few of the measured points again before it carries on (see
+probe.check_drift). Their differences to the checkpoint should all be the same: that's how far the zero moved
+and it's taken off every new sample. Differences that don't agree mean the part moved or changed, and the job
+stops with a DriftError instead of mixing two surfaces in one grid. The points measured before don't belong to
+the part any more, so a checkpoint that ends in a drift record isn't resumed: the next run starts again.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Union
+
+import numpy as np
+import numpy.typing as npt
+
+SUFFIX = ".jsonl"
+CHECK_POINTS = 3  # measured points probed again when a job is resumed
+DRIFT_TOLERANCE = 10.0  # um the check points may disagree by
+
+PathLike = Union[str, Path]
+
+
+class DriftError(Exception):
+    """The points probed again on resuming don't match the checkpoint"""
+
+
+def job_key(points: npt.NDArray[np.float64], lift: float) -> Dict[str, Any]:
+    """What makes two jobs the same one, the order the points are visited in can change"""
+    digest = hashlib.sha1(np.ascontiguousarray(points, dtype="<f8").tobytes()).hexdigest()
+    return {"points": digest, "count": int(len(points)), "lift": float(lift)}
+
+
+def checkpoint_path(directory: PathLike, key: Dict[str, Any]) -> Path:
+    """Where the checkpoint of a job goes, one file per job"""
+    name = hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[0:16]
+    return Path(directory) / f"{name}{SUFFIX}"
+
+
+def read_records(path: PathLike) -> List[Dict[str, Any]]:
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break  # a torn last line
+    return records
+
+
+class Checkpoint:
+    """
+    Args:
+        path: The checkpoint file. It's carried on from if it's of the same job, didn't fail its drift check and
+            resume is True, otherwise a new one replaces it.
+        points: (n, 2) X Y of the job's points.
+        indices: Column and row of every point, see paths.snap_to_grid.
+        lift: The job's lift height, part of what the job is.
+        resume: Whether to carry on from the file.
+
+    Attributes:
+        done: Value in um, on the job's first zero, of every point index measured.
+        offset: um taken off new samples to put them on the job's first zero, set by resumed().
+    """
+
+    def __init__(
+        self,
+        path: PathLike,
+        points: npt.NDArray[np.float64],
+        indices: npt.NDArray[np.int64],
+        lift: float,
+        resume: bool = True,
+    ) -> None:
+        self.path = Path(path)
+        self.points = points
+        self.indices = indices
+        self.lift = lift
+        self.key = job_key(points, lift)
+        self.done: Dict[int, float] = {}
+        self.offset = 0.0
+
+        records = read_records(self.path) if resume and self.path.exists() else []
+        same_job = records and records[0].get("kind") == "job" and records[0].get("key") == self.key
+        if same_job and records[-1]["kind"] != "drift":
+            for record in records:
+                if record["kind"] == "point":
+                    self.done[int(record["index"])] = float(record["value"])
+        if not self.done:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text("")
+            self.write({"kind": "job", "key": self.key})
+
+    @property
+    def resuming(self) -> bool:
+        return bool(self.done)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        record["time"] = time.time()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def zeroed(self, x: float, y: float) -> None:
+        self.write({"kind": "zero", "x": float(x), "y": float(y)})
+
+    def add(self, index: int, value: float) -> None:
+        """Records the value in um of a point, on the job's first zero"""
+        x, y = self.points[index]
+        column, row = self.indices[index]
+        self.write(
+            {
+                "kind": "point",
+                "index": int(index),
+                "column": int(column),
+                "row": int(row),
+                "x": float(x),
+                "y": float(y),
+                "value": float(value),
+                "offset": self.offset,
+            }
+        )
+        self.done[int(index)] = float(value)
+
+    def remaining(self, order: npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+        """The order without the points measured"""
+        return order[~np.isin(order, list(self.done))]
+
+    def check_points(self, count: int = CHECK_POINTS) -> List[int]:
+        """Indices of measured points spread over the order they were measured in, the last one included"""
+        measured = list(self.done)
+        picks = np.unique(np.linspace(0, len(measured) - 1, min(count, len(measured))).round().astype(int))
+        return [measured[i] for i in picks]
+
+    def resumed(self, differences: List[float], tolerance: float = DRIFT_TOLERANCE) -> float:
+        """
+        Takes the drift check's differences (new value - checkpoint value, um) of the check points.
+
+        Returns:
+            The offset to take off new samples, the median of the differences.
+
+        Raises:
+            DriftError: When the differences disagree by more than the tolerance. The checkpoint won't be resumed
+                after it.
+        """
+        spread = max(differences) - min(differences)
+        if spread > tolerance:
+            self.write({"kind": "drift", "differences": differences})
+            raise DriftError(
+                f"The measured points moved by {min(differences):.1f} to {max(differences):.1f} um, more than "
+                f"{tolerance:g} um apart. The part moved, start the job again to probe every point."
+            )
+        self.offset = float(np.median(differences))
+        self.write({"kind": "resume", "differences": differences, "offset": self.offset})
+        return self.offset
+
+    def finish(self) -> None:
+        """The job is done, there's nothing to resume"""
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
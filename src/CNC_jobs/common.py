@@ -1,48 +1,71 @@
 from __future__ import annotations
 
-import sys
-import time
+from typing import Any
+from typing import Dict
+from typing import Optional
 
 from PySide6.QtCore import QObject
 from PySide6.QtCore import Signal
+from PySide6.QtWidgets import QAbstractSpinBox
+from PySide6.QtWidgets import QComboBox
+from PySide6.QtWidgets import QFormLayout
+from PySide6.QtWidgets import QLabel
 
+from src.CNC_jobs.engine import Job
+from src.CNC_jobs.engine import JobEngine
 
-IN_LINUXCNC = False
-if sys.platform == "linux":
-    print("In LinuxCNC")
-    IN_LINUXCNC = True
-    import linuxcnc
 
-DEV_MODE = False
+class JobDriver(QObject):  # type: ignore
+    """
+    The GUI side of a JobEngine. The engine calls back from its own thread, the signals bring that back to the
+    GUI thread.
+    """
 
+    connection_made = Signal()
+    sample_out = Signal(list)
+    job_stopped = Signal()
 
-class LinuxDriver(QObject):  # type: ignore
-    OnSampleReceived = Signal(list)
-
-    def __init__(self) -> None:
+    def __init__(self, machine: Any = None) -> None:
         super().__init__()
+        self.engine = JobEngine(machine)
 
-        if IN_LINUXCNC:
-            self.s = linuxcnc.stat()  # type: ignore
-            self.c = linuxcnc.command()  # type: ignore
-
-    def ready(self) -> bool:
-        if DEV_MODE:
-            return True
-        self.s.poll()
-        return (
-            not self.s.estop
-            and self.s.enabled
-            and (self.s.homed.count(1) == self.s.joints)
-            and (self.s.interp_state == linuxcnc.INTERP_IDLE)  # type: ignore
-        )
-
-    def cmd(self, cmd: str) -> None:
-        if IN_LINUXCNC:
-            self.c.mdi(cmd)
-            print(f"Sent: {cmd}")
-            self.c.wait_complete()  # wait until mode switch executed
+    def connect_to_host(self, ip: str, port: str) -> None:
+        print(f"ip is {ip}")
+        print(f"port is {port}")
+        if ip and port:
+            self.engine.connect(ip, int(port), self.connect_done)
+        else:
+            print("must have a valid ip and port")
 
+    def connect_done(self, error: Optional[Exception]) -> None:
+        if error is None:
+            self.connection_made.emit()
         else:
-            print(f"Sent: {cmd}")
-            time.sleep(0.1)
+            print(error)
+
+    def start(self, job: Job) -> None:
+        if not self.engine.start(job, self.sample_out.emit, self.job_stopped.emit):
+            print("Can't start the job, not connected or a job is already running")
+            self.job_stopped.emit()
+
+    def stop(self) -> None:
+        self.engine.stop()
+
+    def close(self) -> None:
+        self.engine.close()
+
+
+def form_values(form: QFormLayout) -> Dict[str, Any]:
+    """The label and value of every spin box and combo box row in a job's form, to save with its results"""
+    values: Dict[str, Any] = {}
+    for row in range(form.rowCount()):
+        label = form.itemAt(row, QFormLayout.LabelRole)
+        field = form.itemAt(row, QFormLayout.FieldRole)
+        if label is None or field is None or not isinstance(label.widget(), QLabel):
+            continue
+        widget = field.widget()
+        if isinstance(widget, QAbstractSpinBox):
+            values[label.widget().text()] = widget.value()
+        elif isinstance(widget, QComboBox):
+            values[label.widget().text()] = widget.currentText()
+    return values
@@ -0,0 +1,352 @@
+"""
+Runs the CNC jobs without blocking the GUI or spinning a CPU core.
+
+A job is a coroutine that moves the machine and takes samples through a JobContext. Machine moves and sensor
+requests are awaited, so while the machine moves or the sensor measures the job just sleeps. JobEngine runs the
+jobs on an asyncio loop on a thread of its own, the GUI talks to it through JobDriver (see src.CNC_jobs.common).
+
+    async def job(context: JobContext) -> None:
+        await context.move("G0 X10 Y10")
+        context.emit(0, 0, await context.sample())
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import importlib
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import List
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from src.client import AsyncSensorClient
+from src.client import SensorError
+from src.CNC_jobs.checkpoint import DriftError
+from src.CNC_jobs.program import INDEX_PIN
+from src.CNC_jobs.program import OnRequest
+from src.CNC_jobs.program import ProgramAborted
+from src.CNC_jobs.program import REQUEST_PIN
+from src.CNC_jobs.program import serve_handshake
+from src.CNC_jobs.simulator import SimulatedController
+from src.sampling import FrameResult
+
+try:
+    import linuxcnc
+
+    IN_LINUXCNC = True
+except ImportError:
+    IN_LINUXCNC = False
+
+Job = Callable[["JobContext"], Awaitable[Any]]
+
+TRACKED = (0, 1, 2, 8)  # X Y Z W in LinuxCNC's position tuples
+
+
+class JobStopped(Exception):
+    """Raised in the job at the next step after it has been asked to stop"""
+
+
+class LinuxCNCMachine:
+    """
+    Sends MDI commands to LinuxCNC.
+
+    A command is finished when the task has taken it and the interpreter is idle again, which is polled every
+    poll_interval seconds while the job sleeps in between.
+
+    The linuxcnc and hal modules are the real ones unless others are given, ex the stand-ins in
+    src.CNC_jobs.sim_linuxcnc.
+    """
+
+    def __init__(self, poll_interval: float = 0.01, linuxcnc_module: Any = None, hal_module: Any = None) -> None:
+        self.poll_interval = poll_interval
+        self.linuxcnc = linuxcnc_module or linuxcnc
+        self.hal = hal_module
+        self.s = self.linuxcnc.stat()
+        self.c = self.linuxcnc.command()
+        self.errors = self.linuxcnc.error_channel()
+        self.hal_component: Any = None
+
+    def ready(self) -> bool:
+        self.s.poll()
+        return bool(
+            not self.s.estop
+            and self.s.enabled
+            and (self.s.homed.count(1) == self.s.joints)
+            and (self.s.interp_state == self.linuxcnc.INTERP_IDLE)
+        )
+
+    async def start(self) -> None:
+        self.c.mode(self.linuxcnc.MODE_MDI)
+        await self.wait_complete()
+
+    async def run(self, command: str) -> None:
+        self.c.mdi(command)
+        print(f"Sent: {command}")
+        await self.wait_complete()
+        while True:
+            self.s.poll()
+            if self.s.interp_state == self.linuxcnc.INTERP_IDLE:
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    async def wait_complete(self) -> None:
+        # wait_complete() blocks until the task has taken the command, on a pool thread so the loop keeps going
+        await asyncio.get_running_loop().run_in_executor(None, self.c.wait_complete)
+
+    async def track(self, command: str, interval: float) -> npt.NDArray[np.float64]:
+        """Runs a move, returns (n, 5) time.monotonic() and X Y Z W polled every interval seconds while it ran"""
+        self.c.mdi(command)
+        print(f"Sent: {command}")
+        await self.wait_complete()
+        samples = []
+        while True:
+            self.s.poll()
+            # actual_position is in machine coordinates, the moves are in the work coordinates
+            position = [
+                self.s.actual_position[axis] - self.s.g5x_offset[axis] - self.s.g92_offset[axis] for axis in TRACKED
+            ]
+            samples.append([time.monotonic()] + position)
+            if self.s.interp_state == self.linuxcnc.INTERP_IDLE:
+                return np.array(samples)
+            await asyncio.sleep(interval)
+
+    async def run_program(self, program: str, on_request: OnRequest) -> None:
+        """Runs a program in auto mode, answering its sample requests, see src.CNC_jobs.program"""
+        acknowledge = self.acknowledge_pin()
+        path = Path(tempfile.gettempdir()) / "laser_level_probe.ngc"
+        path.write_text(program)
+
+        self.c.mode(self.linuxcnc.MODE_AUTO)
+        await self.wait_complete()
+        self.c.program_open(str(path))
+        self.c.auto(self.linuxcnc.AUTO_RUN, 0)
+        await self.wait_complete()
+
+        def running() -> bool:
+            self.s.poll()
+            return bool(self.s.interp_state != self.linuxcnc.INTERP_IDLE)
+
+        try:
+            await serve_handshake(
+                lambda: bool(self.s.dout[REQUEST_PIN]),
+                lambda: int(round(self.s.aout[INDEX_PIN])),
+                lambda value: acknowledge.__setitem__("ack", value),
+                running,
+                on_request,
+                self.poll_interval,
+            )
+        except BaseException:
+            self.c.abort()
+            raise
+        finally:
+            self.c.mode(self.linuxcnc.MODE_MDI)
+            await self.wait_complete()
+
+        error = self.errors.poll()
+        if error:
+            raise ProgramAborted(error[1])
+
+    def acknowledge_pin(self) -> Any:
+        """The HAL component with the handshake's acknowledge pin, created and connected on first use"""
+        if self.hal_component is None:
+            hal = self.hal or importlib.import_module("hal")
+            self.hal_component = hal.component("laser-level-probe")
+            self.hal_component.newpin("ack", hal.HAL_BIT, hal.HAL_OUT)
+            self.hal_component.ready()
+            signal, pin = "laser-level-probe-ack", f"motion.digital-in-{REQUEST_PIN:02d}"
+            try:
+                hal.new_sig(signal, hal.HAL_BIT)
+                hal.connect("laser-level-probe.ack", signal)
+                hal.connect(pin, signal)
+            except (AttributeError, RuntimeError) as e:
+                print(f"Connect laser-level-probe.ack to {pin} in HAL to run probe programs ({e})")
+        return self.hal_component
+
+
+class DryRunMachine:
+    """
+    Records and prints the commands instead of sending them, for running the jobs without LinuxCNC.
+
+    Attributes:
+        delay (float): Seconds each command takes.
+        commands (list): Every command run so far.
+
+    Only runs MDI commands, SimulatedController runs programs too.
+    """
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.commands: List[str] = []
+
+    def ready(self) -> bool:
+        return True
+
+    async def start(self) -> None:
+        pass
+
+    async def run(self, command: str) -> None:
+        self.commands.append(command)
+        print(f"Sent: {command}")
+        await asyncio.sleep(self.delay)
+
+    async def track(self, command: str, interval: float) -> npt.NDArray[np.float64]:
+        start = time.monotonic()
+        await self.run(command)
+        return np.array([[start, 0.0, 0.0, 0.0, 0.0], [time.monotonic(), 0.0, 0.0, 0.0, 0.0]])
+
+
+class JobContext:
+    """
+    What a job moves the machine and takes samples with.
+
+    Attributes:
+        machine: A LinuxCNCMachine, SimulatedController or DryRunMachine.
+        sensor (AsyncSensorClient): The connection to the sensor.
+        on_sample (callable): Called with [x, y, value] for every sample the job reports, [x, y, value, False] for
+            a value the job filled in without measuring it (ex interpolated between probed points).
+        stopping (bool): Set to stop the job at its next step.
+    """
+
+    def __init__(self, machine: Any, sensor: AsyncSensorClient, on_sample: Callable[[list], None]) -> None:
+        self.machine = machine
+        self.sensor = sensor
+        self.on_sample = on_sample
+        self.stopping = False
+
+    def check(self) -> None:
+        if self.stopping:
+            raise JobStopped()
+
+    async def move(self, command: str) -> None:
+        self.check()
+        await self.machine.run(command)
+
+    async def track(self, command: str, interval: float) -> npt.NDArray[np.float64]:
+        """Runs a move, returns (n, 5) time.monotonic() and X Y Z W polled every interval seconds while it ran"""
+        self.check()
+        return await self.machine.track(command, interval)  # type: ignore
+
+    async def start_stream(self, on_frame: Callable[[FrameResult], None]) -> None:
+        """Streams the result of every frame the sensor analyses to on_frame, see stop_stream"""
+        self.sensor.on_frame = on_frame
+        await self.sensor.stream(0, "bin")
+
+    async def stop_stream(self) -> None:
+        try:
+            await self.sensor.stop_stream()
+        finally:
+            self.sensor.on_frame = None
+
+    async def run_program(self, program: str, on_request: OnRequest) -> None:
+        """Runs a whole program, on_request is awaited with the point index of every sample it asks for"""
+        self.check()
+        await self.machine.run_program(program, on_request)
+
+    async def zero(self) -> None:
+        self.check()
+        print((await self.sensor.zero()).line)
+
+    async def sample(self) -> float:
+        """Takes a sample, returns it in millimeters"""
+        self.check()
+        return (await self.sensor.take_sample()).value
+
+    def emit(self, x: int, y: int, value: float, measured: bool = True) -> None:
+        self.on_sample([x, y, value] if measured else [x, y, value, False])
+
+
+class JobEngine:
+    """
+    Runs one job at a time on an asyncio loop on its own thread.
+
+    Everything is handed to the loop thread, so the methods can be called from the GUI thread and return right
+    away. The callbacks are called on the loop thread.
+
+    Attributes:
+        machine: Where the moves go, a LinuxCNCMachine in LinuxCNC and a SimulatedController elsewhere.
+        sensor (AsyncSensorClient): Set by connect().
+        context (JobContext): The running job's context, None when no job is running.
+    """
+
+    def __init__(self, machine: Any = None) -> None:
+        if machine is None:
+            machine = LinuxCNCMachine() if IN_LINUXCNC else SimulatedController()
+        self.machine = machine
+        self.sensor: Optional[AsyncSensorClient] = None
+        self.context: Optional[JobContext] = None
+        self.future: Optional[concurrent.futures.Future[None]] = None
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+    def submit(self, coroutine: Awaitable[Any]) -> concurrent.futures.Future[Any]:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)  # type: ignore
+
+    def connect(self, host: str, port: int, on_done: Callable[[Optional[Exception]], None]) -> None:
+        """Connects to the sensor, on_done is called with None or the error"""
+
+        async def connect() -> None:
+            if self.sensor is not None:
+                await self.sensor.close()
+            self.sensor = AsyncSensorClient(host, port)
+            try:
+                await self.sensor.connect()
+            except ConnectionError as e:
+                on_done(e)
+            else:
+                on_done(None)
+
+        self.submit(connect())
+
+    def start(self, job: Job, on_sample: Callable[[list], None], on_finished: Callable[[], None]) -> bool:
+        """Starts the job, returns False if there's no sensor connection or another job is running"""
+        if self.sensor is None or self.running:
+            return False
+        self.context = JobContext(self.machine, self.sensor, on_sample)
+        self.future = self.submit(self.run(job, self.context, on_finished))
+        return True
+
+    async def run(self, job: Job, context: JobContext, on_finished: Callable[[], None]) -> None:
+        print("Starting LinuxCNC job")
+        try:
+            await self.machine.start()
+            await job(context)
+            print("Finished")
+        except JobStopped:
+            print("Job Stopped")
+        except (ConnectionError, SensorError, ProgramAborted, DriftError) as e:
+            print(f"Job failed: {e}")
+        finally:
+            self.context = None
+            on_finished()
+
+    def stop(self) -> None:
+        """Stops the running job at its next step"""
+        context = self.context
+        if context is not None:
+            context.stopping = True
+
+    def close(self) -> None:
+        self.stop()
+        if self.future is not None:
+            self.future.cancel()
+        if self.sensor is not None:
+            try:
+                self.submit(self.sensor.close()).result(timeout=2)
+            except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
+                pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2)
@@ -0,0 +1,192 @@
+"""
+Probe path planning: the order the probe visits its points in, and how long the moves between them take.
+
+Points are machine X Y positions, a regular grid or a list loaded from a CSV file. Each point also has a column
+and row in the job's data grid, found by snapping the positions to the distinct X and Y values (see snap_to_grid).
+
+Orders:
+- Raster: row by row, always in +X, the way the jobs used to run. Every row starts with a return move.
+- Serpentine: row by row, every other row in -X, no return moves.
+- Shortest: nearest neighbour from the start, improved with 2-opt. For point lists that aren't a grid.
+"""
+from __future__ import annotations
+
+import csv
+import math
+from pathlib import Path
+from typing import List
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import numpy.typing as npt
+
+PATH_METHODS = ("Serpentine", "Raster", "Shortest")
+
+RAPID_RATE = 3000.0  # mm/min
+ACCELERATION = 500.0  # mm/s^2
+TOUCH_FEED = 2000.0  # mm/min, the feed the probe moves down at
+
+
+def grid_points(columns: int, rows: int, dist: float) -> npt.NDArray[np.float64]:
+    """Returns the (columns * rows, 2) X Y positions of a grid starting at X0 Y0, row by row"""
+    y, x = np.mgrid[0:rows, 0:columns]
+    return np.column_stack((x.ravel(), y.ravel())).astype(np.float64) * dist
+
+
+def load_points_csv(path: Union[str, Path]) -> npt.NDArray[np.float64]:
+    """
+    Reads X Y positions from a CSV file, one point per line. A header line and any columns after the first two
+    are ignored.
+    """
+    points: List[Tuple[float, float]] = []
+    with open(path, newline="") as f:
+        for line, row in enumerate(csv.reader(f)):
+            if not row or not "".join(row).strip():
+                continue
+            try:
+                points.append((float(row[0]), float(row[1])))
+            except (IndexError, ValueError):
+                if line == 0 and not points:
+                    continue  # header
+                raise ValueError(f"{path}:{line + 1}: expected X,Y but got {row}")
+    if not points:
+        raise ValueError(f"{path}: no points")
+    return np.array(points, dtype=np.float64)
+
+
+def snap_to_grid(points: npt.NDArray[np.float64], decimals: int = 4) -> Tuple[npt.NDArray[np.int64], Tuple[int, int]]:
+    """
+    Returns the (n, 2) column and row of every point, and the (rows, columns) shape of the grid they make.
+
+    Positions are rounded to `decimals` places first so the same row read from a CSV file stays one row.
+    """
+    xs, columns = np.unique(np.round(points[:, 0], decimals), return_inverse=True)
+    ys, rows = np.unique(np.round(points[:, 1], decimals), return_inverse=True)
+    return np.column_stack((columns.ravel(), rows.ravel())).astype(np.int64), (len(ys), len(xs))
+
+
+def raster_order(indices: npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+    return np.lexsort((indices[:, 0], indices[:, 1]))
+
+
+def serpentine_order(indices: npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+    """Row by row, reversing the X direction on every other row that has points"""
+    columns = np.where(np.unique(indices[:, 1], return_inverse=True)[1].ravel() % 2, -indices[:, 0], indices[:, 0])
+    return np.lexsort((columns, indices[:, 1]))
+
+
+def nearest_neighbour_order(points: npt.NDArray[np.float64], start: Tuple[float, float] = (0.0, 0.0)) -> npt.NDArray:
+    order = np.empty(len(points), dtype=np.int64)
+    visited = np.zeros(len(points), dtype=bool)
+    position = np.asarray(start, dtype=np.float64)
+    for i in range(len(points)):
+        distance = np.hypot(*(points - position).T)
+        distance[visited] = np.inf
+        order[i] = nearest = int(np.argmin(distance))
+        visited[nearest] = True
+        position = points[nearest]
+    return order
+
+
+def two_opt(
+    points: npt.NDArray[np.float64],
+    order: npt.NDArray[np.int64],
+    start: Tuple[float, float] = (0.0, 0.0),
+    max_passes: int = 50,
+) -> npt.NDArray[np.int64]:
+    """
+    Shortens an open path from start by reversing segments of it (2-opt) until no reversal helps.
+
+    Reversing order[i:j + 1] replaces the moves a -> b and c -> d with a -> c and b -> d, where a is the point
+    before b = order[i], c = order[j] and d the one after it. When c is the last point there is no move to d.
+    """
+    path = np.vstack((np.asarray(start, dtype=np.float64), points[order]))
+    order = order.copy()
+    n = len(order)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 1):
+            a, b = path[i], path[i + 1]
+            c = path[slice(i + 2, None)]
+            d = np.vstack((path[slice(i + 3, None)], np.full((1, 2), np.nan)))
+            before = np.hypot(*(b - a)) + np.nan_to_num(np.hypot(*(d - c).T))
+            after = np.hypot(*(c - a).T) + np.nan_to_num(np.hypot(*(d - b).T))
+            gain = before - after
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                j = i + 1 + best
+                segment = slice(i, j + 1)
+                order[segment] = order[segment][::-1]
+                path_segment = slice(i + 1, j + 2)
+                path[path_segment] = path[path_segment][::-1]
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def plan_path(
+    points: npt.NDArray[np.float64],
+    indices: npt.NDArray[np.int64],
+    method: str,
+    start: Tuple[float, float] = (0.0, 0.0),
+) -> npt.NDArray[np.int64]:
+    """Returns the order to visit the points in, method is one of PATH_METHODS"""
+    if method == "Raster":
+        return raster_order(indices)
+    if method == "Serpentine":
+        return serpentine_order(indices)
+    if method == "Shortest":
+        return two_opt(points, nearest_neighbour_order(points, start), start)
+    raise ValueError(f"Unknown path method {method}, expected one of {PATH_METHODS}")
+
+
+def move_lengths(
+    points: npt.NDArray[np.float64], order: npt.NDArray[np.int64], start: Tuple[float, float] = (0.0, 0.0)
+) -> npt.NDArray[np.float64]:
+    """Length of every move along the path, the first one from start"""
+    path = np.vstack((np.asarray(start, dtype=np.float64), points[order]))
+    return np.asarray(np.hypot(*np.diff(path, axis=0).T))
+
+
+def move_time(length: npt.ArrayLike, rate: float = RAPID_RATE, acceleration: float = ACCELERATION) -> npt.NDArray:
+    """
+    Time in seconds for moves of the lengths in mm, accelerating to the rate (mm/min) and back down. Short moves
+    never reach the rate.
+    """
+    length = np.asarray(length, dtype=np.float64)
+    speed = rate / 60.0
+    ramp = speed * speed / acceleration  # distance spent speeding up and slowing down
+    return np.where(length >= ramp, length / speed + speed / acceleration, 2.0 * np.sqrt(length / acceleration))
+
+
+def estimate_time(
+    points: npt.NDArray[np.float64],
+    order: npt.NDArray[np.int64],
+    lift: float,
+    rapid_rate: float = RAPID_RATE,
+    acceleration: float = ACCELERATION,
+    start: Tuple[float, float] = (0.0, 0.0),
+) -> Tuple[float, float, float]:
+    """
+    Estimates the machine time of a probe job.
+
+    Returns:
+        - Total length of the moves between points in mm.
+        - Seconds spent moving between points.
+        - Seconds spent moving down to touch and back up to the lift height, for all points.
+        The sampling itself isn't included, it depends on the sensor's settings.
+    """
+    lengths = move_lengths(points, order, start)
+    traverse = float(np.sum(move_time(lengths, rapid_rate, acceleration)))
+    touch = len(order) * float(move_time(lift, TOUCH_FEED, acceleration) + move_time(lift, rapid_rate, acceleration))
+    return float(np.sum(lengths)), traverse, touch
+
+
+def format_duration(seconds: float) -> str:
+    if not math.isfinite(seconds):
+        return "-"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m {seconds:02d}s" if hours else f"{minutes}m {seconds:02d}s"
@@ -1,172 +1,216 @@
 from __future__ import annotations
 
-import sys
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Tuple
 
 import numpy as np
-from PySide6.QtCore import QObject
+import numpy.typing as npt
+from PySide6.QtCore import QStandardPaths
 from PySide6.QtCore import Signal
 from PySide6.QtGui import QCloseEvent
-from PySide6.QtNetwork import QHostAddress
-from PySide6.QtNetwork import QTcpSocket
-from PySide6.QtWidgets import QApplication
+from PySide6.QtWidgets import QCheckBox
+from PySide6.QtWidgets import QComboBox
 from PySide6.QtWidgets import QDoubleSpinBox
+from PySide6.QtWidgets import QFileDialog
 from PySide6.QtWidgets import QFormLayout
 from PySide6.QtWidgets import QGroupBox
-
-IN_LINUXCNC = False
-if sys.platform == "linux":
-    print("In LinuxCNC")
-    IN_LINUXCNC = True
-    import linuxcnc
-
-DEV_MODE = False
-
-
-class ProbeDriver(QObject):  # type: ignore
-    sample_received = Signal(list)
-    connection_made = Signal()
-    sample_out = Signal(list)
-    job_stopped = Signal()
-
-    def __init__(self) -> None:
-        super().__init__()
-        self.socket = QTcpSocket(self)
-        self.socket.connected.connect(self.connected)
-        self.socket.readyRead.connect(self.receive_message)
-        self.message = ""
-        self.stopping = False
-
-        if IN_LINUXCNC:
-            self.s = linuxcnc.stat()  # type: ignore
-            self.c = linuxcnc.command()  # type: ignore
-
-        self.x_holes = 0
-        self.y_holes = 0
-        self.dist = 0.0
-        self.lift = 0.0
-
-    def stop(self) -> None:
-        self.stopping = True
-
-    def loop(self) -> None:
-        self.stopping = False
-        print("Starting LinuxCNC job")
-        if IN_LINUXCNC:
-            self.c.mode(linuxcnc.MODE_MDI)  # type: ignore
-            self.c.wait_complete()  # wait until mode switch executed
-        self.cmd("G64")  # Path blending best possible speed
-
-        # Move the W axis back to machine coord zero
-        self.cmd("G53 G0 W0Z0")
-
-        # Move to the start position
-        self.cmd("G54 G0 X0Y0")
-
-        # Move W to lift height
-        self.cmd(f"G0 W{self.lift}")
-
+from PySide6.QtWidgets import QHBoxLayout
+from PySide6.QtWidgets import QLabel
+from PySide6.QtWidgets import QPushButton
+from PySide6.QtWidgets import QSpinBox
+
+from src.CNC_jobs.adaptive import AdaptiveGrid
+from src.CNC_jobs.adaptive import probe_adaptive
+from src.CNC_jobs.adaptive import TARGET_ERROR
+from src.CNC_jobs.checkpoint import Checkpoint
+from src.CNC_jobs.checkpoint import checkpoint_path
+from src.CNC_jobs.checkpoint import job_key
+from src.CNC_jobs.common import form_values
+from src.CNC_jobs.common import JobDriver
+from src.CNC_jobs.engine import JobContext
+from src.CNC_jobs.paths import estimate_time
+from src.CNC_jobs.paths import format_duration
+from src.CNC_jobs.paths import grid_points
+from src.CNC_jobs.paths import load_points_csv
+from src.CNC_jobs.paths import PATH_METHODS
+from src.CNC_jobs.paths import plan_path
+from src.CNC_jobs.paths import RAPID_RATE
+from src.CNC_jobs.paths import snap_to_grid
+from src.CNC_jobs.program import grid_program
+from src.CNC_jobs.program import points_program
+from src.CNC_jobs.scan import SCAN_FEED
+from src.CNC_jobs.scan import scan_grid
+from src.CNC_jobs.scan import scan_time
+
+
+RUN_MODES = ("MDI", "Program", "Scan", "Adaptive")
+
+
+async def check_drift(job: JobContext, checkpoint: Checkpoint) -> float:
+    """
+    Probes a few of a resumed job's measured points again, see checkpoint.Checkpoint.resumed.
+
+    Returns:
+        The offset in um to take off new samples.
+    """
+    differences = []
+    for index in checkpoint.check_points():
+        x, y = checkpoint.points[index]
+        await job.move(f"G0 X{x:g} Y{y:g}")
+        await job.move("G1 F2000 W0")
+        differences.append(await job.sample() * 1000 - checkpoint.done[index])
+        await job.move(f"G0 W{checkpoint.lift:g}")
+    offset = checkpoint.resumed(differences)
+    print(
+        f"Resuming with {len(checkpoint.done)} points measured, the check points are "
+        f"{', '.join(f'{d:+.1f}' for d in differences)} um off, taking {offset:.1f} um off new samples"
+    )
+    return offset
+
+
+def emit_measured(job: JobContext, checkpoint: Optional[Checkpoint]) -> None:
+    """Reports the points a resumed job measured before"""
+    if checkpoint is None:
+        return
+    for index, value in checkpoint.done.items():
+        column, row = checkpoint.indices[index]
+        job.emit(int(column), int(row), value)
+
+
+async def probe_points(
+    job: JobContext,
+    points: npt.NDArray[np.float64],
+    indices: npt.NDArray[np.int64],
+    order: npt.NDArray[np.int64],
+    lift: float,
+    checkpoint: Optional[Checkpoint] = None,
+) -> None:
+    """
+    Probes the X Y points in the given order, touching down on W at each one. Samples are reported with the
+    point's column and row in the data grid, see paths.snap_to_grid.
+
+    With a checkpoint every point is recorded as it's measured. A checkpoint that's resuming skips the zero and the
+    points it has, after checking the zero hasn't drifted (see check_drift).
+    """
+    emit_measured(job, checkpoint)
+
+    await job.move("G64")  # Path blending best possible speed
+
+    # Move the W axis back to machine coord zero
+    await job.move("G53 G0 W0Z0")
+
+    # Move to the start position
+    await job.move("G54 G0 X0Y0")
+
+    # Move W to lift height
+    await job.move(f"G0 W{lift}")
+
+    offset = 0.0
+    if checkpoint is not None and checkpoint.resuming:
+        offset = await check_drift(job, checkpoint)
+        order = checkpoint.remaining(order)
+    else:
         # Move down to W zero for setting zero
-        self.cmd("G1 F2000 W0")
+        await job.move("G1 F2000 W0")
 
         # Zero out the webcam sensor
-        print(self.send_and_receive("ZERO"))
+        await job.zero()
+        if checkpoint is not None:
+            checkpoint.zeroed(0.0, 0.0)
 
         # Move W to lift height (Starting position)
-        self.cmd(f"G0 W{self.lift}")
-
-        print("About to start loop")
-
-        for y in range(self.y_holes):
-            for x in range(self.x_holes):
-                if self.stopping:
-                    self.job_stopped.emit()
-                    return
-                # Goto next sample location
-                self.cmd(f"G0 X{x*self.dist} Y{y*self.dist}")
-
-                # Move down and take a sample
-                self.cmd("G1 F2000 W0")
-
-                # Send the "TAKE_SAMPLE" message and wait for the response
-                sample = float(self.send_and_receive("TAKE_SAMPLE").split(" ")[1])
-                # print("sample: {sample}")
-
-                self.sample_out.emit([x, y, sample * 1000])  # convert sample mm to um
-
-                # Move up
-                self.cmd(f"G0 W{self.lift}")
-
-            print("not ready")
-
-        # Move the W axis back to machine coord zero
-        self.cmd("G53 G0 W0Z0")
-        print("Finished")
-        self.job_stopped.emit()
-
-    def ready(self) -> bool:
-        if DEV_MODE:
-            return True
-        self.s.poll()
-        return (
-            not self.s.estop
-            and self.s.enabled
-            and (self.s.homed.count(1) == self.s.joints)
-            and (self.s.interp_state == linuxcnc.INTERP_IDLE)  # type: ignore
-        )
-
-    def cmd(self, cmd: str) -> None:
-        if IN_LINUXCNC:
-            self.c.mdi(cmd)
-            print(f"Sent: {cmd}")
-            self.c.wait_complete()  # wait until mode switch executed
-
-        else:
-            print(f"Sent: {cmd}")
-            # time.sleep(0.1)
-
-    def connect_to_host(self, ip: str, port: str) -> None:
-        print(f"ip is {ip}")
-        print(f"port is {port}")
-        print(f"socket is {self.socket}")
-        if ip and port:
-            self.socket.connectToHost(QHostAddress(ip), int(port))
-        else:
-            print("must have a valid ip and port")
-
-    def connected(self) -> None:
-        self.connection_made.emit()
-        # self.text_edit.append("Connected to server.")
-
-    def send_and_receive(self, message: str) -> str:
-        self.send_message(message)
-
-        while not self.message:
-            QApplication.processEvents()  # Process events to prevent UI from freezing
-
-        result = self.message
-        self.message = ""
-        return result
-
-    def send_message(self, message: str) -> None:
-        # print(f"Sent a message to the server: {message}")
-        self.socket.write(f"{message}\n".encode())  # Ensure a newline after the message
+        await job.move(f"G0 W{lift}")
+
+    for point in order:
+        x, y = points[point]
+        column, row = indices[point]
+
+        # Goto next sample location
+        await job.move(f"G0 X{x:g} Y{y:g}")
+
+        # Move down and take a sample
+        await job.move("G1 F2000 W0")
+        value = await job.sample() * 1000 - offset  # convert sample mm to um
+
+        job.emit(int(column), int(row), value)
+        if checkpoint is not None:
+            checkpoint.add(int(point), value)
+
+        # Move up
+        await job.move(f"G0 W{lift}")
+
+    # Move the W axis back to machine coord zero
+    await job.move("G53 G0 W0Z0")
+    if checkpoint is not None:
+        checkpoint.finish()
+
+
+async def probe_grid(
+    job: JobContext,
+    x_holes: int,
+    y_holes: int,
+    dist: float,
+    lift: float,
+    method: str = "Serpentine",
+    checkpoint: Optional[Checkpoint] = None,
+) -> None:
+    """Probes a grid of x_holes by y_holes points dist apart"""
+    points = grid_points(x_holes, y_holes, dist)
+    indices, _ = snap_to_grid(points)
+    await probe_points(job, points, indices, plan_path(points, indices, method), lift, checkpoint)
+
+
+async def probe_program(
+    job: JobContext, program: str, indices: npt.NDArray[np.int64], checkpoint: Optional[Checkpoint] = None
+) -> None:
+    """
+    Runs a probe program (see src.CNC_jobs.program) and answers its sample requests, indices gives the column and
+    row of every point index the program asks for.
+
+    A checkpoint that's resuming is checked for drift in MDI first, the program then only has to visit the points
+    the checkpoint doesn't have and its zero request is answered without zeroing.
+    """
+    emit_measured(job, checkpoint)
+    resuming = checkpoint is not None and checkpoint.resuming
+    offset = 0.0
+    if checkpoint is not None and checkpoint.resuming:
+        await job.move("G53 G0 W0Z0")
+        await job.move("G54 G0 X0Y0")
+        await job.move(f"G0 W{checkpoint.lift:g}")
+        offset = await check_drift(job, checkpoint)
+
+    async def sample(index: int) -> None:
+        if index < 0:
+            if not resuming:
+                await job.zero()
+                if checkpoint is not None:
+                    checkpoint.zeroed(0.0, 0.0)
+            return
+        column, row = indices[index]
+        value = await job.sample() * 1000 - offset  # convert sample mm to um
+        job.emit(int(column), int(row), value)
+        if checkpoint is not None:
+            checkpoint.add(index, value)
 
-    def receive_message(self) -> None:
-        self.message = self.socket.readLine().data().decode()  # Read line instead of all data
-        # print(f"recieved messge: {self.message}")
+    await job.run_program(program, sample)
+    if checkpoint is not None:
+        checkpoint.finish()
 
 
 class ProbeJob(QGroupBox):  # type: ignore
     data_changed = Signal(np.ndarray)
-    start_job = Signal()
 
     def __init__(self) -> None:
         QGroupBox.__init__(self)
         self.setTitle("Probe Job")
 
         self.data = np.zeros((5, 5), dtype=np.float64)
+        self.csv_points: Optional[npt.NDArray[np.float64]] = None  # probe these instead of the grid
 
-        self.driver = ProbeDriver()
+        self.driver = JobDriver()
 
         form = QFormLayout()
         self.setLayout(form)
@@ -175,38 +219,225 @@ class ProbeJob(QGroupBox):  # type: ignore
         self.sample_Y_line = QDoubleSpinBox()
         self.sample_distance = QDoubleSpinBox()
         self.probe_height = QDoubleSpinBox()
+        self.path_method = QComboBox()
+        self.path_method.addItems(PATH_METHODS)
+        self.run_mode = QComboBox()
+        self.run_mode.addItems(RUN_MODES)
+        self.run_mode.setToolTip(
+            "MDI sends every move and waits for it.\n"
+            "Program runs the whole job as one G-code program, the driver only answers the sample requests.\n"
+            "Scan slides the sensor along X at the scan feed, one line every sample distance in Y.\n"
+            "Adaptive probes a coarse grid first and adds points only where the surface bends more than the target "
+            "error allows."
+        )
+        self.scan_feed = QDoubleSpinBox()
+        self.scan_feed.setRange(1, 10000)
+        self.scan_resolution = QDoubleSpinBox()
+        self.scan_resolution.setRange(0.01, 100)
+        self.target_error = QDoubleSpinBox()
+        self.target_error.setRange(0.01, 1000)
+        self.point_budget = QSpinBox()
+        self.point_budget.setRange(0, 1000000)
+        self.point_budget.setSpecialValueText("No limit")
+        self.rapid_rate = QDoubleSpinBox()
+        self.rapid_rate.setRange(1, 100000)
+        self.points_label = QLabel("Grid")
+        self.load_points_btn = QPushButton("Load CSV")
+        self.grid_btn = QPushButton("Use Grid")
+        self.estimate_label = QLabel()
+        self.resume = QCheckBox()
+        self.resume.setChecked(True)
+        self.resume.setToolTip(
+            "Carry on a job that stopped half way from the first point it hasn't measured.\n"
+            "MDI and Program jobs keep a checkpoint of every point, a resumed job probes a few measured points "
+            "again to check nothing moved."
+        )
 
         # Set some values
         self.sample_X_line.setValue(70)
         self.sample_Y_line.setValue(70)
         self.sample_distance.setValue(15)
         self.probe_height.setValue(10)
+        self.rapid_rate.setValue(RAPID_RATE)
+        self.scan_feed.setValue(SCAN_FEED)
+        self.scan_resolution.setValue(1)
+        self.target_error.setValue(TARGET_ERROR * 1000)
+
+        points_layout = QHBoxLayout()
+        points_layout.addWidget(self.points_label, 1)
+        points_layout.addWidget(self.load_points_btn)
+        points_layout.addWidget(self.grid_btn)
 
         form.addRow("Sample X Length", self.sample_X_line)
         form.addRow("Sample Y Length", self.sample_Y_line)
         form.addRow("Sample Distance", self.sample_distance)
         form.addRow("Probe Lift Height", self.probe_height)
+        form.addRow("Points", points_layout)
+        form.addRow("Path", self.path_method)
+        form.addRow("Run As", self.run_mode)
+        form.addRow("Rapid Rate (mm/min)", self.rapid_rate)
+        form.addRow("Scan Feed (mm/min)", self.scan_feed)
+        form.addRow("Scan Resolution", self.scan_resolution)
+        form.addRow("Target Error (um)", self.target_error)
+        form.addRow("Point Budget", self.point_budget)
+        form.addRow("Resume Interrupted Job", self.resume)
+        form.addRow("Estimated Moves", self.estimate_label)
 
         # update the GUI
         self.sample_X_line.valueChanged.connect(self.update_data_shape)
         self.sample_Y_line.valueChanged.connect(self.update_data_shape)
         self.sample_distance.valueChanged.connect(self.update_data_shape)
-        self.probe_height.valueChanged.connect(self.update_data_shape)
+        self.probe_height.valueChanged.connect(self.update_estimate)
+        self.path_method.currentIndexChanged.connect(self.update_estimate)
+        self.rapid_rate.valueChanged.connect(self.update_estimate)
+        self.run_mode.currentIndexChanged.connect(self.update_data_shape)
+        self.scan_feed.valueChanged.connect(self.update_estimate)
+        self.scan_resolution.valueChanged.connect(self.update_data_shape)
+        self.load_points_btn.clicked.connect(self.load_points)
+        self.grid_btn.clicked.connect(self.use_grid)
         self.driver.sample_out.connect(self.sample_in)
 
-        self.start_job.connect(self.driver.loop)
+        self.update_data_shape()
+
+    def points(self) -> npt.NDArray[np.float64]:
+        if self.csv_points is not None:
+            return self.csv_points
+        d = self.sample_distance.value()
+        if d == 0:
+            return np.zeros((0, 2), dtype=np.float64)
+        return grid_points(int(self.sample_X_line.value() / d), int(self.sample_Y_line.value() / d), d)
+
+    def load_points(self) -> None:
+        file_path, _ = QFileDialog.getOpenFileName(self, "Load Probe Points", "", "CSV Files (*.csv);;All Files (*)")
+        if not file_path:
+            return
+        try:
+            self.csv_points = load_points_csv(file_path)
+        except (OSError, ValueError) as e:
+            print(f"Error loading probe points: {e}")
+            return
+        self.points_label.setText(f"{Path(file_path).name} ({len(self.csv_points)} points)")
+        self.update_data_shape()
 
+    def use_grid(self) -> None:
+        self.csv_points = None
+        self.points_label.setText("Grid")
         self.update_data_shape()
 
+    def scanning(self) -> bool:
+        return bool(self.run_mode.currentText() == "Scan")
+
+    def scan_shape(self) -> tuple[int, int]:
+        """Lines and columns of a scan"""
+        d = self.sample_distance.value()
+        rows = max(int(self.sample_Y_line.value() / d), 1) if d else 0
+        return rows, int(round(self.sample_X_line.value() / self.scan_resolution.value())) + 1
+
+    def update_estimate(self) -> None:
+        if self.scanning():
+            rows, _ = self.scan_shape()
+            seconds = scan_time(self.sample_X_line.value(), rows, self.scan_feed.value())
+            self.estimate_label.setText(f"{format_duration(seconds)} scanning {rows} lines")
+            return
+        points = self.points()
+        if not len(points):
+            self.estimate_label.setText("-")
+            return
+        indices, _ = snap_to_grid(points)
+        order = plan_path(points, indices, self.path_method.currentText())
+        length, traverse, touch = estimate_time(points, order, self.probe_height.value(), self.rapid_rate.value())
+        self.estimate_label.setText(
+            f"{format_duration(traverse + touch)} ({format_duration(traverse)} traverse, {length / 1000:.2f} m)"
+        )
+
     def start_driver(self) -> None:
-        self.driver.x_holes = int(self.sample_X_line.value() / self.sample_distance.value())
-        self.driver.y_holes = int(self.sample_Y_line.value() / self.sample_distance.value())
-        self.driver.dist = self.sample_distance.value()
-        self.driver.lift = self.probe_height.value()
+        if self.scanning():
+            self.start_scan()
+            return
+        if self.run_mode.currentText() == "Adaptive":
+            self.start_adaptive()
+            return
+        points = self.points()
+        if not len(points):
+            return
+        indices, shape = snap_to_grid(points)
+        order = plan_path(points, indices, self.path_method.currentText())
+        lift = self.probe_height.value()
+
+        length, traverse, touch = estimate_time(points, order, lift, self.rapid_rate.value())
+        print(
+            f"Probing {len(points)} points, {length:.0f} mm of moves between them. "
+            f"Estimated move time {format_duration(traverse + touch)} plus sampling."
+        )
+
+        self.data = np.full(shape, np.nan if self.csv_points is not None else 0.0, dtype=np.float64)
+
+        try:
+            path = checkpoint_path(self.checkpoint_directory(), job_key(points, lift))
+            checkpoint: Optional[Checkpoint] = Checkpoint(path, points, indices, lift, self.resume.isChecked())
+        except (OSError, ValueError) as e:
+            print(f"Can't keep a checkpoint of the job: {e}")
+            checkpoint = None
+        if checkpoint is not None and checkpoint.resuming:
+            print(f"Resuming the job from {path}, {len(checkpoint.done)} of {len(points)} points are measured")
+
+        if self.run_mode.currentText() == "MDI":
+            self.driver.start(lambda job: probe_points(job, points, indices, order, lift, checkpoint))
+            return
+
+        method = self.path_method.currentText()
+        if checkpoint is not None and checkpoint.resuming:
+            program = points_program(points, checkpoint.remaining(order), lift)
+        elif self.csv_points is None and method != "Shortest":
+            columns, rows = shape[1], shape[0]
+            program = grid_program(columns, rows, self.sample_distance.value(), lift, method == "Serpentine")
+        else:
+            program = points_program(points, order, lift)
+        self.driver.start(lambda job: probe_program(job, program, indices, checkpoint))
+
+    def checkpoint_directory(self) -> Path:
+        return Path(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)) / "checkpoints"
+
+    def start_scan(self) -> None:
+        rows, columns = self.scan_shape()
+        if not rows:
+            return
+        if self.csv_points is not None:
+            print("Scans cover the X and Y lengths, the loaded points are ignored")
+        length, dist = self.sample_X_line.value(), self.sample_distance.value()
+        resolution, lift, feed = self.scan_resolution.value(), self.probe_height.value(), self.scan_feed.value()
+        print(f"Scanning {rows} lines of {length:g} mm, {format_duration(scan_time(length, rows, feed))} along them")
+
+        self.data = np.full((rows, columns), np.nan, dtype=np.float64)
+        self.driver.start(lambda job: scan_grid(job, length, rows, dist, resolution, lift, feed))
+
+    def start_adaptive(self) -> None:
+        if self.csv_points is not None:
+            print("Adaptive probing refines the grid, the loaded points are ignored")
+        dist = self.sample_distance.value()
+        if not dist:
+            return
+        columns, rows = int(self.sample_X_line.value() / dist), int(self.sample_Y_line.value() / dist)
+        if not columns or not rows:
+            return
+        budget = self.point_budget.value() or None
+        grid = AdaptiveGrid(columns, rows, self.target_error.value() / 1000, budget)
+        lift, method = self.probe_height.value(), self.path_method.currentText()
+        print(f"Adaptive probing of a {columns} by {rows} grid, {len(grid.coarse)} points to start with")
+
+        self.data = np.full((rows, columns), np.nan, dtype=np.float64)
+        self.driver.start(lambda job: probe_adaptive(job, grid, dist, lift, method))
 
-        self.data = np.zeros((self.driver.x_holes, self.driver.y_holes), dtype=np.float64)
+    def parameters(self) -> Dict[str, Any]:
+        parameters = {"job": self.title(), **form_values(self.layout())}
+        parameters["Points"] = self.points_label.text()
+        return parameters
 
-        self.start_job.emit()
+    def spacing(self) -> Tuple[float, float]:
+        """X and Y distance between the data's columns and rows"""
+        if self.scanning():
+            return self.scan_resolution.value(), self.sample_distance.value()
+        return self.sample_distance.value(), self.sample_distance.value()
 
     def sample_in(self, sample: list[int | int | float]) -> None:
         print(f"Sample into the job GUI is: {sample}")
@@ -218,22 +449,21 @@ class ProbeJob(QGroupBox):  # type: ignore
         self.data_changed.emit(self.data)
 
     def update_data_shape(self) -> None:
-        x = self.sample_X_line.value()
-        y = self.sample_Y_line.value()
-        d = self.sample_distance.value()
-
-        if d == 0:
+        points = self.points()
+        self.update_estimate()
+        if self.scanning():
+            shape = self.scan_shape()
+        elif len(points):
+            _, shape = snap_to_grid(points)
+        else:
             return
 
-        x_shape = int(x / d)
-        y_shape = int(y / d)
-
-        self.data = np.zeros((x_shape, y_shape), dtype=np.float64)
+        self.data = np.zeros(shape, dtype=np.float64)
         print("emitting data")
         self.data_changed.emit(self.data)
         print("data emitted")
 
     def closeEvent(self, event: QCloseEvent) -> QCloseEvent:
         print("inside close event for test job")
-        self.driver.stopping = True
+        self.driver.close()
         return super().closeEvent(event)
@@ -1,87 +1,62 @@
 from __future__ import annotations
 
-import sys
 from typing import Any
 from typing import Dict
+from typing import Tuple
 
 import numpy as np
-from PySide6.QtCore import QThread
 from PySide6.QtCore import Signal
 from PySide6.QtGui import QCloseEvent
 from PySide6.QtWidgets import QDoubleSpinBox
 from PySide6.QtWidgets import QFormLayout
 from PySide6.QtWidgets import QGroupBox
 
-from src.client import Client
-from src.CNC_jobs.common import LinuxDriver
+from src.CNC_jobs.common import form_values
+from src.CNC_jobs.common import JobDriver
+from src.CNC_jobs.engine import JobContext
 
-IN_LINUXCNC = False
-if sys.platform == "linux":
-    IN_LINUXCNC = True
-    import linuxcnc
 
+async def probe_and_machine_grid(job: JobContext, x_holes: int, y_holes: int, dist: float) -> None:
+    """Samples each point of the grid and mills a circle there at a depth offset by the sample"""
+    await job.move("G64")  # Path blending best possible speed
 
-class ProbeAndMachineDriver(LinuxDriver):
-    def init(self, client: Client) -> None:
-        super().__init__()
+    radius = 2  # milling radius
+    height = 4  # safe height
 
-        self.client = client
+    feed = 5000
 
-    def loop(self, params: Dict[str, Any]) -> None:
-        x_holes = params["x_holes"]
-        y_holes = params["y_holes"]
-        dist = params["dist"]
+    await job.zero()
 
-        print("Starting LinuxCNC job")
-        self.c.mode(linuxcnc.MODE_MDI)  # type: ignore
-        self.c.wait_complete()  # wait until mode switch executed
-        self.cmd("G64")  # Path blending best possible speed
+    for y in range(y_holes):
+        for x in range(x_holes):
+            print(f"index x: {x} y: {y}")
 
-        radius = 2  # milling radius
-        height = 4  # safe height
+            # Move down
+            sample = await job.sample()
+            job.emit(x, y, sample)
+            await job.move(f"G0 X{x*dist} Y{y*dist} Z{height + (sample * 100)}")
+            await job.move(f"G0 X{x*dist} Y{y*dist} Z{height}")
+            await job.move(f"G0 X{x*dist} Y{y*dist} Z0")
 
-        feed = 5000
+            # Circle
+            await job.move(f"G0 X{x*dist -radius} Y{y*dist} Z0")
+            await job.move(f"G02 X{x*dist -radius} Y{y*dist} I{radius} J0 F{feed}")
+            await job.move(f"G0 X{x*dist } Y{y*dist} Z0")
 
-        print(self.client.send_recieve("ZERO"))
-
-        for y in range(y_holes):
-            for x in range(x_holes):
-                if QThread.currentThread().isInterruptionRequested():
-                    print("Job Stopped")
-                    return
-
-                print(f"index x: {x} y: {y}")
-
-                # Move down
-                sample = float(self.client.send_recieve("TAKE_SAMPLE").split(" ")[1])
-                self.OnSampleReceived.emit([x, y, sample])
-                self.cmd(f"G0 X{x*dist} Y{y*dist} Z{height + (sample * 100)}")
-                self.cmd(f"G0 X{x*dist} Y{y*dist} Z{height}")
-                self.cmd(f"G0 X{x*dist} Y{y*dist} Z0")
-
-                # Circle
-                self.cmd(f"G0 X{x*dist -radius} Y{y*dist} Z0")
-                self.cmd(f"G02 X{x*dist -radius} Y{y*dist} I{radius} J0 F{feed}")
-                self.cmd(f"G0 X{x*dist } Y{y*dist} Z0")
-
-                # Move up
-                self.cmd(f"G0 X{x*dist} Y{y*dist} Z{height}")
-
-            print("not ready")
+            # Move up
+            await job.move(f"G0 X{x*dist} Y{y*dist} Z{height}")
 
 
 class ProbeAndMachineJob(QGroupBox):  # type: ignore
-    OnDataChanged = Signal(np.ndarray)
-    OnStartJob = Signal(dict)
+    data_changed = Signal(np.ndarray)
 
-    def __init__(self, client: Client) -> None:
+    def __init__(self) -> None:
         QGroupBox.__init__(self)
         self.setTitle("Probe And Machine Job")
 
-        self.driver = ProbeAndMachineDriver()
-        self.driver_thread = QThread()
-        self.driver.moveToThread(self.driver_thread)
-        self.driver_thread.start()
+        self.data = np.zeros((5, 5), dtype=np.float64)
+
+        self.driver = JobDriver()
 
         form = QFormLayout()
         self.setLayout(form)
@@ -99,25 +74,37 @@ class ProbeAndMachineJob(QGroupBox):  # type: ignore
         form.addRow("Sample Y Length", self.sample_Y_line)
         form.addRow("Sample Distance", self.sample_distance)
 
-        # Update the driver
-        self.OnStartJob.connect(self.driver.loop)
-
         # update the GUI
         self.sample_X_line.valueChanged.connect(self.update_data_shape)
         self.sample_Y_line.valueChanged.connect(self.update_data_shape)
         self.sample_distance.valueChanged.connect(self.update_data_shape)
+        self.driver.sample_out.connect(self.sample_in)
 
         self.update_data_shape()
 
-    def start_job(self) -> None:
-        sample_X_line = self.sample_X_line.value()
-        sample_X_line = self.sample_X_line.value()
+    def start_driver(self) -> None:
         dist = self.sample_distance.value()
+        x_holes = int(self.sample_X_line.value() / dist)
+        y_holes = int(self.sample_Y_line.value() / dist)
+
+        self.data = np.zeros((y_holes, x_holes), dtype=np.float64)  # rows, columns
+
+        self.driver.start(lambda job: self.grid_job(job, x_holes, y_holes, dist))
+
+    async def grid_job(self, job: JobContext, x_holes: int, y_holes: int, dist: float) -> None:
+        await probe_and_machine_grid(job, x_holes, y_holes, dist)
+
+    def parameters(self) -> Dict[str, Any]:
+        return {"job": self.title(), **form_values(self.layout())}
 
-        x_holes = int(sample_X_line / dist)
-        y_holes = int(sample_X_line / dist)
+    def spacing(self) -> Tuple[float, float]:
+        """X and Y distance between the data's columns and rows"""
+        return self.sample_distance.value(), self.sample_distance.value()
 
-        self.OnStartJob.emit({"x_holes": x_holes, "y_holes": y_holes, "dist": dist})
+    def sample_in(self, sample: list[int | int | float]) -> None:
+        x, y, val = sample
+        self.data[y][x] = val
+        self.data_changed.emit(self.data)
 
     def update_data_shape(self) -> None:
         x = self.sample_X_line.value()
@@ -130,13 +117,13 @@ class ProbeAndMachineJob(QGroupBox):  # type: ignore
         x_shape = int(x / d)
         y_shape = int(y / d)
 
-        self.data = np.zeros((x_shape, y_shape), dtype=np.float64)
+        self.data = np.zeros((y_shape, x_shape), dtype=np.float64)
         print("emitting data")
-        self.OnDataChanged.emit(self.data)
+        self.data_changed.emit(self.data)
         print("data emitted")
 
     def closeEvent(self, event: QCloseEvent) -> QCloseEvent:
         print("inside close event for test job")
-        self.driver_thread.requestInterruption()
+        self.driver.close()
 
         return super().closeEvent(event)
@@ -0,0 +1,148 @@
+"""
+The probe job as one G-code program that the controller runs on its own.
+
+Sending every move as MDI costs mode round trips per point and the interpreter can never blend the moves. Here the
+whole pattern is one program and the driver only answers the sample requests. At each point the program moves
+down, dwells to settle and hands over to the driver with a four phase handshake on the motion digital IO:
+
+    M68 E0 Q<index>     motion.analog-out-00: which point, -1 to set the zero
+    M66 P0 L4 Q5        wait for motion.digital-in-00 (the driver's acknowledge) to be low
+    M64 P0              motion.digital-out-00 high: sample request
+    M66 P0 L3 Q<timeout>  wait for the acknowledge, the driver raises it once the sample is taken
+    M65 P0              request low, the driver drops the acknowledge in return
+
+If the acknowledge doesn't come in time the program aborts. The driver's acknowledge pin (see LinuxCNCMachine) has
+to be connected to motion.digital-in-00, the driver tries to do that itself.
+
+Regular grids are written as O-word loops, point lists (CSV files or the Shortest path) as one call per point.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable
+from typing import Callable
+from typing import List
+
+import numpy as np
+import numpy.typing as npt
+
+from src.CNC_jobs.paths import TOUCH_FEED
+
+REQUEST_PIN = 0  # motion.digital-out-NN and motion.digital-in-NN
+INDEX_PIN = 0  # motion.analog-out-NN
+SAMPLE_TIMEOUT = 120.0  # seconds the program waits for a sample
+DWELL = 0.2  # seconds to settle after touching down
+
+OnRequest = Callable[[int], Awaitable[None]]
+
+
+class ProgramAborted(Exception):
+    """The program stopped at an (abort, ...) comment, ex because a sample didn't come in time"""
+
+
+def program_header(lift: float, dwell: float = DWELL, timeout: float = SAMPLE_TIMEOUT) -> List[str]:
+    """The setup and the touch subroutine, which probes the point at the current X Y"""
+    return [
+        "(Laser level probe job)",
+        "G21 G90 G64",
+        f"#<_lift> = {lift:g}",
+        "O<touch> sub",
+        "  (#1 is the point index, -1 to set the zero)",
+        f"  G1 F{TOUCH_FEED:g} W0",
+        f"  G4 P{dwell:g}",
+        f"  M68 E{INDEX_PIN} Q#1",
+        f"  M66 P{REQUEST_PIN} L4 Q5",
+        "  O<released> if [#5399 LT 0]",
+        "    (abort, the driver is still acknowledging the last sample)",
+        "  O<released> endif",
+        f"  M64 P{REQUEST_PIN}",
+        f"  M66 P{REQUEST_PIN} L3 Q{timeout:g}",
+        "  O<sampled> if [#5399 LT 0]",
+        "    (abort, no sample from the sensor)",
+        "  O<sampled> endif",
+        f"  M65 P{REQUEST_PIN}",
+        "  G0 W#<_lift>",
+        "O<touch> endsub",
+        "G53 G0 W0 Z0",
+        "G54 G0 X0 Y0",
+        "G0 W#<_lift>",
+        "O<touch> call [-1]",
+    ]
+
+
+PROGRAM_FOOTER = ["G53 G0 W0 Z0", "M2"]
+
+
+def grid_program(
+    columns: int, rows: int, dist: float, lift: float, serpentine: bool = True, dwell: float = DWELL
+) -> str:
+    """
+    Probes a grid like paths.grid_points with nested O-word loops. The point index is row * columns + column,
+    the index into grid_points.
+    """
+    lines = program_header(lift, dwell)
+    lines += [
+        "#<row> = 0",
+        f"O<rows> while [#<row> LT {rows}]",
+        "  #<step> = 0",
+        f"  O<columns> while [#<step> LT {columns}]",
+        "    #<column> = #<step>",
+    ]
+    if serpentine:
+        lines += [
+            "    O<reverse> if [[#<row> MOD 2] EQ 1]",
+            f"      #<column> = [{columns - 1} - #<step>]",
+            "    O<reverse> endif",
+        ]
+    lines += [
+        f"    G0 X[#<column> * {dist:g}] Y[#<row> * {dist:g}]",
+        f"    O<touch> call [#<row> * {columns} + #<column>]",
+        "    #<step> = [#<step> + 1]",
+        "  O<columns> endwhile",
+        "  #<row> = [#<row> + 1]",
+        "O<rows> endwhile",
+    ]
+    return "\n".join(lines + PROGRAM_FOOTER) + "\n"
+
+
+def points_program(
+    points: npt.NDArray[np.float64], order: npt.NDArray[np.int64], lift: float, dwell: float = DWELL
+) -> str:
+    """Probes the points in the given order, the point index is the index into points"""
+    lines = program_header(lift, dwell)
+    for index in order:
+        x, y = points[index]
+        lines += [f"G0 X{x:g} Y{y:g}", f"O<touch> call [{int(index)}]"]
+    return "\n".join(lines + PROGRAM_FOOTER) + "\n"
+
+
+async def serve_handshake(
+    request: Callable[[], bool],
+    index: Callable[[], int],
+    acknowledge: Callable[[bool], None],
+    running: Callable[[], bool],
+    on_request: OnRequest,
+    poll_interval: float = 0.01,
+) -> None:
+    """
+    The driver's side of the handshake, until the program stops running.
+
+    Args:
+        request: Reads the request output.
+        index: Reads the point index output.
+        acknowledge: Sets the acknowledge input.
+        running: True while the program runs.
+        on_request: Awaited with the point index for every request, the acknowledge is raised when it returns.
+    """
+    answered = False
+    while running():
+        if request() and not answered:
+            await on_request(index())
+            acknowledge(True)
+            answered = True
+        elif answered and not request():
+            acknowledge(False)
+            answered = False
+        else:
+            await asyncio.sleep(poll_interval)
+    acknowledge(False)
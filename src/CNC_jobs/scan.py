@@ -0,0 +1,162 @@
+"""
+Continuous scanning: the sensor slides along lines at a steady feed instead of stopping at every point.
+
+While the machine moves along a line the sensor streams the result of every frame (see src.protocol STREAM) and
+the driver polls the machine's position. Afterwards each frame is placed by time: its timestamp is moved onto the
+driver's clock and the position at that moment is interpolated from the polled positions.
+
+The sensor runs on another computer, so its clock is only known up to an offset. estimate_clock_offset() takes the
+smallest gap between a frame's timestamp and when it was received, which is the offset plus the shortest network
+delay. The frame timestamps mark when the frame arrived from the camera, the exposure was a little before that,
+`lag` corrects for it.
+"""
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from typing import List
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from src.CNC_jobs.engine import JobContext
+from src.CNC_jobs.paths import TOUCH_FEED
+from src.sampling import FrameResult
+
+SCAN_FEED = 600.0  # mm/min
+POSITION_INTERVAL = 0.005  # seconds between position polls while scanning
+
+Line = Tuple[Tuple[float, float], Tuple[float, float]]
+
+
+@dataclass
+class ScanLine:
+    """
+    What was recorded along one line.
+
+    Attributes:
+        row (int): The line's row in the data grid.
+        positions (ndarray): (n, 5) driver time and X Y Z W polled while moving along the line.
+        frames (list): (received, FrameResult) for every frame that arrived meanwhile, received on the driver's clock.
+    """
+
+    row: int
+    positions: npt.NDArray[np.float64]
+    frames: List[Tuple[float, FrameResult]] = field(default_factory=list)
+
+
+def scan_lines(columns_length: float, rows: int, spacing: float, serpentine: bool = True) -> List[Line]:
+    """Lines along X from X0, spacing apart in Y, every other one backwards when serpentine"""
+    lines: List[Line] = []
+    for row in range(rows):
+        start, end = (0.0, row * spacing), (columns_length, row * spacing)
+        lines.append((end, start) if serpentine and row % 2 else (start, end))
+    return lines
+
+
+def estimate_clock_offset(sensor_times: npt.ArrayLike, received_times: npt.ArrayLike) -> float:
+    """Returns the offset that moves sensor timestamps onto the receiver's clock"""
+    return float(np.min(np.asarray(received_times) - np.asarray(sensor_times)))
+
+
+def align(
+    frame_times: npt.ArrayLike,
+    values: npt.ArrayLike,
+    positions: npt.NDArray[np.float64],
+    offset: float,
+    lag: float = 0.0,
+) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """
+    Places the frames along the machine's path.
+
+    Args:
+        frame_times: Sensor timestamps of the frames.
+        values: Their values.
+        positions: (n, 1 + axes) driver time and axis positions.
+        offset: Sensor to driver clock offset, see estimate_clock_offset.
+        lag: Seconds between the exposure and the frame's timestamp.
+
+    Returns:
+        - (m, axes) positions of the frames that were taken while the machine moved and have a value.
+        - Their values.
+    """
+    times = np.asarray(frame_times, dtype=np.float64) + offset - lag
+    values = np.asarray(values, dtype=np.float64)
+    keep = (times >= positions[0, 0]) & (times <= positions[-1, 0]) & np.isfinite(values)
+    times = times[keep]
+    placed = np.column_stack([np.interp(times, positions[:, 0], axis) for axis in positions[:, 1:].T])
+    return placed, values[keep]
+
+
+def bin_profile(
+    x: npt.NDArray[np.float64], values: npt.NDArray[np.float64], resolution: float, columns: int
+) -> npt.NDArray[np.float64]:
+    """Averages the values into columns resolution apart from X0, columns without any are nan"""
+    column = np.rint(x / resolution).astype(np.int64)
+    inside = (column >= 0) & (column < columns)
+    sums = np.bincount(column[inside], weights=values[inside], minlength=columns)
+    counts = np.bincount(column[inside], minlength=columns)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def scan_time(length: float, rows: int, feed: float = SCAN_FEED) -> float:
+    """Seconds spent moving along the lines"""
+    return rows * length / (feed / 60.0)
+
+
+async def scan_grid(
+    job: JobContext,
+    length: float,
+    rows: int,
+    spacing: float,
+    resolution: float,
+    lift: float,
+    feed: float = SCAN_FEED,
+    lag: float = 0.0,
+) -> List[ScanLine]:
+    """
+    Scans rows lines of the given length along X, spacing apart. Every line is reported binned into columns
+    resolution apart once it has been scanned, in um like the probe jobs.
+    """
+    columns = int(round(length / resolution)) + 1
+    scanned: List[ScanLine] = []
+    received: List[Tuple[float, FrameResult]] = []
+    offset = np.inf  # the smallest gap seen so far is the best estimate
+
+    await job.move("G64")  # Path blending best possible speed
+    await job.move("G53 G0 W0Z0")
+    await job.move("G54 G0 X0Y0")
+    await job.move(f"G0 W{lift}")
+    await job.move(f"G1 F{TOUCH_FEED:g} W0")
+    await job.zero()
+    await job.move(f"G0 W{lift}")
+
+    await job.start_stream(lambda frame: received.append((time.monotonic(), frame)))
+    try:
+        for row, (start, end) in enumerate(scan_lines(length, rows, spacing)):
+            await job.move(f"G0 X{start[0]:g} Y{start[1]:g}")
+            await job.move(f"G1 F{TOUCH_FEED:g} W0")
+            del received[:]
+            positions = await job.track(f"G1 F{feed:g} X{end[0]:g} Y{end[1]:g}", POSITION_INTERVAL)
+            await job.move(f"G0 W{lift}")
+            line = ScanLine(row, positions, list(received))  # frames from the end of the line arrive during the lift
+            scanned.append(line)
+
+            if not line.frames:
+                print(f"No frames streamed while scanning line {row}")
+                continue
+            received_times = [when for when, _ in line.frames]
+            sensor_times = [frame.timestamp for _, frame in line.frames]
+            offset = min(offset, estimate_clock_offset(sensor_times, received_times))
+            placed, values = align(sensor_times, [frame.value for _, frame in line.frames], positions, offset, lag)
+            profile = bin_profile(placed[:, 0], values, resolution, columns)
+            for column in np.flatnonzero(np.isfinite(profile)):
+                job.emit(int(column), row, float(profile[column]) * 1000)  # convert mm to um
+    finally:
+        await job.stop_stream()
+
+    await job.move("G53 G0 W0Z0")
+    return scanned
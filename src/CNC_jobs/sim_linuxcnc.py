@@ -0,0 +1,394 @@
+"""
+Stand-ins for LinuxCNC's linuxcnc and hal Python modules, so the jobs can run through LinuxCNCMachine without
+LinuxCNC, ex in CI, and report how long they would take on the machine.
+
+SimulatedLinuxCNC plays the task. Commands come in through command(), it reports through stat() and
+error_channel(), and it runs them on a SimulatedController (see src.CNC_jobs.simulator) on a thread of its own,
+the way the real task runs in its own process. Pass it where the linuxcnc module would go and its hal attribute
+where the hal module would:
+
+    task = SimulatedLinuxCNC()
+    machine = LinuxCNCMachine(linuxcnc_module=task, hal_module=task.hal)
+
+What's modelled:
+
+- Modes: MDI commands are only taken in MODE_MDI and programs only run in MODE_AUTO. The mode only changes while
+  the interpreter is idle. Refused commands go to the error channel, like they do on the real task.
+- The MDI queue: commands run one after another. interp_state is INTERP_READING from mdi() until the queue is
+  empty, and wait_complete() returns once the task has taken the last command.
+- Motion: moves take the time the axis velocity and acceleration limits give them, on the controller's simulated
+  clock. time_scale turns that into real time, 0 runs as fast as it can.
+- Every command costs command_latency simulated seconds, the task and servo cycles it waits for on a machine.
+- An error stops the queue, the rest of it is dropped.
+- The motion IO and the HAL signals the probe program handshake goes through.
+
+clock is the predicted machine time of everything run so far, SimulatedSensorServer adds the sampling to it.
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import re
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from src.CNC_jobs.simulator import AXES
+from src.CNC_jobs.simulator import SimulatedController
+
+# Max velocity in mm/min and acceleration in mm/s^2, a small router with a slow probe axis
+AXIS_LIMITS = {"X": (3000.0, 500.0), "Y": (3000.0, 500.0), "Z": (1500.0, 300.0), "W": (2000.0, 300.0)}
+COMMAND_LATENCY = 0.01  # simulated seconds a command waits for the task to pick it up
+MAX_JOINTS = 16
+IO_PINS = 64
+POSITION_INDEX = {"X": 0, "Y": 1, "Z": 2, "W": 8}  # in LinuxCNC's 9 axis position tuples
+
+DIGITAL_IN_PIN = re.compile(r"^motion\.digital-in-(\d+)$")
+
+
+class SimulatedStat:
+    """linuxcnc.stat, poll() takes a snapshot of the task"""
+
+    def __init__(self, task: "SimulatedLinuxCNC") -> None:
+        self.task = task
+        self.poll()
+
+    def poll(self) -> None:
+        self.__dict__.update(self.task.snapshot())
+
+
+class SimulatedCommand:
+    """linuxcnc.command"""
+
+    def __init__(self, task: "SimulatedLinuxCNC") -> None:
+        self.task = task
+
+    def mode(self, mode: int) -> None:
+        self.task.set_mode(mode)
+
+    def mdi(self, command: str) -> None:
+        self.task.mdi(command)
+
+    def program_open(self, path: str) -> None:
+        self.task.program = Path(path).read_text()
+
+    def auto(self, code: int, line: int = 0) -> None:
+        self.task.auto(code, line)
+
+    def abort(self) -> None:
+        self.task.abort()
+
+    def state(self, state: int) -> None:
+        self.task.set_state(state)
+
+    def home(self, joint: int) -> None:
+        self.task.homed = True
+
+    def wait_complete(self, timeout: float = 5.0) -> int:
+        return self.task.wait_taken(timeout)
+
+
+class SimulatedErrorChannel:
+    """linuxcnc.error_channel, poll() returns (kind, text) of the oldest error or None"""
+
+    def __init__(self, task: "SimulatedLinuxCNC") -> None:
+        self.task = task
+
+    def poll(self) -> Optional[Tuple[int, str]]:
+        with self.task.lock:
+            return self.task.errors.popleft() if self.task.errors else None
+
+
+class SimulatedComponent:
+    """A hal.component, writing a pin sets every pin on the same signal"""
+
+    def __init__(self, hal: "SimulatedHal", name: str) -> None:
+        self.hal = hal
+        self.name = name
+        self.pins: Dict[str, Any] = {}
+
+    def newpin(self, name: str, kind: int, direction: int) -> None:
+        self.pins[name] = 0
+
+    def ready(self) -> None:
+        pass
+
+    def __getitem__(self, name: str) -> Any:
+        return self.pins[name]
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        if name not in self.pins:
+            raise AttributeError(f"{self.name} has no pin {name}")
+        self.pins[name] = value
+        self.hal.set_pin(f"{self.name}.{name}", value)
+
+
+class SimulatedHal:
+    """The hal module, with the motion IO pins wired to the task"""
+
+    HAL_BIT, HAL_FLOAT, HAL_S32, HAL_U32 = 1, 2, 3, 4
+    HAL_IN, HAL_OUT, HAL_IO = 16, 32, 48
+
+    def __init__(self, task: "SimulatedLinuxCNC") -> None:
+        self.task = task
+        self.signals: Dict[str, List[str]] = {}
+
+    def component(self, name: str) -> SimulatedComponent:
+        return SimulatedComponent(self, name)
+
+    def new_sig(self, name: str, kind: int) -> None:
+        if name in self.signals:
+            raise RuntimeError(f"signal {name} already exists")
+        self.signals[name] = []
+
+    def connect(self, pin: str, signal: str) -> None:
+        if signal not in self.signals:
+            raise RuntimeError(f"no signal {signal}")
+        self.signals[signal].append(pin)
+
+    def set_pin(self, pin: str, value: Any) -> None:
+        for pins in self.signals.values():
+            if pin in pins:
+                for other in pins:
+                    match = DIGITAL_IN_PIN.match(other)
+                    if match:
+                        self.task.set_input(int(match.group(1)), bool(value))
+
+
+class SimulatedLinuxCNC:
+    """
+    Args:
+        axis_limits: Max velocity in mm/min and acceleration in mm/s^2 of each axis.
+        time_scale: Real seconds per simulated second, 0 runs as fast as possible.
+        command_latency: Simulated seconds every command waits before it runs.
+        homed: Whether the machine starts switched on and homed, ready for jobs.
+    """
+
+    MODE_MANUAL, MODE_AUTO, MODE_MDI = 1, 2, 3
+    INTERP_IDLE, INTERP_READING, INTERP_PAUSED, INTERP_WAITING = 1, 2, 3, 4
+    RCS_DONE, RCS_EXEC, RCS_ERROR = 1, 2, 3
+    AUTO_RUN, AUTO_PAUSE, AUTO_RESUME, AUTO_STEP = 0, 1, 2, 3
+    STATE_ESTOP, STATE_ESTOP_RESET, STATE_OFF, STATE_ON = 1, 2, 3, 4
+    NML_ERROR, OPERATOR_ERROR = 1, 11
+
+    def __init__(
+        self,
+        axis_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        time_scale: float = 0.0,
+        command_latency: float = COMMAND_LATENCY,
+        homed: bool = True,
+    ) -> None:
+        limits = AXIS_LIMITS if axis_limits is None else axis_limits
+        rapid = max((velocity for velocity, _ in limits.values()), default=None)
+        acceleration = max((acceleration for _, acceleration in limits.values()), default=None)
+        self.controller = SimulatedController(time_scale=time_scale, axis_limits=limits)
+        if rapid is not None and acceleration is not None:
+            self.controller.rapid_rate, self.controller.acceleration = rapid, acceleration
+        self.command_latency = command_latency
+        self.hal = SimulatedHal(self)
+
+        self.lock = threading.Lock()
+        self.taken = threading.Condition(self.lock)
+        self.task_mode = self.MODE_MANUAL
+        self.estop = not homed
+        self.enabled = homed
+        self.homed = homed
+        self.program = ""
+        self.errors: Deque[Tuple[int, str]] = deque()
+        self.futures: List[concurrent.futures.Future[None]] = []  # commands given and not finished
+        self.given = 0  # serial numbers of commands given and taken
+        self.taken_serial = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.busy: asyncio.Lock = self.call(self.make_lock())
+
+    @staticmethod
+    async def make_lock() -> asyncio.Lock:
+        return asyncio.Lock()
+
+    def call(self, coroutine: Awaitable[Any], timeout: Optional[float] = 5.0) -> Any:
+        """Runs a coroutine on the task's thread and waits for it"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)  # type: ignore
+
+    @property
+    def clock(self) -> float:
+        """Simulated seconds of machine time so far"""
+        return float(self.controller.clock)
+
+    def elapse(self, seconds: float) -> None:
+        """Adds time spent outside the task to the clock, ex sampling"""
+
+        def add() -> None:
+            self.controller.clock += seconds
+
+        self.loop.call_soon_threadsafe(add)
+
+    # linuxcnc module interface
+
+    def stat(self) -> SimulatedStat:
+        return SimulatedStat(self)
+
+    def command(self) -> SimulatedCommand:
+        return SimulatedCommand(self)
+
+    def error_channel(self) -> SimulatedErrorChannel:
+        return SimulatedErrorChannel(self)
+
+    # The task
+
+    def busy_interpreting(self) -> bool:
+        with self.lock:
+            self.futures = [future for future in self.futures if not future.done()]
+            return bool(self.futures)
+
+    def snapshot(self) -> Dict[str, Any]:
+        async def read() -> Dict[str, Any]:
+            controller = self.controller
+            position = controller.position_at(time.monotonic())
+            actual = [0.0] * 9
+            for axis, value in zip(AXES, position):
+                actual[POSITION_INDEX[axis]] = value
+            dout, aout, din = [False] * IO_PINS, [0.0] * IO_PINS, [False] * IO_PINS
+            for pin, on in controller.digital_out.items():
+                dout[pin] = on
+            for pin, value in controller.analog_out.items():
+                aout[pin] = value
+            for pin, on in controller.digital_in.items():
+                din[pin] = on
+            return {
+                "actual_position": tuple(actual),
+                "position": tuple(actual),
+                "dout": tuple(dout),
+                "aout": tuple(aout),
+                "din": tuple(din),
+            }
+
+        state = self.call(read())
+        busy = self.busy_interpreting()
+        joints = len(AXES)
+        state.update(
+            estop=int(self.estop),
+            enabled=self.enabled,
+            joints=joints,
+            homed=tuple([int(self.homed)] * joints + [0] * (MAX_JOINTS - joints)),
+            task_mode=self.task_mode,
+            interp_state=self.INTERP_READING if busy else self.INTERP_IDLE,
+            state=self.RCS_EXEC if busy else self.RCS_DONE,
+            g5x_offset=(0.0,) * 9,
+            g92_offset=(0.0,) * 9,
+            file=self.program,
+        )
+        return state
+
+    def error(self, text: str, kind: int = NML_ERROR) -> None:
+        with self.lock:
+            self.errors.append((kind, text))
+
+    def give(self) -> int:
+        with self.lock:
+            self.given += 1
+            return self.given
+
+    def take(self, serial: int) -> None:
+        with self.taken:
+            self.taken_serial = max(self.taken_serial, serial)
+            self.taken.notify_all()
+
+    def wait_taken(self, timeout: float) -> int:
+        """RCS_DONE once the last command given has been taken, -1 on timeout like linuxcnc"""
+        with self.taken:
+            if self.taken.wait_for(lambda: self.taken_serial >= self.given, timeout):
+                return self.RCS_DONE
+            return -1
+
+    def queue(self, work: Callable[[], Awaitable[None]]) -> None:
+        """Runs the work after the commands before it, it's taken when it starts"""
+        serial = self.give()
+
+        async def perform() -> None:
+            async with self.busy:
+                self.take(serial)
+                try:
+                    await self.controller.elapse(self.command_latency)
+                    await work()
+                except asyncio.CancelledError:
+                    pass
+                except Exception as e:  # an error in the program, the task reports it and stops
+                    self.error(str(e) or type(e).__name__)
+                    self.drop_queue()
+
+        future = asyncio.run_coroutine_threadsafe(perform(), self.loop)
+        with self.lock:
+            self.futures.append(future)
+
+    def drop_queue(self) -> None:
+        with self.lock:
+            futures, self.futures = self.futures, []
+        for future in futures:
+            future.cancel()
+        self.take(self.given)
+
+    def refuse(self, text: str) -> None:
+        self.error(text, self.OPERATOR_ERROR)
+        self.take(self.give())
+
+    def set_mode(self, mode: int) -> None:
+        if mode != self.task_mode and self.busy_interpreting():
+            self.refuse("Can't change modes while the interpreter is running")
+            return
+        self.task_mode = mode
+        self.take(self.give())
+
+    def set_state(self, state: int) -> None:
+        if state == self.STATE_ESTOP:
+            self.estop, self.enabled = True, False
+            self.drop_queue()
+        elif state == self.STATE_ESTOP_RESET:
+            self.estop = False
+        elif state == self.STATE_ON:
+            self.enabled = not self.estop
+        elif state == self.STATE_OFF:
+            self.enabled = False
+        self.take(self.give())
+
+    def mdi(self, command: str) -> None:
+        if self.task_mode != self.MODE_MDI:
+            self.refuse(f"MDI command '{command}' refused, the machine isn't in MDI mode")
+        elif self.estop or not self.enabled or not self.homed:
+            self.refuse(f"MDI command '{command}' refused, the machine isn't on and homed")
+        else:
+            self.queue(lambda: self.controller.execute(command))
+
+    def auto(self, code: int, line: int = 0) -> None:
+        if code != self.AUTO_RUN:
+            self.refuse("Only AUTO_RUN is simulated")
+        elif self.task_mode != self.MODE_AUTO:
+            self.refuse("Can't run a program, the machine isn't in auto mode")
+        elif not self.program:
+            self.refuse("Can't run a program, none is open")
+        else:
+            program = self.program
+            self.queue(lambda: self.controller.execute(program))
+
+    def abort(self) -> None:
+        self.drop_queue()
+        self.take(self.give())
+
+    def set_input(self, pin: int, value: bool) -> None:
+        self.loop.call_soon_threadsafe(self.controller.digital_in.__setitem__, pin, value)
+
+    def close(self) -> None:
+        self.drop_queue()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2)
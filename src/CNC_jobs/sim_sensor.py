@@ -0,0 +1,120 @@
+"""
+A sensor server for running jobs on a simulated machine, see src.CNC_jobs.sim_linuxcnc.
+
+It speaks the sensor's protocol (see src.protocol) on a local port, on a thread of its own like the sensor app.
+A sample is the height of a surface under the machine's X Y, in mm from where the zero was set, with noise if
+asked for. A measurement takes measure_time simulated seconds, which go on the machine's clock so the clock
+predicts the whole job, and measure_time * time_scale real seconds.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Callable
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+from src.CNC_jobs.sim_linuxcnc import SimulatedLinuxCNC
+from src.protocol import CommandDispatcher
+from src.protocol import Session
+from src.sampling import SampleResult
+
+MEASURE_TIME = 0.35  # simulated seconds per sample, about 10 frames at 30 fps
+SUBSAMPLES = 10
+
+Surface = Callable[[float, float], float]  # X Y in mm to height in mm
+
+
+def flat(x: float, y: float) -> float:
+    return 0.0
+
+
+class SimulatedSensorServer:
+    """
+    Args:
+        task: The simulated machine, where the sensor is and whose clock the measurements go on.
+        surface: Height under the sensor at X Y.
+        measure_time: Simulated seconds per measurement.
+        noise: Standard deviation of the noise on every sample, in mm.
+        seed: For the noise.
+    """
+
+    def __init__(
+        self,
+        task: SimulatedLinuxCNC,
+        surface: Surface = flat,
+        measure_time: float = MEASURE_TIME,
+        noise: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.task = task
+        self.surface = surface
+        self.measure_time = measure_time
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.zero = 0.0
+        self.samples = 0
+        self.writers: List[asyncio.StreamWriter] = []
+        self.loop = asyncio.new_event_loop()
+        self.dispatcher = CommandDispatcher(self.start_measurement, log=lambda _: None)
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+
+        started = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(started,), daemon=True)
+        self.thread.start()
+        started.wait(5)
+
+    def run(self, started: threading.Event) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle_client, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        started.set()
+        self.loop.run_forever()
+
+    def height(self) -> float:
+        """The surface under the sensor now"""
+        x, y = self.task.controller.position["X"], self.task.controller.position["Y"]
+        return float(self.surface(x, y))
+
+    def start_measurement(self, zero: bool, token: int) -> None:
+        self.task.elapse(self.measure_time)
+        self.loop.call_later(self.measure_time * self.task.controller.time_scale, self.finish, zero, token)
+
+    def finish(self, zero: bool, token: int) -> None:
+        height = self.height() + (self.rng.normal(0.0, self.noise) if self.noise else 0.0)
+        if zero:
+            self.zero = height
+            value = 0.0
+        else:
+            self.samples += 1
+            value = height - self.zero
+        self.dispatcher.measurement_complete(SampleResult(value, self.noise / np.sqrt(SUBSAMPLES), SUBSAMPLES), token)
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = Session("client", writer.write, writer.transport.get_write_buffer_size)
+        self.writers.append(writer)
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                self.dispatcher.feed(session, data)
+        except ConnectionError:
+            pass
+        finally:
+            self.dispatcher.close(session)
+            writer.close()
+
+    def close(self) -> None:
+        def stop() -> None:
+            for writer in self.writers:
+                writer.transport.abort()
+            if self.server is not None:
+                self.server.close()
+            self.loop.stop()
+
+        self.loop.call_soon_threadsafe(stop)
+        self.thread.join(5)
@@ -0,0 +1,469 @@
+"""
+A simulated controller for running the CNC jobs without a machine.
+
+SimulatedController takes MDI commands and whole programs like LinuxCNCMachine does, interpreting the subset of
+RS274NGC the jobs use: G0 G1 G4 G53 G54 G21 G90 G64, F, the X Y Z W axes, M2 M64 M65 M66 M68, parameters and
+expressions and the O-word sub/call/while/if blocks. Moves take the time paths.move_time gives them on a simulated
+clock, every executed line is logged with it. Given axis_limits, moves are held to each axis's own velocity and
+acceleration the way LinuxCNC's planner does, a move goes as fast as its slowest axis allows it to. The motion IO
+is simulated so programs hand over to the driver with the real handshake, see src.CNC_jobs.program.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from src.CNC_jobs.paths import ACCELERATION
+from src.CNC_jobs.paths import move_time
+from src.CNC_jobs.paths import RAPID_RATE
+from src.CNC_jobs.program import INDEX_PIN
+from src.CNC_jobs.program import OnRequest
+from src.CNC_jobs.program import ProgramAborted
+from src.CNC_jobs.program import REQUEST_PIN
+from src.CNC_jobs.program import serve_handshake
+
+AXES = "XYZW"
+
+O_WORD = re.compile(r"^O<(\w+)>\s+(sub|endsub|call|while|endwhile|if|else|endif)\b\s*(.*)$", re.IGNORECASE)
+ASSIGNMENT = re.compile(r"^(#<\w+>|#\d+)\s*=\s*(.+)$")
+EXPRESSION_TOKEN = re.compile(r"\s*(#<\w+>|#\d+|\d*\.?\d+|[A-Z]+|\*\*|[-+*/\[\]])", re.IGNORECASE)
+COMMENT = re.compile(r"\([^)]*\)")
+
+COMPARISONS = {
+    "EQ": lambda a, b: a == b,
+    "NE": lambda a, b: a != b,
+    "GT": lambda a, b: a > b,
+    "GE": lambda a, b: a >= b,
+    "LT": lambda a, b: a < b,
+    "LE": lambda a, b: a <= b,
+}
+
+
+@dataclass
+class Block:
+    """One parsed line of a program"""
+
+    kind: str  # "o" for O-words, "assign", "abort" or "words"
+    text: str
+    name: str = ""
+    keyword: str = ""
+    argument: str = ""
+    target: int = -1  # the matching line of an O-word block
+
+
+class Expressions:
+    """Evaluates RS274NGC expressions like [#<row> * 4 + #<column>] against a parameter lookup"""
+
+    def __init__(self, lookup: Dict[str, float], frame: Dict[str, float]) -> None:
+        self.lookup = lookup
+        self.frame = frame
+
+    def evaluate(self, text: str) -> float:
+        self.tokens = [token.upper() for token in EXPRESSION_TOKEN.findall(text)]
+        self.position = 0
+        value = self.logical()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Can't evaluate {text}")
+        return value
+
+    def peek(self) -> str:
+        return self.tokens[self.position] if self.position < len(self.tokens) else ""
+
+    def take(self) -> str:
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def logical(self) -> float:
+        value = self.comparison()
+        while self.peek() in ("AND", "OR", "XOR"):
+            operator, other = self.take(), self.comparison()
+            if operator == "AND":
+                value = float(bool(value) and bool(other))
+            elif operator == "OR":
+                value = float(bool(value) or bool(other))
+            else:
+                value = float(bool(value) != bool(other))
+        return value
+
+    def comparison(self) -> float:
+        value = self.sum()
+        while self.peek() in COMPARISONS:
+            operator = self.take()
+            value = float(COMPARISONS[operator](value, self.sum()))
+        return value
+
+    def sum(self) -> float:
+        value = self.product()
+        while self.peek() in ("+", "-"):
+            operator, other = self.take(), self.product()
+            value = value + other if operator == "+" else value - other
+        return value
+
+    def product(self) -> float:
+        value = self.power()
+        while self.peek() in ("*", "/", "MOD"):
+            operator, other = self.take(), self.power()
+            if operator == "*":
+                value *= other
+            elif operator == "/":
+                value /= other
+            else:
+                value = math.fmod(value, other)
+        return value
+
+    def power(self) -> float:
+        value = self.unary()
+        if self.peek() == "**":
+            self.take()
+            value = value ** self.power()
+        return value
+
+    def unary(self) -> float:
+        token = self.take()
+        if token == "-":
+            return -self.unary()
+        if token == "+":
+            return self.unary()
+        if token == "[":
+            value = self.logical()
+            if self.take() != "]":
+                raise ValueError("Missing ]")
+            return value
+        if token.startswith("#"):
+            return self.parameter(token)
+        try:
+            return float(token)
+        except ValueError:
+            raise ValueError(f"Unexpected {token!r} in expression") from None
+
+    def parameter(self, token: str) -> float:
+        key = token.lower()
+        if key in self.frame:
+            return self.frame[key]
+        if key in self.lookup:
+            return self.lookup[key]
+        raise ValueError(f"Parameter {token} isn't set")
+
+
+def parse_program(program: str) -> Tuple[List[Block], Dict[str, int]]:
+    """Parses the lines and matches up the O-word blocks, returns the blocks and where each sub starts"""
+    blocks: List[Block] = []
+    for line in program.splitlines():
+        text = line.strip()
+        if text.lower().startswith("(abort,"):
+            blocks.append(Block("abort", text[7:-1].strip()))
+            continue
+        text = COMMENT.sub("", text).strip()
+        if not text or text == "%":
+            continue
+        match = O_WORD.match(text)
+        if match:
+            name, keyword, argument = match.groups()
+            blocks.append(Block("o", text, name.lower(), keyword.lower(), argument.strip()))
+        elif ASSIGNMENT.match(text):
+            blocks.append(Block("assign", text))
+        else:
+            blocks.append(Block("words", text.upper()))
+
+    subs: Dict[str, int] = {}
+    opened: List[int] = []
+    for i, block in enumerate(blocks):
+        if block.kind != "o":
+            continue
+        if block.keyword in ("sub", "while", "if"):
+            opened.append(i)
+            if block.keyword == "sub":
+                subs[block.name] = i
+            continue
+        if block.keyword == "call":
+            continue
+        start = opened[-1] if opened else -1
+        if start < 0 or blocks[start].name != block.name:
+            raise ValueError(f"Unmatched O<{block.name}> {block.keyword}")
+        blocks[start].target = i  # sub, while and if point at their end or the else, the else at the end
+        if block.keyword == "else":
+            opened[-1] = i
+        else:
+            opened.pop()
+            block.target = start
+    if opened:
+        raise ValueError(f"O<{blocks[opened[-1]].name}> isn't closed")
+    return blocks, subs
+
+
+def bracket_groups(text: str) -> List[str]:
+    """Splits "[1] [#<a> + [2]]" into ["[1]", "[#<a> + [2]]"]"""
+    groups: List[str] = []
+    depth = start = 0
+    for i, char in enumerate(text):
+        if char == "[":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == "]":
+            depth -= 1
+            if depth == 0:
+                groups.append(text[slice(start, i + 1)])
+    return groups
+
+
+def split_words(text: str) -> List[Tuple[str, str]]:
+    """Splits "G0 X[#<column> * 15] Y0" into [("G", "0"), ("X", "[#<column> * 15]"), ("Y", "0")]"""
+    words: List[Tuple[str, str]] = []
+    i = 0
+    while i < len(text):
+        letter = text[i]
+        if letter.isspace():
+            i += 1
+            continue
+        if not letter.isalpha():
+            raise ValueError(f"Expected a word in {text!r}")
+        i += 1
+        while i < len(text) and text[i].isspace():
+            i += 1
+        start = i
+        if i < len(text) and text[i] == "[":
+            depth = 0
+            while i < len(text):
+                depth += {"[": 1, "]": -1}.get(text[i], 0)
+                i += 1
+                if depth == 0:
+                    break
+        elif i < len(text) and text[i] == "#":
+            i += 1
+            if i < len(text) and text[i] == "<":
+                i = text.index(">", i) + 1
+            else:
+                while i < len(text) and text[i].isdigit():
+                    i += 1
+        else:
+            while i < len(text) and (text[i].isdigit() or text[i] in ".+-"):
+                i += 1
+        words.append((letter, text[start:i]))
+    return words
+
+
+class SimulatedController:
+    """
+    Runs MDI commands and programs on a simulated machine.
+
+    Attributes:
+        rapid_rate (float): G0 feed in mm/min.
+        acceleration (float): mm/s^2.
+        axis_limits (dict): Max velocity in mm/min and acceleration in mm/s^2 of each axis, none by default.
+        time_scale (float): Real seconds per simulated second. 0 runs as fast as possible.
+        poll_interval (float): Real seconds between checks of the inputs while M66 waits.
+        clock (float): Simulated seconds since the controller was created.
+        position (dict): Current axis positions.
+        log (list): (clock, line) for every executed line with words.
+        positions (list): (clock, X, Y, Z, W) at the end of every move.
+        digital_out, digital_in, analog_out (dict): The motion IO.
+    """
+
+    def __init__(
+        self,
+        rapid_rate: float = RAPID_RATE,
+        acceleration: float = ACCELERATION,
+        time_scale: float = 0.0,
+        poll_interval: float = 0.001,
+        axis_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+    ) -> None:
+        self.rapid_rate = rapid_rate
+        self.acceleration = acceleration
+        self.axis_limits = axis_limits or {}
+        self.time_scale = time_scale
+        self.poll_interval = poll_interval
+
+        self.clock = 0.0
+        self.position = {axis: 0.0 for axis in AXES}
+        self.feed = 0.0
+        self.motion = 0
+        self.log: List[Tuple[float, str]] = []
+        self.positions: List[Tuple[float, float, float, float, float]] = []
+        self.parameters: Dict[str, float] = {"#5399": 0.0}
+        self.digital_out: Dict[int, bool] = {}
+        self.digital_in: Dict[int, bool] = {}
+        self.analog_out: Dict[int, float] = {}
+        self.running = False
+        self.move: Optional[Tuple[float, float, Dict[str, float], Dict[str, float]]] = None  # real start, end, from, to
+
+    def ready(self) -> bool:
+        return True
+
+    async def start(self) -> None:
+        pass
+
+    async def run(self, command: str) -> None:
+        """Runs one MDI command"""
+        print(f"Sent: {command}")
+        await self.execute(command)
+
+    def position_at(self, when: float) -> List[float]:
+        """X Y Z W at time.monotonic() when, moving at a constant speed along the current move"""
+        position = self.position
+        if self.move is not None:
+            start, end, origin, target = self.move
+            fraction = min(max(when - start, 0.0) / (end - start), 1.0) if end > start else 1.0
+            position = {axis: origin[axis] + (target[axis] - origin[axis]) * fraction for axis in AXES}
+        return [position[axis] for axis in AXES]
+
+    async def track(self, command: str, interval: float) -> npt.NDArray[np.float64]:
+        """Runs a move, returns (n, 5) time.monotonic() and X Y Z W every interval seconds while it ran"""
+        samples = [[time.monotonic()] + self.position_at(time.monotonic())]
+        move = asyncio.ensure_future(self.run(command))
+        while not move.done():
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            samples.append([now] + self.position_at(now))
+        await move
+        return np.array(samples)
+
+    async def run_program(self, program: str, on_request: OnRequest) -> None:
+        """Runs a program, answering its sample requests with on_request"""
+        task = asyncio.ensure_future(self.execute(program))
+        try:
+            await serve_handshake(
+                lambda: self.digital_out.get(REQUEST_PIN, False),
+                lambda: int(round(self.analog_out.get(INDEX_PIN, 0.0))),
+                lambda value: self.digital_in.__setitem__(REQUEST_PIN, value),
+                lambda: not task.done(),
+                on_request,
+                self.poll_interval,
+            )
+        finally:
+            if not task.done():
+                task.cancel()  # the driver side failed, abort like LinuxCNCMachine does
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        await task
+
+    async def execute(self, program: str) -> None:
+        blocks, subs = parse_program(program)
+        frame: Dict[str, float] = {}
+        calls: List[Tuple[int, Dict[str, float]]] = []
+        pc = 0
+        self.running = True
+        try:
+            while pc < len(blocks):
+                block = blocks[pc]
+                expressions = Expressions(self.parameters, frame)
+                pc += 1
+
+                if block.kind == "abort":
+                    raise ProgramAborted(block.text)
+                if block.kind == "assign":
+                    name, expression = ASSIGNMENT.match(block.text).groups()  # type: ignore
+                    value = expressions.evaluate(expression)
+                    if name.startswith("#<_") or not name.startswith("#<"):
+                        self.parameters[name.lower()] = value
+                    else:
+                        frame[name.lower()] = value
+                    continue
+                if block.kind == "words":
+                    if await self.execute_words(block.text, expressions):
+                        break
+                    continue
+
+                keyword = block.keyword
+                if keyword == "sub":
+                    pc = block.target + 1  # skip the definition
+                elif keyword == "endsub":
+                    pc, frame = calls.pop()
+                elif keyword == "call":
+                    arguments = bracket_groups(block.argument)
+                    calls.append((pc, frame))
+                    frame = {f"#{i + 1}": expressions.evaluate(a) for i, a in enumerate(arguments)}
+                    pc = subs[block.name] + 1
+                elif keyword in ("while", "if"):
+                    if not expressions.evaluate(block.argument):
+                        pc = block.target + 1
+                elif keyword == "endwhile":
+                    pc = block.target
+                elif keyword == "else":
+                    pc = block.target + 1
+        finally:
+            self.running = False
+            self.digital_out.clear()
+
+    async def execute_words(self, text: str, expressions: Expressions) -> bool:
+        """Executes one line of words, returns True at the program end"""
+        words = [(letter, expressions.evaluate(value)) for letter, value in split_words(text)]
+        g = [int(value) for letter, value in words if letter == "G"]
+        m = [int(value) for letter, value in words if letter == "M"]
+        values = {letter: value for letter, value in words if letter not in "GM"}
+        self.log.append((self.clock, text))
+
+        if "F" in values:
+            self.feed = values["F"]
+        for code in g:
+            if code in (0, 1):
+                self.motion = code
+        if 4 in g:
+            await self.elapse(values.get("P", 0.0))
+
+        target = dict(self.position)
+        target.update({axis: values[axis] for axis in AXES if axis in values})
+        if target != self.position:
+            rate = self.rapid_rate if self.motion == 0 else min(self.feed, self.rapid_rate)
+            duration = self.move_duration(self.position, target, rate)
+            now = time.monotonic()
+            self.move = (now, now + duration * self.time_scale, self.position, target)
+            await self.elapse(duration)
+            self.position = target
+            self.positions.append((self.clock, target["X"], target["Y"], target["Z"], target["W"]))
+
+        for code in m:
+            pin = int(values.get("P", values.get("E", 0)))
+            if code == 64:
+                self.digital_out[pin] = True
+            elif code == 65:
+                self.digital_out[pin] = False
+            elif code == 68:
+                self.analog_out[int(values.get("E", 0))] = values.get("Q", 0.0)
+            elif code == 66:
+                await self.wait_input(pin, int(values.get("L", 0)), values.get("Q", 0.0))
+            elif code in (2, 30):
+                return True
+        return False
+
+    def move_duration(self, origin: Dict[str, float], target: Dict[str, float], rate: float) -> float:
+        """Seconds a straight move takes at rate mm/min, held to the axis limits along its direction"""
+        distance = math.sqrt(sum((target[axis] - origin[axis]) ** 2 for axis in AXES))
+        acceleration = self.acceleration
+        for axis, (velocity, axis_acceleration) in self.axis_limits.items():
+            share = abs(target[axis] - origin[axis]) / distance  # of the move's length that's along the axis
+            if share > 0:
+                rate = min(rate, velocity / share)
+                acceleration = min(acceleration, axis_acceleration / share)
+        return float(move_time(distance, rate, acceleration))
+
+    async def wait_input(self, pin: int, mode: int, timeout: float) -> None:
+        """M66 with L3 (wait for high) or L4 (wait for low), sets #5399 to -1 on timeout"""
+        want = mode == 3
+        start = time.monotonic()
+        deadline: Optional[float] = start + timeout if timeout else None
+        while self.digital_in.get(pin, False) != want:
+            if deadline is not None and time.monotonic() > deadline:
+                self.parameters["#5399"] = -1.0
+                break
+            await asyncio.sleep(self.poll_interval)
+        else:
+            self.parameters["#5399"] = float(want)
+        self.clock += time.monotonic() - start
+
+    async def elapse(self, seconds: float) -> None:
+        self.clock += seconds
+        await asyncio.sleep(seconds * self.time_scale)
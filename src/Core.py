@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from typing import Optional
+
 import numpy as np
 from PySide6.QtCore import QObject
 from PySide6.QtCore import QThread
@@ -11,9 +13,12 @@ from PySide6.QtMultimedia import QMediaCaptureSession
 from PySide6.QtMultimedia import QMediaDevices
 from PySide6.QtMultimedia import QVideoFrame
 from PySide6.QtMultimedia import QVideoSink
-from scipy.stats import linregress
 
+from src.camera_formats import choose_format
+from src.camera_formats import format_key
+from src.camera_formats import rank_formats
 from src.DataClasses import Sample
+from src.sampling import SampleResult
 from src.Workers import FrameSender
 from src.Workers import FrameWorker
 from src.Workers import SampleWorker
@@ -37,6 +42,8 @@ def samples_recalc(samples: list[Sample]) -> None:
     """
     # Ensure that there are at least 3 samples to calculate the linear regression and errors.
     if len(samples) >= 3:
+        from scipy.stats import linregress
+
         # Get the x and y values from the samples.
         x = [s.x for s in samples]
         y = [s.y for s in samples]
@@ -75,6 +82,9 @@ class Core(QObject):  # type: ignore
         self.pixmap = None  # pixmap used for the camera feed
         self.histo = None  # histogram values used in analyser
         self.camera = QCamera()  # camera being used
+        self.camera_index = 0  # index of the camera in QMediaDevices.videoInputs()
+        self.camera_format = ""  # format key of the format the camera is running in
+        self.camera_format_override = ""  # format key the user picked, empty for automatic
         self.centre = 0.0  # The found centre of the histogram
         self.zero = 0.0  # The zero point
         self.analyser_widget_height = 0  # The height of the widget so we can calculate the offset
@@ -85,8 +95,10 @@ class Core(QObject):  # type: ignore
         self.setting_zero_sample = False  # boolean if we are setting zero or a sample
         self.replacing_sample = False  # If we are replacing a sample
         self.replacing_sample_index = 0  # the index of the sample we are replacing
+        self.measurement_token: Optional[int] = None  # socket server token of the running sample, None for the GUI
         self.line_data = np.empty(0)  # numpy array of the fitted line through the samples
         self.samples: list[Sample] = []
+        self.last_result = SampleResult(0.0, 0.0, 0)  # the last sample or zero, with its uncertainty
 
         # Frame worker
         self.workerThread = QThread()
@@ -127,10 +139,16 @@ class Core(QObject):  # type: ignore
         self.OnSubsampleProgressUpdate.emit([subsample, self.subsamples])  # current sample and total
 
     def received_sample(self, val: float) -> None:
+        stats = self.sample_worker.last_stats
+        timing = self.sample_worker.last_timing
+        mm_per_pixel = self.sensor_width / self.frameWorker.data_width if self.frameWorker.data_width else 0.0
+
         if self.setting_zero_sample:
             self.zero = val
+            self.last_result = SampleResult(0.0, stats.std_err * mm_per_pixel, stats.count, timing)
         else:
-            size_in_mm = (self.sensor_width / self.frameWorker.data_width) * (val - self.zero)
+            size_in_mm = mm_per_pixel * (val - self.zero)
+            self.last_result = SampleResult(size_in_mm, stats.std_err * mm_per_pixel, stats.count, timing)
 
             if self.replacing_sample:
                 x_orig = self.samples[self.replacing_sample_index].x
@@ -158,6 +176,7 @@ class Core(QObject):  # type: ignore
             self.zero = 0.0
 
         self.setting_zero_sample = zero
+        self.measurement_token = None
         self.sample_worker.start(self.subsamples, self.outliers)
 
     @Slot(QVideoFrame)  # type: ignore
@@ -165,6 +184,23 @@ class Core(QObject):  # type: ignore
         if self.frameWorker.ready:
             self.frameSender.OnFrameChanged.emit(frame)
 
+    def get_camera_formats(self, index: int) -> list[str]:
+        """
+        Returns the format keys the camera at the index offers, best first. See src.camera_formats.
+        """
+        available_cameras = QMediaDevices.videoInputs()
+        if not 0 <= index < len(available_cameras):
+            return []
+
+        return [format_key(f) for f in rank_formats(available_cameras[index].videoFormats())]
+
+    def set_camera_format(self, key: str) -> None:
+        """
+        Sets the user override for the camera format and restarts the camera with it. An empty key means automatic.
+        """
+        self.camera_format_override = key
+        self.set_camera(self.camera_index)
+
     def get_cameras(self) -> list[str]:
         cams = []
         for cam in QMediaDevices.videoInputs():
@@ -180,8 +216,17 @@ class Core(QObject):  # type: ignore
         if not available_cameras:
             return
 
+        self.camera_index = index
         camera_info = available_cameras[index]
         self.camera = QCamera(cameraDevice=camera_info, parent=self)
 
+        # Pick a format that's cheap to get a grayscale image out of, the backend default is often MJPEG
+        camera_format = choose_format(camera_info.videoFormats(), self.camera_format_override)
+        if camera_format is not None:
+            self.camera.setCameraFormat(camera_format)
+            self.camera_format = format_key(camera_format)
+        else:
+            self.camera_format = ""  # the backend's default, not the last camera's
+
         self.captureSession.setCamera(self.camera)
         self.camera.start()
@@ -2,10 +2,9 @@ from __future__ import annotations
 
 from typing import Any
 
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from PySide6.QtCore import Qt
+from PySide6.QtCore import QTimer
 from PySide6.QtCore import Signal
 from PySide6.QtGui import QColor
 from PySide6.QtGui import QFont
@@ -14,11 +13,11 @@ from PySide6.QtGui import QPaintEvent
 from PySide6.QtGui import QPen
 from PySide6.QtGui import QPixmap
 from PySide6.QtGui import QResizeEvent
+from PySide6.QtGui import QShowEvent
 from PySide6.QtWidgets import QSizePolicy
 from PySide6.QtWidgets import QTableWidgetItem
 from PySide6.QtWidgets import QVBoxLayout
 from PySide6.QtWidgets import QWidget
-from scipy.interpolate import CubicSpline
 
 from src.DataClasses import FrameData
 from src.DataClasses import Sample
@@ -46,7 +45,6 @@ style = {
     "savefig.facecolor": "212946",
     "image.cmap": "RdPu",
 }
-plt.style.use(style)
 
 
 class Graph(QWidget):  # type: ignore
@@ -57,11 +55,33 @@ class Graph(QWidget):  # type: ignore
         self.units = ""
         self.mode = ""
         self.selected_index = 0
+        self.ax: Any = None  # created with the canvas
+        self.canvas: Any = None  # matplotlib is only imported once the widget is on screen
 
         # Layouts
-        main_layout = QVBoxLayout()
-        self.setLayout(main_layout)
-        main_layout.setContentsMargins(0, 0, 0, 0)
+        self.main_layout = QVBoxLayout()
+        self.setLayout(self.main_layout)
+        self.main_layout.setContentsMargins(0, 0, 0, 0)
+
+    def showEvent(self, event: QShowEvent) -> None:
+        super().showEvent(event)
+
+        # Defer the matplotlib import until after the window has painted its first frame
+        if self.canvas is None:
+            QTimer.singleShot(0, self.create_canvas)
+
+    def create_canvas(self) -> None:
+        """
+        Imports matplotlib and builds the line chart. Importing matplotlib (and applying the style) is the
+        single most expensive part of the app startup, so it is done on first show rather than at import.
+        """
+        if self.canvas is not None:
+            return
+
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+
+        plt.style.use(style)
 
         # Line chart
         fig, self.ax = plt.subplots()
@@ -70,7 +90,8 @@ class Graph(QWidget):  # type: ignore
         self.ax.set_ylabel(self.units)
         self.ax.autoscale_view("tight")
 
-        main_layout.addWidget(self.canvas)
+        self.main_layout.addWidget(self.canvas)
+        self.update_graph()
 
     def set_selected_index(self, index: int) -> None:
         self.selected_index = index + 1
@@ -85,6 +106,12 @@ class Graph(QWidget):  # type: ignore
         self.update_graph()
 
     def update_graph(self) -> None:
+        # Nothing to draw on until the canvas exists, create_canvas() redraws once it does
+        if self.canvas is None:
+            return
+
+        from scipy.interpolate import CubicSpline
+
         # Clear the axis and plot the data
         self.ax.clear()
 
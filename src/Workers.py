@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import time
 from typing import Any
+from typing import Optional
+from typing import Tuple
 
 import numpy as np
+import numpy.typing as npt
 import qimage2ndarray
 from PySide6.QtCore import QObject
 from PySide6.QtCore import Signal
@@ -12,11 +16,60 @@ from PySide6.QtGui import QPixmap
 from PySide6.QtGui import QTransform
 from PySide6.QtMultimedia import QVideoFrame
 
-from src.curves import fit_gaussian
+from src.camera_formats import pixel_format_name
 from src.DataClasses import FrameData
+from src.frame_ops import channel_view
+from src.frame_ops import decimate_rows
+from src.frame_ops import find_line
+from src.frame_ops import LUMA_FORMATS
+from src.frame_ops import luma_view
+from src.frame_ops import profile_noise
+from src.frame_ops import to_sensor_pixels
+from src.jpeg_decode import JPEG_LUMA_AVAILABLE
+from src.jpeg_decode import LumaDecodePool
+from src.sampling import FrameResult
+from src.sampling import SampleStats
+from src.sampling import SampleTiming
+from src.sampling import subsample
+from src.sampling import trimmed_mean
 from src.utils import get_units
 
 
+def video_frame_to_gray(frame: QVideoFrame, channel: str = "Luma") -> Tuple[npt.NDArray, Optional[QImage]]:
+    """
+    Returns the frame as a 2D uint8 array of intensities in the channel.
+
+    In luma mode YUV frames have their luma plane read directly, anything else goes through a QImage
+    conversion. The colour channel modes need an RGB image: RGB32 frames are read with a strided view, every
+    other format (the YUV ones the camera format is usually chosen for included) is converted to RGB32 first,
+    which costs a full frame conversion.
+
+    Args:
+        frame (QVideoFrame): A QVideoFrame object to be converted.
+        channel (str): One of frame_ops.CHANNEL_MODES.
+
+    Returns:
+        The grayscale image with the long side of the sensor along axis 1, and the QImage it is a view into
+        (None if it isn't a view). Keep a reference to the image for as long as the array is used.
+    """
+    if channel != "Luma":
+        image = frame.toImage()
+        if image.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied):
+            image = image.convertToFormat(QImage.Format_RGB32)
+        return channel_view(qimage2ndarray.byte_view(image), channel), image
+
+    format_name = pixel_format_name(frame.pixelFormat())
+    if format_name in LUMA_FORMATS and frame.map(QVideoFrame.ReadOnly):
+        try:
+            luma = luma_view(frame.bits(0), frame.width(), frame.height(), frame.bytesPerLine(0), format_name)
+            return np.array(luma), None  # copy out before the buffer is unmapped
+        finally:
+            frame.unmap()
+
+    image = frame.toImage().convertToFormat(QImage.Format_Grayscale8)
+    return qimage2ndarray.raw_view(image), image
+
+
 class SampleWorker(QObject):  # type: ignore
     """
     A worker class to process a stream of samples and emit the calculated mean.
@@ -41,8 +94,18 @@ class SampleWorker(QObject):  # type: ignore
         self.running_total = 0
         self.outlier_percent = 0.0
         self.started = False
+        self.last_stats = SampleStats(0.0, 0.0, 0)
+        self.first_frame = float("nan")  # arrival of the frame the first subsample came from
+        self.last_timing = SampleTiming()
+
+    def frame_in(self, result: FrameResult) -> None:
+        """
+        Takes the centre of an analysed frame as a subsample (see sampling.subsample), keeping the frame's
+        timestamp for the timing.
+        """
+        self.sample_in(subsample(result), result.timestamp)
 
-    def sample_in(self, sample: float) -> None:
+    def sample_in(self, sample: float, timestamp: float = float("nan")) -> None:
         """
         Process a new subsample by appending it to the array and emitting OnSubsampleRecieved.
 
@@ -51,10 +114,14 @@ class SampleWorker(QObject):  # type: ignore
 
         Args:
             sample (float): A new subsample to process.
+            timestamp (float): time.monotonic() when the frame it came from arrived, if known.
         """
         if not self.started:
             return
 
+        if self.running_total == 0:
+            self.first_frame = timestamp
+
         # Append new value to array
         self.sample_array = np.append(self.sample_array, sample)
 
@@ -64,17 +131,11 @@ class SampleWorker(QObject):  # type: ignore
         self.OnSubsampleRecieved.emit(self.running_total)
 
         if self.running_total == self.total_samples:
-            # Calculate the number of outliers to remove
-            n_outliers = int(len(self.sample_array) * self.outlier_percent / 2.0)
-
-            # Sort and remove the outliers
-            first, last = n_outliers, -n_outliers if n_outliers > 0 else None
-            self.sample_array = self.sample_array[self.sample_array.argsort()][first:last]
+            # Remove the outliers and calculate the new mean. The stats are kept for the socket server replies.
+            self.last_stats = trimmed_mean(self.sample_array, self.outlier_percent)
+            self.last_timing = SampleTiming(self.first_frame, timestamp, time.monotonic())
 
-            # Calculate new mean as float
-            mean = np.mean(self.sample_array).astype(float)
-
-            self.OnSampleReady.emit(mean)
+            self.OnSampleReady.emit(self.last_stats.mean)
 
             # reset
             self.sample_array = np.empty((0,))
@@ -112,6 +173,9 @@ class FrameWorker(QObject):  # type: ignore
     OnCentreChanged = Signal(int)
     OnPixmapChanged = Signal(QPixmap)
     OnAnalyserUpdate = Signal(FrameData)
+    OnJpegDecoded = Signal()
+    OnProfileNoise = Signal(float)
+    OnFrameAnalysed = Signal(FrameResult)
 
     def __init__(self, parent_obj: Any):
         super().__init__(None)
@@ -121,6 +185,16 @@ class FrameWorker(QObject):  # type: ignore
         self.analyser_widget_height = 0
         self.parent_obj = parent_obj
         self.data_width = 0
+        self.frame_image: Optional[QImage] = None  # backs the raw view of the last converted frame
+        self.jpeg_scale = 0  # 0 lets Qt decode MJPEG frames, otherwise decode the luma only at 1/jpeg_scale
+        self.jpeg_pool: Optional[LumaDecodePool] = None
+        self.channel = "Luma"  # colour channel the laser line is read from, see frame_ops.CHANNEL_MODES
+        self.row_stride = 1  # average every row_stride-th row into the profile
+        self.row_band = 0  # only average the middle row_band rows, 0 for all of them
+        self.noise_interval = 30  # frames between profile noise reports
+        self.frame_count = 0
+
+        self.OnJpegDecoded.connect(self.jpeg_decoded)
 
     @Slot(QVideoFrame)  # type: ignore
     def setVideoFrame(self, frame: QVideoFrame) -> None:
@@ -135,35 +209,101 @@ class FrameWorker(QObject):  # type: ignore
 
         """
         self.ready = False
+        timestamp = time.monotonic()
+
+        # Compressed frames go to the decode pool and come back through jpeg_decoded()
+        format_name = pixel_format_name(frame.pixelFormat())
+        if self.jpeg_scale and self.channel == "Luma" and JPEG_LUMA_AVAILABLE and format_name == "Format_Jpeg":
+            self.submit_jpeg(frame, timestamp)
+            return
 
         # Get the frame as a gray scale image
-        image = frame.toImage().convertToFormat(QImage.Format_Grayscale8)
         try:
-            histo = np.mean(qimage2ndarray.raw_view(image), axis=0)
+            gray = self.frame_to_gray(frame)
         except ValueError as e:
             print("Invalid QImage:", e)
+            self.ready = True
             return
 
-        pixmap = QPixmap.fromImage(image).transformed(QTransform().rotate(-90))
-        self.OnPixmapChanged.emit(pixmap)
+        self.analyse(gray, timestamp=timestamp)
+        self.ready = True
 
-        # Smoothing
-        kernel = np.ones(2 * self.analyser_smoothing + 1) / (2 * self.analyser_smoothing + 1)
-        histo = np.convolve(histo, kernel, mode="valid")
+    def frame_to_gray(self, frame: QVideoFrame) -> npt.NDArray:
+        """
+        Returns the frame as a 2D uint8 array of intensities in the selected channel, see video_frame_to_gray.
+        """
+        gray, self.frame_image = video_frame_to_gray(frame, self.channel)
+        return gray
+
+    def submit_jpeg(self, frame: QVideoFrame, timestamp: float) -> None:
+        """
+        Copies the compressed bytes out of an MJPEG frame and queues them on the luma decode pool.
 
-        # Find the min and max values
-        min_value, max_value = histo.min(), histo.max()
+        Args:
+            frame (QVideoFrame): A QVideoFrame in Format_Jpeg.
+            timestamp (float): time.monotonic() when the frame arrived.
+        """
+        if self.jpeg_pool is None or self.jpeg_pool.scale != self.jpeg_scale:
+            if self.jpeg_pool is not None:
+                self.jpeg_pool.shutdown()
+            self.jpeg_pool = LumaDecodePool(scale=self.jpeg_scale)
 
-        # Rescale the intensity values to have a range between 0 and 255
-        histo = ((histo - min_value) * (255.0 / (max_value - min_value))).clip(0, 255).astype(np.uint8)
+        if not frame.map(QVideoFrame.ReadOnly):
+            self.ready = True
+            return
+        try:
+            size = frame.mappedBytes(0)
+            data = bytes(frame.bits(0))[:size]
+        finally:
+            frame.unmap()
+
+        self.jpeg_pool.submit(data, self.OnJpegDecoded.emit, timestamp)
+        self.ready = not self.jpeg_pool.busy()  # keep accepting frames while a decode thread is free
+
+    @Slot()  # type: ignore
+    def jpeg_decoded(self) -> None:
+        """Analyses the frames the decode pool has finished, in the order they were captured"""
+        if self.jpeg_pool is None:
+            return
+
+        for timestamp, gray, (_, full_width) in self.jpeg_pool.ready():
+            self.analyse(gray, pixel_scale=self.jpeg_pool.scale, timestamp=timestamp, full_width=full_width)
+        self.ready = not self.jpeg_pool.busy()
+
+    def analyse(
+        self, gray: npt.NDArray, pixel_scale: int = 1, timestamp: float = 0.0, full_width: Optional[int] = None
+    ) -> None:
+        """
+        Finds the laser line in a grayscale image and emits the sensor feed, analyser and centre.
+
+        Args:
+            gray (ndarray): A 2D uint8 image, see frame_to_gray.
+            pixel_scale (int): How many sensor pixels each image pixel covers. The centre and data width are
+                reported in sensor pixels (see to_sensor_pixels) so the zero stays valid when the decode scale
+                changes.
+            timestamp (float): time.monotonic() when the frame arrived, passed on in OnFrameAnalysed.
+            full_width (int): Width of the frame in sensor pixels, the scaled width is rounded up so it can't be
+                worked out from it. Defaults to the image's width times pixel_scale.
+        """
+        rows = decimate_rows(gray, self.row_stride, self.row_band)
+        line = find_line(rows, self.analyser_smoothing, pixel_scale)
+
+        # The noise estimate is another pass over the rows, so only do it every so often
+        self.frame_count += 1
+        if self.frame_count % self.noise_interval == 0:
+            self.OnProfileNoise.emit(profile_noise(rows))
+
+        # QImage needs one contiguous buffer, only padded rows and single channel views get copied here
+        gray = np.ascontiguousarray(gray)
+        image = QImage(gray.data, gray.shape[1], gray.shape[0], gray.strides[0], QImage.Format_Grayscale8)
+        pixmap = QPixmap.fromImage(image).transformed(QTransform().rotate(-90))
+        self.OnPixmapChanged.emit(pixmap)
 
         # Generate the image
         # Define the scope image data as the width (long side) of the image x 256 for pixels
+        histo = self.histo = line.histo
         scopeData = np.zeros((histo.shape[0], 256), dtype=np.uint8)
 
-        # Replace NaN values with 0
-        self.histo = np.nan_to_num(histo)
-
         # Set scope data
         for i, intensity in enumerate(histo):
             scopeData[i, : int(intensity)] = 128
@@ -183,27 +323,32 @@ class FrameWorker(QObject):  # type: ignore
         # Create a vertical flip transform and apply it to the QPixmap
         a_pix = a_pix.transformed(QTransform().scale(1, -1))
 
-        width = self.histo.shape[0]
+        if full_width is None:
+            full_width = gray.shape[1] * pixel_scale
+        width = full_width - 2 * self.analyser_smoothing  # the smoothed profile is this much shorter
         self.data_width = width
 
         a_sample = 0
-        self.centre = fit_gaussian(self.histo)  # Specify the y position of the line
+        # Specify the y position of the line, 0 when there's none
+        self.centre = to_sensor_pixels(line.centre, pixel_scale, self.analyser_smoothing) if line.centre else 0.0
         self.OnCentreChanged.emit(self.centre)
         if self.centre:
             # self.sample_worker.sample_in(self.centre)  # send the sample to the sample worker right away.
             a_sample = int(self.analyser_widget_height - self.centre * self.analyser_widget_height / width)
 
         a_zero, a_text = 0, ""
+        centre_real = float("nan")
         if self.parent_obj.zero and self.centre:  # If we have zero, we can set it and the text
             a_zero = int(self.analyser_widget_height - self.parent_obj.zero * self.analyser_widget_height / width)
             centre_real = (self.parent_obj.sensor_width / width) * (self.centre - self.parent_obj.zero)
             a_text = get_units(self.parent_obj.units, centre_real)
 
+        self.OnFrameAnalysed.emit(FrameResult(self.frame_count, timestamp, self.centre, centre_real, line.quality))
+
         frame_data = FrameData(a_pix, a_sample, a_zero, a_text)
         self.OnAnalyserUpdate.emit(frame_data)
 
         # self.OnFrameChanged.emit([pixmap, histo, a_pix])
-        self.ready = True
 
 
 class FrameSender(QObject):  # type: ignore
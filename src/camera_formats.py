@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+# Relative cost of getting a grayscale image out of a frame in each pixel format. Formats are keyed by their enum
+# name so this module doesn't need QtMultimedia, which keeps the policy testable against plain mock objects.
+#
+# 0 - the frame is already grayscale
+# 1 - planar YUV, the luma plane can be read directly
+# 2 - packed YUV 4:2:2, the luma is every other byte and can be read with a strided view
+# 3 - RGB, and AYUV which frame_ops has no view for, needs a conversion and a weighted sum per pixel
+# 5 - compressed, needs a full JPEG decode before anything else
+DECODE_COST = {
+    "Format_Y8": 0,
+    "Format_Y16": 0,
+    "Format_NV12": 1,
+    "Format_NV21": 1,
+    "Format_YUV420P": 1,
+    "Format_YUV420P10": 1,
+    "Format_YUV422P": 1,
+    "Format_YV12": 1,
+    "Format_IMC1": 1,
+    "Format_IMC2": 1,
+    "Format_IMC3": 1,
+    "Format_IMC4": 1,
+    "Format_P010": 1,
+    "Format_P016": 1,
+    "Format_YUYV": 2,
+    "Format_UYVY": 2,
+    "Format_AYUV": 3,
+    "Format_AYUV_Premultiplied": 3,
+    "Format_ARGB8888": 3,
+    "Format_ARGB8888_Premultiplied": 3,
+    "Format_XRGB8888": 3,
+    "Format_BGRA8888": 3,
+    "Format_BGRA8888_Premultiplied": 3,
+    "Format_BGRX8888": 3,
+    "Format_ABGR8888": 3,
+    "Format_XBGR8888": 3,
+    "Format_RGBA8888": 3,
+    "Format_RGBX8888": 3,
+    "Format_Jpeg": 5,
+}
+UNKNOWN_COST = 9
+
+MIN_WIDTH = 640  # below this the measurement resolution isn't worth having
+MAX_WIDTH = 1920  # above this the extra pixels mostly cost bandwidth
+MIN_FPS = 15.0  # below this subsampling gets painfully slow
+MAX_FPS = 60.0  # above this the extra frames are dropped by the frame worker anyway
+
+
+def pixel_format_name(pixel_format: Any) -> str:
+    """
+    Returns the enum name of a QVideoFrameFormat.PixelFormat, ex "Format_NV12".
+    """
+    name = getattr(pixel_format, "name", None)
+    if not isinstance(name, str):
+        name = str(pixel_format)
+    return name.split(".")[-1]
+
+
+def decode_cost(camera_format: Any) -> int:
+    """
+    Returns the relative cost of turning a frame in this format into a grayscale image. See DECODE_COST.
+    """
+    return DECODE_COST.get(pixel_format_name(camera_format.pixelFormat()), UNKNOWN_COST)
+
+
+def format_key(camera_format: Any) -> str:
+    """
+    Returns a human readable key for a QCameraFormat. It is used in the GUI and to persist the user's choice.
+
+    Example:
+    - format_key(fmt) -> "1920x1080 NV12 30fps"
+    """
+    size = camera_format.resolution()
+    name = pixel_format_name(camera_format.pixelFormat()).replace("Format_", "")
+    return f"{size.width()}x{size.height()} {name} {camera_format.maxFrameRate():g}fps"
+
+
+def rank_key(
+    camera_format: Any,
+    min_width: int = MIN_WIDTH,
+    max_width: int = MAX_WIDTH,
+    min_fps: float = MIN_FPS,
+    max_fps: float = MAX_FPS,
+) -> Tuple[bool, bool, int, float, int, int]:
+    """
+    Sort key for a QCameraFormat, lower is better.
+
+    Formats with a useful resolution and frame rate always come first. Among those the cheapest to decode wins,
+    then the highest frame rate (up to max_fps) and then the widest resolution (up to max_width). Anything wider
+    than max_width is treated as max_width, with the smaller one winning the tie.
+    """
+    width = camera_format.resolution().width()
+    fps = float(camera_format.maxFrameRate())
+    return (
+        width < min_width,
+        fps < min_fps,
+        decode_cost(camera_format),
+        -min(fps, max_fps),
+        -min(width, max_width),
+        width,
+    )
+
+
+def rank_formats(formats: Sequence[Any], **limits: Any) -> list[Any]:
+    """
+    Sorts the QCameraFormats from QCameraDevice.videoFormats(), best first. See rank_key for the limits.
+    """
+    return sorted(formats, key=lambda f: rank_key(f, **limits))
+
+
+def choose_format(formats: Sequence[Any], override: str = "", **limits: Any) -> Optional[Any]:
+    """
+    Picks the QCameraFormat to use.
+
+    Args:
+    - formats (Sequence): The formats the camera offers.
+    - override (str): A format_key() chosen by the user. Used if the camera still offers it.
+
+    Returns:
+    - The chosen format, or None if the camera didn't report any.
+    """
+    if override:
+        for camera_format in formats:
+            if format_key(camera_format) == override:
+                return camera_format
+
+    ranked = rank_formats(formats, **limits)
+    return ranked[0] if ranked else None
@@ -1,55 +1,589 @@
+"""
+Client library for the sensor's socket protocol, see src.protocol.
+
+SensorClient is blocking and AsyncSensorClient is for asyncio. Both tag every request with an ID so several can be
+in flight at once (pipelining), time out instead of waiting forever, and reconnect on the next request after the
+connection drops. The pools talk to several sensors at once, ex one per axis.
+
+    sensor = SensorClient("192.168.1.20", 9999)
+    sensor.zero()
+    print(sensor.take_sample().value)
+
+    pool = SensorPool({"left": ("192.168.1.20", 9999), "right": ("192.168.1.21", 9999)})
+    samples = pool.request_all("TAKE_SAMPLE")  # both sensors measure at the same time
+"""
 from __future__ import annotations
 
+import asyncio
+import itertools
+import math
 import random
 import socket
+import time
+from collections import deque
+from dataclasses import dataclass
+from dataclasses import field
 from typing import Any
+from typing import Callable
+from typing import Deque
 from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+from src.protocol import decode_frame
+from src.protocol import format_line
+from src.protocol import STREAM_MARKER
+from src.protocol import STREAM_RECORD
+from src.sampling import FrameResult
+
+DEFAULT_TIMEOUT = 30.0  # seconds to wait for a reply, a sample with many subsamples takes a while
+CONNECT_TIMEOUT = 3.0
+CONNECT_RETRIES = 3
+RETRY_DELAY = 0.5  # seconds before the first connect retry, doubled for every retry after it
+
+# Requests that can safely be sent again after the connection dropped before the reply came back
+IDEMPOTENT = {"PING", "TAKE_SAMPLE", "TAKE_SAMPLES", "TIMING_STATS"}
+
+SKIP_CONNECTION = False  # the legacy Client returns fake data without connecting
+
+
+class SensorError(Exception):
+    """The sensor answered with an ERROR"""
+
+
+class SensorTimeout(SensorError, TimeoutError):
+    """The sensor didn't answer in time"""
+
+
+@dataclass
+class Reply:
+    """
+    One reply line from the sensor.
+
+    Attributes:
+        id (str): The request ID it answers, empty for replies to requests sent without one.
+        kind (str): The first word, ex "SAMPLE", "ZERO_COMPLETE", "PONG" or "ERROR".
+        args (list): The words after it that aren't key=value fields.
+        fields (dict): The key=value fields, ex {"unc": "0.000051", "n": "10", "ms": "812"}.
+        line (str): The whole line without the ID.
+    """
 
-from PySide6.QtCore import QObject
+    id: str
+    kind: str
+    args: List[str] = field(default_factory=list)
+    fields: Dict[str, str] = field(default_factory=dict)
+    line: str = ""
 
-SKIP_CONNECTION = False
+    @property
+    def value(self) -> float:
+        """The measured value of a SAMPLE in millimeters"""
+        return float(self.args[0]) if self.args else math.nan
 
+    @property
+    def uncertainty(self) -> float:
+        return float(self.fields.get("unc", "nan"))
 
-class Client(QObject):  # type: ignore
-    server = socket.socket()  # Create a socket object
+
+def parse_reply(line: str) -> Reply:
+    """
+    Splits a reply line into its parts.
+
+    Example:
+    - parse_reply("#4 SAMPLE 0.5 unc=0.001 n=10") -> Reply("4", "SAMPLE", ["0.5"], {"unc": "0.001", "n": "10"}, ...)
+    """
+    tokens = line.split()
+    reply_id = tokens.pop(0)[1:] if tokens and tokens[0].startswith("#") else ""
+    kind = tokens[0] if tokens else ""
+    args, fields = [], {}
+    for token in tokens[1:]:
+        key, sep, value = token.partition("=")
+        if sep:
+            fields[key] = value
+        else:
+            args.append(token)
+    return Reply(reply_id, kind, args, fields, " ".join(tokens))
+
+
+class ReplyDecoder:
+    """
+    Splits the bytes received from the sensor into replies and stream records.
+
+    Example:
+    - decoder.feed(b"#1 PO") -> []
+    - decoder.feed(b"NG\\n{\\"frame\\":3,...}\\n") -> [Reply("1", "PONG"), FrameResult(3, ...)]
+    """
 
     def __init__(self) -> None:
-        super().__init__()
+        self.pending = b""
+
+    def feed(self, data: bytes) -> List[Union[Reply, FrameResult]]:
+        self.pending += data
+        items: List[Union[Reply, FrameResult]] = []
+        while self.pending:
+            if self.pending.startswith(STREAM_MARKER):
+                size = STREAM_RECORD.size + 1
+                if len(self.pending) < size:
+                    break
+                items.append(decode_frame(self.pending[:size]))
+                self.pending = self.pending[size:]
+                continue
+
+            end = self.pending.find(b"\n")
+            if end < 0:
+                break
+            line, start = self.pending[:end].strip(), end + 1
+            self.pending = self.pending[start:]
+            if line.startswith(b"{"):
+                items.append(decode_frame(line))
+            elif line:
+                items.append(parse_reply(line.decode("utf-8", errors="replace")))
+        return items
+
+
+@dataclass
+class PendingRequest:
+    """
+    A request waiting for its replies.
+
+    Attributes:
+        id (int): The request ID.
+        command (str): The command, ex "TAKE_SAMPLES".
+        expected (int): Number of replies it gets, TAKE_SAMPLES gets one per sample.
+        replies (list): The replies received so far.
+        error (Reply): The ERROR reply, if it got one.
+    """
+
+    id: int
+    command: str
+    expected: int = 1
+    replies: List[Reply] = field(default_factory=list)
+    error: Optional[Reply] = None
+
+    @property
+    def done(self) -> bool:
+        return self.error is not None or len(self.replies) >= self.expected
+
+    def add(self, reply: Reply) -> None:
+        if reply.kind == "ERROR":
+            self.error = reply
+        else:
+            self.replies.append(reply)
+
+
+def expected_replies(command: str, args: Tuple[Any, ...]) -> int:
+    """Number of replies a request gets, invalid counts get the one ERROR reply"""
+    if command.upper() == "TAKE_SAMPLES" and args and str(args[0]).isdigit():
+        return max(int(args[0]), 1)
+    return 1
+
+
+class ClientBase:
+    """
+    What the blocking and asyncio clients share: request IDs, routing replies to requests and the stream records.
+
+    Attributes:
+        host (str): Sensor address.
+        port (int): Sensor port.
+        timeout (float): Default seconds to wait for the replies to a request.
+        on_frame (callable): Called with every streamed FrameResult. Without it the latest max_frames are kept
+            in frames.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        timeout: float = DEFAULT_TIMEOUT,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        retries: int = CONNECT_RETRIES,
+        retry_delay: float = RETRY_DELAY,
+        on_frame: Optional[Callable[[FrameResult], None]] = None,
+        max_frames: int = 10000,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.on_frame = on_frame
+        self.frames: Deque[FrameResult] = deque(maxlen=max_frames)
+        self.decoder = ReplyDecoder()
+        self.pending: Dict[int, PendingRequest] = {}
+        self.ids = itertools.count(1)
+
+    def new_request(self, command: str, args: Tuple[Any, ...]) -> Tuple[PendingRequest, bytes]:
+        pending = PendingRequest(next(self.ids), command.upper(), expected_replies(command, args))
+        self.pending[pending.id] = pending
+        return pending, format_line(str(pending.id), command, *args).encode()
+
+    def received(self, data: bytes) -> None:
+        for item in self.decoder.feed(data):
+            if isinstance(item, FrameResult):
+                if self.on_frame is not None:
+                    self.on_frame(item)
+                else:
+                    self.frames.append(item)
+                continue
+
+            pending = self.pending.get(int(item.id)) if item.id.isdigit() else None
+            if pending is not None:  # replies to requests that timed out are dropped here
+                pending.add(item)
+
+    def finish(self, pending: PendingRequest) -> List[Reply]:
+        self.pending.pop(pending.id, None)
+        if pending.error is not None:
+            raise SensorError(f"{pending.command}: {pending.error.line}")
+        return pending.replies
+
+    def connection_lost(self) -> None:
+        self.decoder = ReplyDecoder()
+        self.pending.clear()
+
+
+class SensorClient(ClientBase):
+    """
+    Blocking client for one sensor. Not thread safe, use one per thread.
+
+    Raises ConnectionError when the sensor can't be reached or the connection drops while waiting, SensorTimeout
+    when a reply doesn't come in time and SensorError when the sensor answers with an ERROR. Idempotent requests
+    (see IDEMPOTENT) are sent once more on a new connection when the connection dropped.
+    """
+
+    def __init__(self, host: str, port: int, **options: Any) -> None:
+        super().__init__(host, port, **options)
+        self.sock: Optional[socket.socket] = None
+
+    @property
+    def connected(self) -> bool:
+        return self.sock is not None
+
+    def connect(self) -> None:
+        error: Optional[OSError] = None
+        for attempt in range(max(self.retries, 1)):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                self.sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+            except OSError as e:
+                error = e
+                continue
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # requests are small, send them now
+            return
+        raise ConnectionError(f"Can't connect to the sensor at {self.host}:{self.port}: {error}")
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.connection_lost()
 
+    def submit(self, command: str, *args: Any) -> PendingRequest:
+        """Sends a request without waiting for the reply, see wait()"""
+        if self.sock is None:
+            self.connect()
+        assert self.sock is not None
+
+        pending, data = self.new_request(command, args)
+        try:
+            self.sock.sendall(data)
+        except OSError as e:
+            self.close()
+            raise ConnectionError(f"Lost the connection to the sensor: {e}") from e
+        return pending
+
+    def wait(self, pending: PendingRequest, timeout: Optional[float] = None) -> List[Reply]:
+        """Returns the replies to a submitted request once they have all arrived"""
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while not pending.done:
+            if self.sock is None or pending.id not in self.pending:
+                raise ConnectionError("Lost the connection to the sensor before the reply")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.pending.pop(pending.id, None)
+                raise SensorTimeout(f"No reply to {pending.command} from {self.host}:{self.port}")
+            self.poll(remaining)
+        return self.finish(pending)
+
+    def poll(self, timeout: float) -> None:
+        """Reads whatever the sensor sent within the timeout and routes it"""
+        assert self.sock is not None
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(65536)
+        except socket.timeout:
+            return
+        except OSError as e:
+            self.close()
+            raise ConnectionError(f"Lost the connection to the sensor: {e}") from e
+        if not data:
+            self.close()
+            raise ConnectionError("The sensor closed the connection")
+        self.received(data)
+
+    def request(self, command: str, *args: Any, timeout: Optional[float] = None) -> List[Reply]:
+        """Sends a request and returns all its replies"""
+        try:
+            return self.wait(self.submit(command, *args), timeout)
+        except ConnectionError:
+            if command.upper() not in IDEMPOTENT:
+                raise
+        return self.wait(self.submit(command, *args), timeout)
+
+    def take_sample(self, timeout: Optional[float] = None) -> Reply:
+        return self.request("TAKE_SAMPLE", timeout=timeout)[-1]
+
+    def take_samples(self, count: int, timeout: Optional[float] = None) -> List[Reply]:
+        return self.request("TAKE_SAMPLES", count, timeout=timeout)
+
+    def zero(self, timeout: Optional[float] = None) -> Reply:
+        return self.request("ZERO", timeout=timeout)[-1]
+
+    def ping(self, timeout: Optional[float] = None) -> float:
+        """Returns the round trip time in seconds"""
+        start = time.perf_counter()
+        self.request("PING", timeout=timeout)
+        return time.perf_counter() - start
+
+    def stream(self, rate: float = 0.0, stream_format: str = "bin") -> Reply:
+        """Subscribes to the per-frame results, they arrive in frames (or on_frame) while reading"""
+        return self.request("STREAM", f"{rate:g}", stream_format)[-1]
+
+    def stop_stream(self) -> Reply:
+        return self.request("STOP_STREAM")[-1]
+
+    def read_frames(self, timeout: float) -> List[FrameResult]:
+        """Reads for up to timeout seconds, returns the streamed frames received as soon as there are any"""
+        deadline = time.monotonic() + timeout
+        while not self.frames and self.sock is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.poll(remaining)
+        frames = list(self.frames)
+        self.frames.clear()
+        return frames
+
+    def __enter__(self) -> SensorClient:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class AsyncSensorClient(ClientBase):
+    """
+    asyncio client for one sensor, see SensorClient for the errors. Requests can be made from several tasks at
+    once, their replies are matched up by ID.
+    """
+
+    def __init__(self, host: str, port: int, **options: Any) -> None:
+        super().__init__(host, port, **options)
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reader_task: Optional[asyncio.Task[None]] = None
+        self.waiters: Dict[int, asyncio.Future[None]] = {}
+        self.connecting: Optional[asyncio.Lock] = None
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None
+
+    async def connect(self) -> None:
+        if self.connecting is None:
+            self.connecting = asyncio.Lock()
+        async with self.connecting:  # several tasks can ask for the connection at once
+            if self.writer is not None:
+                return
+            error: Optional[BaseException] = None
+            for attempt in range(max(self.retries, 1)):
+                if attempt:
+                    await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+                try:
+                    connection = asyncio.open_connection(self.host, self.port)
+                    reader, writer = await asyncio.wait_for(connection, self.connect_timeout)
+                except (OSError, asyncio.TimeoutError) as e:
+                    error = e
+                    continue
+                sock = writer.get_extra_info("socket")
+                if sock is not None:
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.writer = writer
+                self.reader_task = asyncio.ensure_future(self.read_loop(reader))
+                return
+            raise ConnectionError(f"Can't connect to the sensor at {self.host}:{self.port}: {error}")
+
+    async def read_loop(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                self.received(data)
+                for request_id, pending in list(self.pending.items()):
+                    waiter = self.waiters.get(request_id)
+                    if pending.done and waiter is not None and not waiter.done():
+                        waiter.set_result(None)
+        except OSError:
+            pass
+        finally:
+            self.drop_connection()
+
+    def drop_connection(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        for waiter in self.waiters.values():
+            if not waiter.done():
+                waiter.set_exception(ConnectionError("Lost the connection to the sensor before the reply"))
+        self.waiters.clear()
+        self.connection_lost()
+
+    async def close(self) -> None:
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            try:
+                await self.reader_task
+            except asyncio.CancelledError:
+                pass
+            self.reader_task = None
+        self.drop_connection()
+
+    async def request_once(self, command: str, args: Tuple[Any, ...], timeout: Optional[float]) -> List[Reply]:
+        if self.writer is None:
+            await self.connect()
+        assert self.writer is not None
+
+        pending, data = self.new_request(command, args)
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[pending.id] = waiter
+        try:
+            self.writer.write(data)
+            await asyncio.wait_for(waiter, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            raise SensorTimeout(f"No reply to {pending.command} from {self.host}:{self.port}") from None
+        finally:
+            self.waiters.pop(pending.id, None)
+            self.pending.pop(pending.id, None)
+        return self.finish(pending)
+
+    async def request(self, command: str, *args: Any, timeout: Optional[float] = None) -> List[Reply]:
+        """Sends a request and returns all its replies"""
+        try:
+            return await self.request_once(command, args, timeout)
+        except ConnectionError:
+            if command.upper() not in IDEMPOTENT:
+                raise
+        return await self.request_once(command, args, timeout)
+
+    async def take_sample(self, timeout: Optional[float] = None) -> Reply:
+        return (await self.request("TAKE_SAMPLE", timeout=timeout))[-1]
+
+    async def take_samples(self, count: int, timeout: Optional[float] = None) -> List[Reply]:
+        return await self.request("TAKE_SAMPLES", count, timeout=timeout)
+
+    async def zero(self, timeout: Optional[float] = None) -> Reply:
+        return (await self.request("ZERO", timeout=timeout))[-1]
+
+    async def ping(self, timeout: Optional[float] = None) -> float:
+        start = time.perf_counter()
+        await self.request("PING", timeout=timeout)
+        return time.perf_counter() - start
+
+    async def stream(self, rate: float = 0.0, stream_format: str = "bin") -> Reply:
+        return (await self.request("STREAM", f"{rate:g}", stream_format))[-1]
+
+    async def stop_stream(self) -> Reply:
+        return (await self.request("STOP_STREAM"))[-1]
+
+
+class SensorPool:
+    """
+    Blocking connections to several sensors by name, connected on first use.
+
+    request_all() sends the request to every sensor before waiting for any of the replies, so the sensors work
+    in parallel without any threads.
+    """
+
+    def __init__(self, sensors: Dict[str, Tuple[str, int]], **options: Any) -> None:
+        self.sensors = sensors
+        self.options = options
+        self.clients: Dict[str, SensorClient] = {}
+
+    def client(self, name: str) -> SensorClient:
+        if name not in self.clients:
+            host, port = self.sensors[name]
+            self.clients[name] = SensorClient(host, port, **self.options)
+        return self.clients[name]
+
+    def request_all(self, command: str, *args: Any, timeout: Optional[float] = None) -> Dict[str, List[Reply]]:
+        submitted = {name: self.client(name).submit(command, *args) for name in self.sensors}
+        return {name: self.client(name).wait(pending, timeout) for name, pending in submitted.items()}
+
+    def close(self) -> None:
+        for client in self.clients.values():
+            client.close()
+        self.clients.clear()
+
+
+class AsyncSensorPool:
+    """asyncio connections to several sensors by name, see SensorPool"""
+
+    def __init__(self, sensors: Dict[str, Tuple[str, int]], **options: Any) -> None:
+        self.sensors = sensors
+        self.options = options
+        self.clients: Dict[str, AsyncSensorClient] = {}
+
+    def client(self, name: str) -> AsyncSensorClient:
+        if name not in self.clients:
+            host, port = self.sensors[name]
+            self.clients[name] = AsyncSensorClient(host, port, **self.options)
+        return self.clients[name]
+
+    async def request_all(self, command: str, *args: Any, timeout: Optional[float] = None) -> Dict[str, List[Reply]]:
+        names = list(self.sensors)
+        replies = await asyncio.gather(*(self.client(name).request(command, *args, timeout=timeout) for name in names))
+        return dict(zip(names, replies))
+
+    async def close(self) -> None:
+        await asyncio.gather(*(client.close() for client in self.clients.values()))
+        self.clients.clear()
+
+
+class Client:
+    """
+    The original blocking client API, kept for the jobs that still use it. New code should use SensorClient.
+    """
+
+    def __init__(self) -> None:
         self.port = 0
         self.ip = ""
+        self.sensor: Optional[SensorClient] = None
 
     def connect_socket(self, params: Dict[str, Any]) -> bool:
-        self.port = params["port"]
+        self.port = int(params["port"])
         self.ip = params["ip"]
         print(f"Connecting.. IP: {self.ip} Port: {self.port}")
-        connected = False
-        num_fails = 0
-        while not connected:
-            if num_fails >= 3:
-                break
-            try:
-                self.server.connect((self.ip, self.port))
-                connected = True
-                print("Connected.")
-                return True
-            except Exception as e:
-                print(
-                    f"Failed to connect with the following: {e}. Using IP {self.ip}, Port: \
-{self.port}, Try: {num_fails+1}/3"
-                )  # print why and try again
-                num_fails += 1
-                continue
-        print("...Stopped")
-        return False
+        self.sensor = SensorClient(self.ip, self.port)
+        try:
+            self.sensor.connect()
+        except ConnectionError as e:
+            print(e)
+            return False
+        print("Connected.")
+        return True
 
     def send_recieve(self, cmd: str) -> str:
+        """Returns the reply line without the request ID, ex "SAMPLE 0.001234 unc=0.000051 n=10 ms=812" """
         if SKIP_CONNECTION:
-            recv = f"Fake_Data: {random.uniform(-1.0, 1.0)}"
-        else:
-            self.server.send(cmd.encode("utf-8"))
-            recv = self.server.recv(1024).decode("utf-8")
-        return recv
+            return f"Fake_Data: {random.uniform(-1.0, 1.0)}"
+        if self.sensor is None:
+            self.sensor = SensorClient(self.ip, self.port)
+        try:
+            return self.sensor.request(*cmd.split())[-1].line
+        except SensorError as e:
+            return f"ERROR {e}"
 
     def set_IP(self, ip: str) -> None:
         self.ip = ip
@@ -60,4 +594,5 @@ class Client(QObject):  # type: ignore
         print("Set port to:", self.port)
 
     def close_socket(self) -> None:
-        self.server.close()
+        if self.sensor is not None:
+            self.sensor.close()
@@ -2,15 +2,16 @@ from __future__ import annotations
 
 import numpy as np
 import numpy.typing as npt
-from scipy.optimize import curve_fit
 
 
-def fit_gaussian(curve: npt.NDArray) -> float:
+def fit_gaussian(curve: npt.NDArray, scale: int = 1) -> float:
     """
     Fits a Gaussian curve to the given data points.
 
     Args:
     curve: 1D array of float, representing the curve to be fitted.
+    scale: Full resolution pixels per point of the curve, ex 2 for an image decoded at half size. The model is
+        narrowed by it so a scaled curve gets the same fit as the full resolution one.
 
     Returns:
     A float representing the mean of the fitted Gaussian curve.
@@ -26,7 +27,9 @@ def fit_gaussian(curve: npt.NDArray) -> float:
 
     # Define the Gaussian function
     def gaussian(x: npt.NDArray, mean: int) -> npt.NDArray:
-        return curve_max * np.exp(-(((x - mean) / curve_std) ** 2))
+        return curve_max * np.exp(-(((x - mean) * scale / curve_std) ** 2))
+
+    from scipy.optimize import curve_fit  # lazy, see src.startup
 
     # Generate x data points and try to fit the curve using the defined
     # Gaussian function
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import sys
+from dataclasses import dataclass
+from typing import Any
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from src.curves import fit_gaussian
+
+# Pixel formats where plane 0 is the luma at one byte per pixel
+LUMA_PLANE_8 = {
+    "Format_Y8",
+    "Format_NV12",
+    "Format_NV21",
+    "Format_YUV420P",
+    "Format_YUV422P",
+    "Format_YV12",
+    "Format_IMC1",
+    "Format_IMC2",
+    "Format_IMC3",
+    "Format_IMC4",
+}
+
+# Pixel formats where plane 0 is the luma at two bytes per pixel, and the shift down to 8 bits
+LUMA_PLANE_16 = {"Format_Y16": 8, "Format_P010": 8, "Format_P016": 8, "Format_YUV420P10": 2}
+
+# Packed YUV 4:2:2 formats and the byte offset of the first luma sample in each pixel pair
+LUMA_PACKED = {"Format_YUYV": 0, "Format_UYVY": 1}
+
+LUMA_FORMATS = LUMA_PLANE_8 | set(LUMA_PLANE_16) | set(LUMA_PACKED)
+
+# Channels the laser line can be read from. Luma is the weighted grayscale of all three.
+CHANNEL_MODES = ["Luma", "Red", "Green", "Blue", "Max"]
+
+# Byte offset of each channel in a QImage.Format_RGB32 / Format_ARGB32 pixel, which is 0xAARRGGBB in native order
+if sys.byteorder == "little":
+    RGB32_OFFSETS = {"Blue": 0, "Green": 1, "Red": 2}
+else:
+    RGB32_OFFSETS = {"Blue": 3, "Green": 2, "Red": 1}
+
+
+def luma_view(buffer: Any, width: int, height: int, stride: int, format_name: str) -> Optional[npt.NDArray]:
+    """
+    Reads the luma out of plane 0 of a mapped video frame without any colour conversion.
+
+    Args:
+    - buffer: The bytes of plane 0, ex QVideoFrame.bits(0) while the frame is mapped.
+    - width (int): Frame width in pixels.
+    - height (int): Frame height in pixels.
+    - stride (int): Bytes per line of plane 0, ex QVideoFrame.bytesPerLine(0).
+    - format_name (str): The pixel format enum name, see camera_formats.pixel_format_name.
+
+    Returns:
+    - A (height, width) uint8 array. For 8 bit planar formats it is a view into the buffer, so copy it before the
+      frame is unmapped. None if the format has no directly readable luma.
+    """
+    if format_name not in LUMA_FORMATS:
+        return None
+
+    plane = np.frombuffer(buffer, dtype=np.uint8, count=stride * height).reshape(height, stride)
+
+    if format_name in LUMA_PLANE_8:
+        return plane[:, :width]
+
+    if format_name in LUMA_PLANE_16:
+        return (plane.view(np.uint16)[:, :width] >> LUMA_PLANE_16[format_name]).astype(np.uint8)
+
+    start = LUMA_PACKED[format_name]
+    stop = start + 2 * width
+    return plane[:, start:stop:2]
+
+
+def channel_view(pixels: npt.NDArray, mode: str) -> npt.NDArray:
+    """
+    Picks the channel the laser line is read from out of an RGB32 image, without a grayscale conversion.
+
+    A red laser on the luma is diluted by the blue and green noise, reading only the red channel gives a better
+    signal to noise ratio per frame and skips the weighted sum over all three channels.
+
+    Args:
+    - pixels: A (height, width, 4) uint8 view of a QImage in Format_RGB32 or Format_ARGB32.
+    - mode (str): "Red", "Green" or "Blue" for a single channel, "Max" for the brightest of the three.
+
+    Returns:
+    - A (height, width) uint8 array. Single channels are a strided view into pixels, no data is copied.
+    """
+    if mode == "Max":
+        red = pixels[..., RGB32_OFFSETS["Red"]]
+        green = pixels[..., RGB32_OFFSETS["Green"]]
+        blue = pixels[..., RGB32_OFFSETS["Blue"]]
+        return np.maximum(np.maximum(red, green), blue)
+
+    if mode not in RGB32_OFFSETS:
+        raise ValueError(f"Unknown channel mode: {mode}")
+    return pixels[..., RGB32_OFFSETS[mode]]
+
+
+def decimate_rows(gray: npt.NDArray, stride: int = 1, band: int = 0) -> npt.NDArray:
+    """
+    Selects the rows that go into the profile, as a view so the reduction only touches those rows.
+
+    The laser line profile converges long before every row is averaged, so skipping rows trades a little noise
+    for a proportional cut in memory bandwidth. See profile_noise to measure the trade-off.
+
+    Args:
+    - gray: The (height, width) image, averaged along axis 0.
+    - stride (int): Use every stride-th row.
+    - band (int): Only use the middle band rows, 0 uses the full height.
+
+    Returns:
+    - A view of gray with the selected rows.
+    """
+    height = gray.shape[0]
+    if 0 < band < height:
+        start = (height - band) // 2
+        stop = start + band
+        gray = gray[start:stop]
+    if stride > 1:
+        gray = gray[::stride]
+    return gray
+
+
+def profile_noise(rows: npt.NDArray) -> float:
+    """
+    Estimates the noise of the profile averaged from these rows.
+
+    This is the standard error of the column means, the median over all the columns so the laser line itself
+    doesn't dominate. It goes down with the square root of the number of rows.
+
+    Args:
+    - rows: The rows going into the profile, ex from decimate_rows.
+
+    Returns:
+    - The noise in intensity levels (0-255).
+    """
+    if rows.shape[0] < 2:
+        return float("nan")
+    return float(np.median(rows.std(axis=0)) / np.sqrt(rows.shape[0]))
+
+
+@dataclass
+class LineProfile:
+    """
+    The laser line found in a set of rows.
+
+    Attributes:
+        histo (ndarray): The smoothed profile rescaled to 0-255, uint8.
+        centre (float): Centre of the line in profile pixels, 0 when no line was found.
+        quality (float): Contrast of the smoothed profile before rescaling (0-1).
+    """
+
+    histo: npt.NDArray
+    centre: float
+    quality: float
+
+
+def find_line(rows: npt.NDArray, smoothing: int = 0, scale: int = 1) -> LineProfile:
+    """
+    Averages the rows into a profile, smooths it and fits the laser line. This is the measurement itself, shared
+    by the GUI frame worker and the headless daemon.
+
+    Args:
+    - rows: The rows going into the profile, ex from decimate_rows.
+    - smoothing (int): Half width of the moving average applied to the profile.
+    - scale (int): Sensor pixels per pixel of the rows, see to_sensor_pixels. The centre is still in the rows'
+      pixels.
+    """
+    histo = np.mean(rows, axis=0)
+
+    # Smoothing
+    kernel = np.ones(2 * smoothing + 1) / (2 * smoothing + 1)
+    histo = np.convolve(histo, kernel, mode="valid")
+
+    # Rescale the intensity values to have a range between 0 and 255
+    min_value, max_value = histo.min(), histo.max()
+    if max_value > min_value:
+        histo = ((histo - min_value) * (255.0 / (max_value - min_value))).clip(0, 255).astype(np.uint8)
+    else:
+        histo = np.zeros(histo.shape, dtype=np.uint8)
+
+    return LineProfile(histo, float(fit_gaussian(histo, scale)), float(max_value - min_value) / 255.0)
+
+
+def to_sensor_pixels(position: float, scale: int = 1, smoothing: int = 0) -> float:
+    """
+    A position on the profile of an image decoded at 1/scale (ex by jpeg_decode.decode_luma), as the position on
+    the profile of the full resolution image with the same smoothing. The zero and the data width are in those
+    pixels, so readings agree whatever the decode scale.
+
+    Pixel i of the scaled image covers pixels i * scale to i * scale + scale - 1 of the full image, so its centre
+    is at (i + 0.5) * scale - 0.5. The smoothed profile starts smoothing pixels into the image.
+    """
+    return (position + smoothing + 0.5) * scale - 0.5 - smoothing
@@ -0,0 +1,164 @@
+"""
+Frame sources for the headless daemon (src.headless).
+
+A source has an async frames() generator yielding (timestamp, gray) pairs, where timestamp is time.monotonic() when
+the frame arrived and gray is a 2D uint8 image with the long side of the sensor along axis 1, like
+Workers.video_frame_to_gray returns. Sources drop frames instead of queueing them when the consumer is slower
+than the camera, the same as the GUI frame worker does.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import AsyncIterator
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from src.camera_formats import choose_format
+
+Frame = Tuple[float, npt.NDArray]
+
+
+class SyntheticSource:
+    """
+    Renders a Gaussian laser line on a noisy background, for tests and running without a camera.
+
+    Attributes:
+        width (int): Image width, the axis the line moves along.
+        height (int): Image height.
+        fps (float): Frame rate.
+        centre (callable): Returns the line centre in pixels for a timestamp. Replace it to move the line.
+        line_width (float): 1/e half width of the line in pixels.
+        noise (float): Standard deviation of the background noise in intensity levels.
+        realtime (bool): Pace the frames at fps. Otherwise they come as fast as they are consumed, with
+            timestamps as if they had been paced, which keeps tests fast and repeatable.
+    """
+
+    def __init__(
+        self,
+        width: int = 1280,
+        height: int = 720,
+        fps: float = 30.0,
+        centre: Optional[Callable[[float], float]] = None,
+        line_width: float = 25.0,
+        noise: float = 3.0,
+        realtime: bool = True,
+        seed: int = 0,
+    ) -> None:
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.centre: Callable[[float], float] = centre or (lambda _: width / 2.0)
+        self.line_width = line_width
+        self.noise = noise
+        self.realtime = realtime
+
+        # A few noise frames are made up front and cycled through, generating them per frame costs more than the
+        # analysis being tested
+        rng = np.random.default_rng(seed)
+        self.noise_frames = rng.normal(0.0, noise, size=(4, height, width)).astype(np.float32)
+
+    def render(self, centre: float, index: int = 0) -> npt.NDArray:
+        """Returns one frame with the line at centre"""
+        x = np.arange(self.width, dtype=np.float32)
+        profile = 20.0 + 200.0 * np.exp(-(((x - centre) / self.line_width) ** 2))
+        image = profile[np.newaxis, :] + self.noise_frames[index % len(self.noise_frames)]
+        return np.asarray(image.clip(0, 255), dtype=np.uint8)
+
+    async def frames(self) -> AsyncIterator[Frame]:
+        start = time.monotonic()
+        index = 0
+        while True:
+            timestamp = start + index / self.fps
+            if self.realtime:
+                now = time.monotonic()
+                if now < timestamp:
+                    await asyncio.sleep(timestamp - now)
+                elif now - timestamp > 1.0 / self.fps:
+                    # The consumer fell behind, skip to the current frame like a camera would
+                    index = int((now - start) * self.fps)
+                    timestamp = start + index / self.fps
+            else:
+                await asyncio.sleep(0)
+
+            yield timestamp, self.render(self.centre(timestamp), index)
+            index += 1
+
+
+class CameraSource:
+    """
+    Reads frames from a camera with QtMultimedia, without any widgets.
+
+    Qt's events are processed from the asyncio loop, so everything stays on the one thread. Only the newest frame
+    is kept, frames that arrive while the previous one is still being analysed are dropped.
+
+    Attributes:
+        index (int): Index of the camera in QMediaDevices.videoInputs().
+        format_key (str): A camera_formats.format_key() to use instead of the automatic choice.
+        channel (str): One of frame_ops.CHANNEL_MODES.
+        poll_interval (float): Seconds between processing Qt events while waiting for a frame.
+    """
+
+    def __init__(self, index: int = 0, format_key: str = "", channel: str = "Luma", poll_interval: float = 0.002):
+        self.index = index
+        self.format_key = format_key
+        self.channel = channel
+        self.poll_interval = poll_interval
+
+    async def frames(self) -> AsyncIterator[Frame]:
+        # QtMultimedia is only needed with a real camera
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PySide6.QtGui import QGuiApplication
+        from PySide6.QtMultimedia import QCamera
+        from PySide6.QtMultimedia import QMediaCaptureSession
+        from PySide6.QtMultimedia import QMediaDevices
+        from PySide6.QtMultimedia import QVideoFrame
+        from PySide6.QtMultimedia import QVideoSink
+
+        from src.Workers import video_frame_to_gray
+
+        app = QGuiApplication.instance() or QGuiApplication([])
+
+        devices = QMediaDevices.videoInputs()
+        if not 0 <= self.index < len(devices):
+            raise RuntimeError(f"No camera at index {self.index}, found {len(devices)}")
+        device = devices[self.index]
+
+        camera = QCamera(device)
+        camera_format = choose_format(device.videoFormats(), self.format_key)
+        if camera_format is not None:
+            camera.setCameraFormat(camera_format)
+
+        session = QMediaCaptureSession()
+        session.setCamera(camera)
+        sink = QVideoSink()
+        session.setVideoSink(sink)
+
+        latest: list[Tuple[float, QVideoFrame]] = []
+
+        def frame_changed(frame: QVideoFrame) -> None:
+            latest[:] = [(time.monotonic(), frame)]
+
+        sink.videoFrameChanged.connect(frame_changed)
+        camera.start()
+        try:
+            while True:
+                app.processEvents()
+                if not latest:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+
+                timestamp, frame = latest.pop()
+                try:
+                    gray, image = video_frame_to_gray(frame, self.channel)
+                except ValueError as e:
+                    print("Invalid frame:", e)
+                    continue
+                yield timestamp, gray if image is None else np.array(gray)  # views don't outlive the image
+        finally:
+            camera.stop()
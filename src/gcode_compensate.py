@@ -0,0 +1,356 @@
+"""
+Z compensation of G-code programs from a probed heightmap.
+
+Lines go in and come out one at a time, so a program of any size takes a few thousand lines of memory. Every move
+gets the height of the heightmap under it added to its Z:
+
+- G1 moves longer than max_segment in X Y are cut into pieces that are, so they follow the surface between the
+  probed points.
+- G2 and G3 arcs in the XY plane (G17), with I J or R, become G1 pieces along the arc. An arc without X Y Z is
+  a full circle.
+- G0 moves only get their end point compensated, they aren't cutting.
+
+Lines are read in blocks and the heights of every point in a block are looked up in one call (see
+src.heightmap_query), which is where most of the time would go point by point.
+
+The program's modes are followed: G90 / G91 (moves in G91 stay incremental), G20 / G21 (the heightmap is in mm),
+G17 / G18 / G19 and G92. Moves in machine coordinates (G28, G30, G53) and canned cycles (G81 to G89) are passed
+through as they are and the position is taken as unknown until X, Y and Z have all been given again. Lines before
+the position is known are passed through too. In G91 X, Y and Z are never given, so a program that starts in G91
+or goes back to G91 after a machine move isn't compensated from there on. Moves passed through this way (and
+canned cycles) are counted in GcodeCompensator.uncompensated so they can be reported.
+"""
+from __future__ import annotations
+
+import math
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import numpy.typing as npt
+
+from src.heightmap_query import HeightmapQuery
+
+MAX_SEGMENT = 1.0  # mm
+BLOCK_LINES = 4096  # lines read before their heights are looked up
+POSITION = "X%.4f Y%.4f Z%.4f"
+MM_PER_INCH = 25.4
+
+WORD = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+COMMENT = re.compile(r"\([^)]*\)|;.*$")
+
+AXES = "XYZ"
+MOTION_WORDS = set("XYZIJKR")
+UNKNOWN_AFTER = {28.0, 30.0, 53.0}  # moves that leave the position in machine terms
+CANNED_CYCLES = {81.0, 82.0, 83.0, 84.0, 85.0, 86.0, 87.0, 88.0, 89.0}
+
+PathLike = Union[str, Path]
+
+
+class GcodeError(ValueError):
+    """A move that can't be compensated, with the line number it's on"""
+
+
+@dataclass
+class Move:
+    """
+    A compensated move waiting for its heights.
+
+    Attributes:
+        prefix: Words that go before the first piece, ex the G code, N and F.
+        motion: G code of the pieces.
+        start: X Y Z the move starts from.
+        points: X Y Z of the ends of the pieces.
+        incremental: Whether the pieces are written in G91.
+        comment: Comment of the line, after the last piece.
+        after_passthrough: Whether the move before it was written as it was, without compensation.
+        scale: mm per unit of the program at the move, G20 or G21.
+    """
+
+    prefix: str
+    motion: str
+    start: List[float]
+    points: List[List[float]]
+    incremental: bool
+    comment: str
+    after_passthrough: bool = False
+    scale: float = 1.0
+
+
+def split_comment(line: str) -> Tuple[str, str]:
+    comments = COMMENT.findall(line)
+    return COMMENT.sub("", line), " ".join(c.strip() for c in comments)
+
+
+def arc_points(
+    start: npt.NDArray[np.float64],
+    end: npt.NDArray[np.float64],
+    centre: Tuple[float, float],
+    clockwise: bool,
+    max_segment: float,
+) -> npt.NDArray[np.float64]:
+    """(n, 3) points along an XY arc ending exactly at end, Z changes evenly (a helix)"""
+    cx, cy = centre
+    radius = math.hypot(start[0] - cx, start[1] - cy)
+    a0 = math.atan2(start[1] - cy, start[0] - cx)
+    a1 = math.atan2(end[1] - cy, end[0] - cx)
+    sweep = a1 - a0
+    if clockwise:
+        sweep = sweep - 2 * math.pi if sweep >= 0 else sweep
+    else:
+        sweep = sweep + 2 * math.pi if sweep <= 0 else sweep
+    if math.isclose(abs(sweep), 2 * math.pi) and not np.allclose(start[0:2], end[0:2]):
+        sweep = 0.0  # rounding made a tiny arc look like a full circle
+    pieces = max(int(math.ceil(abs(sweep) * radius / max_segment)), 1)
+    fraction = np.arange(1, pieces + 1) / pieces
+    angles = a0 + sweep * fraction
+    points = np.column_stack(
+        (cx + radius * np.cos(angles), cy + radius * np.sin(angles), start[2] + (end[2] - start[2]) * fraction)
+    )
+    points[-1] = end
+    return points
+
+
+def arc_centre(
+    start: npt.NDArray[np.float64], end: npt.NDArray[np.float64], radius: float, clockwise: bool
+) -> Tuple[float, float]:
+    """The centre of an R arc, a negative R is the long way round"""
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    chord = math.hypot(dx, dy)
+    if chord == 0 or chord > 2 * abs(radius) + 1e-9:
+        raise ValueError(f"no arc of radius {radius} joins the points")
+    height = math.sqrt(max(radius * radius - chord * chord / 4, 0.0))
+    # Clockwise short arcs have the centre to the right of the chord
+    side = -1.0 if clockwise == (radius > 0) else 1.0
+    return start[0] + dx / 2 - side * height * dy / chord, start[1] + dy / 2 + side * height * dx / chord
+
+
+class GcodeCompensator:
+    """
+    Args:
+        query: Heights of the heightmap, at X Y in mm.
+        z_scale: Heights times this are mm, 0.001 for heightmaps in um.
+        max_segment: Longest piece of a cutting move, in the program's units.
+        block_lines: Lines to read before looking up their heights.
+
+    Attributes:
+        uncompensated: Moves written as they were because the position wasn't known, even after them, or they're
+            canned cycles. Moves in machine coordinates and G92 aren't counted.
+    """
+
+    def __init__(
+        self,
+        query: HeightmapQuery,
+        z_scale: float = 0.001,
+        max_segment: float = MAX_SEGMENT,
+        block_lines: int = BLOCK_LINES,
+    ) -> None:
+        if max_segment <= 0:
+            raise ValueError(f"max_segment must be more than 0, not {max_segment}")
+        self.query = query
+        self.z_scale = z_scale
+        self.max_segment = max_segment
+        self.block_lines = block_lines
+        self.reset()
+
+    def reset(self) -> None:
+        self.motion: Optional[float] = None
+        self.absolute = True
+        self.inches = False
+        self.plane = 17.0
+        self.position: List[Optional[float]] = [None, None, None]
+        self.offset = 0.0  # compensation of the last move written, in the program's units
+        self.passed = False  # the last move was passed through
+        self.line_number = 0
+        self.uncompensated = 0
+
+    def compensate(self, lines: Iterable[str]) -> Iterator[str]:
+        """The compensated program, lines without their line ends"""
+        block: List[Union[str, Move]] = []
+        for line in lines:
+            self.line_number += 1
+            block.append(self.parse(line.rstrip("\r\n")))
+            if len(block) >= self.block_lines:
+                yield from self.write(block)
+                block = []
+        yield from self.write(block)
+
+    def parse(self, line: str) -> Union[str, Move]:
+        """A line as it is or the move it makes, keeps track of the modes and the position"""
+        code, comment = split_comment(line)
+        words = [(letter, float(value), f"{letter}{value}") for letter, value in WORD.findall(code.upper())]
+        if not words:
+            return line
+
+        passthrough = unknown = setting = machine = False
+        motion = self.motion
+        for letter, value, _ in words:
+            if letter != "G":
+                continue
+            if value in (0.0, 1.0, 2.0, 3.0):
+                motion = value
+            elif value == 90.0:
+                self.absolute = True
+            elif value == 91.0:
+                self.absolute = False
+            elif value == 20.0:
+                self.inches = True
+            elif value == 21.0:
+                self.inches = False
+            elif value in (17.0, 18.0, 19.0):
+                self.plane = value
+            elif value == 80.0:
+                motion = None
+            elif value in CANNED_CYCLES:
+                motion = None
+                passthrough = unknown = True
+            elif value in UNKNOWN_AFTER:
+                passthrough = unknown = machine = True
+            elif value == 92.0:
+                passthrough = setting = True
+        self.motion = motion
+        if unknown:
+            self.position = [None, None, None]
+            self.passed = True
+
+        given = {letter: value for letter, value, _ in words if letter in MOTION_WORDS}
+        # An arc without X Y Z is a full circle back to where it starts
+        circle = motion in (2.0, 3.0) and any(word in given for word in "IJKR")
+        if not circle and not any(axis in given for axis in AXES):
+            return line
+
+        if passthrough or motion is None or None in self.position:
+            if not unknown:
+                self.pass_move(given, setting)
+            # Canned cycles, and moves that leave the position unknown (not the ones that make it known)
+            if not (machine or setting) and (unknown or (motion is not None and None in self.position)):
+                self.uncompensated += 1
+            return line
+
+        start: List[float] = list(self.position)  # type: ignore
+        end = list(start)
+        for i, axis in enumerate(AXES):
+            if axis in given:
+                end[i] = given[axis] if self.absolute else start[i] + given[axis]
+
+        if motion in (2.0, 3.0):
+            if self.plane != 17.0:
+                raise GcodeError(f"line {self.line_number}: arcs can only be compensated in the XY plane (G17)")
+            clockwise = motion == 2.0
+            try:
+                if "R" in given:
+                    centre = arc_centre(np.array(start), np.array(end), given["R"], clockwise)
+                else:
+                    centre = start[0] + given.get("I", 0.0), start[1] + given.get("J", 0.0)
+            except ValueError as e:
+                raise GcodeError(f"line {self.line_number}: {e}")
+            points = arc_points(np.array(start), np.array(end), centre, clockwise, self.max_segment).tolist()
+            label = "G1"
+        elif motion == 1.0:
+            # Most moves are one piece, plain floats are a lot quicker than arrays for those
+            pieces = max(int(math.ceil(math.hypot(end[0] - start[0], end[1] - start[1]) / self.max_segment)), 1)
+            points = [[a + (b - a) * i / pieces for a, b in zip(start, end)] for i in range(1, pieces)] + [end]
+            label = "G1"
+        else:
+            points = [end]
+            label = "G0"
+
+        self.position = list(end)
+        prefix = " ".join(
+            text for letter, value, text in words if letter not in MOTION_WORDS and not is_motion(letter, value)
+        )
+        scale = MM_PER_INCH if self.inches else 1.0
+        move = Move(prefix, label, start, points, not self.absolute, comment, self.passed, scale)
+        self.passed = False
+        return move
+
+    def pass_move(self, given: Dict[str, float], setting: bool) -> None:
+        """Follows the position through a move that isn't compensated, G92 sets it"""
+        for i, axis in enumerate(AXES):
+            current = self.position[i]
+            if axis in given:
+                if self.absolute or setting:
+                    self.position[i] = given[axis]
+                else:
+                    self.position[i] = None if current is None else current + given[axis]
+        self.passed = True
+
+    def write(self, block: List[Union[str, Move]]) -> Iterator[str]:
+        moves = [item for item in block if isinstance(item, Move)]
+        offsets: List[float] = []
+        if moves:
+            points = np.array([point for move in moves for point in move.points], dtype=np.float64)
+            scale = np.repeat([move.scale for move in moves], [len(move.points) for move in moves])
+            offsets = (self.query(points[:, 0] * scale, points[:, 1] * scale) * self.z_scale / scale).tolist()
+        index = 0
+        for item in block:
+            if isinstance(item, str):
+                yield item
+                continue
+            count = len(item.points)
+            yield from self.pieces(item, offsets[slice(index, index + count)])
+            index += count
+
+    def pieces(self, move: Move, offsets: List[float]) -> Iterator[str]:
+        # Where the machine is, compensated, for writing incremental moves
+        px, py, pz = move.start
+        pz += 0.0 if move.after_passthrough else self.offset
+        last = len(move.points) - 1
+        for i, ((x, y, z), offset) in enumerate(zip(move.points, offsets)):
+            z += offset
+            if move.incremental:
+                values = (x - px, y - py, z - pz)
+                px, py, pz = x, y, z
+            else:
+                values = (x, y, z)
+            words = [move.prefix, move.motion] if i == 0 else []
+            words.append(POSITION % values)
+            if i == last and move.comment:
+                words.append(move.comment)
+            yield " ".join(word for word in words if word)
+        self.offset = offsets[-1]
+
+
+def is_motion(letter: str, value: float) -> bool:
+    return letter == "G" and value in (0.0, 1.0, 2.0, 3.0)
+
+
+def compensate_file(
+    source: PathLike,
+    target: PathLike,
+    query: HeightmapQuery,
+    z_scale: float = 0.001,
+    max_segment: float = MAX_SEGMENT,
+) -> Tuple[int, int, int]:
+    """
+    Writes the compensated program next to the target and moves it over it when it's done.
+
+    Returns:
+        Lines read, lines written and moves left uncompensated (see GcodeCompensator.uncompensated).
+    """
+    target = Path(target)
+    partial = target.with_name(target.name + ".partial")
+    compensator = GcodeCompensator(query, z_scale, max_segment)
+    written = 0
+    try:
+        with open(source, "r") as lines, open(partial, "w") as out:
+            for line in compensator.compensate(lines):
+                out.write(line + "\n")
+                written += 1
+    except BaseException:
+        try:
+            partial.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+    os.replace(partial, target)
+    return compensator.line_number, written, compensator.uncompensated
@@ -0,0 +1,283 @@
+"""
+Headless measurement daemon.
+
+Runs the sensor without the GUI, ex on the CNC controller. Frames come from a camera or a synthetic source (see
+src.frame_sources), the laser line is found with the same code as the GUI (frame_ops.find_line) and the socket
+protocol (src.protocol) is served on an asyncio loop. No widgets, matplotlib or plotly are imported.
+
+    python -m src.headless --port 9999
+    python -m src.headless --port 9999 --synthetic
+
+Settings not given on the command line are read from the ones saved by the GUI, so the sensor can be set up with
+the GUI once and then run headless.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import TYPE_CHECKING
+
+import numpy.typing as npt
+
+from src.frame_ops import decimate_rows
+from src.frame_ops import find_line
+from src.protocol import CommandDispatcher
+from src.protocol import Session
+from src.sampling import FrameResult
+from src.sampling import SampleResult
+from src.sampling import SampleTiming
+from src.sampling import subsample
+from src.sampling import trimmed_mean
+
+if TYPE_CHECKING:
+    from src.shared_state import SharedStateWriter  # multiprocessing.shared_memory is Python 3.8+
+
+DEFAULT_PORT = 9999
+
+
+class HeadlessSensor:
+    """
+    The sensor's measurement loop and socket server on asyncio.
+
+    Frames are analysed one at a time on a worker thread so the loop keeps serving clients. Measurements average
+    the centre of the next `subsamples` frames where a line was found, then drop the outliers like the GUI does.
+
+    Attributes:
+        source: Where the frames come from, see src.frame_sources.
+        sensor_width (float): Width of the sensor in millimeters.
+        subsamples (int): Number of frames averaged per measurement.
+        outliers (float): Percentage (0-100) of the subsamples dropped as outliers.
+        smoothing (int): Half width of the profile smoothing.
+        row_stride (int): Average every row_stride-th row into the profile.
+        row_band (int): Only average the middle row_band rows, 0 for all of them.
+        shared_state (SharedStateWriter): Publishes every frame to shared memory, None not to.
+        dispatcher (CommandDispatcher): Parses the requests and queues the measurements.
+        zero (float): The zero in sensor pixels, 0 until it has been set.
+    """
+
+    def __init__(
+        self,
+        source: Any,
+        sensor_width: float = 5.9,
+        subsamples: int = 10,
+        outliers: float = 30.0,
+        smoothing: int = 50,
+        row_stride: int = 1,
+        row_band: int = 0,
+        shared_state: Optional[SharedStateWriter] = None,
+        log: Callable[[str], None] = print,
+    ) -> None:
+        self.source = source
+        self.sensor_width = sensor_width
+        self.subsamples = subsamples
+        self.outliers = outliers
+        self.smoothing = smoothing
+        self.row_stride = row_stride
+        self.row_band = row_band
+        self.shared_state = shared_state
+        self.log = log
+
+        self.dispatcher = CommandDispatcher(self.start_measurement, log=log)
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.zero = 0.0
+        self.data_width = 0
+        self.frame_count = 0
+        self.measuring_zero: Optional[bool] = None  # None when no measurement is running
+        self.token = 0  # the dispatcher's token of the running measurement
+        self.subsample_values: List[float] = []
+        self.timing = SampleTiming()
+
+    @property
+    def mm_per_pixel(self) -> float:
+        return self.sensor_width / self.data_width if self.data_width else 0.0
+
+    def analyse(self, timestamp: float, gray: npt.NDArray) -> FrameResult:
+        """Finds the laser line in one frame. Runs on the worker thread."""
+        rows = decimate_rows(gray, self.row_stride, self.row_band)
+        line = find_line(rows, self.smoothing)
+
+        self.frame_count += 1
+        self.data_width = line.histo.shape[0]
+        value = float("nan")
+        if self.zero and line.centre:
+            value = self.mm_per_pixel * (line.centre - self.zero)
+        return FrameResult(self.frame_count, timestamp, line.centre, value, line.quality)
+
+    def frame_analysed(self, result: FrameResult) -> None:
+        """Streams the result to subscribers and adds it to the running measurement"""
+        if self.dispatcher.subscribers:
+            self.dispatcher.publish(result)
+        if self.shared_state is not None:
+            self.shared_state.publish(result)
+
+        if self.measuring_zero is None or not result.centre:
+            return
+        if not self.subsample_values:
+            self.timing.first_frame = result.timestamp
+        self.subsample_values.append(subsample(result))
+        if len(self.subsample_values) >= self.subsamples:
+            self.timing.last_frame = result.timestamp
+            self.finish_measurement()
+
+    def start_measurement(self, zero: bool, token: int) -> None:
+        if zero:
+            self.zero = 0.0
+        self.measuring_zero = zero
+        self.token = token
+        self.subsample_values = []
+        self.timing = SampleTiming()
+
+    def finish_measurement(self) -> None:
+        stats = trimmed_mean(self.subsample_values, self.outliers / 100.0)
+        uncertainty = stats.std_err * self.mm_per_pixel
+        self.timing.computed = time.monotonic()
+
+        if self.measuring_zero:
+            self.zero = stats.mean
+            result = SampleResult(0.0, uncertainty, stats.count, self.timing)
+        else:
+            value = self.mm_per_pixel * (stats.mean - self.zero)
+            result = SampleResult(value, uncertainty, stats.count, self.timing)
+
+        self.measuring_zero = None
+        self.subsample_values = []
+        self.dispatcher.measurement_complete(result, self.token)
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info("peername")
+        name = f"{peer[0]}:{peer[1]}" if peer else "client"
+        session = Session(name, writer.write, writer.transport.get_write_buffer_size)
+        self.log(f"Client connected: {name}")
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                self.dispatcher.feed(session, data)
+        except ConnectionError:
+            pass
+        finally:
+            self.dispatcher.close(session)
+            writer.close()
+            self.log(f"Client disconnected: {name}")
+
+    async def listen(self, host: str = "0.0.0.0", port: int = DEFAULT_PORT) -> int:
+        """Starts the socket server, returns the port it listens on (useful with port 0)"""
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        return int(self.server.sockets[0].getsockname()[1])
+
+    async def run_frames(self) -> None:
+        """Analyses frames from the source until it runs out or the task is cancelled"""
+        loop = asyncio.get_running_loop()
+        async for timestamp, gray in self.source.frames():
+            result = await loop.run_in_executor(None, self.analyse, timestamp, gray)
+            self.frame_analysed(result)
+
+    async def serve(self, host: str = "0.0.0.0", port: int = DEFAULT_PORT) -> None:
+        port = await self.listen(host, port)
+        self.log(f"Server Started at {host}:{port}")
+        try:
+            await self.run_frames()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if self.shared_state is not None:
+            self.shared_state.close()
+            self.shared_state = None
+
+
+def gui_settings() -> Dict[str, Any]:
+    """Returns the settings saved by the GUI, see MainWindow.closeEvent"""
+    from PySide6.QtCore import QSettings
+
+    settings = QSettings("laser-level-webcam", "LaserLevelWebcam")
+    return {key: settings.value(key) for key in settings.allKeys()}
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Laser level sensor without the GUI, served over TCP.")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on.")
+    parser.add_argument("--port", type=int, help=f"Port to listen on, default {DEFAULT_PORT}.")
+    parser.add_argument("--camera", type=int, default=0, help="Camera index.")
+    parser.add_argument("--format", default="", help='Camera format, ex "1920x1080 NV12 30fps". Default automatic.')
+    parser.add_argument("--channel", help="Colour channel the line is read from: Luma, Red, Green, Blue or Max.")
+    parser.add_argument("--synthetic", action="store_true", help="Use a synthetic laser line instead of a camera.")
+    parser.add_argument("--sensor-width", type=float, help="Sensor width in millimeters.")
+    parser.add_argument("--subsamples", type=int, help="Frames averaged per sample.")
+    parser.add_argument("--outliers", type=float, help="Percentage of subsamples dropped as outliers.")
+    parser.add_argument("--smoothing", type=int, help="Profile smoothing.")
+    parser.add_argument("--row-stride", type=int, help="Average every n-th row.")
+    parser.add_argument("--row-band", type=int, help="Only average the middle n rows, 0 for all.")
+    parser.add_argument("--shm", help="Name of the shared memory block to publish to, laser_level_webcam if not given.")
+    parser.add_argument("--no-shm", action="store_true", help="Don't publish to shared memory.")
+    parser.add_argument("--no-settings", action="store_true", help="Ignore the settings saved by the GUI.")
+    return parser.parse_args(argv)
+
+
+def open_shared_state(name: Optional[str] = None) -> Optional[SharedStateWriter]:
+    """
+    The shared memory writer, None when the block can't be made (ex a leftover block that's too small, or Python
+    3.7 without multiprocessing.shared_memory).
+    """
+    try:
+        from src.shared_state import DEFAULT_NAME
+        from src.shared_state import SharedStateWriter
+
+        return SharedStateWriter(name or DEFAULT_NAME)
+    except (ImportError, OSError, ValueError) as e:
+        print("Not publishing to shared memory:", e)
+        return None
+
+
+def start(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    saved = {} if args.no_settings else gui_settings()
+
+    def setting(value: Any, key: str, default: Any, kind: Callable[[Any], Any]) -> Any:
+        if value is not None:
+            return value
+        try:
+            return kind(saved[key])
+        except (KeyError, TypeError, ValueError):
+            return default
+
+    source: Any
+    if args.synthetic:
+        from src.frame_sources import SyntheticSource
+
+        source = SyntheticSource()
+    else:
+        from src.frame_sources import CameraSource
+
+        source = CameraSource(args.camera, args.format, setting(args.channel, "channel", "Luma", str))
+
+    sensor = HeadlessSensor(
+        source,
+        sensor_width=setting(args.sensor_width, "sensor_width", 5.9, float),
+        subsamples=setting(args.subsamples, "subsamples", 10, int),
+        outliers=setting(args.outliers, "outlier", 30.0, float),
+        smoothing=setting(args.smoothing, "smoothing", 50, int),
+        row_stride=setting(args.row_stride, "row_stride", 1, int),
+        row_band=setting(args.row_band, "row_band", 0, int),
+        shared_state=None if args.no_shm else open_shared_state(args.shm),
+    )
+    port = setting(args.port, "port", DEFAULT_PORT, int)
+
+    try:
+        asyncio.run(sensor.serve(args.host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,185 @@
+"""
+Exporting heightmaps for other programs, a block of rows at a time.
+
+- CSV: X,Y,Z text, one line per point that has a value.
+- PLY: a binary point cloud of the same points.
+- STL: a binary mesh, two triangles per grid cell. A cell missing a corner keeps the triangle that doesn't need
+  it, a cell missing two or more has none.
+
+The exporters take the grid in blocks of rows (see grid_blocks), so a memory mapped heightmap (see
+src.heightmap_file) is only read as far as it's written and nothing the size of the whole output is ever built.
+Counts that go in the PLY and STL headers are worked out from the grid first.
+
+Positions are column * spacing X + origin X and row * spacing Y + origin Y. Z is the value times z_scale, heights
+are stored in um so 0.001 gives mm like the positions.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import numpy.typing as npt
+
+BLOCK_ROWS = 256  # grid rows per block
+CSV_FORMAT = "%.4f,%.4f,%.6f\n"
+
+STL_DTYPE = np.dtype(
+    [("normal", "<f4", (3,)), ("v1", "<f4", (3,)), ("v2", "<f4", (3,)), ("v3", "<f4", (3,)), ("attributes", "<u2")]
+)
+
+PathLike = Union[str, Path]
+Grid = npt.NDArray[np.float64]
+
+
+def grid_blocks(data: Grid, rows: int = BLOCK_ROWS, overlap: int = 0) -> Iterator[Tuple[int, Grid]]:
+    """The first row and the rows of each block, overlap rows of the next block are added to the end of each"""
+    for start in range(0, data.shape[0], rows):
+        stop = min(start + rows + overlap, data.shape[0])
+        if stop - start > overlap or start == 0:
+            yield start, np.asarray(data[slice(start, stop)], dtype=np.float64)
+
+
+def block_points(
+    first_row: int, block: Grid, spacing: Tuple[float, float], origin: Tuple[float, float], z_scale: float
+) -> npt.NDArray[np.float64]:
+    """(n, 3) X Y Z of the cells of a block that have a value, row by row"""
+    rows, columns = np.nonzero(np.isfinite(block))
+    x = origin[0] + columns * spacing[0]
+    y = origin[1] + (rows + first_row) * spacing[1]
+    return np.column_stack((x, y, block[rows, columns] * z_scale))
+
+
+def point_chunks(
+    data: Grid,
+    spacing: Tuple[float, float] = (1.0, 1.0),
+    origin: Tuple[float, float] = (0.0, 0.0),
+    z_scale: float = 1.0,
+    rows: int = BLOCK_ROWS,
+) -> Iterator[npt.NDArray[np.float64]]:
+    for first_row, block in grid_blocks(data, rows):
+        yield block_points(first_row, block, spacing, origin, z_scale)
+
+
+def write_csv(
+    path: PathLike,
+    data: Grid,
+    spacing: Tuple[float, float] = (1.0, 1.0),
+    origin: Tuple[float, float] = (0.0, 0.0),
+    z_scale: float = 1.0,
+) -> int:
+    """Writes X,Y,Z lines, returns the number of points"""
+    count = 0
+    with open(path, "w", newline="") as f:
+        f.write("X,Y,Z\n")
+        for points in point_chunks(data, spacing, origin, z_scale):
+            f.write((CSV_FORMAT * len(points)) % tuple(points.ravel()))
+            count += len(points)
+    return count
+
+
+def write_ply(
+    path: PathLike,
+    data: Grid,
+    spacing: Tuple[float, float] = (1.0, 1.0),
+    origin: Tuple[float, float] = (0.0, 0.0),
+    z_scale: float = 1.0,
+) -> int:
+    """Writes a binary little endian PLY point cloud, returns the number of points"""
+    count = sum(int(np.isfinite(block).sum()) for _, block in grid_blocks(data))
+    header = (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        "comment laser level heightmap\n"
+        f"element vertex {count}\n"
+        "property double x\n"
+        "property double y\n"
+        "property double z\n"
+        "end_header\n"
+    )
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        for points in point_chunks(data, spacing, origin, z_scale):
+            f.write(points.astype("<f8").tobytes())
+    return count
+
+
+def block_triangles(
+    first_row: int, block: Grid, spacing: Tuple[float, float], origin: Tuple[float, float], z_scale: float
+) -> npt.NDArray[np.void]:
+    """The triangles of the cells between the rows of a block, as STL records"""
+    rows, columns = block.shape
+    y, x = np.indices((rows, columns), dtype=np.float64)
+    vertices = np.stack((origin[0] + x * spacing[0], origin[1] + (y + first_row) * spacing[1], block * z_scale), -1)
+    known = np.isfinite(block)
+
+    # Cell corners: top left, top right, bottom left, bottom right (top is the lower row)
+    top, bottom = slice(0, rows - 1), slice(1, rows)
+    left, right = slice(0, columns - 1), slice(1, columns)
+    corners = [(top, left), (top, right), (bottom, left), (bottom, right)]
+    v = [vertices[r, c] for r, c in corners]
+    k = [known[r, c] for r, c in corners]
+
+    # Both triangles of each cell, in cell order so the file doesn't depend on where the blocks split
+    triangles = [(0, 1, 2), (1, 3, 2)]
+    v1, v2, v3 = (np.stack([v[t[i]] for t in triangles], axis=2) for i in range(3))
+    keep = np.stack([k[a] & k[b] & k[c] for a, b, c in triangles], axis=2)
+    v1, v2, v3 = v1[keep], v2[keep], v3[keep]
+    normal = np.cross(v2 - v1, v3 - v1)
+    length = np.linalg.norm(normal, axis=1, keepdims=True)
+    normal = np.divide(normal, length, out=np.zeros_like(normal), where=length > 0)
+
+    records = np.zeros(len(v1), dtype=STL_DTYPE)
+    records["normal"], records["v1"], records["v2"], records["v3"] = normal, v1, v2, v3
+    return records
+
+
+def count_triangles(data: Grid) -> int:
+    count = 0
+    for _, block in grid_blocks(data, overlap=1):
+        k = np.isfinite(block)
+        top_left, top_right = k[slice(0, -1), slice(0, -1)], k[slice(0, -1), slice(1, None)]
+        bottom_left, bottom_right = k[slice(1, None), slice(0, -1)], k[slice(1, None), slice(1, None)]
+        count += int((top_left & top_right & bottom_left).sum() + (top_right & bottom_right & bottom_left).sum())
+    return count
+
+
+def write_stl(
+    path: PathLike,
+    data: Grid,
+    spacing: Tuple[float, float] = (1.0, 1.0),
+    origin: Tuple[float, float] = (0.0, 0.0),
+    z_scale: float = 1.0,
+) -> int:
+    """Writes a binary STL mesh of the grid, returns the number of triangles"""
+    count = count_triangles(data)
+    with open(path, "wb") as f:
+        f.write(b"laser level heightmap".ljust(80, b" "))
+        f.write(np.uint32(count).astype("<u4").tobytes())
+        for first_row, block in grid_blocks(data, overlap=1):
+            f.write(block_triangles(first_row, block, spacing, origin, z_scale).tobytes())
+    return count
+
+
+Exporter = Callable[[PathLike, Grid, Tuple[float, float], Tuple[float, float], float], int]
+
+EXPORTERS: Dict[str, Exporter] = {".csv": write_csv, ".ply": write_ply, ".stl": write_stl}
+EXPORT_FILTER = "CSV Points (*.csv);;PLY Point Cloud (*.ply);;STL Mesh (*.stl)"
+
+
+def export_heightmap(
+    path: PathLike,
+    data: Grid,
+    spacing: Tuple[float, float] = (1.0, 1.0),
+    origin: Tuple[float, float] = (0.0, 0.0),
+    z_scale: float = 1.0,
+) -> int:
+    """Exports in the format of the file's suffix, see EXPORTERS. Returns the number of points or triangles"""
+    suffix = Path(path).suffix.lower()
+    if suffix not in EXPORTERS:
+        raise ValueError(f"Can't export to {suffix or 'a file without a suffix'}, use one of {', '.join(EXPORTERS)}")
+    return EXPORTERS[suffix](path, data, spacing, origin, z_scale)
@@ -0,0 +1,313 @@
+"""
+Heightmap files (.llh): the probed grid with what it takes to make sense of it later.
+
+    bytes 0-8        b"LLHMAP1\\n"
+    up to 4096       JSON header, padded with spaces (see Header)
+    grid             rows * columns little endian float64, row major, nan where there's no value
+    samples          SAMPLE_DTYPE records, one per sample in the order they came in
+
+The grid sits at a fixed offset so loading memory maps it instead of reading it. The samples are the job's log:
+time, grid cell, machine position and value of every sample, appended as they come in.
+
+Writing is crash safe. The file is created with the header and an empty grid before the first sample, every
+sample is written to the log and the grid straight away (no Python buffering) and the header is only rewritten
+once, when the job ends, to mark it complete. A file that isn't complete is from a job that stopped half way,
+it's rebuilt from its log when loaded, the log ends at the last whole record.
+
+Old save files were pickled arrays. import_pickle() reads them without running arbitrary code and
+import_legacy() turns one into a .llh file next to it.
+"""
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import time
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+from typing import BinaryIO
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from typing import Type
+from typing import Union
+
+import numpy as np
+import numpy.typing as npt
+
+MAGIC = b"LLHMAP1\n"
+HEADER_SIZE = 4096
+FORMAT_VERSION = 1
+SUFFIX = ".llh"
+SYNC_INTERVAL = 1.0  # seconds between fsyncs while appending
+
+SAMPLE_DTYPE = np.dtype(
+    [("time", "<f8"), ("column", "<i4"), ("row", "<i4"), ("x", "<f8"), ("y", "<f8"), ("value", "<f8")]
+)
+
+PathLike = Union[str, Path]
+
+
+class HeightmapFileError(ValueError):
+    """Not a heightmap file, or a damaged one"""
+
+
+@dataclass
+class Header:
+    """
+    Attributes:
+        shape: (rows, columns) of the grid.
+        spacing: X and Y distance between columns and rows.
+        origin: X and Y of column 0 row 0.
+        units: Units of positions ("xy") and values ("z").
+        created: Unix time the file was started.
+        job: The job's name and settings.
+        complete: False while a job is writing it, or when that job never finished.
+    """
+
+    shape: Tuple[int, int]
+    spacing: Tuple[float, float] = (1.0, 1.0)
+    origin: Tuple[float, float] = (0.0, 0.0)
+    units: Dict[str, str] = field(default_factory=lambda: {"xy": "mm", "z": "um"})
+    created: float = field(default_factory=time.time)
+    job: Dict[str, Any] = field(default_factory=dict)
+    complete: bool = False
+
+    @property
+    def grid_offset(self) -> int:
+        return HEADER_SIZE
+
+    @property
+    def samples_offset(self) -> int:
+        return HEADER_SIZE + self.shape[0] * self.shape[1] * 8
+
+    def encode(self) -> bytes:
+        body = json.dumps({"format": FORMAT_VERSION, **asdict(self)}, sort_keys=True).encode("utf-8")
+        if len(MAGIC) + len(body) > HEADER_SIZE:
+            raise ValueError(f"Heightmap header is {len(body)} bytes, the job settings are too big")
+        return (MAGIC + body).ljust(HEADER_SIZE, b" ")
+
+    @staticmethod
+    def decode(raw: bytes) -> "Header":
+        if not raw.startswith(MAGIC):
+            raise HeightmapFileError("not a heightmap file")
+        try:
+            fields = json.loads(raw[slice(len(MAGIC), None)].decode("utf-8"))
+        except ValueError as e:
+            raise HeightmapFileError(f"damaged header: {e}")
+        if fields.pop("format", None) != FORMAT_VERSION:
+            raise HeightmapFileError("unsupported heightmap format version")
+        fields["shape"] = tuple(fields["shape"])
+        fields["spacing"] = tuple(fields["spacing"])
+        fields["origin"] = tuple(fields["origin"])
+        return Header(**fields)
+
+
+@dataclass
+class Heightmap:
+    """
+    A loaded heightmap file.
+
+    Attributes:
+        header: See Header.
+        data: (rows, columns) grid, a read only memory map unless the file had to be rebuilt.
+        samples: SAMPLE_DTYPE log of the samples.
+    """
+
+    header: Header
+    data: npt.NDArray[np.float64]
+    samples: npt.NDArray[Any]
+
+    def positions(self) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+        """X of the columns and Y of the rows"""
+        rows, columns = self.header.shape
+        (dx, dy), (x0, y0) = self.header.spacing, self.header.origin
+        return x0 + np.arange(columns) * dx, y0 + np.arange(rows) * dy
+
+
+class HeightmapWriter:
+    """
+    Writes a heightmap file a sample at a time.
+
+    Args:
+        path: Where to write it, replaced if it exists.
+        header: What the file is about, its complete flag is set on close().
+        sync_interval: Seconds between fsyncs, the file survives the app crashing either way but not the computer.
+    """
+
+    def __init__(self, path: PathLike, header: Header, sync_interval: float = SYNC_INTERVAL) -> None:
+        self.path = Path(path)
+        self.header = header
+        self.header.complete = False
+        self.sync_interval = sync_interval
+        self.count = 0
+        self.file: Optional[BinaryIO] = open(self.path, "w+b", buffering=0)  # every write goes to the OS
+        self.file.write(header.encode())
+        self.file.write(np.full(header.shape, np.nan, dtype="<f8").tobytes())
+        os.fsync(self.file.fileno())
+        self.synced = time.monotonic()
+
+    def append(
+        self,
+        column: int,
+        row: int,
+        value: float,
+        x: Optional[float] = None,
+        y: Optional[float] = None,
+        when: Optional[float] = None,
+    ) -> None:
+        """Logs a sample and puts it in the grid, x and y default to the cell's position"""
+        (dx, dy), (x0, y0) = self.header.spacing, self.header.origin
+        record = np.array(
+            [
+                (
+                    time.time() if when is None else when,
+                    column,
+                    row,
+                    x0 + column * dx if x is None else x,
+                    y0 + row * dy if y is None else y,
+                    value,
+                )
+            ],
+            dtype=SAMPLE_DTYPE,
+        )
+        self.write_at(self.header.samples_offset + self.count * SAMPLE_DTYPE.itemsize, record.tobytes())
+        self.count += 1
+        rows, columns = self.header.shape
+        if 0 <= row < rows and 0 <= column < columns:
+            self.write_at(HEADER_SIZE + (row * columns + column) * 8, np.array([value], dtype="<f8").tobytes())
+        if time.monotonic() - self.synced > self.sync_interval:
+            self.sync()
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        if self.file is None:
+            raise ValueError("Heightmap file is closed")
+        self.file.seek(offset)
+        self.file.write(data)
+
+    def sync(self) -> None:
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+            self.synced = time.monotonic()
+
+    def write_grid(self, data: npt.NDArray[np.float64]) -> None:
+        """Writes the whole grid at once, for saving a map that isn't coming in sample by sample"""
+        if data.shape != self.header.shape:
+            raise ValueError(f"Grid is {data.shape}, the file is {self.header.shape}")
+        self.write_at(HEADER_SIZE, np.ascontiguousarray(data, dtype="<f8").tobytes())
+
+    def close(self, complete: bool = True) -> None:
+        if self.file is None:
+            return
+        self.sync()  # the samples are on disk before the header says so
+        if complete:
+            self.header.complete = True
+            self.write_at(0, self.header.encode())
+            self.sync()
+        self.file.close()
+        self.file = None
+
+    def __enter__(self) -> "HeightmapWriter":
+        return self
+
+    def __exit__(
+        self, kind: Optional[Type[BaseException]], error: Optional[BaseException], traceback: Optional[TracebackType]
+    ) -> None:
+        self.close(complete=error is None)
+
+
+def save_heightmap(
+    path: PathLike,
+    data: npt.NDArray[np.float64],
+    header: Optional[Header] = None,
+    samples: Optional[npt.NDArray[Any]] = None,
+) -> None:
+    """
+    Saves a whole grid, and the samples log if there is one. header.shape is taken from the data.
+
+    The file is written next to the target and moved over it, so a crash leaves the old file and a file that is
+    memory mapped (ex the one on screen) isn't cut from under its map.
+    """
+    path = Path(path)
+    header = header or Header(shape=data.shape)
+    header.shape = (int(data.shape[0]), int(data.shape[1]))
+    partial = path.with_name(path.name + ".partial")
+    with HeightmapWriter(partial, header) as writer:
+        writer.write_grid(data)
+        if samples is not None and len(samples):
+            writer.write_at(header.samples_offset, np.ascontiguousarray(samples, dtype=SAMPLE_DTYPE).tobytes())
+            writer.count = len(samples)
+    os.replace(partial, path)
+
+
+def load_heightmap(path: PathLike, mmap: bool = True) -> Heightmap:
+    """
+    Loads a heightmap file. A complete file's grid and samples are memory mapped (unless mmap is False), an
+    incomplete one's grid is rebuilt from its samples.
+    """
+    path = Path(path)
+    with open(path, "rb") as f:
+        header = Header.decode(f.read(HEADER_SIZE))
+    size = path.stat().st_size
+    if size < header.samples_offset:
+        raise HeightmapFileError(f"{path} is cut short")
+    count = (size - header.samples_offset) // SAMPLE_DTYPE.itemsize  # a torn last record is left out
+
+    def read(dtype: Any, offset: int, shape: Tuple[int, ...]) -> npt.NDArray[Any]:
+        if mmap and int(np.prod(shape)):
+            return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    samples = read(SAMPLE_DTYPE, header.samples_offset, (count,))
+    if header.complete:
+        return Heightmap(header, read("<f8", header.grid_offset, header.shape), samples)
+
+    # The job stopped half way, the grid might be missing its last sample
+    data = np.full(header.shape, np.nan, dtype=np.float64)
+    rows, columns = header.shape
+    inside = (samples["row"] >= 0) & (samples["row"] < rows) & (samples["column"] >= 0) & (samples["column"] < columns)
+    data[samples["row"][inside], samples["column"][inside]] = samples["value"][inside]  # later samples win
+    return Heightmap(header, data, np.array(samples))
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    """Only lets through what a pickled NumPy array needs"""
+
+    ALLOWED = {
+        ("numpy.core.multiarray", "_reconstruct"),
+        ("numpy._core.multiarray", "_reconstruct"),
+        ("numpy", "ndarray"),
+        ("numpy", "dtype"),
+        ("numpy.core.multiarray", "scalar"),
+        ("numpy._core.multiarray", "scalar"),
+    }
+
+    def find_class(self, module: str, name: str) -> Any:
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError(f"{module}.{name} isn't allowed in a heightmap pickle")
+        return super().find_class(module, name)
+
+
+def import_pickle(path: PathLike) -> npt.NDArray[np.float64]:
+    """Reads an array saved by the old Save Graph"""
+    with open(path, "rb") as f:
+        data = _ArrayUnpickler(f).load()
+    if not isinstance(data, np.ndarray) or data.ndim != 2:
+        raise HeightmapFileError(f"{path} doesn't hold a 2D array")
+    return data.astype(np.float64)
+
+
+def import_legacy(path: PathLike, header: Optional[Header] = None) -> Path:
+    """Converts an old pickle save file to a .llh file next to it, returns the new file's path"""
+    path = Path(path)
+    data = import_pickle(path)
+    header = header or Header(shape=data.shape, created=path.stat().st_mtime, job={"imported_from": path.name})
+    target = path.with_suffix(SUFFIX)
+    save_heightmap(target, data, header)
+    return target
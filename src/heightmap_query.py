@@ -0,0 +1,217 @@
+"""
+Heights at any X Y of a probed heightmap, for compensating toolpaths.
+
+A query answers whole arrays of points at once. Every cell of the grid gets a polynomial in its local t (along X)
+and s (along Y), both 0 to 1 across the cell:
+
+- bilinear: z = sum a_ij t^i s^j for i, j up to 1, straight lines along the grid lines.
+- bicubic: i, j up to 3, through the grid values with the slopes of the grid (central differences) at every
+  node, so the surface and its slope are continuous from cell to cell. Quadratic surfaces come back exactly.
+
+The tables of coefficients are worked out once per method, a lookup is finding each point's cell and
+evaluating its polynomial. Points are done in chunks so millions of them don't need gigabytes of temporaries.
+
+Outside the grid the extrapolation policy decides:
+
+- clamp: the value at the nearest edge of the grid.
+- linear: the nearest edge value carried on along the surface's slope there.
+- nan: nan.
+- error: raises ValueError.
+
+The grid has to be complete (see src.surface.fill_grid) and at least 2 by 2.
+"""
+from __future__ import annotations
+
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+METHODS = ("bilinear", "bicubic")
+EXTRAPOLATION = ("clamp", "linear", "nan", "error")
+QUERY_CHUNK = 1 << 16  # points evaluated at a time
+
+# Hermite basis: cubic coefficients from the values and slopes at 0 and 1
+HERMITE = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [-3.0, 3.0, -2.0, -1.0], [2.0, -2.0, 1.0, 1.0]])
+
+Table = npt.NDArray[np.float64]  # (rows - 1, columns - 1, n, n), [..., i, j] multiplies t^i s^j
+
+
+def corners(values: npt.NDArray[np.float64]) -> Tuple[npt.NDArray[np.float64], ...]:
+    """The values at each cell's (t, s) corners (0, 0), (1, 0), (0, 1), (1, 1)"""
+    low, high = slice(0, -1), slice(1, None)
+    return values[low, low], values[low, high], values[high, low], values[high, high]
+
+
+def bilinear_table(data: npt.NDArray[np.float64]) -> Table:
+    f00, f10, f01, f11 = corners(data)
+    table = np.empty(f00.shape + (2, 2))
+    table[..., 0, 0] = f00
+    table[..., 1, 0] = f10 - f00
+    table[..., 0, 1] = f01 - f00
+    table[..., 1, 1] = f11 - f10 - f01 + f00
+    return table
+
+
+def bicubic_table(data: npt.NDArray[np.float64]) -> Table:
+    """Slopes are in grid steps, central differences inside and second order one sided ones at the edges"""
+    edge_order = 2 if min(data.shape) > 2 else 1
+    dx = np.gradient(data, axis=1, edge_order=edge_order)
+    dy = np.gradient(data, axis=0, edge_order=edge_order)
+    dxy = np.gradient(dx, axis=0, edge_order=edge_order)
+
+    f, fx, fy, fxy = corners(data), corners(dx), corners(dy), corners(dxy)
+    # [i, j]: value or slope at t = 0 or 1 (i), s = 0 or 1 (j), see HERMITE
+    nodes = np.empty(f[0].shape + (4, 4))
+    nodes[..., 0, 0], nodes[..., 1, 0], nodes[..., 0, 1], nodes[..., 1, 1] = f
+    nodes[..., 2, 0], nodes[..., 3, 0], nodes[..., 2, 1], nodes[..., 3, 1] = fx
+    nodes[..., 0, 2], nodes[..., 1, 2], nodes[..., 0, 3], nodes[..., 1, 3] = fy
+    nodes[..., 2, 2], nodes[..., 3, 2], nodes[..., 2, 3], nodes[..., 3, 3] = fxy
+    return HERMITE @ nodes @ HERMITE.T
+
+
+TABLES = {"bilinear": bilinear_table, "bicubic": bicubic_table}
+
+
+def evaluate(coefficients: Table, t: npt.NDArray[np.float64], s: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """sum c_ij t^i s^j for (n, k, k) coefficients"""
+    degree = coefficients.shape[-1]
+    tp = t[:, None] ** np.arange(degree)
+    sp = s[:, None] ** np.arange(degree)
+    return np.einsum("ni,nij,nj->n", tp, coefficients, sp)
+
+
+def slopes(
+    coefficients: Table, t: npt.NDArray[np.float64], s: npt.NDArray[np.float64]
+) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """d/dt and d/ds of the polynomials"""
+    degree = coefficients.shape[-1]
+    powers = np.arange(degree)
+    tp, sp = t[:, None] ** powers, s[:, None] ** powers
+    dtp = np.zeros_like(tp)
+    dsp = np.zeros_like(sp)
+    dtp[:, 1:] = powers[1:] * tp[:, :-1]
+    dsp[:, 1:] = powers[1:] * sp[:, :-1]
+    return np.einsum("ni,nij,nj->n", dtp, coefficients, sp), np.einsum("ni,nij,nj->n", tp, coefficients, dsp)
+
+
+class HeightmapQuery:
+    """
+    Args:
+        data: (rows, columns) heightmap, no nan.
+        spacing: X and Y distance between columns and rows.
+        origin: X and Y of column 0 row 0.
+        method: One of METHODS.
+        extrapolate: One of EXTRAPOLATION.
+        version: Whatever identifies the data, see QueryCache.
+    """
+
+    def __init__(
+        self,
+        data: npt.NDArray[np.float64],
+        spacing: Tuple[float, float] = (1.0, 1.0),
+        origin: Tuple[float, float] = (0.0, 0.0),
+        method: str = "bicubic",
+        extrapolate: str = "clamp",
+        version: int = 0,
+    ) -> None:
+        data = np.asarray(data, dtype=np.float64)
+        if data.ndim != 2 or min(data.shape) < 2:
+            raise ValueError(f"A heightmap query needs a grid of at least 2 by 2, not {data.shape}")
+        if not np.isfinite(data).all():
+            raise ValueError("The heightmap has cells without a value, fill them first")
+        if method not in METHODS:
+            raise ValueError(f"Unknown interpolation method {method}, use one of {', '.join(METHODS)}")
+        if extrapolate not in EXTRAPOLATION:
+            raise ValueError(f"Unknown extrapolation {extrapolate}, use one of {', '.join(EXTRAPOLATION)}")
+        if spacing[0] <= 0 or spacing[1] <= 0:
+            raise ValueError(f"Spacing must be more than 0, not {spacing}")
+        self.data = data
+        self.spacing = spacing
+        self.origin = origin
+        self.method = method
+        self.extrapolate = extrapolate
+        self.version = version
+        self.tables: Dict[str, Table] = {}
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.data.shape  # type: ignore
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """x0, x1, y0, y1 covered by the grid"""
+        rows, columns = self.shape
+        (dx, dy), (x0, y0) = self.spacing, self.origin
+        return x0, x0 + (columns - 1) * dx, y0, y0 + (rows - 1) * dy
+
+    def table(self, method: Optional[str] = None) -> Table:
+        method = method or self.method
+        if method not in self.tables:
+            self.tables[method] = TABLES[method](self.data)
+        return self.tables[method]
+
+    def __call__(self, x: npt.ArrayLike, y: npt.ArrayLike, method: Optional[str] = None) -> npt.NDArray[np.float64]:
+        """Heights at X Y, arrays of any (matching) shape"""
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        table = self.table(method)
+        flat_x, flat_y = x.ravel(), y.ravel()
+        out = np.empty(flat_x.shape)
+        for start in range(0, len(flat_x), QUERY_CHUNK):
+            chunk = slice(start, start + QUERY_CHUNK)
+            out[chunk] = self.lookup(table, flat_x[chunk], flat_y[chunk])
+        return out.reshape(x.shape)
+
+    def lookup(self, table: Table, x: npt.NDArray[np.float64], y: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        rows, columns = self.shape
+        u = (x - self.origin[0]) / self.spacing[0]  # in columns
+        v = (y - self.origin[1]) / self.spacing[1]  # in rows
+        uc, vc = np.clip(u, 0.0, columns - 1.0), np.clip(v, 0.0, rows - 1.0)
+        outside = (uc != u) | (vc != v) | np.isnan(u) | np.isnan(v)
+        if self.extrapolate == "error" and outside.any():
+            i = int(np.argmax(outside))
+            raise ValueError(f"X{x[i]} Y{y[i]} is outside the heightmap {self.bounds}")
+
+        column = np.minimum(np.nan_to_num(uc).astype(np.intp), columns - 2)
+        row = np.minimum(np.nan_to_num(vc).astype(np.intp), rows - 2)
+        t, s = uc - column, vc - row
+        coefficients = table[row, column]
+        z = evaluate(coefficients, t, s)
+        if self.extrapolate == "linear" and outside.any():
+            dt, ds = slopes(coefficients[outside], t[outside], s[outside])
+            z[outside] += dt * (u - uc)[outside] + ds * (v - vc)[outside]
+        elif self.extrapolate == "nan":
+            z[outside] = np.nan
+        return z
+
+
+class QueryCache:
+    """Keeps the query of the latest heightmap, so its tables are only worked out again when the data changes"""
+
+    def __init__(self) -> None:
+        self.query: Optional[HeightmapQuery] = None
+
+    def get(
+        self,
+        data: npt.NDArray[np.float64],
+        version: int,
+        spacing: Tuple[float, float] = (1.0, 1.0),
+        origin: Tuple[float, float] = (0.0, 0.0),
+        method: str = "bicubic",
+        extrapolate: str = "clamp",
+    ) -> HeightmapQuery:
+        query = self.query
+        if (
+            query is None
+            or query.version != version
+            or query.shape != data.shape
+            or query.spacing != spacing
+            or query.origin != origin
+        ):
+            query = HeightmapQuery(data, spacing, origin, method, extrapolate, version)
+        else:
+            query.method, query.extrapolate = method, extrapolate  # the tables don't depend on these
+        self.query = query
+        return query
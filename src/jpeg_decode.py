@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import importlib.util
+import io
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+# Pillow comes in with matplotlib, but it's only needed for this decoder so don't make it a hard requirement.
+# It's imported on first use to keep it out of the app startup.
+JPEG_LUMA_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+DCT_SCALES = (1, 2, 4, 8)  # libjpeg can only scale down by these while decoding
+
+# MJPEG decode modes shown in the GUI and the DCT scale used for each, 0 leaves the decoding to Qt
+DECODE_MODES = {"Qt (colour)": 0}
+if JPEG_LUMA_AVAILABLE:
+    DECODE_MODES.update({"Luma": 1, "Luma 1/2": 2, "Luma 1/4": 4, "Luma 1/8": 8})
+
+
+def decode_luma(data: bytes, scale: int = 1) -> npt.NDArray:
+    """
+    Decodes only the luminance of a JPEG, see decode_luma_sized.
+
+    Returns:
+    - A (height / scale, width / scale) uint8 array, rounded up.
+    """
+    return decode_luma_sized(data, scale)[0]
+
+
+def decode_luma_sized(data: bytes, scale: int = 1) -> Tuple[npt.NDArray, Tuple[int, int]]:
+    """
+    Decodes only the luminance of a JPEG.
+
+    libjpeg skips the chroma upsampling and colour conversion when asked for grayscale output, and with a scale
+    it drops the high frequency DCT coefficients instead of decoding them, so this is a lot cheaper than a full
+    RGB decode followed by a grayscale conversion.
+
+    Args:
+    - data (bytes): A complete JPEG image, ex one MJPEG frame.
+    - scale (int): Decode at 1/scale of the resolution. One of 1, 2, 4 or 8.
+
+    Returns:
+    - A (height / scale, width / scale) uint8 array. libjpeg rounds the scaled size up.
+    - The (height, width) of the full resolution image, what the scaled image covers.
+    """
+    from PIL import Image
+
+    if scale not in DCT_SCALES:
+        raise ValueError(f"JPEG scale must be one of {DCT_SCALES}, got {scale}")
+
+    image = Image.open(io.BytesIO(data))
+    size = (image.height, image.width)
+    image.draft("L", (image.width // scale, image.height // scale))
+    if image.mode != "L":  # draft is only a request, ex progressive JPEGs in some versions ignore it
+        image = image.convert("L")
+    return np.asarray(image), size
+
+
+class LumaDecodePool:
+    """
+    Decodes JPEG frames on a small thread pool.
+
+    Pillow releases the GIL while libjpeg runs, so with a couple of workers several frames decode in parallel
+    while the frame worker is busy analysing the previous one. Results are handed back in submission order.
+
+    Attributes:
+        workers (int): The number of decode threads, also the number of frames that can be in flight.
+        scale (int): The DCT scale passed to decode_luma.
+    """
+
+    def __init__(self, workers: int = 2, scale: int = 1) -> None:
+        self.workers = workers
+        self.scale = scale
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jpeg-luma")
+        self.pending: list[Tuple[float, Future[Tuple[npt.NDArray, Tuple[int, int]]]]] = []
+
+    def busy(self) -> bool:
+        """True when every worker has a frame, the caller should drop frames until one finishes."""
+        return len(self.pending) >= self.workers
+
+    def submit(self, data: bytes, on_done: Optional[Callable[[], None]] = None, timestamp: float = 0.0) -> None:
+        """
+        Queues a JPEG for decoding.
+
+        Args:
+        - data (bytes): The JPEG, it must not be a view into a buffer that gets unmapped.
+        - on_done (callable): Called from the decode thread when this frame is decoded. Use it to wake up the
+          consumer (ex by emitting a signal) and call ready() from the consumer's own thread.
+        - timestamp (float): When the frame arrived, handed back with the decoded frame.
+        """
+        future = self.executor.submit(decode_luma_sized, data, self.scale)
+        self.pending.append((timestamp, future))
+        if on_done is not None:
+            future.add_done_callback(lambda _: on_done())
+
+    def ready(self) -> list[Tuple[float, npt.NDArray, Tuple[int, int]]]:
+        """
+        Returns the timestamp, decoded frame and full resolution (height, width) of the frames that are finished,
+        oldest first. Frames that failed to decode are skipped.
+        """
+        frames = []
+        while self.pending and self.pending[0][1].done():
+            timestamp, future = self.pending.pop(0)
+            try:
+                frames.append((timestamp, *future.result()))
+            except (OSError, ValueError) as e:
+                print("Invalid JPEG frame:", e)
+        return frames
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+        self.pending = []
@@ -4,26 +4,33 @@ from __future__ import annotations
 import pickle
 import re
 import sys
+import time
 from pathlib import Path
 from typing import Any
 from typing import Dict
+from typing import Optional
+from typing import Tuple
 
 import numpy as np
-import plotly
-import plotly.graph_objects as go
-import plotly.io as io
 import qdarktheme
+from PySide6.QtCore import QCoreApplication
+from PySide6.QtCore import QObject
 from PySide6.QtCore import QSettings
+from PySide6.QtCore import QStandardPaths
+from PySide6.QtCore import Qt
+from PySide6.QtCore import QTimer
 from PySide6.QtCore import QUrl
 from PySide6.QtCore import Signal
+from PySide6.QtCore import Slot
 from PySide6.QtGui import QCloseEvent
-from PySide6.QtWebEngineWidgets import QWebEngineView
+from PySide6.QtGui import QShowEvent
 from PySide6.QtWidgets import QApplication
 from PySide6.QtWidgets import QComboBox
 from PySide6.QtWidgets import QFileDialog
 from PySide6.QtWidgets import QFormLayout
 from PySide6.QtWidgets import QGridLayout
 from PySide6.QtWidgets import QHBoxLayout
+from PySide6.QtWidgets import QLabel
 from PySide6.QtWidgets import QLineEdit
 from PySide6.QtWidgets import QMainWindow
 from PySide6.QtWidgets import QPushButton
@@ -31,21 +38,52 @@ from PySide6.QtWidgets import QVBoxLayout
 from PySide6.QtWidgets import QWidget
 
 from src.CNC_jobs.probe import ProbeJob
-
-# from src.CNC_jobs.probe_and_machine import ProbeAndMachineJob
-# from src.CNC_jobs.test_job import TestJob
-
-io.templates.default = "plotly_dark"
+from src.CNC_jobs.probe_and_machine import ProbeAndMachineJob
+from src.CNC_jobs.test_job import TestJob
+from src.gcode_compensate import compensate_file
+from src.heightmap_export import EXPORT_FILTER
+from src.heightmap_export import export_heightmap
+from src.heightmap_file import Header
+from src.heightmap_file import HeightmapWriter
+from src.heightmap_file import import_legacy
+from src.heightmap_file import load_heightmap
+from src.heightmap_file import save_heightmap
+from src.heightmap_file import SUFFIX
+from src.heightmap_query import HeightmapQuery
+from src.pyramid import cells_for_view
+from src.pyramid import PyramidCache
+from src.pyramid import Window
+from src.startup import DRIVER_PRELOAD
+from src.startup import preload_modules
+from src.surface import fill_grid
+from src.surface import FILL_METHODS
+from src.surface import FlatnessTracker
+from src.surface import grid_points
+from src.surface_plot import set_point_call
+from src.surface_plot import set_surface_call
+from src.surface_plot import surface_page
 
 
 DEV_MODE = False  # Use a bunch of dummy things such as fake linuxcnc module
 SKIP_CONNECTION = False  # Work without connecting to a socket
+HEIGHTMAP_FILTER = f"Heightmaps (*{SUFFIX});;Old Pickle Files (*.pkl);;All Files (*)"
+GCODE_FILTER = "G-code (*.ngc *.nc *.gcode *.tap);;All Files (*)"
 
 
 def camel_case_split(str: str) -> str:
     return " ".join(re.findall(r"[A-Z](?:[a-z]+|[A-Z]*(?=[A-Z]|$))", str))
 
 
+class GraphBridge(QObject):  # type: ignore
+    """What the graph page calls back, see src.surface_plot"""
+
+    view_changed = Signal(float, float, float, float)
+
+    @Slot(float, float, float, float)  # type: ignore
+    def set_view(self, x0: float, x1: float, y0: float, y1: float) -> None:
+        self.view_changed.emit(x0, x1, y0, y1)
+
+
 # Define the main window
 class MainWindow(QMainWindow):  # type: ignore
     OnConnect = Signal(dict)
@@ -67,10 +105,27 @@ class MainWindow(QMainWindow):  # type: ignore
         btn_layout = QGridLayout()
         form = QFormLayout()
 
-        # we create an instance of QWebEngineView and set the html code
-        self.plot_widget = QWebEngineView()
-        self.plot_widget.setMinimumWidth(self.graph_size + 20)
-        self.plot_widget.setMinimumHeight(self.graph_size + 20)
+        # The QWebEngineView is created after the window is shown (see create_plot_widget), QtWebEngine spins up
+        # a whole Chromium process so we only hold a placeholder for it here.
+        self.plot_widget: Any = None
+        self.plot_loaded = False
+        # The data version, level and cells on the page, None to send it all again
+        self.plot_view: Optional[Tuple[int, int, slice, slice]] = None
+        self.view_window: Optional[Window] = None  # what the camera looks at, None for all of it
+        self.pyramids = PyramidCache()
+        self.data_version = 0  # goes up when the data is replaced, samples change it in place
+        self.recording: Optional[HeightmapWriter] = None  # the running job's file
+        self.data_source: Optional[Path] = None  # the file the data is in, None when it's in no file
+        # Samples that can't go in one cell (ex the grid changed shape) are merged into one update
+        self.graph_timer = QTimer(self)
+        self.graph_timer.setSingleShot(True)
+        self.graph_timer.setInterval(100)
+        self.graph_timer.timeout.connect(self.update_graph)
+        self.plot_container = QWidget()
+        self.plot_container.setMinimumWidth(self.graph_size + 20)
+        self.plot_container.setMinimumHeight(self.graph_size + 20)
+        plot_layout = QVBoxLayout(self.plot_container)
+        plot_layout.setContentsMargins(0, 0, 0, 0)
 
         self.connect_btn = QPushButton("Connect")
         self.update_btn = QPushButton("Update")
@@ -84,15 +139,26 @@ class MainWindow(QMainWindow):  # type: ignore
         self.save_btn = QPushButton("Save Graph")
         self.load_btn = QPushButton("Load Graph")
         self.export_btn = QPushButton("Export Graph")
+        self.compensate_btn = QPushButton("Compensate G-code")
+        self.compensate_btn.setToolTip("Adds the heightmap to the Z of a G-code program's moves")
 
         self.job_type_combo = QComboBox()
+        self.fill_combo = QComboBox()
+        self.fill_combo.addItems(FILL_METHODS)
+        self.fill_combo.setToolTip("How the graph fills in points that weren't probed")
+        self.flatness_label = QLabel("-")
+        self.flatness_label.setToolTip(
+            "Plane: peak to valley from the least squares plane.\n"
+            "Min zone: the smallest gap between two parallel planes holding every point."
+        )
+        self.flatness = FlatnessTracker()
 
         self.jobs_types = {}
         self.job = ProbeJob()
 
         self.data = np.zeros((5, 5), dtype=np.float64)
 
-        for job in [ProbeJob]:
+        for job in [ProbeJob, ProbeAndMachineJob, TestJob]:
             job_name = str(job.__name__)
             job_name = camel_case_split(job_name)
             self.jobs_types[job_name] = job
@@ -102,6 +168,8 @@ class MainWindow(QMainWindow):  # type: ignore
         form.addRow("IP Address", self.ip_line)
         form.addRow("Port", self.port_line)
         form.addRow("Job", self.job_type_combo)
+        form.addRow("Fill Gaps", self.fill_combo)
+        form.addRow("Flatness", self.flatness_label)
 
         btn_layout.addWidget(self.connect_btn, 1, 1, 1, 2)
         btn_layout.addWidget(self.start_btn, 2, 1)
@@ -109,7 +177,8 @@ class MainWindow(QMainWindow):  # type: ignore
         btn_layout.addWidget(self.update_btn, 3, 1, 1, 2)
         btn_layout.addWidget(self.save_btn, 4, 1)
         btn_layout.addWidget(self.load_btn, 4, 2)
-        btn_layout.addWidget(self.export_btn, 5, 1, 1, 2)
+        btn_layout.addWidget(self.export_btn, 5, 1)
+        btn_layout.addWidget(self.compensate_btn, 5, 2)
 
         self.left_layout.addLayout(form)
 
@@ -118,15 +187,17 @@ class MainWindow(QMainWindow):  # type: ignore
         self.left_layout.addLayout(btn_layout)
 
         main_layout.addLayout(self.left_layout)
-        main_layout.addWidget(self.plot_widget)
+        main_layout.addWidget(self.plot_container)
 
         # Logic
         self.start_btn.clicked.connect(self.start_btn_update_GUI)
         self.job_type_combo.currentIndexChanged.connect(self.job_changed)
         self.update_btn.clicked.connect(self.update_graph)
-        self.save_btn.clicked.connect(self.save_np)
-        self.load_btn.clicked.connect(self.load_np)
-        self.export_btn.clicked.connect(self.export_np)
+        self.fill_combo.currentIndexChanged.connect(self.update_graph)
+        self.save_btn.clicked.connect(self.save_graph)
+        self.load_btn.clicked.connect(self.load_graph)
+        self.export_btn.clicked.connect(self.export_graph)
+        self.compensate_btn.clicked.connect(self.compensate_gcode)
 
         # Load GUI saved defaults
         settings = QSettings("linuxcnc_remote_driver", "LinuxCNCRemoteDriver")
@@ -141,56 +212,177 @@ class MainWindow(QMainWindow):  # type: ignore
         self.job_changed()
         self.update_graph()
 
-    def save_np(self) -> None:
-        options = QFileDialog.Options()
-        file_path, _ = QFileDialog.getSaveFileName(
-            self, "Save NumPy Array", "", "Pickle Files (*.pkl);;All Files (*)", options=options
-        )
+    def showEvent(self, event: QShowEvent) -> None:
+        super().showEvent(event)
+        if self.plot_widget is None:
+            QTimer.singleShot(0, self.create_plot_widget)
 
-        if file_path:
-            # Use pickle to save the NumPy array to the selected file
-            with open(file_path, "wb") as file:
-                pickle.dump(self.data, file)
+    def create_plot_widget(self) -> None:
+        """Creates the QWebEngineView for the graph once the rest of the GUI is on screen"""
+        if self.plot_widget is not None:
+            return
 
-            print(f"NumPy array saved to {file_path}")
+        from PySide6.QtWebEngineWidgets import QWebEngineView
 
-    def load_np(self) -> None:
-        options = QFileDialog.Options()
-        file_path, _ = QFileDialog.getOpenFileName(
-            self, "Load NumPy Array", "", "Pickle Files (*.pkl);;All Files (*)", options=options
-        )
+        self.plot_widget = QWebEngineView()
+        self.plot_container.layout().addWidget(self.plot_widget)
+        self.plot_widget.loadFinished.connect(self.plot_page_loaded)
 
-        if file_path:
-            try:
-                # Use pickle to load the NumPy array from the selected file
-                with open(file_path, "rb") as file:
-                    loaded_array = pickle.load(file)
+        from PySide6.QtWebChannel import QWebChannel
 
-                # Update the stored data with the loaded array
-                self.data = loaded_array
+        self.bridge = GraphBridge(self)
+        self.bridge.view_changed.connect(self.view_changed)
+        self.channel = QWebChannel(self.plot_widget.page())
+        self.channel.registerObject("bridge", self.bridge)
+        self.plot_widget.page().setWebChannel(self.channel)
+        base = QUrl.fromLocalFile(str(Path(__file__).resolve()))
+        self.plot_widget.setHtml(surface_page(self.graph_size), baseUrl=base)
 
-                print(f"NumPy array loaded from {file_path}: {self.data}")
-            except Exception as e:
-                print(f"Error loading NumPy array: {e}")
+    def plot_page_loaded(self, ok: bool) -> None:
+        self.plot_loaded = ok
+        if not ok:
+            print("The graph page failed to load")
+        self.update_graph()
 
+    def save_graph(self) -> None:
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Heightmap", "", HEIGHTMAP_FILTER)
+        if not file_path:
+            return
+        path = Path(file_path)
+        if not path.suffix:
+            path = path.with_suffix(SUFFIX)
+
+        # The file the data came from (a job's recording or a loaded file) has its header and samples
+        header, samples = self.data_header(), None
+        if self.data_source is not None and self.data_source.resolve() != path.resolve():
+            try:
+                source = load_heightmap(self.data_source)
+                header, samples = source.header, source.samples
+            except (OSError, ValueError) as e:
+                print(f"Couldn't read the samples from {self.data_source}: {e}")
+        try:
+            save_heightmap(path, np.asarray(self.data), header, samples)
+        except (OSError, ValueError) as e:
+            print(f"Error saving heightmap: {e}")
+            return
+        print(f"Heightmap saved to {path}")
+
+    def load_graph(self) -> None:
+        file_path, _ = QFileDialog.getOpenFileName(self, "Load Heightmap", "", HEIGHTMAP_FILTER)
+        if not file_path:
+            return
+        path = Path(file_path)
+        try:
+            if path.suffix.lower() == ".pkl" and path.with_suffix(SUFFIX).exists():
+                path = path.with_suffix(SUFFIX)  # imported before
+            elif path.suffix.lower() == ".pkl":
+                path = import_legacy(path)
+                print(f"Imported {file_path} to {path}")
+            heightmap = load_heightmap(path)
+        except (OSError, ValueError, pickle.UnpicklingError) as e:
+            print(f"Error loading heightmap: {e}")
+            return
+
+        self.data = heightmap.data
+        self.data_version += 1
+        self.data_source = path
+        self.view_window = None
+        self.flatness.reset()
+        self.flatness.extend(grid_points(np.asarray(self.data)))
+        self.update_flatness()
+        state = "" if heightmap.header.complete else ", its job didn't finish"
+        print(f"Heightmap {heightmap.header.shape} loaded from {path}{state}")
         self.update_graph()
 
-    def export_np(self) -> None:
-        options = QFileDialog.Options()
-        file_path, _ = QFileDialog.getSaveFileName(
-            self, "Export NumPy Array to CSV", "", "CSV Files (*.csv);;All Files (*)", options=options
+    def data_header(self) -> Header:
+        """A header for the current job's data"""
+        return Header(shape=self.data.shape, spacing=self.job.spacing(), job=self.job.parameters())
+
+    def record_sample(self, column: int, row: int, value: float) -> None:
+        """Appends the sample to the job's file, which is started with the first sample"""
+        if self.recording is not None and self.recording.header.shape != self.data.shape:
+            self.stop_recording(complete=False)  # the job changed the grid, start another file
+        if self.recording is None:
+            jobs = Path(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)) / "jobs"
+            path = jobs / time.strftime(f"%Y-%m-%d_%H-%M-%S{SUFFIX}")
+            try:
+                jobs.mkdir(parents=True, exist_ok=True)
+                self.recording = HeightmapWriter(path, self.data_header())
+            except (OSError, ValueError) as e:
+                print(f"Can't record the job to {path}: {e}")
+                return
+            self.data_source = path
+            print(f"Recording the job to {path}")
+        try:
+            self.recording.append(column, row, value)
+        except OSError as e:
+            print(f"Recording the job failed: {e}")
+            self.stop_recording(complete=False)
+
+    def stop_recording(self, complete: bool = True) -> None:
+        if self.recording is not None:
+            try:
+                self.recording.close(complete)
+            except OSError as e:
+                print(f"Closing the job's file failed: {e}")
+            self.recording = None
+
+    def export_graph(self) -> None:
+        file_path, selected = QFileDialog.getSaveFileName(self, "Export Heightmap", "", EXPORT_FILTER)
+        if not file_path:
+            return
+        path = Path(file_path)
+        if not path.suffix:
+            match = re.search(r"\*(\.\w+)", selected)
+            path = path.with_suffix(match.group(1) if match else ".csv")
+
+        header = self.data_file_header()
+        z_scale = 0.001 if header.units.get("z") == "um" and header.units.get("xy") == "mm" else 1.0
+        start = time.perf_counter()
+        try:
+            count = export_heightmap(path, np.asarray(self.data), header.spacing, header.origin, z_scale)
+        except (OSError, ValueError) as e:
+            print(f"Error exporting heightmap: {e}")
+            return
+        print(
+            f"Exported {count} {'triangles' if path.suffix.lower() == '.stl' else 'points'} to {path} "
+            f"in {time.perf_counter() - start:.1f}s"
         )
 
-        if file_path:
+    def data_file_header(self) -> Header:
+        """The header of the file the data is in, or one for the current job's data"""
+        if self.data_source is not None:
             try:
-                # Save the NumPy array to a CSV file
-                np.savetxt(
-                    file_path, self.data, delimiter=",", fmt="%.6f"
-                )  # fmt = 6 decimal places. Change if you need more
-
-                print(f"NumPy array exported to {file_path} in CSV format.")
-            except Exception as e:
-                print(f"Error exporting NumPy array to CSV: {e}")
+                return load_heightmap(self.data_source).header
+            except (OSError, ValueError) as e:
+                print(f"Couldn't read the positions from {self.data_source}: {e}")
+        return self.data_header()
+
+    def compensate_gcode(self) -> None:
+        source, _ = QFileDialog.getOpenFileName(self, "G-code To Compensate", "", GCODE_FILTER)
+        if not source:
+            return
+        target, _ = QFileDialog.getSaveFileName(self, "Save Compensated G-code", "", GCODE_FILTER)
+        if not target:
+            return
+
+        header = self.data_file_header()
+        z_scale = 0.001 if header.units.get("z") == "um" and header.units.get("xy") == "mm" else 1.0
+        start = time.perf_counter()
+        try:
+            # Gaps are filled the way the graph fills them
+            data = fill_grid(np.asarray(self.data), self.fill_combo.currentText())
+            query = HeightmapQuery(data, header.spacing, header.origin)
+            read, written, uncompensated = compensate_file(source, target, query, z_scale)
+        except (OSError, ValueError) as e:
+            print(f"Error compensating G-code: {e}")
+            return
+        print(f"Compensated {read} lines of {source} to {written} in {target} in {time.perf_counter() - start:.1f}s")
+        if uncompensated:
+            print(
+                f"Warning: {uncompensated} moves were left as they were, the position wasn't known (ex G91 with no "
+                "G90 X Y Z move before them) or they're canned cycles"
+            )
 
     def job_changed(self) -> None:
         job_name = str(self.job_type_combo.currentText())
@@ -198,6 +390,7 @@ class MainWindow(QMainWindow):  # type: ignore
         new_widget = self.jobs_types[job_name]()
         self.left_layout.replaceWidget(old_widget, new_widget)
         self.job = new_widget
+        old_widget.driver.close()
         old_widget.deleteLater()
 
         # Hook up the new connections
@@ -209,11 +402,57 @@ class MainWindow(QMainWindow):  # type: ignore
         self.job.data_changed.connect(self.update_data)
         self.start_btn.clicked.connect(self.job.start_driver)
         self.job.driver.job_stopped.connect(self.stop_update_GUI)
+        self.job.driver.sample_out.connect(self.sample_in)
 
     def update_data(self, data: Dict[str, Any]) -> None:
         print("updating data:", data)
+        if data is not self.data:
+            self.data_version += 1
+            self.data_source = None
         self.data = data
 
+    def sample_in(self, sample: list[int | int | float]) -> None:
+        column, row, value = sample[0:3]
+        if len(sample) == 3:  # filled in values (see JobContext.emit) are shown but aren't measurements
+            self.record_sample(column, row, value)
+            self.flatness.add(column, row, value)  # the figures are the same in columns and rows as in mm
+            self.update_flatness()
+
+        pyramid = self.pyramids.get(self.data, self.data_version)
+        pyramid.update(row, column, value)
+        if not self.plot_view or self.plot_view[0] != self.data_version or self.fill_combo.currentText() != "None":
+            self.graph_timer.start()
+            return
+        _, level, rows, columns = self.plot_view
+        cell_row, cell_column = row >> level, column >> level
+        if rows.start <= cell_row < rows.stop and columns.start <= cell_column < columns.stop:
+            call = set_point_call(
+                cell_row - rows.start, cell_column - columns.start, pyramid.level(level)[cell_row, cell_column]
+            )
+            self.plot_widget.page().runJavaScript(call)
+
+    def view_changed(self, x0: float, x1: float, y0: float, y1: float) -> None:
+        rows, columns = self.data.shape
+        whole = x0 <= 0 and y0 <= 0 and x1 >= columns - 1 and y1 >= rows - 1
+        self.view_window = None if whole else (x0, x1, y0, y1)
+        if self.plot_view is None or self.plot_view[1:] != self.select_view():
+            self.graph_timer.start()
+
+    def select_view(self) -> Tuple[int, slice, slice]:
+        """The level and cells of it to draw"""
+        pyramid = self.pyramids.get(self.data, self.data_version)
+        size = self.plot_widget.size()
+        return pyramid.select(cells_for_view(size.width(), size.height()), self.view_window)
+
+    def update_flatness(self) -> None:
+        if not self.flatness.count:
+            self.flatness_label.setText("-")
+            return
+        tracker = self.flatness
+        self.flatness_label.setText(
+            f"Plane {tracker.flatness:.1f} um, min zone {tracker.zone:.1f} um ({tracker.count} points)"
+        )
+
     def connect_update_GUI(self) -> None:
         print("updating the GUI that a connection was made")
         self.connect_btn.setDisabled(True)
@@ -222,10 +461,15 @@ class MainWindow(QMainWindow):  # type: ignore
     def start_btn_update_GUI(self) -> None:
         self.start_btn.setDisabled(True)
         self.stop_btn.setEnabled(True)
+        self.flatness.reset()
+        self.update_flatness()
+        self.plot_view = None  # the job starts a new grid
+        self.stop_recording()
 
     def stop_update_GUI(self) -> None:
         self.start_btn.setEnabled(True)
         self.stop_btn.setDisabled(True)
+        self.stop_recording()
         self.update_graph()
 
     def closeEvent(self, event: QCloseEvent) -> None:
@@ -234,48 +478,38 @@ class MainWindow(QMainWindow):  # type: ignore
         self.settings.setValue("geometry", self.saveGeometry())
         self.settings.setValue("ip", self.ip_line.text())
         self.settings.setValue("port", self.port_line.text())
+        self.job.driver.close()
+        self.stop_recording(complete=not self.stop_btn.isEnabled())  # closing during a job stops it half way
         self.deleteLater()
         QWidget.closeEvent(self, event)
 
     def update_graph(self) -> None:
-        print("Updating Graph")
-        print(self.data)
-        graph = go.Surface(z=self.data)
-        fig = go.Figure(
-            data=[graph],
-        )
-
-        fig.update_layout(
-            title="Surface Height",
-            autosize=False,
-            width=self.graph_size,
-            height=self.graph_size,
-            margin=dict(l=0, r=0, b=0, t=40),
-        )
+        """Sends the whole grid to the graph page"""
+        self.graph_timer.stop()
+        # The web view gets created after the window shows and calls back in here once the page has loaded
+        if not self.plot_loaded:
+            return
 
-        self.plot = plotly.offline.plot(
-            fig,
-            output_type="div",
-            image_width="100%",
-            image_height="100%",
-            include_plotlyjs=False,
-        )
-
-        # we create html code of the figure
-        html = '<html><script src="plotly.js"></script><body style = "background:black">'
-        html += self.plot
-        html += "</body></html>"
-        base = QUrl.fromLocalFile(str(Path(__file__).resolve()))
-        self.plot_widget.setHtml(html, baseUrl=base)
+        print("Updating Graph")
+        pyramid = self.pyramids.get(self.data, self.data_version)
+        level, rows, columns = self.select_view()
+        x, y = pyramid.coordinates(level)
+        z = fill_grid(pyramid.level(level)[rows, columns], self.fill_combo.currentText())
+        extent = (0.0, self.data.shape[1] - 1.0, 0.0, self.data.shape[0] - 1.0)
+        self.plot_widget.page().runJavaScript(set_surface_call(z, x[columns], y[rows], extent))
+        self.plot_view = (self.data_version, level, rows, columns)
 
 
 def start() -> None:
+    # Needed because QtWebEngine is imported lazily, after the QApplication exists
+    QCoreApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
     app = QApplication(sys.argv)
     qdarktheme.setup_theme(additional_qss="QToolTip {color: black;}")
 
     window = MainWindow()
 
     window.show()
+    QTimer.singleShot(0, lambda: preload_modules(DRIVER_PRELOAD))
     sys.exit(app.exec())
 
 
@@ -4,10 +4,13 @@ import csv
 import shutil
 import subprocess
 import sys
+from typing import Optional
+from typing import TYPE_CHECKING
 
 import qdarktheme
 from PySide6.QtCore import QSettings
 from PySide6.QtCore import Qt
+from PySide6.QtCore import QTimer
 from PySide6.QtCore import QUrl
 from PySide6.QtGui import QAction
 from PySide6.QtGui import QCloseEvent
@@ -38,7 +41,11 @@ from PySide6.QtWidgets import QWidget
 
 from src.Core import Core
 from src.cycle import CyclicMeasurementSetupWindow
+from src.frame_ops import CHANNEL_MODES
+from src.jpeg_decode import DECODE_MODES
 from src.s_server import SocketWindow
+from src.startup import preload_modules
+from src.startup import SENSOR_PRELOAD
 from src.tooltips import tooltips as tt
 from src.utils import units_of_measurements
 from src.Widgets import AnalyserWidget
@@ -46,6 +53,9 @@ from src.Widgets import Graph
 from src.Widgets import PixmapWidget
 from src.Widgets import TableUnit
 
+if TYPE_CHECKING:
+    from src.shared_state import SharedStateWriter  # multiprocessing.shared_memory is Python 3.8+
+
 
 # Define the main window
 class MainWindow(QMainWindow):  # type: ignore
@@ -75,8 +85,20 @@ class MainWindow(QMainWindow):  # type: ignore
         websocket_action = QAction("Socket Server", self)
         websocket_action.triggered.connect(self.socket_server_action)
         self.socket_dialog = SocketWindow(self)
+        self.socket_dialog.message_received.connect(self.socket_dialog.update_text_edit)
+        self.socket_dialog.take_sample.connect(self.socket_sample)
+        self.socket_dialog.zero.connect(self.socket_zero)
         file_menu.addAction(websocket_action)
 
+        # The latest measurement in shared memory for drivers on the same machine, see src.shared_state
+        self.shared_state: Optional[SharedStateWriter] = None
+        try:
+            from src.shared_state import SharedStateWriter as Writer
+
+            self.shared_state = Writer()
+        except (ImportError, OSError, ValueError) as e:
+            print("Not publishing to shared memory:", e)
+
         # create a QAction for the "Exit" option
         exit_action = QAction("Exit", self)
         exit_action.setShortcut("Ctrl+Q")
@@ -118,12 +140,20 @@ class MainWindow(QMainWindow):  # type: ignore
         self.sensor_feed_widget.setToolTip(tt["feed"])
         self.camera_combo = QComboBox()
         self.camera_combo.setToolTip(tt["cameras"])
+        self.format_combo = QComboBox()
+        self.format_combo.setToolTip(tt["camera_format"])
+        self.jpeg_combo = QComboBox()
+        self.jpeg_combo.setToolTip(tt["jpeg_decode"])
+        for name, scale in DECODE_MODES.items():
+            self.jpeg_combo.addItem(name, scale)
         camera_device_settings_btn = QPushButton("Device Settings")
         camera_device_settings_btn.setToolTip(tt["cam_device"])
         sensor_layout = QVBoxLayout()
         sensor_layout.setContentsMargins(1, 6, 1, 1)
         sensor_form = QFormLayout()
         sensor_form.addRow("Camera", self.camera_combo)
+        sensor_form.addRow("Format", self.format_combo)
+        sensor_form.addRow("MJPEG Decode", self.jpeg_combo)
         sensor_layout.addWidget(self.sensor_feed_widget)
         sensor_layout.addLayout(sensor_form)
         sensor_layout.addWidget(camera_device_settings_btn)
@@ -136,9 +166,22 @@ class MainWindow(QMainWindow):  # type: ignore
         self.smoothing.setToolTip(tt["smoothing"])
         self.smoothing.setRange(0, 200)
         self.smoothing.setTickInterval(1)
+        self.channel_combo = QComboBox()
+        self.channel_combo.setToolTip(tt["channel"])
+        self.channel_combo.addItems(CHANNEL_MODES)
+        self.row_stride_spin = QSpinBox()
+        self.row_stride_spin.setToolTip(tt["row_stride"])
+        self.row_stride_spin.setRange(1, 64)
+        self.row_band_spin = QSpinBox()
+        self.row_band_spin.setToolTip(tt["row_band"])
+        self.row_band_spin.setRange(0, 9999)
+        self.row_band_spin.setSpecialValueText("All")
         analyser_form = QFormLayout()
         analyser_layout = QVBoxLayout()
         analyser_layout.setContentsMargins(1, 6, 1, 1)
+        analyser_form.addRow("Channel", self.channel_combo)
+        analyser_form.addRow("Row Stride", self.row_stride_spin)
+        analyser_form.addRow("Row Band", self.row_band_spin)
         analyser_form.addRow("Smoothing", self.smoothing)
         analyser_layout.addWidget(self.analyser_widget)
         analyser_layout.addLayout(analyser_form)
@@ -224,7 +267,7 @@ class MainWindow(QMainWindow):  # type: ignore
         for cam in self.core.get_cameras():
             self.camera_combo.addItem(cam)
 
-        self.core.set_camera(self.camera_combo.currentIndex())
+        self.camera_changed(self.camera_combo.currentIndex())
 
         # Signals
         # self.core.OnSensorFeedUpdate.connect(self.sensor_feed_widget.setPixmap)
@@ -235,6 +278,10 @@ class MainWindow(QMainWindow):  # type: ignore
         )
         self.smoothing.valueChanged.connect(lambda value: setattr(self.core.frameWorker, "analyser_smoothing", value))
         self.smoothing.valueChanged.connect(self.smoothing_value)
+        self.channel_combo.currentTextChanged.connect(lambda text: setattr(self.core.frameWorker, "channel", text))
+        self.row_stride_spin.valueChanged.connect(lambda value: setattr(self.core.frameWorker, "row_stride", value))
+        self.row_band_spin.valueChanged.connect(lambda value: setattr(self.core.frameWorker, "row_band", value))
+        self.core.frameWorker.OnProfileNoise.connect(self.profile_noise)
         self.subsamples_spin.valueChanged.connect(lambda value: setattr(self.core, "subsamples", value))
         self.outlier_spin.valueChanged.connect(lambda value: setattr(self.core, "outliers", value))
         self.units_combo.currentTextChanged.connect(self.core.set_units)
@@ -246,16 +293,24 @@ class MainWindow(QMainWindow):  # type: ignore
         self.core.OnSubsampleProgressUpdate.connect(self.subsample_progress_update)
         self.core.OnSampleComplete.connect(self.finished_subsample)
         self.core.OnSampleComplete.connect(self.update_table)
+        self.core.OnSampleComplete.connect(self.socket_server_sample_complete)
+        self.core.frameWorker.OnFrameAnalysed.connect(self.socket_dialog.server.publish_frame)
+        if self.shared_state is not None:
+            self.core.frameWorker.OnFrameAnalysed.connect(self.shared_state.publish)
         self.core.OnUnitsChanged.connect(self.update_table)
         self.core.OnUnitsChanged.connect(self.graph.set_units)
         camera_device_settings_btn.clicked.connect(self.extra_controls)
-        self.camera_combo.currentIndexChanged.connect(self.core.set_camera)
+        self.camera_combo.currentIndexChanged.connect(self.camera_changed)
+        self.format_combo.currentIndexChanged.connect(self.camera_format_changed)
+        self.jpeg_combo.currentIndexChanged.connect(
+            lambda index: setattr(self.core.frameWorker, "jpeg_scale", self.jpeg_combo.itemData(index))
+        )
         self.graph_mode_group.buttonClicked.connect(self.update_graph_mode)
         self.sample_table.itemSelectionChanged.connect(self.hightlight_sample)
 
         # New
         self.core.frameWorker.OnPixmapChanged.connect(self.sensor_feed_widget.setPixmap)
-        self.core.frameWorker.OnCentreChanged.connect(self.core.sample_worker.sample_in)
+        self.core.frameWorker.OnFrameAnalysed.connect(self.core.sample_worker.frame_in)
 
         # Trigger the state of things
         self.smoothing.setValue(50)
@@ -279,6 +334,14 @@ class MainWindow(QMainWindow):  # type: ignore
             self.outlier_spin.setValue(int(settings.value("outlier")))
         if settings.contains("units"):
             self.units_combo.setCurrentIndex(int(settings.value("units")))
+        if settings.contains("row_stride"):
+            self.row_stride_spin.setValue(int(settings.value("row_stride")))
+        if settings.contains("row_band"):
+            self.row_band_spin.setValue(int(settings.value("row_band")))
+        if settings.contains("channel"):
+            self.channel_combo.setCurrentText(settings.value("channel"))
+        if settings.contains("jpeg_decode"):
+            self.jpeg_combo.setCurrentIndex(int(settings.value("jpeg_decode")))
         if settings.contains("raw"):
             if settings.value("raw") == "true":
                 self.raw_radio.setChecked(True)
@@ -301,6 +364,36 @@ class MainWindow(QMainWindow):  # type: ignore
 
         self.status_bar.showMessage("Loading first camera", 1000)  # 3 seconds
 
+    def camera_changed(self, index: int) -> None:
+        """
+        Starts the camera with the user's saved format (if any) and lists its formats in the format combo
+        """
+        settings = QSettings("laser-level-webcam", "LaserLevelWebcam")
+        key = f"camera_format/{self.camera_combo.itemText(index)}"
+        self.core.camera_format_override = str(settings.value(key, ""))
+        self.core.set_camera(index)
+
+        self.format_combo.blockSignals(True)
+        self.format_combo.clear()
+        self.format_combo.addItem("Auto")
+        self.format_combo.addItems(self.core.get_camera_formats(index))
+        if self.core.camera_format_override:
+            self.format_combo.setCurrentText(self.core.camera_format_override)
+        self.format_combo.blockSignals(False)
+
+        if self.core.camera_format:
+            self.status_bar.showMessage(f"Camera format: {self.core.camera_format}", 3000)
+
+    def camera_format_changed(self, index: int) -> None:
+        key = "" if index <= 0 else self.format_combo.currentText()
+        self.core.set_camera_format(key)
+
+        settings = QSettings("laser-level-webcam", "LaserLevelWebcam")
+        settings.setValue(f"camera_format/{self.camera_combo.currentText()}", key)
+
+    def profile_noise(self, noise: float) -> None:
+        self.status_bar.showMessage(f"Profile noise: {noise:.3f}", 2000)
+
     def smoothing_value(self, val: float) -> None:
         self.status_bar.showMessage(f"Smoothing: {val}", 1000)  # 3 seconds
 
@@ -329,21 +422,19 @@ class MainWindow(QMainWindow):  # type: ignore
 
     def socket_server_action(self) -> None:
         """Show the dialog for the websocket server"""
-        self.socket_dialog.message_received.connect(self.socket_dialog.update_text_edit)
-        self.socket_dialog.take_sample.connect(self.sample_btn_cmd)
-        self.socket_dialog.zero.connect(self.zero_btn_cmd)
-        self.core.OnSampleComplete.connect(self.socket_server_sample_complete)
-
         self.socket_dialog.show()
 
+    def socket_zero(self, token: int) -> None:
+        self.zero_btn_cmd()
+        self.core.measurement_token = token
+
+    def socket_sample(self, token: int) -> None:
+        self.sample_btn_cmd()
+        self.core.measurement_token = token
+
     def socket_server_sample_complete(self) -> None:
-        # Zeroing out samples
-        if self.core.setting_zero_sample:
-            self.socket_dialog.send_message("ZERO_COMPLETE")
-        # Sample finished
-        else:
-            sample_val = self.core.samples[-1].y
-            self.socket_dialog.send_message(f"SAMPLE {sample_val}")
+        # Replies go to whichever client asked, samples taken from the GUI have no token and are ignored
+        self.socket_dialog.measurement_complete(self.core.last_result, self.core.measurement_token)
 
     def cycle_measurement_action(self) -> None:
         """Displays the cyclic measurement dialog"""
@@ -505,6 +596,10 @@ class MainWindow(QMainWindow):  # type: ignore
         self.settings.setValue("subsamples", self.subsamples_spin.value())
         self.settings.setValue("outlier", self.outlier_spin.value())
         self.settings.setValue("units", self.units_combo.currentIndex())
+        self.settings.setValue("jpeg_decode", self.jpeg_combo.currentIndex())
+        self.settings.setValue("channel", self.channel_combo.currentText())
+        self.settings.setValue("row_stride", self.row_stride_spin.value())
+        self.settings.setValue("row_band", self.row_band_spin.value())
         self.settings.setValue("raw", self.raw_radio.isChecked())
 
         self.settings.setValue("left_splitter", self.left_splitter.sizes())
@@ -518,6 +613,8 @@ class MainWindow(QMainWindow):  # type: ignore
         self.core.workerThread.wait()
         self.core.sampleWorkerThread.quit()
         self.core.sampleWorkerThread.wait()
+        if self.shared_state is not None:
+            self.shared_state.close()
         self.deleteLater()
         super().closeEvent(event)
 
@@ -529,6 +626,9 @@ def start() -> None:
     window = MainWindow()
 
     window.show()
+
+    # Pull in the heavy scientific modules once the event loop is running and the window is up
+    QTimer.singleShot(0, lambda: preload_modules(SENSOR_PRELOAD))
     sys.exit(app.exec())
 
 
@@ -0,0 +1,525 @@
+"""
+The line based command protocol spoken by the sensor's socket server.
+
+Every request and reply is one line of UTF-8 text terminated by a newline. TCP is a byte stream, so a read can hold
+half a command or several of them, LineBuffer reassembles the lines.
+
+Requests are a command and its arguments, optionally prefixed with a request ID that is echoed back on every reply
+to that request, so a client can send several requests without waiting (pipelining) and match the replies up:
+
+    TAKE_SAMPLE                 ->  SAMPLE 0.001234 unc=0.000051 n=10 ms=812
+    #7 TAKE_SAMPLE              ->  #7 SAMPLE 0.001234 unc=0.000051 n=10 ms=812
+    #8 TAKE_SAMPLES 3           ->  #8 SAMPLE ... i=1/3, #8 SAMPLE ... i=2/3, #8 SAMPLE ... i=3/3
+    #9 ZERO                     ->  #9 ZERO_COMPLETE unc=0.000049 n=10 ms=790
+    PING                        ->  PONG
+    BOGUS                       ->  ERROR unknown command BOGUS
+
+The value is always the second field of a SAMPLE reply, so clients that only split on spaces and read field 1
+keep working. The extra fields are key=value pairs: the uncertainty (standard error, mm), the number of
+subsamples averaged and the time in milliseconds from the sample starting to it finishing.
+
+Measurements share one camera, so they are queued and run one at a time in the order they arrived, across all
+clients. Replies always go to the client that asked.
+
+A client can also subscribe to the centre of every analysed frame, optionally limited to a rate in Hz:
+
+    #3 STREAM                   ->  #3 STREAMING rate=0 format=ndjson
+    #4 STREAM 50 bin            ->  #4 STREAMING rate=50 format=bin
+    #5 STOP_STREAM              ->  #5 STREAM_STOPPED sent=1520 dropped=3
+
+NDJSON records are one JSON object per line, the value is null until the zero has been set:
+
+    {"frame":1021,"t":5321.402113,"centre":612.41,"value":0.01532,"quality":0.87}
+
+Binary records are a 0x00 marker byte followed by STREAM_RECORD (little endian frame number, timestamp, centre,
+value and quality). Text lines never start with 0x00, so a client reads one byte to tell the two apart. Records
+are interleaved with the replies to the client's other requests.
+
+Each measurement is timed through its phases, see CommandTiming. A client can ask for the breakdown on its
+replies, and for the rolling statistics over the last STATS_WINDOW measurements from all clients:
+
+    #6 TIMING ON                ->  #6 TIMING ON
+    #7 TAKE_SAMPLE              ->  #7 SAMPLE 0.001234 unc=... ms=812 queue_ms=0.4 wait_ms=21.5 frames_ms=780.2 ...
+    #8 TIMING_STATS             ->  #8 TIMING_STATS n=100 queue_ms=0.3/1.2/4.0 wait_ms=... (median/p95/max)
+
+Frames are never held back for a subscriber. A record is skipped when it comes sooner than the subscriber's rate
+allows, and dropped when more than MAX_STREAM_BACKLOG bytes are still waiting to be written to the subscriber,
+so a slow client sees gaps in the frame numbers instead of slowing the sensor down.
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import math
+import struct
+import time
+from collections import deque
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+from src.sampling import FrameResult
+from src.sampling import SampleResult
+
+MAX_LINE_LENGTH = 1024  # longer lines are dropped, no valid command comes anywhere near this
+MAX_BATCH = 10000  # upper limit for TAKE_SAMPLES
+MAX_STREAM_BACKLOG = 64 * 1024  # bytes waiting to be sent before stream records to that client are dropped
+
+STREAM_MARKER = b"\x00"
+STREAM_RECORD = struct.Struct("<Qdddf")  # frame, timestamp, centre, value, quality
+STREAM_FORMATS = ("ndjson", "bin")
+STATS_WINDOW = 100  # measurements kept for TIMING_STATS
+
+
+class LineBuffer:
+    """
+    Reassembles newline terminated lines from a stream of byte chunks.
+
+    Example:
+    - buffer.feed(b"TAKE_SAM") -> []
+    - buffer.feed(b"PLE\\nZERO\\nPI") -> ["TAKE_SAMPLE", "ZERO"]
+    """
+
+    def __init__(self, max_length: int = MAX_LINE_LENGTH) -> None:
+        self.max_length = max_length
+        self.pending = b""
+        self.overflowed = False  # set when a line was dropped for being too long
+        self.discarding = False  # the rest of an overlong line is still coming in
+
+    def feed(self, data: bytes) -> List[str]:
+        self.pending += data
+        *lines, self.pending = self.pending.split(b"\n")
+
+        if self.discarding and lines:
+            lines.pop(0)
+            self.discarding = False
+
+        # A partial line that's already too long can't be a command, throw it away as it comes in
+        if len(self.pending) > self.max_length:
+            self.pending = b""
+            self.overflowed = True
+            self.discarding = True
+
+        result = []
+        for line in lines:
+            if len(line) > self.max_length:
+                self.overflowed = True
+                continue
+            text = line.decode("utf-8", errors="replace").strip()
+            if text:
+                result.append(text)
+        return result
+
+
+@dataclass
+class Request:
+    """
+    One parsed request line.
+
+    Attributes:
+        id (str): The request ID without the "#", empty when the client didn't send one.
+        command (str): The command, upper case.
+        args (list): Whatever followed the command.
+    """
+
+    id: str
+    command: str
+    args: List[str] = field(default_factory=list)
+
+
+def parse_request(line: str) -> Request:
+    """
+    Splits a request line into its ID, command and arguments.
+
+    Example:
+    - parse_request("#12 take_samples 5") -> Request(id="12", command="TAKE_SAMPLES", args=["5"])
+    """
+    tokens = line.split()
+    request_id = ""
+    if tokens and tokens[0].startswith("#"):
+        request_id = tokens.pop(0)[1:]
+    command = tokens.pop(0).upper() if tokens else ""
+    return Request(request_id, command, tokens)
+
+
+def format_line(request_id: str, *fields: object) -> str:
+    """
+    Builds a reply line, prefixed with the request ID if there is one.
+
+    Example:
+    - format_line("7", "SAMPLE", 0.5) -> "#7 SAMPLE 0.5\\n"
+    """
+    text = " ".join(str(f) for f in fields)
+    if request_id:
+        text = f"#{request_id} {text}"
+    return text + "\n"
+
+
+def format_result(result: SampleResult, elapsed_ms: float) -> List[str]:
+    """
+    Returns the fields describing a finished sample, see the module docstring.
+    """
+    return [f"unc={result.uncertainty:.6g}", f"n={result.subsamples}", f"ms={elapsed_ms:.0f}"]
+
+
+def encode_frame(result: FrameResult, stream_format: str) -> bytes:
+    """
+    Encodes a frame result as one stream record, see the module docstring.
+    """
+    if stream_format == "bin":
+        return STREAM_MARKER + STREAM_RECORD.pack(
+            result.frame, result.timestamp, result.centre, result.value, result.quality
+        )
+
+    record = {
+        "frame": result.frame,
+        "t": round(result.timestamp, 6),
+        "centre": round(result.centre, 3),
+        "value": None if math.isnan(result.value) else round(result.value, 6),
+        "quality": round(result.quality, 3),
+    }
+    return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+
+def decode_frame(record: bytes) -> FrameResult:
+    """
+    Decodes one stream record, an NDJSON line or a binary record with or without the marker byte.
+    """
+    if record.startswith(b"{"):
+        fields = json.loads(record)
+        value = math.nan if fields["value"] is None else fields["value"]
+        return FrameResult(fields["frame"], fields["t"], fields["centre"], value, fields["quality"])
+
+    if len(record) == STREAM_RECORD.size + 1:
+        record = record[1:]
+    return FrameResult(*STREAM_RECORD.unpack(record))
+
+
+@dataclass
+class Subscription:
+    """
+    A client's STREAM subscription.
+
+    Attributes:
+        interval (float): Minimum seconds between records, 0 for every frame.
+        format (str): One of STREAM_FORMATS.
+        next_due (float): Timestamp from which the next record can be sent.
+        sent (int): Number of records sent.
+        dropped (int): Number of records dropped because the client wasn't keeping up.
+    """
+
+    interval: float = 0.0
+    format: str = "ndjson"
+    next_due: float = -math.inf
+    sent: int = 0
+    dropped: int = 0
+
+
+class Session:
+    """
+    One connected client.
+
+    Attributes:
+        name (str): Used in the log, ex the peer address.
+        send (callable): Writes bytes to the client without blocking.
+        backlog (callable): Returns the number of bytes written but not yet sent, ex QTcpSocket.bytesToWrite.
+        buffer (LineBuffer): Reassembles the client's requests.
+        open (bool): False once the client disconnected, queued work for it is dropped.
+        subscription (Subscription): The client's STREAM subscription, None when it isn't streaming.
+        timing (bool): Add the timing breakdown to the client's replies.
+    """
+
+    def __init__(self, name: str, send: Callable[[bytes], None], backlog: Callable[[], int] = lambda: 0) -> None:
+        self.name = name
+        self.send = send
+        self.backlog = backlog
+        self.buffer = LineBuffer()
+        self.open = True
+        self.subscription: Optional[Subscription] = None
+        self.timing = False
+
+
+@dataclass
+class Job:
+    """
+    A queued measurement.
+
+    Attributes:
+        session (Session): The client that asked for it.
+        request (Request): The request it came from.
+        zero (bool): True to set the zero, False to take samples.
+        total (int): Number of samples to take.
+        done (int): Number of samples taken so far.
+        queued (float): time.monotonic() when the request was received, or the previous sample of the batch
+            finished.
+        started (float): time.monotonic() when the current sample started.
+        token (int): Identifies the current sample, see CommandDispatcher.
+    """
+
+    session: Session
+    request: Request
+    zero: bool
+    total: int = 1
+    done: int = 0
+    queued: float = field(default_factory=time.monotonic)
+    started: float = 0.0
+    token: int = 0
+
+
+@dataclass
+class CommandTiming:
+    """
+    Where the time went for one measurement, in milliseconds.
+
+    Attributes:
+        queue (float): Received to started, waiting for the measurements queued before it.
+        wait (float): Started to the arrival of the first subsample's frame. Can be slightly negative when that
+            frame was already being analysed when the sample started.
+        frames (float): First to last subsample frame, set by the frame rate and number of subsamples.
+        compute (float): Last subsample frame to the mean being computed, the analysis and averaging.
+        reply (float): Mean computed to the reply written to the client.
+        total (float): Received to the reply written.
+    """
+
+    queue: float
+    wait: float
+    frames: float
+    compute: float
+    reply: float
+    total: float
+
+    PHASES = ("queue", "wait", "frames", "compute", "reply", "total")
+
+    @classmethod
+    def from_job(cls, job: Job, result: SampleResult, sent: float) -> CommandTiming:
+        timing = result.timing
+        return cls(
+            queue=(job.started - job.queued) * 1000.0,
+            wait=(timing.first_frame - job.started) * 1000.0,
+            frames=(timing.last_frame - timing.first_frame) * 1000.0,
+            compute=(timing.computed - timing.last_frame) * 1000.0,
+            reply=(sent - timing.computed) * 1000.0,
+            total=(sent - job.queued) * 1000.0,
+        )
+
+    def fields(self, phases: tuple[str, ...] = PHASES) -> List[str]:
+        return [f"{phase}_ms={getattr(self, phase):.1f}" for phase in phases]
+
+
+class LatencyStats:
+    """
+    Rolling statistics of the last few CommandTimings.
+
+    Example:
+    - stats.fields() -> ["n=100", "queue_ms=0.3/1.2/4.0", ...] with the median/95th percentile/max of each phase
+    """
+
+    def __init__(self, window: int = STATS_WINDOW) -> None:
+        self.timings: Deque[CommandTiming] = deque(maxlen=window)
+
+    def add(self, timing: CommandTiming) -> None:
+        self.timings.append(timing)
+
+    def summary(self) -> Dict[str, tuple[float, float, float]]:
+        """Returns the median, 95th percentile and max of each phase, ignoring unknown (nan) values"""
+        summary = {}
+        for phase in CommandTiming.PHASES:
+            values = np.array([getattr(t, phase) for t in self.timings], dtype=np.float64)
+            values = values[~np.isnan(values)]
+            if values.size:
+                summary[phase] = (float(np.median(values)), float(np.percentile(values, 95)), float(values.max()))
+        return summary
+
+    def fields(self) -> List[str]:
+        fields = [f"n={len(self.timings)}"]
+        for phase, (median, p95, peak) in self.summary().items():
+            fields.append(f"{phase}_ms={median:.1f}/{p95:.1f}/{peak:.1f}")
+        return fields
+
+
+class CommandDispatcher:
+    """
+    Parses client requests, queues the measurements and routes the results back, independent of the transport.
+
+    The transport (a QTcpServer, an asyncio server, a test) creates a Session per client, passes the received
+    bytes to feed() and calls measurement_complete() when the measurement it was asked to start has finished.
+
+    Args:
+        start_measurement (callable): Called with True to start setting the zero, False to start a sample, and a
+            token the result is reported back with. Only one measurement is started at a time.
+        log (callable): Called with a line of text for the command history.
+    """
+
+    def __init__(self, start_measurement: Callable[[bool, int], None], log: Callable[[str], None] = print) -> None:
+        self.start_measurement = start_measurement
+        self.tokens = itertools.count(1)
+        self.log = log
+        self.queue: Deque[Job] = deque()
+        self.active: Optional[Job] = None
+        self.subscribers: List[Session] = []
+        self.stats = LatencyStats()
+
+    @property
+    def busy(self) -> bool:
+        return self.active is not None
+
+    def close(self, session: Session) -> None:
+        """Marks the client as gone and drops whatever it had queued"""
+        session.open = False
+        self.queue = deque(job for job in self.queue if job.session is not session)
+        if session in self.subscribers:
+            self.subscribers.remove(session)
+
+    def feed(self, session: Session, data: bytes) -> None:
+        """Handles the bytes received from a client"""
+        for line in session.buffer.feed(data):
+            self.log(f"Received ({session.name}): {line}")
+            self.handle(session, parse_request(line))
+
+        if session.buffer.overflowed:
+            session.buffer.overflowed = False
+            self.reply(session, "", "ERROR", "line too long")
+
+        self.pump()
+
+    def handle(self, session: Session, request: Request) -> None:
+        """Answers a request right away or queues the measurement for it"""
+        if request.command == "TAKE_SAMPLE":
+            self.queue.append(Job(session, request, zero=False))
+        elif request.command == "TAKE_SAMPLES":
+            try:
+                total = int(request.args[0])
+            except (IndexError, ValueError):
+                total = 0
+            if not 0 < total <= MAX_BATCH:
+                self.reply(session, request.id, "ERROR", f"TAKE_SAMPLES needs a count from 1 to {MAX_BATCH}")
+                return
+            self.queue.append(Job(session, request, zero=False, total=total))
+        elif request.command == "ZERO":
+            self.queue.append(Job(session, request, zero=True))
+        elif request.command == "PING":
+            self.reply(session, request.id, "PONG")
+        elif request.command == "TIMING":
+            option = request.args[0].upper() if request.args else ""
+            if option not in ("ON", "OFF"):
+                self.reply(session, request.id, "ERROR", "TIMING needs ON or OFF")
+                return
+            session.timing = option == "ON"
+            self.reply(session, request.id, "TIMING", option)
+        elif request.command == "TIMING_STATS":
+            self.reply(session, request.id, "TIMING_STATS", *self.stats.fields())
+        elif request.command == "STREAM":
+            self.subscribe(session, request)
+        elif request.command == "STOP_STREAM":
+            subscription = session.subscription or Subscription()
+            session.subscription = None
+            if session in self.subscribers:
+                self.subscribers.remove(session)
+            self.reply(
+                session, request.id, "STREAM_STOPPED", f"sent={subscription.sent}", f"dropped={subscription.dropped}"
+            )
+        else:
+            self.reply(session, request.id, "ERROR", "unknown command", request.command)
+
+    def subscribe(self, session: Session, request: Request) -> None:
+        """Starts or changes a client's STREAM subscription, the arguments are an optional rate and format"""
+        rate, stream_format = 0.0, "ndjson"
+        for arg in request.args:
+            if arg.lower() in STREAM_FORMATS:
+                stream_format = arg.lower()
+                continue
+            try:
+                rate = float(arg)
+            except ValueError:
+                rate = -1.0
+            if not 0 <= rate < math.inf:
+                self.reply(
+                    session, request.id, "ERROR", f"STREAM takes a rate in Hz and one of {', '.join(STREAM_FORMATS)}"
+                )
+                return
+
+        session.subscription = Subscription(interval=1.0 / rate if rate else 0.0, format=stream_format)
+        if session not in self.subscribers:
+            self.subscribers.append(session)
+        self.reply(session, request.id, "STREAMING", f"rate={rate:g}", f"format={stream_format}")
+
+    def publish(self, result: FrameResult) -> None:
+        """
+        Sends a frame result to every subscriber that is due one and keeping up. Never blocks, see the module
+        docstring for the rate limiting and dropping.
+        """
+        for session in self.subscribers:
+            subscription = session.subscription
+            if subscription is None:
+                continue
+            if result.timestamp < subscription.next_due:
+                continue
+            if session.backlog() > MAX_STREAM_BACKLOG:
+                subscription.dropped += 1
+                continue
+
+            # Step the schedule by the interval so the average rate holds with frames jittering around it
+            if result.timestamp - subscription.next_due < subscription.interval:
+                subscription.next_due += subscription.interval
+            else:
+                subscription.next_due = result.timestamp + subscription.interval
+            subscription.sent += 1
+            session.send(encode_frame(result, subscription.format))
+
+    def pump(self) -> None:
+        """Starts the next queued measurement if nothing is running"""
+        if self.active is not None or not self.queue:
+            return
+
+        self.active = self.queue.popleft()
+        self.active.started = time.monotonic()
+        self.active.token = next(self.tokens)
+        self.start_measurement(self.active.zero, self.active.token)
+
+    def measurement_complete(self, result: SampleResult, token: Optional[int] = None) -> None:
+        """
+        Reports a finished measurement back to the client that asked for it.
+
+        Measurements the dispatcher didn't start (ex from the GUI buttons) have no token or another one, and are
+        ignored.
+        """
+        job = self.active
+        if job is None or token != job.token:
+            return
+
+        now = time.monotonic()
+        elapsed_ms = (now - job.started) * 1000.0
+        job.done += 1
+        fields = format_result(result, elapsed_ms)
+        if not job.zero:
+            fields.insert(0, f"{result.value:.6g}")
+            if job.request.command == "TAKE_SAMPLES":
+                fields.append(f"i={job.done}/{job.total}")
+        if job.session.timing:
+            fields += CommandTiming.from_job(job, result, now).fields(("queue", "wait", "frames", "compute"))
+        self.reply(job.session, job.request.id, "ZERO_COMPLETE" if job.zero else "SAMPLE", *fields)
+
+        # Timed again now that the reply is written, for the log and TIMING_STATS
+        timing = CommandTiming.from_job(job, result, time.monotonic())
+        self.stats.add(timing)
+        request_id = f" #{job.request.id}" if job.request.id else ""
+        self.log(f"Timing ({job.session.name}{request_id}): {' '.join(timing.fields())}")
+
+        self.active = None
+        if job.done < job.total and job.session.open:
+            job.queued = time.monotonic()
+            self.queue.appendleft(job)  # the rest of the batch goes before anything queued after it
+        self.pump()
+
+    def reply(self, session: Session, request_id: str, *fields: object) -> None:
+        if not session.open:
+            return
+        line = format_line(request_id, *fields)
+        self.log(f"Replying ({session.name}): {line.strip()}")
+        session.send(line.encode())
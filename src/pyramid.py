@@ -0,0 +1,127 @@
+"""
+Level of detail for heightmaps too big to draw whole.
+
+Level 0 is the heightmap, every level above it averages 2 by 2 blocks of the one below (cells without a value
+don't count, a block without any has none). The graph draws the level that gives about as many cells as the view
+has room for, and when the view is zoomed in only the cells in view, which can be a more detailed level down to
+the full resolution.
+
+Every level keeps sums and counts instead of averages, so changing one cell (a sample coming in) changes one cell
+per level instead of rebuilding them.
+"""
+from __future__ import annotations
+
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+MIN_LEVEL_SIZE = 2  # no levels smaller than this along both sides
+PIXELS_PER_CELL = 16  # 4 by 4 pixels of view for every cell drawn
+
+Window = Tuple[float, float, float, float]  # x0, x1, y0, y1 in level 0 columns and rows
+
+
+def reduce_blocks(array: npt.NDArray) -> npt.NDArray:
+    """Sums 2 by 2 blocks, an odd last row or column sums alone"""
+    rows, columns = array.shape
+    padded = np.zeros((rows + rows % 2, columns + columns % 2), dtype=array.dtype)
+    padded[slice(0, rows), slice(0, columns)] = array
+    return padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).sum(axis=(1, 3))
+
+
+def block_centres(count: int, level: int) -> npt.NDArray[np.float64]:
+    """Where the cells of a level are in level 0 indices, the middle of the cells they cover"""
+    size = 2**level
+    first = np.arange(0, count, size)
+    last = np.minimum(first + size, count) - 1
+    return (first + last) / 2.0
+
+
+def cells_for_view(width: int, height: int) -> int:
+    return max(width * height // PIXELS_PER_CELL, 1)
+
+
+class HeightmapPyramid:
+    """
+    Args:
+        data: (rows, columns) heightmap, nan where there's no value.
+        version: Whatever identifies the data, see PyramidCache.
+    """
+
+    def __init__(self, data: npt.NDArray[np.float64], version: int = 0) -> None:
+        self.version = version
+        self.shape = data.shape
+        known = np.isfinite(data)
+        self.sums: List[npt.NDArray[np.float64]] = [np.where(known, data, 0.0)]
+        self.counts: List[npt.NDArray[np.int64]] = [known.astype(np.int64)]
+        while max(self.sums[-1].shape) > MIN_LEVEL_SIZE:
+            self.sums.append(reduce_blocks(self.sums[-1]))
+            self.counts.append(reduce_blocks(self.counts[-1]))
+        self.values: List[Optional[npt.NDArray[np.float64]]] = [None] * len(self.sums)
+
+    @property
+    def levels(self) -> int:
+        return len(self.sums)
+
+    def level(self, level: int) -> npt.NDArray[np.float64]:
+        """The averages of a level, nan where there's no value"""
+        values = self.values[level]
+        if values is None:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = np.where(self.counts[level] > 0, self.sums[level] / self.counts[level], np.nan)
+            self.values[level] = values
+        return values
+
+    def coordinates(self, level: int) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+        """X (column) and Y (row) of the level's cells in level 0 indices"""
+        return block_centres(self.shape[1], level), block_centres(self.shape[0], level)
+
+    def update(self, row: int, column: int, value: float) -> None:
+        """Sets one level 0 cell"""
+        old = self.sums[0][row, column] if self.counts[0][row, column] else None
+        new = value if np.isfinite(value) else None
+        delta_sum = (new or 0.0) - (old or 0.0)
+        delta_count = (new is not None) - (old is not None)
+        for level in range(self.levels):
+            cell = (row >> level, column >> level)
+            self.sums[level][cell] += delta_sum
+            self.counts[level][cell] += delta_count
+            values = self.values[level]
+            if values is not None:
+                count = self.counts[level][cell]
+                values[cell] = self.sums[level][cell] / count if count else np.nan
+
+    def select(self, cells: int, window: Optional[Window] = None) -> Tuple[int, slice, slice]:
+        """
+        The most detailed level that draws the window (all of it by default) in at most about `cells` cells.
+
+        Returns:
+            The level and the rows and columns of it that cover the window.
+        """
+        rows, columns = self.shape
+        x0, x1, y0, y1 = window or (0.0, columns - 1.0, 0.0, rows - 1.0)
+        x0, y0 = min(max(x0, 0.0), columns - 1.0), min(max(y0, 0.0), rows - 1.0)
+        x1, y1 = min(max(x1, x0), columns - 1.0), min(max(y1, y0), rows - 1.0)
+        for level in range(self.levels):
+            size = 2**level
+            row_slice = slice(int(y0) // size, int(np.ceil(y1)) // size + 1)
+            column_slice = slice(int(x0) // size, int(np.ceil(x1)) // size + 1)
+            drawn = (row_slice.stop - row_slice.start) * (column_slice.stop - column_slice.start)
+            if drawn <= cells:
+                break
+        return level, row_slice, column_slice
+
+
+class PyramidCache:
+    """Keeps the pyramid of the latest data, rebuilding it only when the data's version changes"""
+
+    def __init__(self) -> None:
+        self.pyramid: Optional[HeightmapPyramid] = None
+
+    def get(self, data: npt.NDArray[np.float64], version: int) -> HeightmapPyramid:
+        if self.pyramid is None or self.pyramid.version != version or self.pyramid.shape != data.shape:
+            self.pyramid = HeightmapPyramid(data, version)
+        return self.pyramid
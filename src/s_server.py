@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 import socket
+from typing import Dict
+from typing import Optional
 
+from PySide6.QtCore import QObject
 from PySide6.QtCore import Signal
 from PySide6.QtNetwork import QHostAddress
 from PySide6.QtNetwork import QTcpServer
@@ -16,11 +19,93 @@ from PySide6.QtWidgets import QPushButton
 from PySide6.QtWidgets import QTextEdit
 from PySide6.QtWidgets import QVBoxLayout
 
+from src.protocol import CommandDispatcher
+from src.protocol import Session
+from src.sampling import FrameResult
+from src.sampling import SampleResult
+
+
+class MeasurementServer(QObject):  # type: ignore
+    """
+    TCP server for the sensor's command protocol, see src.protocol.
+
+    Serves any number of clients at once. Measurements are requested with the take_sample and zero signals, one
+    at a time, and the owner reports the result back with measurement_complete() and the signal's token.
+
+    Attributes:
+        take_sample (Signal): Emitted with a token to start a sample.
+        zero (Signal): Emitted with a token to start setting the zero.
+        message_received (Signal): A line for the command history.
+    """
+
+    take_sample = Signal(int)
+    zero = Signal(int)
+    message_received = Signal(str)
+
+    def __init__(self, parent: Optional[QObject] = None) -> None:
+        super().__init__(parent)
+        self.server = QTcpServer(self)
+        self.server.newConnection.connect(self.new_connection)
+        self.dispatcher = CommandDispatcher(self.start_measurement, log=self.message_received.emit)
+        self.sessions: Dict[QTcpSocket, Session] = {}
+
+    def listen(self, ip: str, port: int) -> bool:
+        return bool(self.server.listen(QHostAddress(ip), port))
+
+    def port(self) -> int:
+        return int(self.server.serverPort())
+
+    def close(self) -> None:
+        self.server.close()
+        for connection in list(self.sessions):
+            connection.disconnectFromHost()
+
+    def new_connection(self) -> None:
+        while self.server.hasPendingConnections():
+            connection = self.server.nextPendingConnection()
+            name = f"{connection.peerAddress().toString()}:{connection.peerPort()}"
+            session = Session(name, connection.write, connection.bytesToWrite)
+            self.sessions[connection] = session
+
+            connection.readyRead.connect(lambda c=connection: self.receive(c))
+            connection.disconnected.connect(lambda c=connection: self.disconnected(c))
+            self.message_received.emit(f"Client connected: {name}")
+
+    def receive(self, connection: QTcpSocket) -> None:
+        session = self.sessions.get(connection)
+        if session is not None:
+            self.dispatcher.feed(session, connection.readAll().data())
+
+    def disconnected(self, connection: QTcpSocket) -> None:
+        session = self.sessions.pop(connection, None)
+        if session is not None:
+            self.dispatcher.close(session)
+            self.message_received.emit(f"Client disconnected: {session.name}")
+        connection.deleteLater()
+
+    def start_measurement(self, zero: bool, token: int) -> None:
+        if zero:
+            self.zero.emit(token)
+        else:
+            self.take_sample.emit(token)
+
+    def measurement_complete(self, result: SampleResult, token: Optional[int]) -> None:
+        """
+        Called by the owner when a measurement has finished, with the token of the take_sample or zero signal that
+        started it. Measurements started any other way have no token.
+        """
+        self.dispatcher.measurement_complete(result, token)
+
+    def publish_frame(self, result: FrameResult) -> None:
+        """Called by the owner for every analysed frame, sends it to the STREAM subscribers"""
+        if self.dispatcher.subscribers:
+            self.dispatcher.publish(result)
+
 
 class SocketWindow(QDialog):  # type: ignore
     message_received = Signal(str)
-    take_sample = Signal()
-    zero = Signal()
+    take_sample = Signal(int)
+    zero = Signal(int)
 
     def __init__(self, parent: QMainWindow):
         super().__init__(parent)
@@ -28,8 +113,10 @@ class SocketWindow(QDialog):  # type: ignore
         self.setWindowTitle("Socket Server GUI")
         self.setGeometry(100, 100, 400, 300)
 
-        self.server = QTcpServer(self)
-        self.client_connection = QTcpSocket()
+        self.server = MeasurementServer(self)
+        self.server.take_sample.connect(self.take_sample)
+        self.server.zero.connect(self.zero)
+        self.server.message_received.connect(self.message_received)
 
         layout = QVBoxLayout()
 
@@ -74,37 +161,17 @@ class SocketWindow(QDialog):  # type: ignore
         sock.close()
         self.ip_line.setText(address)
 
-    def newConnection(self) -> None:
-        self.client_connection = self.server.nextPendingConnection()
-        self.client_connection.readyRead.connect(self.receive_message)
-
     def start_server(self) -> None:
         print("Start server")
         ip = str(self.ip_line.text())
         port = int(self.port_line.text())
-        self.server.listen(QHostAddress(ip), port)
-        self.server.newConnection.connect(self.newConnection)
-        self.update_text_edit(f"Server Started at {ip}:{port}")
-
-    def receive_message(self) -> None:
-        message = self.client_connection.readAll().data().decode()
-        print(f"server recieved message: {message}")
-        if message == "TAKE_SAMPLE\n":
-            self.take_sample.emit()
-        elif message == "ZERO\n":
-            self.zero.emit()
+        if self.server.listen(ip, port):
+            self.update_text_edit(f"Server Started at {ip}:{port}")
         else:
-            self.send_message(f"Invalid command: {message}")
+            self.update_text_edit(f"Failed to start the server at {ip}:{port}: {self.server.server.errorString()}")
 
-        self.update_text_edit(f"Received: {message}")
-
-    def send_message(self, message: str) -> None:
-        if message:
-            print(f"sending message to the client {message}")
-            self.client_connection.write(f"{message}".encode())
-            self.update_text_edit(f"Replying: {message}")
-        else:
-            print(f"message is empty: {[message]}")
+    def measurement_complete(self, result: SampleResult, token: Optional[int]) -> None:
+        self.server.measurement_complete(result, token)
 
     def update_text_edit(self, message: str) -> None:
         self.history.append(message)
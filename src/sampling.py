@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Sequence
+
+import numpy as np
+
+
+@dataclass
+class SampleStats:
+    """
+    The result of averaging a set of subsamples, in pixels.
+
+    Attributes:
+        mean (float): Mean of the subsamples left after outlier removal.
+        std_err (float): Standard error of that mean, 0 with fewer than 2 subsamples.
+        count (int): Number of subsamples the mean was taken over.
+    """
+
+    mean: float
+    std_err: float
+    count: int
+
+
+@dataclass
+class SampleTiming:
+    """
+    When the phases of taking a sample happened, all time.monotonic() in seconds. nan when unknown.
+
+    Attributes:
+        first_frame (float): Arrival of the frame the first subsample came from.
+        last_frame (float): Arrival of the frame the last subsample came from.
+        computed (float): The mean of the subsamples was computed.
+    """
+
+    first_frame: float = float("nan")
+    last_frame: float = float("nan")
+    computed: float = float("nan")
+
+
+@dataclass
+class SampleResult:
+    """
+    A finished sample in physical units, as reported to socket clients.
+
+    Attributes:
+        value (float): Distance from zero in millimeters.
+        uncertainty (float): Standard error of the value in millimeters.
+        subsamples (int): Number of subsamples averaged.
+        timing (SampleTiming): When the subsamples were captured and averaged.
+    """
+
+    value: float
+    uncertainty: float
+    subsamples: int
+    timing: SampleTiming = field(default_factory=SampleTiming)
+
+
+@dataclass
+class FrameResult:
+    """
+    The laser line found in one analysed frame, as streamed to socket subscribers.
+
+    Attributes:
+        frame (int): Frame number, counting up from the first analysed frame. Gaps mean frames were dropped.
+        timestamp (float): time.monotonic() on the sensor when the frame arrived, in seconds.
+        centre (float): Centre of the laser line in sensor pixels, 0 when none was found.
+        value (float): Distance from zero in millimeters, nan until the zero has been set.
+        quality (float): Contrast of the line profile (0-1), low values mean the line is weak or missing.
+    """
+
+    frame: int
+    timestamp: float
+    centre: float
+    value: float
+    quality: float
+
+
+def subsample(result: FrameResult) -> float:
+    """
+    The centre of an analysed frame as a measurement subsample, in sensor pixels. The GUI (SampleWorker) and the
+    headless daemon both take their subsamples through here, so the same frames give the same measurement.
+    """
+    return float(result.centre)
+
+
+def trimmed_mean(samples: Sequence[float], outlier_percent: float) -> SampleStats:
+    """
+    Removes the outliers from both ends of the subsamples and averages the rest.
+
+    Args:
+    - samples (Sequence[float]): The subsamples.
+    - outlier_percent (float): Fraction (0-1) of the subsamples to remove, half from each end.
+
+    Returns:
+    - SampleStats: The mean and its standard error over the remaining subsamples.
+
+    Example:
+    - trimmed_mean([1, 2, 3, 100], 0.5) -> SampleStats(mean=2.5, std_err=0.5, count=2)
+    """
+    values = np.sort(np.asarray(samples, dtype=np.float64))
+
+    # Calculate the number of outliers to remove
+    n_outliers = int(len(values) * outlier_percent / 2.0)
+    if n_outliers > 0:
+        values = values[n_outliers:-n_outliers]
+
+    count = len(values)
+    if count == 0:
+        return SampleStats(float("nan"), float("nan"), 0)
+
+    std_err = float(np.std(values, ddof=1) / np.sqrt(count)) if count > 1 else 0.0
+    return SampleStats(float(np.mean(values)), std_err, count)
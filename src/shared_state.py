@@ -0,0 +1,239 @@
+"""
+Publishes the latest measurement in shared memory for programs on the same machine, ex the LinuxCNC driver.
+
+Reading the block takes microseconds, against a TCP round trip and a subsample cycle for TAKE_SAMPLE. The block
+is guarded by a sequence lock: the writer makes the sequence number odd, writes the fields and makes it even
+again. A reader copies the fields between two reads of the sequence number and retries if it changed or was odd.
+Readers never take a lock, so they can't slow down or block the writer.
+
+There's one writer per block, the process id in the block says which. A second sensor (ex the headless daemon
+while the GUI runs) can't open a block whose writer is still running and has to use another name.
+
+Block layout, little endian:
+
+    0   magic       4s  b"LLWC"
+    4   version     u16
+    6   (padding)
+    8   sequence    u64
+    16  frame       u64
+    24  timestamp   f64 time.monotonic() of the writer, comparable with the reader's on the same machine
+    32  centre      f64 sensor pixels
+    40  value       f64 mm from zero, nan until the zero is set
+    48  filtered    f64 value through a low pass filter, see SharedStateWriter
+    56  quality     f64
+    64  owner       u64 process id of the writer
+"""
+from __future__ import annotations
+
+import math
+import os
+import struct
+import sys
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Optional
+
+from src.sampling import FrameResult
+
+DEFAULT_NAME = "laser_level_webcam"
+MAGIC = b"LLWC"
+VERSION = 2
+
+HEADER = struct.Struct("<4sHxxQ")  # magic, version, sequence
+SEQUENCE_OFFSET = 8
+SEQUENCE = struct.Struct("<Q")
+PAYLOAD = struct.Struct("<Qddddd")  # frame, timestamp, centre, value, filtered, quality
+PAYLOAD_OFFSET = HEADER.size
+OWNER_OFFSET = PAYLOAD_OFFSET + PAYLOAD.size
+OWNER = struct.Struct("<Q")
+SIZE = OWNER_OFFSET + OWNER.size
+
+
+@dataclass
+class SharedMeasurement:
+    """
+    A consistent copy of the shared block.
+
+    Attributes:
+        frame (int): Frame number the measurement came from, 0 before the first frame.
+        timestamp (float): time.monotonic() when that frame arrived.
+        centre (float): Centre of the laser line in sensor pixels.
+        value (float): Distance from zero in millimeters, nan until the zero has been set.
+        filtered (float): The value through the writer's low pass filter.
+        quality (float): Contrast of the line profile (0-1).
+    """
+
+    frame: int
+    timestamp: float
+    centre: float
+    value: float
+    filtered: float
+    quality: float
+
+
+class SharedStateWriter:
+    """
+    Creates the shared block and publishes frame results into it.
+
+    If a block with the name is left over from a previous run that didn't shut down cleanly, it is reused.
+
+    Raises:
+        FileExistsError: When another writer that's still running has the block.
+
+    Attributes:
+        name (str): Name of the shared memory block.
+        time_constant (float): Time constant of the filter on the value in seconds, 0 to turn the filter off.
+    """
+
+    def __init__(self, name: str = DEFAULT_NAME, time_constant: float = 0.2) -> None:
+        self.name = name
+        self.time_constant = time_constant
+        try:
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+        except FileExistsError:
+            self.memory = shared_memory.SharedMemory(name=name)
+            if self.memory.size < SIZE:
+                self.memory.close()
+                raise
+            (owner,) = OWNER.unpack_from(self.memory.buf, OWNER_OFFSET)
+            if process_alive(owner):
+                self.memory.close()
+                raise FileExistsError(f"Shared memory {name} is in use by process {owner}")
+        self.buffer = self.memory.buf
+        OWNER.pack_into(self.buffer, OWNER_OFFSET, os.getpid())
+        self.sequence = 0
+        self.filtered = math.nan
+        self.last_timestamp = math.nan
+
+        HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, self.sequence)
+        self.write(SharedMeasurement(0, 0.0, 0.0, math.nan, math.nan, 0.0))
+
+    def filter(self, value: float, timestamp: float) -> float:
+        """One pole low pass filter on the value, restarted whenever the value is unknown"""
+        if math.isnan(value) or math.isnan(self.filtered) or not self.time_constant:
+            self.filtered = value
+        else:
+            alpha = 1.0 - math.exp(-max(timestamp - self.last_timestamp, 0.0) / self.time_constant)
+            self.filtered += alpha * (value - self.filtered)
+        self.last_timestamp = timestamp
+        return self.filtered
+
+    def publish(self, result: FrameResult) -> None:
+        """Publishes the result of an analysed frame, see FrameWorker.OnFrameAnalysed"""
+        filtered = self.filter(result.value, result.timestamp)
+        self.write(
+            SharedMeasurement(result.frame, result.timestamp, result.centre, result.value, filtered, result.quality)
+        )
+
+    def write(self, measurement: SharedMeasurement) -> None:
+        self.sequence += 1  # odd, readers retry until the write is finished
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, self.sequence)
+        PAYLOAD.pack_into(
+            self.buffer,
+            PAYLOAD_OFFSET,
+            measurement.frame,
+            measurement.timestamp,
+            measurement.centre,
+            measurement.value,
+            measurement.filtered,
+            measurement.quality,
+        )
+        self.sequence += 1
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self) -> None:
+        """Closes and removes the block, readers that have it open keep their mapping"""
+        (owner,) = OWNER.unpack_from(self.buffer, OWNER_OFFSET)
+        self.memory.close()
+        if owner != os.getpid():
+            return  # not ours any more, leave it to its writer
+        try:
+            self.memory.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedStateReader:
+    """
+    Reads the block published by SharedStateWriter.
+
+    Example:
+    - reader = SharedStateReader()
+    - reader.read() -> SharedMeasurement(frame=1021, timestamp=5321.40, centre=612.41, value=0.0153, ...)
+
+    Raises FileNotFoundError when the sensor isn't running, and ValueError when the block isn't one of ours.
+    """
+
+    def __init__(self, name: str = DEFAULT_NAME) -> None:
+        self.memory = attach(name)
+        self.buffer = self.memory.buf
+        magic, version, _ = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.memory.close()
+            raise ValueError(f"Shared memory {name} isn't a version {VERSION} laser level block")
+
+    def read(self, retries: int = 1000) -> Optional[SharedMeasurement]:
+        """
+        Returns a consistent copy of the latest measurement, or None if the writer kept changing it for all the
+        retries, which only happens if it is writing far faster than anything can read.
+        """
+        for _ in range(retries):
+            (before,) = SEQUENCE.unpack_from(self.buffer, SEQUENCE_OFFSET)
+            if before % 2:
+                continue
+            fields = PAYLOAD.unpack_from(self.buffer, PAYLOAD_OFFSET)
+            (after,) = SEQUENCE.unpack_from(self.buffer, SEQUENCE_OFFSET)
+            if before == after:
+                return SharedMeasurement(*fields)
+        return None
+
+    def close(self) -> None:
+        self.memory.close()
+
+
+def process_alive(pid: int) -> bool:
+    """Whether the writer with the process id is running"""
+    if pid <= 0:
+        return False
+    if sys.platform == "win32":
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32  # type: ignore
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        try:
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # someone else's process
+    return True
+
+
+def attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Opens an existing block without taking ownership of it.
+
+    Before Python 3.13 every process that opens a block registers it with its resource tracker, which removes the
+    block when that process exits. A reader must not take the sensor's block down with it, so the registration is
+    skipped.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    if sys.platform == "win32":  # no resource tracker, the block lives as long as a handle to it is open
+        return shared_memory.SharedMemory(name=name)
+
+    from multiprocessing import resource_tracker
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None  # type: ignore
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register  # type: ignore
@@ -0,0 +1,46 @@
+"""
+Keeping heavy imports (scipy, plotly) off the startup path.
+
+Modules that import them do so inside the function that needs them, not at the top of the module, so starting
+the app only pays for what the first window needs. The modules listed below are then imported on a background
+thread once the window shows (preload_modules), so the first call usually finds them already imported.
+"""
+from __future__ import annotations
+
+import importlib
+import threading
+from typing import Iterable
+
+# Modules that are imported lazily by the sensor app. Preloading them in the background after the window shows
+# means the first camera frame / first sample doesn't pay for the import either.
+SENSOR_PRELOAD = ("scipy.optimize", "scipy.stats", "scipy.interpolate")
+
+# Modules that are imported lazily by the LinuxCNC remote driver.
+DRIVER_PRELOAD = ("plotly.graph_objects", "plotly.io", "scipy.optimize", "scipy.interpolate")
+
+
+def preload_modules(modules: Iterable[str]) -> threading.Thread:
+    """
+    Imports the given modules on a daemon thread.
+
+    The import lock makes this safe to race with a lazy import on the GUI thread, whichever gets there first does
+    the work and the other one waits for it.
+
+    Args:
+    - modules (Iterable[str]): Dotted module names to import.
+
+    Returns:
+    - threading.Thread: The started thread, mostly useful for tests and benchmarks to join on.
+    """
+    names = list(modules)
+
+    def _run() -> None:
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                print(f"Failed to preload {name}: {e}")
+
+    thread = threading.Thread(target=_run, name="preload", daemon=True)
+    thread.start()
+    return thread
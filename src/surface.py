@@ -0,0 +1,224 @@
+"""
+Surface reconstruction and flatness for probe heightmaps.
+
+Points are (n, 3) arrays of X Y Z, either scattered (a CSV point list, an adaptive job) or the known cells of a
+grid (see grid_points). Everything here works on whole arrays so tens of thousands of points stay quick.
+
+Flatness is reported two ways:
+- Plane: the peak to valley of the residuals from the least squares plane, what most people compute by hand.
+- Min zone: the smallest distance between two parallel planes that hold every point, the ISO 1101 definition.
+  It's never more than the plane figure. Only the points on the convex hull can touch the zone, so the linear
+  program is solved over those.
+
+Both are measured along Z. Stretching X or Y only changes the slope of the planes, so the figures are the same in
+grid columns and rows as in mm.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+Points = npt.NDArray[np.float64]
+
+FILL_METHODS = ("None", "Linear", "Cubic", "Thin Plate")
+HULL_MIN_POINTS = 64  # below this the hull costs more than it saves
+RBF_NEIGHBORS = 64  # thin plate splines over more points than this use the nearest ones only
+
+
+@dataclass
+class Plane:
+    """z = a x + b y + c"""
+
+    a: float = 0.0
+    b: float = 0.0
+    c: float = 0.0
+
+    def __call__(self, x: npt.ArrayLike, y: npt.ArrayLike) -> npt.NDArray[np.float64]:
+        return self.a * np.asarray(x, dtype=np.float64) + self.b * np.asarray(y, dtype=np.float64) + self.c
+
+    def residuals(self, points: Points) -> npt.NDArray[np.float64]:
+        return points[:, 2] - self(points[:, 0], points[:, 1])
+
+
+def grid_points(data: npt.NDArray[np.float64], spacing: Tuple[float, float] = (1.0, 1.0)) -> Points:
+    """The (n, 3) X Y Z of the finite cells of a (rows, columns) grid, spacing is the X and Y distance"""
+    rows, columns = np.nonzero(np.isfinite(data))
+    return np.column_stack((columns * spacing[0], rows * spacing[1], data[rows, columns])).astype(np.float64)
+
+
+def best_fit_plane(points: Points) -> Plane:
+    """Least squares plane through the points"""
+    if len(points) == 0:
+        return Plane()
+    design = np.column_stack((points[:, 0], points[:, 1], np.ones(len(points))))
+    (a, b, c), *_ = np.linalg.lstsq(design, points[:, 2], rcond=None)
+    return Plane(float(a), float(b), float(c))
+
+
+def plane_flatness(points: Points, plane: Optional[Plane] = None) -> float:
+    """Peak to valley of the residuals from the plane, the least squares plane by default"""
+    if len(points) == 0:
+        return 0.0
+    residuals = (plane or best_fit_plane(points)).residuals(points)
+    return float(residuals.max() - residuals.min())
+
+
+def hull_points(points: Points) -> Points:
+    """The points on the convex hull, all of them when they don't make a solid (ex all on one plane)"""
+    if len(points) < HULL_MIN_POINTS:
+        return points
+
+    from scipy.spatial import ConvexHull
+
+    try:
+        return points[ConvexHull(points).vertices]
+    except (RuntimeError, ValueError):  # QhullError is a RuntimeError
+        return points
+
+
+def min_zone(points: Points) -> Tuple[float, Plane]:
+    """
+    Minimum zone flatness.
+
+    Returns:
+        - The distance along Z between the two planes.
+        - The plane half way between them.
+    """
+    if len(points) == 0:
+        return 0.0, Plane()
+
+    from scipy.optimize import linprog  # lazy, see src.startup
+
+    centre = points.mean(axis=0)
+    p = hull_points(points) - centre
+    # Variables a, b, low, high. Minimise high - low with low <= z - a x - b y <= high for every point.
+    ones = np.ones((len(p), 1))
+    xy = p[:, slice(0, 2)]
+    constraints = np.vstack((np.hstack((-xy, np.zeros_like(ones), -ones)), np.hstack((xy, ones, np.zeros_like(ones)))))
+    bounds = np.concatenate((-p[:, 2], p[:, 2]))
+    result = linprog([0, 0, -1, 1], A_ub=constraints, b_ub=bounds, bounds=[(None, None)] * 4, method="highs")
+    if not result.success:
+        plane = best_fit_plane(points)
+        return plane_flatness(points, plane), plane
+    a, b, low, high = result.x
+    c = centre[2] + (low + high) / 2 - a * centre[0] - b * centre[1]
+    return float(high - low), Plane(float(a), float(b), float(c))
+
+
+class FlatnessTracker:
+    """
+    Keeps the flatness figures up to date while points come in one by one.
+
+    The least squares plane is solved from running sums so adding a point doesn't refit. Both figures only depend
+    on the points on the convex hull (a linear function is largest and smallest on the hull), so the tracker keeps
+    those instead of every point: new points are added to them and the ones inside the hull are dropped again
+    whenever they have doubled, which keeps an update about as cheap as the hull is small. The min zone is only
+    solved again when the new point is outside the current zone, more points can only make the zone wider and a
+    point inside it doesn't change the answer.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.hull = np.empty((0, 3), dtype=np.float64)  # every point on the hull of the points added, and some more
+        self.pruned = 0  # hull points after the last time the points inside were dropped
+        self.count = 0
+        self.moments = np.zeros((3, 3), dtype=np.float64)  # design matrix transposed times itself
+        self.projection = np.zeros(3, dtype=np.float64)  # design matrix transposed times z
+        self.plane = Plane()
+        self.zone = 0.0
+        self.zone_plane = Plane()
+        self.low, self.high = np.inf, -np.inf  # least squares residual range
+
+    def add(self, x: float, y: float, z: float) -> None:
+        self.extend(np.array([[x, y, z]], dtype=np.float64))
+
+    def extend(self, points: Points) -> None:
+        """Adds (n, 3) points"""
+        points = points[np.isfinite(points).all(axis=1)]
+        if not len(points):
+            return
+        self.count += len(points)
+        self.hull = np.vstack((self.hull, points))
+        if len(self.hull) >= max(2 * self.pruned, HULL_MIN_POINTS):
+            self.hull = hull_points(self.hull)
+            self.pruned = len(self.hull)
+
+        design = np.column_stack((points[:, 0], points[:, 1], np.ones(len(points))))
+        self.moments += design.T @ design
+        self.projection += design.T @ points[:, 2]
+        (a, b, c), *_ = np.linalg.lstsq(self.moments, self.projection, rcond=None)
+        self.plane = Plane(float(a), float(b), float(c))
+        residuals = self.plane.residuals(self.hull)
+        self.low, self.high = float(residuals.min()), float(residuals.max())
+
+        outside = np.abs(self.zone_plane.residuals(points)) > self.zone / 2 + 1e-12
+        if outside.any():
+            self.zone, self.zone_plane = min_zone(self.hull)
+
+    @property
+    def flatness(self) -> float:
+        """Peak to valley from the least squares plane"""
+        return self.high - self.low if self.count else 0.0
+
+
+def interpolator(points: Points, method: str = "Cubic") -> Callable[[Points], npt.NDArray[np.float64]]:
+    """
+    Returns a function from (m, 2) X Y to Z through the scattered points.
+
+    Args:
+        points: (n, 3) X Y Z.
+        method: One of FILL_METHODS after "None":
+            - Linear: planes between the points' Delaunay triangles, nan outside them.
+            - Cubic: a C1 cubic (Clough-Tocher) over the same triangles, nan outside them.
+            - Thin Plate: the smoothest surface through the points, defined everywhere. Over more than
+              RBF_NEIGHBORS points each value only uses the nearest ones so large maps stay fast.
+    """
+    from scipy import interpolate
+
+    xy, z = points[:, slice(0, 2)], points[:, 2]
+    if method == "Linear":
+        return interpolate.LinearNDInterpolator(xy, z)  # type: ignore
+    if method == "Cubic":
+        return interpolate.CloughTocher2DInterpolator(xy, z)  # type: ignore
+    if method == "Thin Plate":
+        neighbors = RBF_NEIGHBORS if len(points) > RBF_NEIGHBORS else None
+        return interpolate.RBFInterpolator(xy, z, kernel="thin_plate_spline", neighbors=neighbors)  # type: ignore
+    raise ValueError(f"Unknown interpolation method {method}")
+
+
+def bicubic(data: npt.NDArray[np.float64], spacing: Tuple[float, float] = (1.0, 1.0)) -> Callable[..., npt.NDArray]:
+    """
+    An interpolating bicubic spline through a complete (rows, columns) grid, called with X and Y arrays.
+    Grids smaller than 4 along a side get the highest degree that fits.
+    """
+    from scipy.interpolate import RectBivariateSpline
+
+    rows, columns = data.shape
+    y, x = np.arange(rows) * spacing[1], np.arange(columns) * spacing[0]
+    spline = RectBivariateSpline(y, x, data, kx=min(3, rows - 1), ky=min(3, columns - 1), s=0)
+    return lambda xi, yi: spline(yi, xi, grid=False)
+
+
+def fill_grid(data: npt.NDArray[np.float64], method: str = "Cubic") -> npt.NDArray[np.float64]:
+    """The grid with its nan cells interpolated from the others, see interpolator"""
+    missing = ~np.isfinite(data)
+    if method == "None" or not missing.any() or missing.all():
+        return data
+    points = grid_points(data)
+    if len(points) < 3:
+        return data
+    rows, columns = np.nonzero(missing)
+    filled = data.copy()
+    try:
+        filled[rows, columns] = interpolator(points, method)(np.column_stack((columns, rows)).astype(np.float64))
+    except (ValueError, np.linalg.LinAlgError, RuntimeError) as e:  # ex every point on one line
+        print(f"Couldn't fill the grid: {e}")
+        return data
+    return filled
@@ -0,0 +1,184 @@
+"""
+The remote driver's surface graph as a page that is loaded once and then fed data.
+
+Rebuilding the figure as HTML and calling setHtml reloads the page and plotly.js with it for every update and
+throws away the camera. Here the page holds the plot and a few functions, and the driver calls them through
+QWebEnginePage.runJavaScript:
+
+    setSurface(z, rows, columns, x, y, xRange, yRange)
+                                    a grid, row major float64 with nan where there's no value, its X and Y and
+                                    the axis ranges
+    setPoint(row, column, value)    one cell, for samples coming in during a job
+
+The arrays are sent as base64 bytes instead of JSON, it's smaller, quicker to decode and nan survives it. Updates
+that come in faster than the page draws are merged into one Plotly.update on the next animation frame. update
+keeps the layout and uirevision keeps the camera and zoom when the plot is redrawn from scratch.
+
+Large maps are drawn at a level of detail that fits the view (see src.pyramid), which needs to know what's in
+view. The page reports that back through a QWebChannel object named "bridge" with a set_view(x0, x1, y0, y1)
+slot, a while after the camera stops moving.
+"""
+from __future__ import annotations
+
+import base64
+import json
+import math
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+PLOT_SCRIPT = """
+const plot = document.getElementById("plot");
+const layout = %(layout)s;
+const DEFAULT_DISTANCE = Math.hypot(1.25, 1.25, 1.25);  // plotly's default camera eye
+let trace = null;
+let extent = null;
+let drawn = false;
+let scheduled = false;
+let bridge = null;
+let viewTimer = null;
+
+if (typeof QWebChannel !== "undefined") {
+    new QWebChannel(qt.webChannelTransport, (channel) => {
+        bridge = channel.objects.bridge;
+    });
+}
+
+function decode(encoded) {
+    const bytes = Uint8Array.from(atob(encoded), (c) => c.charCodeAt(0));
+    return new Float64Array(bytes.buffer);
+}
+
+function visibleWindow() {
+    // Roughly the X Y the camera looks at: zooming in moves the eye closer to the centre
+    const scene = plot._fullLayout.scene;
+    const eye = scene.camera.eye;
+    const centre = scene.camera.center;
+    const distance = Math.hypot(eye.x - centre.x, eye.y - centre.y, eye.z - centre.z);
+    const fraction = Math.min(distance / DEFAULT_DISTANCE, 1);
+    const window = [];
+    for (const [range, offset, ratio] of [
+        [extent[0], centre.x, scene.aspectratio.x],
+        [extent[1], centre.y, scene.aspectratio.y],
+    ]) {
+        const span = range[1] - range[0];
+        const middle = range[0] + (offset / ratio + 0.5) * span;
+        window.push(middle - (fraction * span) / 2, middle + (fraction * span) / 2);
+    }
+    return window;
+}
+
+function viewChanged() {
+    clearTimeout(viewTimer);
+    viewTimer = setTimeout(() => {
+        if (bridge !== null && extent !== null) {
+            bridge.set_view(...visibleWindow());
+        }
+    }, 200);
+}
+
+function draw() {
+    scheduled = false;
+    const ranges = {"scene.xaxis.range": extent[0], "scene.yaxis.range": extent[1]};
+    if (drawn) {
+        Plotly.update(plot, {z: [trace.z], x: [trace.x], y: [trace.y]}, ranges);
+    } else {
+        Plotly.newPlot(plot, [trace], Object.assign({}, layout, {scene: {
+            xaxis: {range: extent[0]}, yaxis: {range: extent[1]}
+        }}), {responsive: true});
+        plot.on("plotly_relayout", viewChanged);
+        drawn = true;
+    }
+}
+
+function schedule() {
+    if (!scheduled) {
+        scheduled = true;
+        requestAnimationFrame(draw);
+    }
+}
+
+function setSurface(encoded, rows, columns, x, y, xRange, yRange) {
+    const values = decode(encoded);
+    const z = [];
+    for (let row = 0; row < rows; row++) {
+        const start = row * columns;
+        z.push(Array.from(values.subarray(start, start + columns), (v) => (Number.isNaN(v) ? null : v)));
+    }
+    trace = {type: "surface", z: z, x: Array.from(decode(x)), y: Array.from(decode(y))};
+    // The axes stay at the whole map's size when only part of it is sent, so the camera keeps its place
+    extent = [xRange, yRange];
+    schedule();
+}
+
+function setPoint(row, column, value) {
+    if (trace === null || row < 0 || column < 0 || row >= trace.z.length || column >= trace.z[row].length) {
+        return false;
+    }
+    trace.z[row][column] = value;
+    schedule();
+    return true;
+}
+"""
+
+
+def plot_layout(size: int) -> str:
+    """The figure's layout as JSON, with the dark template"""
+    import plotly.graph_objects as go  # lazy, see src.startup
+    import plotly.io as io
+    from plotly.utils import PlotlyJSONEncoder
+
+    layout = go.Layout(
+        template=io.templates["plotly_dark"],
+        title="Surface Height",
+        autosize=False,
+        width=size,
+        height=size,
+        margin=dict(l=0, r=0, b=0, t=40),
+        uirevision="keep",
+    )
+    return json.dumps(layout.to_plotly_json(), cls=PlotlyJSONEncoder)
+
+
+def surface_page(size: int) -> str:
+    """The page the graph lives in, plotly.js is loaded from next to the base URL"""
+    script = PLOT_SCRIPT % {"layout": plot_layout(size)}
+    return (
+        '<html><script src="plotly.js"></script><script src="qrc:///qtwebchannel/qwebchannel.js"></script>'
+        '<body style="background:black;margin:0">'
+        f'<div id="plot"></div><script>{script}</script></body></html>'
+    )
+
+
+def encode_grid(data: npt.NDArray[np.float64]) -> str:
+    """Row major little endian float64 bytes as base64"""
+    return base64.b64encode(np.ascontiguousarray(data, dtype="<f8").tobytes()).decode("ascii")
+
+
+def set_surface_call(
+    data: npt.NDArray[np.float64],
+    x: Optional[npt.NDArray[np.float64]] = None,
+    y: Optional[npt.NDArray[np.float64]] = None,
+    extent: Optional[Tuple[float, float, float, float]] = None,
+) -> str:
+    """
+    Args:
+        data: (rows, columns) Z.
+        x: X of the columns, 0 to columns - 1 by default.
+        y: Y of the rows, 0 to rows - 1 by default.
+        extent: X and Y range of the axes, the range of x and y by default.
+    """
+    rows, columns = data.shape
+    x = np.arange(columns, dtype=np.float64) if x is None else x
+    y = np.arange(rows, dtype=np.float64) if y is None else y
+    x0, x1, y0, y1 = extent or (float(x[0]), float(x[-1]), float(y[0]), float(y[-1]))
+    return (
+        f'setSurface("{encode_grid(data)}", {rows}, {columns}, "{encode_grid(x)}", "{encode_grid(y)}", '
+        f"[{x0!r}, {x1!r}], [{y0!r}, {y1!r}])"
+    )
+
+
+def set_point_call(row: int, column: int, value: float) -> str:
+    return f"setPoint({int(row)}, {int(column)}, {json.dumps(value) if math.isfinite(value) else 'null'})"
@@ -39,6 +39,35 @@ tooltips[
 
 Please refer to the tooltip on the Take Sample button for more information on usage. """
 
+tooltips[
+    "channel"
+] = """The colour channel the laser line is read from.
+
+Luma is the gray scale image, a weighted mix of all three channels.
+Picking the channel that matches the laser (Red for a red laser, Green for a green one) leaves out
+the noise and ambient light in the other channels, so each frame is cleaner and fewer sub samples
+are needed for the same repeatability. Max takes the brightest of the three channels per pixel.
+
+The colour channels are read from an RGB image, so on a camera running in a YUV format every frame
+is converted first, which takes more CPU than Luma."""
+
+
+tooltips[
+    "row_stride"
+] = """Only average every Nth row of the image into the luminosity profile.
+
+The profile settles well before every row is averaged, so skipping rows makes each frame cheaper
+to process (half the work at 2, a quarter at 4) for a small increase in noise. The profile noise is
+shown in the status bar so you can pick the trade-off."""
+
+
+tooltips[
+    "row_band"
+] = """Only average the middle N rows of the image into the luminosity profile. 0 uses every row.
+
+Useful to leave out the edges of the sensor or a part of the image that isn't lit by the laser."""
+
+
 tooltips[
     "smoothing"
 ] = """Smoothing is used to remove the high frequency noise in the luminosity view above.
@@ -93,6 +122,25 @@ Different cameras have different resolutions. The calculations seen in the analy
 on pixel resolution width of the camera`s sensor."""
 
 
+tooltips[
+    "camera_format"
+] = """The resolution, pixel format and frame rate the camera runs in.
+
+Auto picks the format that is cheapest to turn into a grayscale image (raw YUV before RGB before MJPEG),
+then the highest frame rate and then the widest resolution up to 1920. Pick a format here to override it,
+the choice is remembered per camera."""
+
+
+tooltips[
+    "jpeg_decode"
+] = """How MJPEG camera frames are decoded. Only used when the camera format is Jpeg.
+
+Qt decodes the full colour image and then converts it to gray scale.
+Luma decodes only the brightness of the JPEG on a couple of background threads, which is a lot cheaper.
+The 1/2, 1/4 and 1/8 options also skip the fine detail while decoding. The analyser runs on the smaller
+image so it's faster again, at the cost of some resolution."""
+
+
 tooltips[
     "table"
 ] = """This table shows all the samples and derived information on those samples in the units specified above.
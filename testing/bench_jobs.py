@@ -0,0 +1,107 @@
+"""
+Probe job benchmark on the simulated machine and sensor (see src.CNC_jobs.sim_linuxcnc and sim_sensor).
+
+Every path method in MDI mode and the Program mode run the same grid through LinuxCNCMachine and the real job
+engine, so the protocol and the G-code are the ones sent to the machine. For each one it prints:
+
+- predicted, the simulated machine time of the whole job: moves with the axes' velocity and acceleration limits,
+  a latency for every MDI command and the sensor's time for every sample.
+- estimate, what paths.estimate_time gives for the moves, without the samples, to compare with.
+- wall, how long the simulation took here.
+
+The samples are the same for every run, only the order and the protocol change.
+
+Run from the repository root:
+
+    python testing/bench_jobs.py --columns 20 --rows 10 --dist 5 --measure-time 0.35
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import List
+from typing import Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.CNC_jobs.engine import JobEngine  # noqa: E402
+from src.CNC_jobs.engine import LinuxCNCMachine  # noqa: E402
+from src.CNC_jobs.paths import estimate_time  # noqa: E402
+from src.CNC_jobs.paths import format_duration  # noqa: E402
+from src.CNC_jobs.paths import grid_points  # noqa: E402
+from src.CNC_jobs.paths import PATH_METHODS  # noqa: E402
+from src.CNC_jobs.paths import plan_path  # noqa: E402
+from src.CNC_jobs.paths import snap_to_grid  # noqa: E402
+from src.CNC_jobs.probe import probe_grid  # noqa: E402
+from src.CNC_jobs.probe import probe_program  # noqa: E402
+from src.CNC_jobs.program import grid_program  # noqa: E402
+from src.CNC_jobs.sim_linuxcnc import COMMAND_LATENCY  # noqa: E402
+from src.CNC_jobs.sim_linuxcnc import SimulatedLinuxCNC  # noqa: E402
+from src.CNC_jobs.sim_sensor import MEASURE_TIME  # noqa: E402
+from src.CNC_jobs.sim_sensor import SimulatedSensorServer  # noqa: E402
+
+
+def run_job(job: Callable[[Any], Any], latency: float, measure_time: float) -> Tuple[float, float, int]:
+    """Predicted seconds, wall seconds and the number of samples of a job"""
+    task = SimulatedLinuxCNC(command_latency=latency)
+    sensor = SimulatedSensorServer(task, lambda x, y: 0.001 * x, measure_time=measure_time)
+    engine = JobEngine(LinuxCNCMachine(poll_interval=0.001, linuxcnc_module=task, hal_module=task.hal))
+    samples: List[list] = []
+    try:
+        connected, finished = threading.Event(), threading.Event()
+        engine.connect("127.0.0.1", sensor.port, lambda _: connected.set())
+        if not connected.wait(5):
+            raise RuntimeError("the simulated sensor didn't connect")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # the engine prints every command
+            engine.start(job, samples.append, finished.set)
+            finished.wait()
+        return task.clock, time.perf_counter() - start, len(samples)
+    finally:
+        engine.close()
+        sensor.close()
+        task.close()
+
+
+def run() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--dist", type=float, default=5.0, help="mm between points")
+    parser.add_argument("--lift", type=float, default=5.0, help="mm the probe lifts between points")
+    parser.add_argument("--measure-time", type=float, default=MEASURE_TIME, help="sensor seconds per sample")
+    parser.add_argument("--latency", type=float, default=COMMAND_LATENCY, help="seconds per MDI command")
+    args = parser.parse_args()
+
+    points = grid_points(args.columns, args.rows, args.dist)
+    indices, _ = snap_to_grid(points)
+    jobs = {}
+    for method in PATH_METHODS:
+        jobs[f"MDI {method}"] = (
+            lambda job, method=method: probe_grid(job, args.columns, args.rows, args.dist, args.lift, method),
+            plan_path(points, indices, method),
+        )
+    program = grid_program(args.columns, args.rows, args.dist, args.lift)
+    jobs["Program"] = (lambda job: probe_program(job, program, indices), plan_path(points, indices, "Serpentine"))
+
+    print(f"{args.columns} x {args.rows} points {args.dist:g} mm apart")
+    for name, (job, order) in jobs.items():
+        predicted, wall, samples = run_job(job, args.latency, args.measure_time)
+        _, traverse, touch = estimate_time(points, order, args.lift)
+        print(
+            f"{name:>16}: predicted {format_duration(predicted)} ({predicted:.1f} s), "
+            f"estimate {traverse + touch:.1f} s + {samples} samples, wall {wall:.2f} s"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,92 @@
+"""
+Offline benchmark of the MJPEG decode paths on a directory of captured JPEG frames.
+
+Compares Qt's full colour decode plus grayscale conversion (what FrameWorker does by default) against the luma
+only decoder at each DCT scale, single threaded and on the decode pool.
+
+    python testing/bench_jpeg_decode.py path/to/frames --repeat 3 --workers 2
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+from typing import List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.jpeg_decode import DCT_SCALES  # noqa: E402
+from src.jpeg_decode import decode_luma  # noqa: E402
+from src.jpeg_decode import LumaDecodePool  # noqa: E402
+
+
+def qt_decode(data: bytes) -> None:
+    from PySide6.QtGui import QImage
+
+    QImage.fromData(data).convertToFormat(QImage.Format_Grayscale8)
+
+
+def time_serial(frames: List[bytes], decode: Callable[[bytes], object], repeat: int) -> float:
+    """Returns the mean milliseconds per frame"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in frames:
+            decode(data)
+    return (time.perf_counter() - start) * 1000.0 / (len(frames) * repeat)
+
+
+def time_pool(frames: List[bytes], scale: int, workers: int, repeat: int) -> float:
+    """Returns the mean milliseconds per frame with the decode pool kept full, like the frame worker does"""
+    pool = LumaDecodePool(workers=workers, scale=scale)
+    finished = threading.Semaphore(0)
+    total = len(frames) * repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in frames:
+            while pool.busy():
+                finished.acquire()
+                pool.ready()
+            pool.submit(data, finished.release)
+    while pool.pending:
+        finished.acquire()
+        pool.ready()
+    elapsed = time.perf_counter() - start
+
+    pool.shutdown()
+    return elapsed * 1000.0 / total
+
+
+def run() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("frames", type=Path, help="directory of .jpg frames")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    paths = sorted(p for p in args.frames.iterdir() if p.suffix.lower() in (".jpg", ".jpeg"))
+    if not paths:
+        sys.exit(f"No JPEG frames found in {args.frames}")
+    frames = [p.read_bytes() for p in paths]
+    print(f"{len(frames)} frames, {sum(len(f) for f in frames) / len(frames) / 1024:.0f} KiB average")
+
+    def report(name: str, ms: float) -> None:
+        print(f"{name:<28} {ms:7.2f} ms/frame {1000.0 / ms:7.1f} fps")
+
+    try:
+        report("qt rgb + grayscale", time_serial(frames, qt_decode, args.repeat))
+    except ImportError:
+        print("PySide6 not available, skipping the Qt decode")
+
+    for scale in DCT_SCALES:
+        report(f"luma 1/{scale}", time_serial(frames, lambda data: decode_luma(data, scale), args.repeat))
+    for scale in DCT_SCALES:
+        report(f"luma 1/{scale} pool x{args.workers}", time_pool(frames, scale, args.workers, args.repeat))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,163 @@
+"""
+Startup benchmark for the sensor app and the LinuxCNC remote driver.
+
+Two things are measured, each in a fresh interpreter so nothing is cached between runs:
+
+- import time, parsed from ``python -X importtime``. The slowest imports made by the entry module are listed so a
+  new heavy import at module level is easy to spot.
+- time to first frame, the wall time from launching the interpreter to the main window being painted and (for the
+  sensor app, if a camera is attached) the first camera frame reaching the sensor feed.
+
+Run from the repository root:
+
+    python testing/bench_startup.py --runs 5 --budget-ms 1500
+
+A non-zero exit code is returned when the median time to window shown is over the budget, so this can be wired
+into CI to catch startup regressions.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+TARGETS = {
+    "sensor": ("src.main", "MainWindow"),
+    "driver": ("src.linuxcnc_remote_driver", "MainWindow"),
+}
+
+# Executed in the child process. Prints a marker line with the time since launch (passed in by the parent) for each
+# stage of the startup.
+FIRST_FRAME_SCRIPT = """
+import os, sys, time
+from PySide6.QtCore import QTimer
+from PySide6.QtWidgets import QApplication
+app = QApplication(sys.argv)
+import {module} as target
+window = target.{window}()
+
+def mark(name):
+    print(f"{{name}} {{(time.time() - float(os.environ['BENCH_LAUNCH'])) * 1000.0:.1f}}", flush=True)
+
+def shown():
+    mark("SHOWN")
+    core = getattr(window, "core", None)
+    if core is None:
+        app.quit()
+        return
+    core.frameWorker.OnPixmapChanged.connect(lambda *_: (mark("FIRST_FRAME"), app.quit()))
+    QTimer.singleShot({frame_timeout}, app.quit)
+
+mark("IMPORTED")
+window.show()
+QTimer.singleShot(0, shown)
+app.exec()
+"""
+
+
+def import_times(module: str) -> Tuple[float, List[Tuple[int, str]]]:
+    """
+    Runs ``python -X importtime -c "import module"`` and parses the report.
+
+    Returns:
+    - The total import time in milliseconds and a list of (cumulative us, module) for the direct imports.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    top_level = []
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        # Format is "import time: self [us] | cumulative | imported package", skip the header
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        total_us += int(self_us)
+        # Nesting is shown by two spaces per level. Keep the imports made directly by the target module, that is
+        # where a heavy module level import shows up.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            top_level.append((int(cumulative_us), name.strip()))
+
+    top_level.sort(reverse=True)
+    return total_us / 1000.0, top_level
+
+
+def first_frame_times(module: str, window: str, frame_timeout: int) -> Dict[str, float]:
+    """
+    Launches the app and records the time for each stage, measured from the launch of the interpreter.
+
+    Returns:
+    - A dict of stage name to milliseconds. FIRST_FRAME is missing if no camera frame arrived in time.
+    """
+    script = FIRST_FRAME_SCRIPT.format(module=module, window=window, frame_timeout=frame_timeout)
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    env["BENCH_LAUNCH"] = repr(time.time())
+    proc = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, env=env)
+
+    marks = {}
+    for line in proc.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0] in ("IMPORTED", "SHOWN", "FIRST_FRAME"):
+            marks[parts[0]] = float(parts[1])
+
+    if proc.returncode != 0 or "SHOWN" not in marks:
+        print(proc.stderr)
+        raise RuntimeError(f"{module} failed to start")
+
+    return marks
+
+
+def run() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=list(TARGETS), nargs="*", default=list(TARGETS))
+    parser.add_argument("--runs", type=int, default=3, help="number of cold launches per target")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest direct imports to list")
+    parser.add_argument("--frame-timeout", type=int, default=5000, help="ms to wait for the first camera frame")
+    parser.add_argument("--budget-ms", type=float, default=0.0, help="fail if the median time to shown is over this")
+    args = parser.parse_args()
+
+    over_budget = False
+    for target in args.target:
+        module, window = TARGETS[target]
+
+        print(f"== {target} ({module}) ==")
+        total, top_level = import_times(module)
+        print(f"import time: {total:.1f} ms")
+        for cumulative, name in top_level[: args.top]:
+            print(f"  {cumulative / 1000.0:8.1f} ms  {name}")
+
+        stages: Dict[str, List[float]] = {}
+        for _ in range(args.runs):
+            for name, value in first_frame_times(module, window, args.frame_timeout).items():
+                stages.setdefault(name, []).append(value)
+
+        for name in ("IMPORTED", "SHOWN", "FIRST_FRAME"):
+            if name in stages:
+                values = stages[name]
+                print(f"{name.lower():>12}: median {statistics.median(values):.1f} ms, max {max(values):.1f} ms")
+
+        shown = statistics.median(stages["SHOWN"])
+        if args.budget_ms and shown > args.budget_ms:
+            print(f"!! {target} took {shown:.1f} ms to show, over the {args.budget_ms:.1f} ms budget")
+            over_budget = True
+
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
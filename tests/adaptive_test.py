@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import threading
+from typing import Any
+from typing import Callable
+from typing import List
+
+import numpy as np
+import pytest
+
+from src.CNC_jobs.adaptive import AdaptiveGrid
+from src.CNC_jobs.adaptive import lattice
+from src.CNC_jobs.adaptive import probe_adaptive
+from src.CNC_jobs.adaptive import split_cell
+from src.CNC_jobs.engine import DryRunMachine
+from src.CNC_jobs.engine import JobEngine
+from tests.client_test import StandInSensor
+
+Surface = Callable[[Any, Any], Any]  # column, row -> mm
+
+
+def tilted(x: Any, y: Any) -> Any:
+    return 0.01 * x - 0.003 * y
+
+
+def bowl(x: Any, y: Any) -> Any:
+    return 0.00005 * ((x - 16) ** 2 + (y - 12) ** 2)
+
+
+def bump(x: Any, y: Any) -> Any:
+    """Flat apart from a narrow bump, narrower than the coarse grid"""
+    return 0.05 * np.exp(-((x - 20) ** 2 + (y - 12) ** 2) / 8.0)
+
+
+def refine(grid: AdaptiveGrid, surface: Surface) -> int:
+    """Probes the grid until it's done, returns the number of batches"""
+    batches = 0
+    batch = grid.next_points()
+    while batch:
+        batches += 1
+        assert not set(batch) & grid.values.keys()  # never probes a point twice
+        for column, row in batch:
+            grid.add((column, row), float(surface(column, row)))
+        batch = grid.next_points()
+    return batches
+
+
+def map_error(grid: AdaptiveGrid, surface: Surface) -> float:
+    y, x = np.indices((grid.rows, grid.columns))
+    return float(np.abs(grid.map() - surface(x, y)).max())
+
+
+def test_lattice_and_split() -> None:
+    assert lattice(9, 4) == [0, 4, 8]
+    assert lattice(10, 4) == [0, 4, 8, 9]
+    assert lattice(1, 4) == [0]
+    assert split_cell((0, 0, 4, 4)) == [(0, 0, 2, 2), (0, 2, 2, 4), (2, 0, 4, 2), (2, 2, 4, 4)]
+    assert split_cell((8, 0, 9, 4)) == [(8, 0, 9, 2), (8, 2, 9, 4)]
+    assert split_cell((0, 0, 1, 1)) == [(0, 0, 1, 1)]
+
+
+def test_plane_needs_only_the_coarse_grid() -> None:
+    grid = AdaptiveGrid(33, 25, target_error=0.0005)
+    assert refine(grid, tilted) == 1
+    assert len(grid.values) == 9 * 7
+    assert map_error(grid, tilted) < 1e-12
+
+
+@pytest.mark.parametrize("surface", [bowl, bump])
+@pytest.mark.parametrize("target", [0.002, 0.0005])
+def test_reaches_the_target_with_fewer_points(surface: Surface, target: float) -> None:
+    grid = AdaptiveGrid(33, 25, target_error=target)
+    refine(grid, surface)
+    assert map_error(grid, surface) <= target
+    assert len(grid.values) < 0.5 * 33 * 25
+
+
+def test_refines_where_the_surface_bends() -> None:
+    grid = AdaptiveGrid(33, 25, target_error=0.0005)
+    refine(grid, bump)
+    y, x = np.indices((grid.rows, grid.columns))
+    near = np.hypot(x - 20, y - 12) < 8
+    probed = np.zeros(near.shape, dtype=bool)
+    for column, row in grid.values:
+        probed[row, column] = True
+    assert probed[near].mean() > 0.75
+    assert probed[~near].mean() < 0.25
+
+
+def test_budget() -> None:
+    grid = AdaptiveGrid(33, 25, target_error=0.0001, budget=100)
+    refine(grid, bump)
+    assert 63 < len(grid.values) <= 100
+    assert np.isfinite(grid.map()).all()
+
+    small = AdaptiveGrid(33, 25, budget=10)
+    refine(small, bump)
+    assert len(small.values) == 10
+
+
+def test_single_row() -> None:
+    grid = AdaptiveGrid(33, 1, target_error=0.0001)
+    refine(grid, bowl)
+    assert map_error(grid, bowl) <= 0.0001
+
+
+def test_adaptive_job() -> None:
+    sensor = StandInSensor(delay=0.001)
+    machine = DryRunMachine(delay=0.0)
+    engine = JobEngine(machine)
+    samples: List[list] = []
+    try:
+        connected, finished = threading.Event(), threading.Event()
+        engine.connect("127.0.0.1", sensor.port, lambda _: connected.set())
+        assert connected.wait(5)
+        grid = AdaptiveGrid(9, 9, target_error=0.1, budget=30)  # the stand-in's samples count up 1 mm every time
+        assert engine.start(lambda job: probe_adaptive(job, grid, 10.0, 5.0), samples.append, finished.set)
+        assert finished.wait(10)
+    finally:
+        engine.close()
+        sensor.close()
+
+    probed = len(grid.values)
+    assert 9 < probed <= 30
+    assert len(samples) == 81  # the probed points, then the rest filled in
+    assert {tuple(sample[0:2]) for sample in samples} == {(c, r) for r in range(9) for c in range(9)}
+    assert all(len(sample) == 3 for sample in samples[0:probed])
+    assert all(sample[3] is False for sample in samples[probed:])
+    assert machine.commands[-1] == "G53 G0 W0Z0"
+    assert machine.commands.count("G1 F2000 W0") == probed + 1  # and the zero
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from enum import Enum
+
+from src.camera_formats import choose_format
+from src.camera_formats import DECODE_COST
+from src.camera_formats import format_key
+from src.camera_formats import pixel_format_name
+from src.camera_formats import rank_formats
+from src.frame_ops import LUMA_FORMATS
+
+
+class PixelFormat(Enum):
+    Format_NV12 = 1
+    Format_YUYV = 2
+    Format_Jpeg = 3
+    Format_XRGB8888 = 4
+
+
+class MockSize:
+    def __init__(self, width: int, height: int) -> None:
+        self.w = width
+        self.h = height
+
+    def width(self) -> int:
+        return self.w
+
+    def height(self) -> int:
+        return self.h
+
+
+class MockFormat:
+    def __init__(self, pixel_format: PixelFormat, width: int, height: int, fps: float) -> None:
+        self.pixel_format = pixel_format
+        self.size = MockSize(width, height)
+        self.fps = fps
+
+    def pixelFormat(self) -> PixelFormat:
+        return self.pixel_format
+
+    def resolution(self) -> MockSize:
+        return self.size
+
+    def maxFrameRate(self) -> float:
+        return self.fps
+
+
+def test_pixel_format_name() -> None:
+    assert pixel_format_name(PixelFormat.Format_NV12) == "Format_NV12"
+    assert pixel_format_name("PixelFormat.Format_Jpeg") == "Format_Jpeg"
+
+
+def test_rank_prefers_cheap_decode() -> None:
+    mjpeg = MockFormat(PixelFormat.Format_Jpeg, 1920, 1080, 30)
+    rgb = MockFormat(PixelFormat.Format_XRGB8888, 1920, 1080, 30)
+    yuyv = MockFormat(PixelFormat.Format_YUYV, 1920, 1080, 30)
+    nv12 = MockFormat(PixelFormat.Format_NV12, 1920, 1080, 30)
+
+    assert rank_formats([mjpeg, rgb, yuyv, nv12]) == [nv12, yuyv, rgb, mjpeg]
+
+
+def test_rank_skips_useless_formats() -> None:
+    # Raw YUV at 5fps or a tiny resolution loses to MJPEG at a usable frame rate
+    slow_yuv = MockFormat(PixelFormat.Format_YUYV, 1920, 1080, 5)
+    tiny_yuv = MockFormat(PixelFormat.Format_YUYV, 320, 240, 30)
+    mjpeg = MockFormat(PixelFormat.Format_Jpeg, 1920, 1080, 30)
+
+    assert rank_formats([slow_yuv, tiny_yuv, mjpeg])[0] is mjpeg
+
+
+def test_rank_frame_rate_then_resolution() -> None:
+    hd_30 = MockFormat(PixelFormat.Format_YUYV, 1280, 720, 30)
+    hd_60 = MockFormat(PixelFormat.Format_YUYV, 1280, 720, 60)
+    fhd_30 = MockFormat(PixelFormat.Format_YUYV, 1920, 1080, 30)
+    uhd_30 = MockFormat(PixelFormat.Format_YUYV, 3840, 2160, 30)
+
+    assert rank_formats([hd_30, uhd_30, fhd_30, hd_60]) == [hd_60, fhd_30, uhd_30, hd_30]
+
+
+def test_choose_format_override() -> None:
+    nv12 = MockFormat(PixelFormat.Format_NV12, 1920, 1080, 30)
+    mjpeg = MockFormat(PixelFormat.Format_Jpeg, 3840, 2160, 30)
+
+    assert format_key(mjpeg) == "3840x2160 Jpeg 30fps"
+    assert choose_format([nv12, mjpeg]) is nv12
+    assert choose_format([nv12, mjpeg], override="3840x2160 Jpeg 30fps") is mjpeg
+    assert choose_format([nv12, mjpeg], override="no longer offered") is nv12
+    assert choose_format([]) is None
+
+
+def test_cheap_formats_have_a_luma_view() -> None:
+    # Ranking a format as cheap only helps if frame_ops can read its luma without a conversion
+    assert {name for name, cost in DECODE_COST.items() if cost <= 2} <= LUMA_FORMATS
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import pytest
+
+from src.CNC_jobs.checkpoint import Checkpoint
+from src.CNC_jobs.checkpoint import checkpoint_path
+from src.CNC_jobs.checkpoint import DriftError
+from src.CNC_jobs.checkpoint import job_key
+from src.CNC_jobs.checkpoint import read_records
+from src.CNC_jobs.engine import JobEngine
+from src.CNC_jobs.engine import LinuxCNCMachine
+from src.CNC_jobs.paths import grid_points
+from src.CNC_jobs.paths import plan_path
+from src.CNC_jobs.paths import snap_to_grid
+from src.CNC_jobs.probe import probe_points
+from src.CNC_jobs.probe import probe_program
+from src.CNC_jobs.program import points_program
+from src.CNC_jobs.sim_linuxcnc import SimulatedLinuxCNC
+from src.CNC_jobs.sim_sensor import SimulatedSensorServer
+
+POINTS = grid_points(4, 3, 10.0)
+INDICES, SHAPE = snap_to_grid(POINTS)
+ORDER = plan_path(POINTS, INDICES, "Serpentine")
+LIFT = 5.0
+
+
+def tilted(x: float, y: float) -> float:
+    return 0.001 * x - 0.002 * y
+
+
+def expected(index: int) -> float:
+    return 1000.0 * tilted(*POINTS[index])  # um
+
+
+def new_checkpoint(tmp_path: Path, resume: bool = True, lift: float = LIFT) -> Checkpoint:
+    return Checkpoint(checkpoint_path(tmp_path, job_key(POINTS, lift)), POINTS, INDICES, lift, resume)
+
+
+def test_checkpoint_file(tmp_path: Path) -> None:
+    checkpoint = new_checkpoint(tmp_path)
+    assert not checkpoint.resuming
+    checkpoint.zeroed(0.0, 0.0)
+    for index in ORDER[0:5]:
+        checkpoint.add(int(index), expected(index))
+    with open(checkpoint.path, "a") as f:
+        f.write('{"kind": "point", "index": 11, "va')  # the driver died writing it
+
+    resumed = new_checkpoint(tmp_path)
+    assert resumed.resuming
+    assert resumed.done == pytest.approx({int(index): expected(index) for index in ORDER[0:5]})
+    assert resumed.remaining(ORDER).tolist() == ORDER[5:].tolist()
+    assert resumed.check_points() == [int(ORDER[0]), int(ORDER[2]), int(ORDER[4])]
+
+    point = [record for record in read_records(checkpoint.path) if record["kind"] == "point"][0]
+    assert point["column"] == INDICES[ORDER[0]][0] and point["time"] > 0 and point["offset"] == 0.0
+
+    # Another lift is another job, and a job can start again
+    assert not new_checkpoint(tmp_path, lift=LIFT + 1).resuming
+    assert not new_checkpoint(tmp_path, resume=False).resuming
+    assert not new_checkpoint(tmp_path).resuming
+
+    checkpoint.finish()
+    assert not checkpoint.path.exists()
+
+
+def test_drift_check(tmp_path: Path) -> None:
+    checkpoint = new_checkpoint(tmp_path)
+    assert checkpoint.resumed([1.0, -2.0, 0.5]) == 0.5  # noise, still the best guess of the zero
+    assert checkpoint.resumed([50.0, 52.0, 49.0]) == 50.0  # the sensor lost its zero
+    with pytest.raises(DriftError):
+        checkpoint.resumed([0.0, 30.0, 60.0])  # the part moved
+    kinds = [record["kind"] for record in read_records(checkpoint.path)]
+    assert kinds == ["job", "resume", "resume", "drift"]
+    checkpoint.finish()
+    checkpoint.finish()  # there's nothing left to remove
+
+
+class Setup:
+    def __init__(self) -> None:
+        self.task = SimulatedLinuxCNC(command_latency=0.0)
+        self.sensor = SimulatedSensorServer(self.task, tilted, measure_time=0.01)
+
+    def run(self, job: Any, stop_after: Optional[int] = None) -> Dict[Tuple[int, int], float]:
+        """The samples the job reported by column and row, stopping it after some if asked to"""
+        engine = JobEngine(LinuxCNCMachine(poll_interval=0.001, linuxcnc_module=self.task, hal_module=self.task.hal))
+        samples: Dict[Tuple[int, int], float] = {}
+
+        def on_sample(sample: list) -> None:
+            samples[sample[0], sample[1]] = sample[2]
+            if stop_after is not None and len(samples) >= stop_after:
+                engine.stop()
+
+        try:
+            connected, finished = threading.Event(), threading.Event()
+            engine.connect("127.0.0.1", self.sensor.port, lambda _: connected.set())
+            assert connected.wait(5)
+            assert engine.start(job, on_sample, finished.set)
+            assert finished.wait(30)
+        finally:
+            engine.close()
+        return samples
+
+    def close(self) -> None:
+        self.sensor.close()
+        self.task.close()
+
+
+@pytest.fixture
+def setup() -> Any:
+    made = Setup()
+    yield made
+    made.close()
+
+
+def points_job(checkpoint: Checkpoint) -> Any:
+    return lambda job: probe_points(job, POINTS, INDICES, ORDER, LIFT, checkpoint)
+
+
+def test_interrupted_job_resumes(tmp_path: Path, setup: Setup) -> None:
+    setup.run(points_job(new_checkpoint(tmp_path)), stop_after=5)
+    checkpoint = new_checkpoint(tmp_path)
+    assert sorted(checkpoint.done) == sorted(ORDER[0:5].tolist())
+
+    # The sensor app was restarted, its zero is 50 um off
+    zero = setup.sensor.zero
+    setup.sensor.zero = zero - 0.05
+    samples_before = setup.sensor.samples
+
+    samples = setup.run(points_job(checkpoint))
+
+    assert setup.sensor.zero == zero - 0.05  # not zeroed again
+    assert setup.sensor.samples - samples_before == 3 + len(ORDER) - 5  # the check points and the rest
+    assert len(samples) == len(POINTS)
+    for index, (column, row) in enumerate(INDICES):
+        assert samples[column, row] == pytest.approx(expected(index))
+    assert not checkpoint.path.exists()
+
+
+def test_drift_stops_the_job(tmp_path: Path, setup: Setup) -> None:
+    setup.run(points_job(new_checkpoint(tmp_path)), stop_after=5)
+
+    setup.sensor.surface = lambda x, y: tilted(x, y) + 0.003 * x  # the part moved
+    checkpoint = new_checkpoint(tmp_path)
+    samples = setup.run(points_job(checkpoint))
+
+    assert len(samples) == 5  # only the ones from before
+    records = read_records(checkpoint.path)
+    assert records[-1]["kind"] == "drift"
+    assert len([record for record in records if record["kind"] == "point"]) == 5
+
+    # Resuming would fail the same way every time, the next run starts again
+    assert not new_checkpoint(tmp_path).resuming
+
+
+def test_program_job_resumes(tmp_path: Path, setup: Setup) -> None:
+    checkpoint = new_checkpoint(tmp_path)
+    program = points_program(POINTS, ORDER, LIFT)
+    setup.run(lambda job: probe_program(job, program, INDICES, checkpoint), stop_after=4)
+    # The program stops at its next request
+    assert 4 <= len(new_checkpoint(tmp_path).done) < len(POINTS)
+
+    checkpoint = new_checkpoint(tmp_path)
+    program = points_program(POINTS, checkpoint.remaining(ORDER), LIFT)
+    samples = setup.run(lambda job: probe_program(job, program, INDICES, checkpoint))
+
+    assert len(samples) == len(POINTS)
+    for index, (column, row) in enumerate(INDICES):
+        assert samples[column, row] == pytest.approx(expected(index))
+    assert not checkpoint.path.exists()
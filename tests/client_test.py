@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import threading
+import time
+from typing import Any
+from typing import List
+from typing import Optional
+
+import pytest
+
+from src.client import AsyncSensorClient
+from src.client import AsyncSensorPool
+from src.client import Client
+from src.client import parse_reply
+from src.client import ReplyDecoder
+from src.client import SensorClient
+from src.client import SensorError
+from src.client import SensorPool
+from src.client import SensorTimeout
+from src.protocol import CommandDispatcher
+from src.protocol import encode_frame
+from src.protocol import Session
+from src.sampling import FrameResult
+from src.sampling import SampleResult
+
+
+class StandInSensor:
+    """
+    A local server speaking the sensor's protocol, on its own thread. Measurements finish after `delay` seconds
+    with the next value from 1, 2, 3...
+    """
+
+    def __init__(self, delay: float = 0.02) -> None:
+        self.delay = delay
+        self.samples = 0
+        self.writers: List[asyncio.StreamWriter] = []
+        self.loop = asyncio.new_event_loop()
+        self.dispatcher = CommandDispatcher(self.start_measurement, log=lambda _: None)
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+
+        started = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(started,), daemon=True)
+        self.thread.start()
+        started.wait(5)
+
+    def run(self, started: threading.Event) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle_client, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        started.set()
+        self.loop.run_forever()
+
+    def start_measurement(self, zero: bool, token: int) -> None:
+        if zero:
+            self.samples = 0
+        self.loop.call_later(self.delay, self.finish, zero, token)
+
+    def finish(self, zero: bool, token: int) -> None:
+        if not zero:
+            self.samples += 1
+        self.dispatcher.measurement_complete(SampleResult(float(self.samples), 0.001, 10), token)
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = Session("client", writer.write, writer.transport.get_write_buffer_size)
+        self.writers.append(writer)
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                self.dispatcher.feed(session, data)
+        except ConnectionError:
+            pass
+        finally:
+            self.dispatcher.close(session)
+            writer.close()
+
+    def call(self, function: Any, *args: Any) -> None:
+        self.loop.call_soon_threadsafe(function, *args)
+
+    def drop_connections(self) -> None:
+        def drop() -> None:
+            for writer in self.writers:
+                writer.transport.abort()
+            self.writers.clear()
+
+        done = threading.Event()
+        self.call(lambda: (drop(), done.set()))
+        done.wait(5)
+
+    def publish(self, *results: FrameResult) -> None:
+        for result in results:
+            self.call(self.dispatcher.publish, result)
+
+    def close(self) -> None:
+        self.drop_connections()
+        self.call(self.loop.stop)
+        self.thread.join(5)
+
+
+@pytest.fixture
+def sensor() -> Any:
+    stand_in = StandInSensor()
+    yield stand_in
+    stand_in.close()
+
+
+def test_parse_reply() -> None:
+    reply = parse_reply("#4 SAMPLE 0.500000 unc=0.001000 n=10 ms=20")
+
+    assert (reply.id, reply.kind, reply.args) == ("4", "SAMPLE", ["0.500000"])
+    assert reply.value == 0.5 and reply.uncertainty == 0.001 and reply.fields["n"] == "10"
+    assert reply.line == "SAMPLE 0.500000 unc=0.001000 n=10 ms=20"
+    assert parse_reply("PONG").id == ""
+
+
+def test_reply_decoder_mixed_and_split() -> None:
+    frame = FrameResult(7, 1.5, 612.25, math.nan, 0.5)
+    data = b"#1 PONG\n" + encode_frame(frame, "bin") + encode_frame(frame, "ndjson") + b"#2 ZERO_COMPLETE\n"
+    decoder = ReplyDecoder()
+
+    items = [item for byte in range(len(data)) for item in decoder.feed(data[byte : byte + 1])]  # noqa: E203
+
+    assert [type(item).__name__ for item in items] == ["Reply", "FrameResult", "FrameResult", "Reply"]
+    assert items[1].centre == items[2].centre == 612.25 and math.isnan(items[2].value)
+    assert items[3].kind == "ZERO_COMPLETE"
+
+
+def test_pipelined_requests(sensor: StandInSensor) -> None:
+    with SensorClient("127.0.0.1", sensor.port, timeout=5) as client:
+        first = client.submit("TAKE_SAMPLE")
+        ping = client.submit("PING")
+        batch = client.submit("TAKE_SAMPLES", 3)
+
+        # PING is answered before the measurements, waiting out of order still matches replies by ID
+        assert [reply.value for reply in client.wait(batch)] == [2.0, 3.0, 4.0]
+        assert client.wait(ping)[0].kind == "PONG"
+        assert client.wait(first)[0].value == 1.0
+
+
+def test_error_and_timeout(sensor: StandInSensor) -> None:
+    sensor.delay = 0.5
+    with SensorClient("127.0.0.1", sensor.port) as client:
+        with pytest.raises(SensorError):
+            client.request("TAKE_SAMPLES", 0)
+
+        start = time.monotonic()
+        with pytest.raises(SensorTimeout):
+            client.take_sample(timeout=0.1)
+        assert time.monotonic() - start < 0.4
+
+        # The late reply to the request that timed out is dropped, not mistaken for the next one
+        sensor.delay = 0.01
+        assert client.take_sample(timeout=5).value == 2.0
+
+
+def test_reconnect(sensor: StandInSensor) -> None:
+    with SensorClient("127.0.0.1", sensor.port, timeout=5, retry_delay=0.01) as client:
+        assert client.ping() < 5
+        sensor.drop_connections()
+        assert client.take_sample().value == 1.0  # idempotent, sent again on a new connection
+        sensor.drop_connections()
+        with pytest.raises(ConnectionError):
+            client.zero()
+        assert client.zero().kind == "ZERO_COMPLETE"
+
+
+def test_connect_refused() -> None:
+    stand_in = StandInSensor()
+    port = stand_in.port
+    stand_in.call(stand_in.server.close)
+    stand_in.close()
+    time.sleep(0.05)
+
+    with pytest.raises(ConnectionError):
+        SensorClient("127.0.0.1", port, retries=2, retry_delay=0.01).connect()
+
+
+def test_stream_frames(sensor: StandInSensor) -> None:
+    frames = [FrameResult(index, index / 30.0, 100.0 + index, 0.001 * index, 0.5) for index in range(1, 4)]
+    with SensorClient("127.0.0.1", sensor.port, timeout=5) as client:
+        assert client.stream(0, "bin").kind == "STREAMING"
+        sensor.publish(*frames)
+
+        received: List[FrameResult] = []
+        deadline = time.monotonic() + 5
+        while len(received) < 3 and time.monotonic() < deadline:
+            received += client.read_frames(0.5)
+        assert received == frames
+        assert client.stop_stream().kind == "STREAM_STOPPED"
+
+
+def test_pool_measures_in_parallel() -> None:
+    sensors = {"left": StandInSensor(delay=0.3), "right": StandInSensor(delay=0.3)}
+    pool = SensorPool({name: ("127.0.0.1", stand_in.port) for name, stand_in in sensors.items()}, timeout=5)
+    try:
+        start = time.monotonic()
+        replies = pool.request_all("TAKE_SAMPLE")
+        assert time.monotonic() - start < 0.55
+        assert {name: reply[0].value for name, reply in replies.items()} == {"left": 1.0, "right": 1.0}
+    finally:
+        pool.close()
+        for stand_in in sensors.values():
+            stand_in.close()
+
+
+def test_async_client(sensor: StandInSensor) -> None:
+    async def session() -> List[Any]:
+        client = AsyncSensorClient("127.0.0.1", sensor.port, timeout=5, retry_delay=0.01)
+        samples, pong = await asyncio.gather(client.take_samples(2), client.ping())
+        sensor.drop_connections()
+        await asyncio.sleep(0.05)
+        sample = await client.take_sample()
+        with pytest.raises(SensorTimeout):
+            sensor.delay = 0.5
+            await client.take_sample(timeout=0.1)
+        await client.close()
+        return [samples, pong, sample]
+
+    samples, pong, sample = asyncio.run(asyncio.wait_for(session(), timeout=20))
+
+    assert [reply.value for reply in samples] == [1.0, 2.0]
+    assert pong < 5
+    assert sample.value == 3.0
+
+
+def test_async_pool() -> None:
+    sensors = [StandInSensor(delay=0.3) for _ in range(3)]
+
+    async def session() -> Any:
+        pool = AsyncSensorPool({str(i): ("127.0.0.1", stand_in.port) for i, stand_in in enumerate(sensors)})
+        start = time.monotonic()
+        replies = await pool.request_all("TAKE_SAMPLE")
+        elapsed = time.monotonic() - start
+        await pool.close()
+        return replies, elapsed
+
+    try:
+        replies, elapsed = asyncio.run(asyncio.wait_for(session(), timeout=20))
+    finally:
+        for stand_in in sensors:
+            stand_in.close()
+
+    assert sorted(replies) == ["0", "1", "2"]
+    assert elapsed < 0.55
+
+
+def test_legacy_client(sensor: StandInSensor) -> None:
+    client = Client()
+    assert client.connect_socket({"ip": "127.0.0.1", "port": sensor.port})
+    assert client.send_recieve("ZERO").startswith("ZERO_COMPLETE")
+    assert float(client.send_recieve("TAKE_SAMPLE").split(" ")[1]) == 1.0
+    assert client.send_recieve("TAKE_SAMPLES x").startswith("ERROR")
+    client.close_socket()
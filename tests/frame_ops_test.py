@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import numpy as np
+
+from src.frame_ops import channel_view
+from src.frame_ops import decimate_rows
+from src.frame_ops import luma_view
+from src.frame_ops import profile_noise
+from src.frame_ops import RGB32_OFFSETS
+
+
+def test_luma_view_planar() -> None:
+    # 4x2 NV12 frame with a stride of 6, followed by the interleaved chroma plane
+    y = np.arange(8, dtype=np.uint8).reshape(2, 4)
+    plane = np.zeros((2, 6), dtype=np.uint8)
+    plane[:, :4] = y
+    buffer = plane.tobytes() + bytes(6)
+
+    assert np.array_equal(luma_view(buffer, 4, 2, 6, "Format_NV12"), y)
+
+
+def test_luma_view_packed() -> None:
+    # YUYV is Y0 U Y1 V, UYVY is U Y0 V Y1
+    yuyv = np.array([[10, 1, 11, 2, 12, 3, 13, 4]], dtype=np.uint8)
+    uyvy = np.array([[1, 10, 2, 11, 3, 12, 4, 13]], dtype=np.uint8)
+
+    assert luma_view(yuyv.tobytes(), 4, 1, 8, "Format_YUYV").tolist() == [[10, 11, 12, 13]]
+    assert luma_view(uyvy.tobytes(), 4, 1, 8, "Format_UYVY").tolist() == [[10, 11, 12, 13]]
+
+
+def test_luma_view_16_bit() -> None:
+    y = np.array([[0xFF00, 0x8000]], dtype=np.uint16)
+
+    assert luma_view(y.tobytes(), 2, 1, 4, "Format_P016").tolist() == [[0xFF, 0x80]]
+
+
+def test_luma_view_unsupported() -> None:
+    assert luma_view(bytes(16), 2, 2, 8, "Format_XRGB8888") is None
+
+
+def test_channel_view() -> None:
+    pixels = np.zeros((2, 3, 4), dtype=np.uint8)
+    pixels[..., RGB32_OFFSETS["Red"]] = 200
+    pixels[..., RGB32_OFFSETS["Green"]] = 50
+    pixels[0, 0, RGB32_OFFSETS["Blue"]] = 250
+
+    red = channel_view(pixels, "Red")
+    assert red.shape == (2, 3)
+    assert np.shares_memory(red, pixels)  # a view, not a copy
+    assert (red == 200).all()
+    assert (channel_view(pixels, "Green") == 50).all()
+    assert channel_view(pixels, "Max").tolist() == [[250, 200, 200], [200, 200, 200]]
+
+
+def test_decimate_rows() -> None:
+    gray = np.arange(40, dtype=np.uint8).reshape(10, 4)
+
+    assert decimate_rows(gray).shape == (10, 4)
+    assert decimate_rows(gray, stride=4)[:, 0].tolist() == [0, 16, 32]
+    assert decimate_rows(gray, band=4)[:, 0].tolist() == [12, 16, 20, 24]
+    assert decimate_rows(gray, stride=2, band=4)[:, 0].tolist() == [12, 20]
+    assert np.shares_memory(decimate_rows(gray, stride=2, band=4), gray)
+
+
+def test_profile_noise() -> None:
+    rng = np.random.default_rng(0)
+    rows = rng.normal(100.0, 8.0, size=(400, 200))
+
+    assert abs(profile_noise(rows) - 8.0 / 20.0) < 0.05
+    # A quarter of the rows doubles the noise
+    assert abs(profile_noise(rows[::4]) / profile_noise(rows) - 2.0) < 0.2
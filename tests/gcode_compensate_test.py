@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import math
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pytest
+
+from src.gcode_compensate import arc_centre
+from src.gcode_compensate import arc_points
+from src.gcode_compensate import compensate_file
+from src.gcode_compensate import GcodeCompensator
+from src.gcode_compensate import GcodeError
+from src.heightmap_query import HeightmapQuery
+
+
+def tilted_query() -> HeightmapQuery:
+    """Heights in um, 10 um per mm along X and 0 along Y, over 0 to 20 mm"""
+    y, x = np.indices((5, 5), dtype=np.float64)
+    return HeightmapQuery(x * 5.0 * 10.0, spacing=(5.0, 5.0), method="bilinear", extrapolate="clamp")
+
+
+def run(program: str, **kwargs) -> List[str]:
+    return list(GcodeCompensator(tilted_query(), **kwargs).compensate(program.splitlines()))
+
+
+def words(line: str) -> dict:
+    return {word[0]: float(word[1:]) for word in line.split() if word[0] in "XYZ"}
+
+
+def test_lines_without_moves_pass_through() -> None:
+    program = "%\n(header)\nG21 G90\nM3 S1000\nF500\n"
+    assert run(program) == program.splitlines()
+
+
+def test_moves_before_the_position_is_known_pass_through() -> None:
+    out = run("G0 X1\nG0 Y1 Z5\nG0 X2")
+    assert out[0:2] == ["G0 X1", "G0 Y1 Z5"]
+    assert words(out[2]) == pytest.approx({"X": 2.0, "Y": 1.0, "Z": 5.02})
+
+
+def test_linear_moves_are_cut_and_compensated() -> None:
+    out = run("G0 X0 Y0 Z0\nN20 G1 X10 Y0 Z-1 F300 (cut)", max_segment=2.0)
+    assert out[0] == "G0 X0 Y0 Z0"  # where it starts from isn't known yet
+    assert out[1].startswith("N20 F300 G1 ")
+    assert len(out) == 1 + 5
+    points = [words(line) for line in out[1:]]
+    for i, point in enumerate(points, 1):
+        x = 2.0 * i
+        assert point == pytest.approx({"X": x, "Y": 0.0, "Z": -0.2 * i + 0.01 * x})
+    assert out[-1].endswith("(cut)")
+
+
+def test_rapids_are_not_cut() -> None:
+    out = run("G0 X0 Y0 Z5\nG0 X20 Y0", max_segment=1.0)
+    assert len(out) == 2
+    assert words(out[1]) == pytest.approx({"X": 20.0, "Y": 0.0, "Z": 5.2})
+
+
+def test_incremental_moves_stay_incremental() -> None:
+    out = run("G0 X0 Y0 Z0\nG91\nG1 X4 F100\nG1 X4", max_segment=2.0)
+    deltas = [words(line) for line in out[2:]]
+    assert len(deltas) == 4
+    # Every 2 mm along X climbs 0.02 mm
+    for delta in deltas:
+        assert delta == pytest.approx({"X": 2.0, "Y": 0.0, "Z": 0.02})
+
+
+def test_inches() -> None:
+    out = run("G20\nG0 X0 Y0 Z0\nG1 X0.5", max_segment=10.0)
+    # 12.7 mm along is 0.127 mm up, in inches
+    assert words(out[-1]) == pytest.approx({"X": 0.5, "Y": 0.0, "Z": 0.127 / 25.4}, abs=1e-4)
+
+
+def test_arcs() -> None:
+    out = run("G0 X10 Y0 Z0\nG3 X0 Y10 I-10 J0 F100", max_segment=1.0)
+    points = [words(line) for line in out[1:]]
+    assert len(points) == math.ceil(math.pi / 2 * 10)
+    assert out[1].startswith("F100 G1 ")
+    for point in points:
+        assert math.hypot(point["X"], point["Y"]) == pytest.approx(10.0, abs=1e-4)
+        assert point["Z"] == pytest.approx(0.01 * point["X"], abs=1e-4)
+    assert points[-1] == pytest.approx({"X": 0.0, "Y": 10.0, "Z": 0.0})
+
+
+def test_arc_geometry() -> None:
+    start, end = np.array([1.0, 0.0, 0.0]), np.array([-1.0, 0.0, 1.0])
+    # Anticlockwise from +X round through +Y, clockwise through -Y
+    assert arc_points(start, end, (0.0, 0.0), False, 0.1)[len(start) * 5][1] > 0
+    assert arc_points(start, end, (0.0, 0.0), True, 0.1)[len(start) * 5][1] < 0
+    full = arc_points(start, start, (0.0, 0.0), False, 0.5)
+    assert len(full) == math.ceil(2 * math.pi / 0.5)
+
+    assert arc_centre(np.array([0.0, 0.0]), np.array([2.0, 0.0]), 1.0, True) == pytest.approx((1.0, 0.0))
+    assert arc_centre(np.array([0.0, 0.0]), np.array([1.0, 1.0]), 1.0, True) == pytest.approx((1.0, 0.0))
+    assert arc_centre(np.array([0.0, 0.0]), np.array([1.0, 1.0]), 1.0, False) == pytest.approx((0.0, 1.0))
+    assert arc_centre(np.array([0.0, 0.0]), np.array([1.0, 1.0]), -1.0, True) == pytest.approx((0.0, 1.0))
+    with pytest.raises(ValueError):
+        arc_centre(np.array([0.0, 0.0]), np.array([5.0, 0.0]), 1.0, True)
+
+
+def test_machine_moves_forget_the_position() -> None:
+    out = run("G0 X0 Y0 Z0\nG53 G0 Z0\nG0 X5 Y5\nG0 Z1\nG0 X10")
+    assert out[1:4] == ["G53 G0 Z0", "G0 X5 Y5", "G0 Z1"]
+    assert words(out[4]) == pytest.approx({"X": 10.0, "Y": 5.0, "Z": 1.1})
+
+
+def test_full_circle_without_xyz() -> None:
+    out = run("G21 G90\nG0 X0 Y0 Z0\nG2 I3 J0 F100", max_segment=1.0)
+    pieces = [words(line) for line in out[2:]]
+    assert len(pieces) == math.ceil(2 * math.pi * 3.0)
+    assert pieces[-1] == pytest.approx({"X": 0.0, "Y": 0.0, "Z": 0.0})
+    assert max(piece["X"] for piece in pieces) == pytest.approx(6.0, abs=0.1)  # round the centre at X3
+    assert all(piece["Z"] == pytest.approx(0.01 * piece["X"], abs=1e-4) for piece in pieces)
+
+    compensator = GcodeCompensator(tilted_query())
+    assert list(compensator.compensate(["G21 G91", "G2 I3 J0 F100"]))[-1] == "G2 I3 J0 F100"
+    assert compensator.uncompensated == 1
+
+
+def test_uncompensated_moves_are_counted() -> None:
+    compensator = GcodeCompensator(tilted_query())
+    program = ["G21 G91", "G1 X1 Y1 Z-1 F100", "G1 X5"]  # never known in G91
+    assert list(compensator.compensate(program)) == program
+    assert compensator.uncompensated == 2
+
+    compensator = GcodeCompensator(tilted_query())
+    list(compensator.compensate(["G0 X0 Y0 Z0", "G92 X0", "G53 G0 Z0", "G91 G0 X1", "G90 G0 X1 Y1 Z1", "G1 X2"]))
+    assert compensator.uncompensated == 1  # only the G91 move after G53
+
+
+def test_arcs_outside_xy_fail() -> None:
+    with pytest.raises(GcodeError):
+        run("G0 X0 Y0 Z0\nG18\nG2 X1 Z1 I0.5 K0")
+
+
+def test_blocks_make_the_same_program() -> None:
+    rng = np.random.default_rng(0)
+    lines = ["G0 X0 Y0 Z1"] + [f"G1 X{x:.3f} Y{y:.3f} Z{z:.3f}" for x, y, z in rng.uniform(0, 20, (200, 3))]
+    whole = run("\n".join(lines))
+    assert run("\n".join(lines), block_lines=7) == whole
+
+
+def test_compensate_file(tmp_path: Path) -> None:
+    (tmp_path / "in.ngc").write_text("G21\nG0 X0 Y0 Z0\nG1 X3 F100\nM2\n")
+    read, written, uncompensated = compensate_file(
+        tmp_path / "in.ngc", tmp_path / "out.ngc", tilted_query(), max_segment=1.0
+    )
+    assert (read, written, uncompensated) == (4, 6, 0)
+    assert (tmp_path / "out.ngc").read_text().splitlines()[-1] == "M2"
+    assert not list(tmp_path.glob("*.partial"))
+
+
+def test_megabytes_in_seconds(tmp_path: Path) -> None:
+    rng = np.random.default_rng(1)
+    with open(tmp_path / "big.ngc", "w") as f:
+        f.write("G21 G90\nG0 X0 Y0 Z1\n")
+        for x, y in rng.uniform(0, 20, (100_000, 2)):
+            f.write(f"G1 X{x:.4f} Y{y:.4f} Z-0.1000 F600\n")
+    assert (tmp_path / "big.ngc").stat().st_size > 3_000_000
+    start = time.perf_counter()
+    compensate_file(tmp_path / "big.ngc", tmp_path / "out.ngc", tilted_query(), max_segment=1000.0)
+    assert time.perf_counter() - start < 10.0
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import subprocess
+import sys
+from typing import List
+
+import numpy as np
+
+from src.frame_ops import decimate_rows
+from src.frame_ops import find_line
+from src.frame_sources import SyntheticSource
+from src.headless import HeadlessSensor
+from src.headless import open_shared_state
+
+
+def test_synthetic_source_line() -> None:
+    source = SyntheticSource(width=320, height=48, realtime=False)
+    gray = source.render(123.4)
+
+    assert gray.shape == (48, 320) and gray.dtype == np.uint8
+    assert abs(find_line(decimate_rows(gray)).centre - 123.4) < 0.2
+
+
+def test_headless_sensor() -> None:
+    source = SyntheticSource(width=320, height=48, fps=100.0, realtime=False)
+    sensor = HeadlessSensor(source, sensor_width=3.2, subsamples=5, smoothing=0, log=lambda _: None)
+
+    async def session() -> List[bytes]:
+        port = await sensor.listen("127.0.0.1", 0)
+        frames = asyncio.ensure_future(sensor.run_frames())
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+        writer.write(b"#1 ZERO\n")
+        lines = [await reader.readline()]
+        source.centre = lambda _: 170.0  # move the line 10 pixels, 0.1 mm at this sensor width
+        writer.write(b"#2 TAKE_SAMPLES 2\n")  # the first can include a frame from before the move
+        await reader.readline()
+        lines.append(await reader.readline())
+        writer.write(b"#3 STREAM 0 ndjson\n")
+        lines += [await reader.readline() for _ in range(3)]
+
+        writer.close()
+        frames.cancel()
+        sensor.close()
+        return lines
+
+    lines = asyncio.run(asyncio.wait_for(session(), timeout=20))
+
+    assert lines[0].split()[:2] == [b"#1", b"ZERO_COMPLETE"]
+    reply = lines[1].split()
+    assert reply[:2] == [b"#2", b"SAMPLE"]
+    assert abs(float(reply[2]) - 0.1) < 0.002
+    assert b"n=5" in reply
+    assert lines[2] == b"#3 STREAMING rate=0 format=ndjson\n"
+    records = [json.loads(line) for line in lines[3:]]
+    assert records[1]["frame"] == records[0]["frame"] + 1
+    assert abs(records[0]["value"] - 0.1) < 0.002
+
+
+def test_headless_imports_no_widgets() -> None:
+    # Nor shared memory, it's Python 3.8+ and only imported when the daemon starts publishing
+    code = (
+        "import sys, src.headless, src.frame_sources; modules = ('PySide6.QtWidgets', 'matplotlib', 'plotly', "
+        "'multiprocessing.shared_memory'); print(sorted(m for m in modules if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
+
+
+def test_shared_state_failure_is_not_fatal() -> None:
+    assert open_shared_state("/not/a valid name" * 40) is None
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.heightmap_export import block_triangles
+from src.heightmap_export import count_triangles
+from src.heightmap_export import export_heightmap
+from src.heightmap_export import grid_blocks
+from src.heightmap_export import STL_DTYPE
+from src.heightmap_export import write_csv
+from src.heightmap_export import write_ply
+from src.heightmap_export import write_stl
+
+
+def sample_grid() -> np.ndarray:
+    data = np.arange(20.0).reshape(4, 5)
+    data[1, 2] = np.nan
+    return data
+
+
+def test_grid_blocks_cover_every_row_once() -> None:
+    data = np.arange(70.0).reshape(7, 10)
+    assert [start for start, _ in grid_blocks(data, rows=3)] == [0, 3, 6]
+    assert np.array_equal(np.vstack([block for _, block in grid_blocks(data, rows=3)]), data)
+
+    # Overlapping blocks share their last row with the next one and don't end in a block of just that row
+    blocks = list(grid_blocks(data, rows=3, overlap=1))
+    assert [(start, len(block)) for start, block in blocks] == [(0, 4), (3, 4)]
+    assert len(list(grid_blocks(data, rows=6, overlap=1))) == 1
+
+
+def test_csv(tmp_path: Path) -> None:
+    count = write_csv(tmp_path / "map.csv", sample_grid(), spacing=(2.0, 0.5), origin=(10.0, 1.0), z_scale=0.001)
+    assert count == 19
+    lines = (tmp_path / "map.csv").read_text().splitlines()
+    assert lines[0] == "X,Y,Z"
+    points = np.loadtxt(tmp_path / "map.csv", delimiter=",", skiprows=1)
+    assert points.shape == (19, 3)
+    assert np.allclose(points[0], [10.0, 1.0, 0.0])
+    assert np.allclose(points[7], [16.0, 1.5, 0.008])  # the nan at row 1 column 2 is skipped
+    assert np.allclose(points[-1], [18.0, 2.5, 0.019])
+
+
+def test_ply(tmp_path: Path) -> None:
+    data = sample_grid()
+    assert write_ply(tmp_path / "map.ply", data, spacing=(2.0, 0.5)) == 19
+    raw = (tmp_path / "map.ply").read_bytes()
+    header, body = raw.split(b"end_header\n")
+    assert b"format binary_little_endian 1.0" in header and b"element vertex 19" in header
+    points = np.frombuffer(body, dtype="<f8").reshape(-1, 3)
+    assert np.array_equal(points[:, 2], data[np.isfinite(data)])
+    assert np.allclose(points[5], [0.0, 0.5, 5.0])
+
+
+def test_stl_triangles(tmp_path: Path) -> None:
+    data = sample_grid()
+    # 12 cells with 2 triangles, of the 4 cells around the nan two keep one triangle and two keep none
+    known = np.isfinite(data)
+    expected = sum(
+        int(known[r, c] & known[r, c + 1] & known[r + 1, c])
+        + int(known[r, c + 1] & known[r + 1, c + 1] & known[r + 1, c])
+        for r in range(3)
+        for c in range(4)
+    )
+    assert count_triangles(data) == expected == 18
+    assert write_stl(tmp_path / "map.stl", data, spacing=(1.0, 1.0)) == 18
+
+    raw = (tmp_path / "map.stl").read_bytes()
+    assert len(raw) == 84 + 18 * STL_DTYPE.itemsize
+    assert int(np.frombuffer(raw[80:84], dtype="<u4")[0]) == 18
+    triangles = np.frombuffer(raw[84:], dtype=STL_DTYPE)
+    vertices = np.concatenate([triangles["v1"], triangles["v2"], triangles["v3"]])
+    assert np.isfinite(vertices).all()
+    assert np.allclose(np.linalg.norm(triangles["normal"], axis=1), 1.0)
+
+
+def test_stl_normals_face_up() -> None:
+    flat = np.zeros((2, 2))
+    triangles = block_triangles(0, flat, (1.0, 1.0), (0.0, 0.0), 1.0)
+    assert len(triangles) == 2
+    assert np.allclose(triangles["normal"], [0.0, 0.0, 1.0])
+
+
+def test_blocks_make_the_same_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    data = np.random.default_rng(1).normal(size=(37, 23))
+    data[data > 1.5] = np.nan
+    whole = {}
+    for suffix in (".csv", ".ply", ".stl"):
+        export_heightmap(tmp_path / f"whole{suffix}", data)
+        whole[suffix] = (tmp_path / f"whole{suffix}").read_bytes()
+
+    monkeypatch.setattr("src.heightmap_export.BLOCK_ROWS", 5)
+    monkeypatch.setattr("src.heightmap_export.grid_blocks.__defaults__", (5, 0))
+    for suffix in (".csv", ".ply", ".stl"):
+        export_heightmap(tmp_path / f"blocks{suffix}", data)
+        assert (tmp_path / f"blocks{suffix}").read_bytes() == whole[suffix]
+
+
+def test_unknown_format(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        export_heightmap(tmp_path / "map.obj", sample_grid())
+
+
+def test_large_scan_is_quick(tmp_path: Path) -> None:
+    data = np.random.default_rng(0).normal(size=(1000, 1000))
+    for suffix in (".csv", ".ply", ".stl"):
+        start = time.perf_counter()
+        export_heightmap(tmp_path / f"map{suffix}", data)
+        assert time.perf_counter() - start < 10.0, suffix
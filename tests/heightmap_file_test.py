@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.heightmap_file import Header
+from src.heightmap_file import HEADER_SIZE
+from src.heightmap_file import HeightmapFileError
+from src.heightmap_file import HeightmapWriter
+from src.heightmap_file import import_legacy
+from src.heightmap_file import import_pickle
+from src.heightmap_file import load_heightmap
+from src.heightmap_file import SAMPLE_DTYPE
+from src.heightmap_file import save_heightmap
+
+
+def test_save_and_load(tmp_path: Path) -> None:
+    data = np.arange(12.0).reshape(3, 4)
+    data[1, 2] = np.nan
+    header = Header(shape=(0, 0), spacing=(2.5, 5.0), origin=(1.0, 0.0), job={"job": "Probe Job", "Lift": 10.0})
+    save_heightmap(tmp_path / "map.llh", data, header)
+
+    heightmap = load_heightmap(tmp_path / "map.llh")
+    assert isinstance(heightmap.data, np.memmap)
+    assert np.array_equal(heightmap.data, data, equal_nan=True)
+    assert heightmap.header.shape == (3, 4) and heightmap.header.complete
+    assert heightmap.header.job == {"job": "Probe Job", "Lift": 10.0}
+    assert heightmap.header.units == {"xy": "mm", "z": "um"}
+    x, y = heightmap.positions()
+    assert x.tolist() == [1.0, 3.5, 6.0, 8.5] and y.tolist() == [0.0, 5.0, 10.0]
+    assert len(heightmap.samples) == 0
+    assert not (tmp_path / "map.llh.partial").exists()
+
+    read = load_heightmap(tmp_path / "map.llh", mmap=False)
+    assert not isinstance(read.data, np.memmap)
+    assert np.array_equal(read.data, data, equal_nan=True)
+
+
+def test_streaming_append(tmp_path: Path) -> None:
+    path = tmp_path / "job.llh"
+    writer = HeightmapWriter(path, Header(shape=(2, 3), spacing=(10.0, 10.0)), sync_interval=0.0)
+    writer.append(0, 0, 1.5, when=100.0)
+    writer.append(2, 1, -3.0, x=20.1, y=9.9, when=101.0)
+
+    # Readable half way through, without closing the writer
+    running = load_heightmap(path)
+    assert not running.header.complete
+    assert running.data[0, 0] == 1.5 and running.data[1, 2] == -3.0 and np.isnan(running.data[0, 1])
+
+    writer.append(0, 0, 2.0, when=102.0)  # probed again, the last one counts
+    writer.close()
+    done = load_heightmap(path)
+    assert done.header.complete
+    assert done.data[0, 0] == 2.0
+    assert done.samples["time"].tolist() == [100.0, 101.0, 102.0]
+    assert done.samples[1].tolist() == (101.0, 2, 1, 20.1, 9.9, -3.0)
+    assert done.samples[0]["x"] == 0.0 and done.samples[2]["y"] == 0.0
+
+
+def test_crashed_job_is_rebuilt_from_its_log(tmp_path: Path) -> None:
+    path = tmp_path / "crash.llh"
+    writer = HeightmapWriter(path, Header(shape=(2, 2)))
+    for column, row, value in [(0, 0, 1.0), (1, 0, 2.0), (1, 1, 3.0)]:
+        writer.append(column, row, value)
+    writer.file.close()  # type: ignore  # the app died, the header still says the job is running
+
+    # Died writing the grid after the last record, and half way through another record
+    with open(path, "r+b") as f:
+        f.seek(HEADER_SIZE + 3 * 8)
+        f.write(np.array([np.nan]).tobytes())
+        f.seek(0, os.SEEK_END)
+        f.write(b"\x00" * (SAMPLE_DTYPE.itemsize // 2))
+
+    heightmap = load_heightmap(path)
+    assert not heightmap.header.complete
+    assert len(heightmap.samples) == 3
+    assert np.array_equal(heightmap.data, [[1.0, 2.0], [np.nan, 3.0]], equal_nan=True)
+
+
+def test_writer_marks_failed_jobs(tmp_path: Path) -> None:
+    with pytest.raises(RuntimeError):
+        with HeightmapWriter(tmp_path / "failed.llh", Header(shape=(1, 1))) as writer:
+            writer.append(0, 0, 1.0)
+            raise RuntimeError("job failed")
+    assert not load_heightmap(tmp_path / "failed.llh").header.complete
+
+
+def test_bad_files(tmp_path: Path) -> None:
+    (tmp_path / "other.llh").write_bytes(b"something else")
+    with pytest.raises(HeightmapFileError):
+        load_heightmap(tmp_path / "other.llh")
+
+    save_heightmap(tmp_path / "short.llh", np.zeros((10, 10)))
+    with open(tmp_path / "short.llh", "r+b") as f:
+        f.truncate(HEADER_SIZE + 100)
+    with pytest.raises(HeightmapFileError):
+        load_heightmap(tmp_path / "short.llh")
+
+    with pytest.raises(ValueError):
+        Header(shape=(1, 1), job={"notes": "x" * HEADER_SIZE}).encode()
+
+
+def test_import_legacy(tmp_path: Path) -> None:
+    data = np.arange(6.0).reshape(2, 3)
+    with open(tmp_path / "old.pkl", "wb") as f:
+        pickle.dump(data, f)
+
+    target = import_legacy(tmp_path / "old.pkl")
+    assert target == tmp_path / "old.llh"
+    heightmap = load_heightmap(target)
+    assert np.array_equal(heightmap.data, data)
+    assert heightmap.header.job == {"imported_from": "old.pkl"}
+
+
+class Exploit:
+    def __reduce__(self) -> tuple:
+        return (os.system, ("echo pwned",))
+
+
+def test_import_pickle_refuses_code(tmp_path: Path) -> None:
+    with open(tmp_path / "evil.pkl", "wb") as f:
+        pickle.dump(Exploit(), f)
+    with pytest.raises(pickle.UnpicklingError):
+        import_pickle(tmp_path / "evil.pkl")
+
+    with open(tmp_path / "list.pkl", "wb") as f:
+        pickle.dump([1, 2, 3], f)
+    with pytest.raises(HeightmapFileError):
+        import_pickle(tmp_path / "list.pkl")
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import time
+
+import numpy as np
+import pytest
+
+from src.heightmap_query import HeightmapQuery
+from src.heightmap_query import QueryCache
+
+
+def grid_of(function, rows: int = 6, columns: int = 8, spacing=(2.0, 0.5), origin=(10.0, -1.0)) -> np.ndarray:
+    y, x = np.indices((rows, columns), dtype=np.float64)
+    return function(origin[0] + x * spacing[0], origin[1] + y * spacing[1])
+
+
+def test_values_at_the_nodes() -> None:
+    data = np.random.default_rng(0).normal(size=(5, 7))
+    for method in ("bilinear", "bicubic"):
+        query = HeightmapQuery(data, (2.0, 3.0), (1.0, 1.0), method)
+        y, x = np.indices(data.shape)
+        assert np.allclose(query(1.0 + x * 2.0, 1.0 + y * 3.0), data)
+
+
+def test_bilinear_is_exact_for_bilinear_surfaces() -> None:
+    def surface(x, y):
+        return 3.0 + 0.5 * x - 2.0 * y + 0.25 * x * y
+
+    query = HeightmapQuery(grid_of(surface), (2.0, 0.5), (10.0, -1.0), "bilinear")
+    x, y = np.random.default_rng(1).uniform([10.0, -1.0], [24.0, 1.5], size=(1000, 2)).T
+    assert np.allclose(query(x, y), surface(x, y))
+
+
+def test_bicubic_is_exact_for_quadratic_surfaces() -> None:
+    def surface(x, y):
+        return 1.0 + x - 0.5 * y + 0.03 * x**2 + 0.2 * x * y - 0.7 * y**2
+
+    query = HeightmapQuery(grid_of(surface), (2.0, 0.5), (10.0, -1.0), "bicubic")
+    x, y = np.random.default_rng(2).uniform([10.0, -1.0], [24.0, 1.5], size=(1000, 2)).T
+    assert np.allclose(query(x, y), surface(x, y))
+
+    # The bilinear surface cuts the corners of a curve
+    assert not np.allclose(query(x, y, method="bilinear"), surface(x, y))
+
+
+def test_bicubic_is_smooth_across_cells() -> None:
+    data = np.random.default_rng(3).normal(size=(4, 4))
+    query = HeightmapQuery(data, method="bicubic")
+    step = 1e-6
+    for edge in (1.0, 2.0):
+        left = (query(edge, 1.3) - query(edge - step, 1.3)) / step
+        right = (query(edge + step, 1.3) - query(edge, 1.3)) / step
+        assert abs(left - right) < 1e-4
+
+
+def test_extrapolation() -> None:
+    def surface(x, y):
+        return 2.0 * x + y
+
+    data = grid_of(surface, 3, 3, (1.0, 1.0), (0.0, 0.0))
+    x, y = np.array([-1.0, 3.0, 1.0]), np.array([1.0, 1.0, 5.0])
+
+    clamped = HeightmapQuery(data, extrapolate="clamp")(x, y)
+    assert np.allclose(clamped, [1.0, 5.0, 4.0])
+
+    for method in ("bilinear", "bicubic"):
+        linear = HeightmapQuery(data, method=method, extrapolate="linear")(x, y)
+        assert np.allclose(linear, surface(x, y))
+
+    values = HeightmapQuery(data, extrapolate="nan")(np.array([1.0, 3.0]), np.array([1.0, 1.0]))
+    assert values[0] == pytest.approx(3.0) and np.isnan(values[1])
+
+    with pytest.raises(ValueError):
+        HeightmapQuery(data, extrapolate="error")(x, y)
+    assert HeightmapQuery(data, extrapolate="error")(1.0, 2.0) == pytest.approx(4.0)
+
+
+def test_shapes_and_chunks(monkeypatch: pytest.MonkeyPatch) -> None:
+    data = np.random.default_rng(4).normal(size=(9, 9))
+    query = HeightmapQuery(data)
+    x, y = np.meshgrid(np.linspace(0, 8, 31), np.linspace(0, 8, 17))
+    whole = query(x, y)
+    assert whole.shape == (17, 31)
+    assert query(3.5, np.array([1.0, 2.0])).shape == (2,)
+
+    monkeypatch.setattr("src.heightmap_query.QUERY_CHUNK", 7)
+    assert np.array_equal(query(x, y), whole)
+
+
+def test_bad_grids() -> None:
+    with pytest.raises(ValueError):
+        HeightmapQuery(np.zeros((1, 5)))
+    with pytest.raises(ValueError):
+        HeightmapQuery(np.array([[0.0, np.nan], [0.0, 0.0]]))
+    with pytest.raises(ValueError):
+        HeightmapQuery(np.zeros((3, 3)), method="nearest")
+
+
+def test_cache_keeps_tables() -> None:
+    cache = QueryCache()
+    data = np.zeros((4, 4))
+    query = cache.get(data, 1)
+    table = query.table()
+    assert cache.get(data, 1, extrapolate="nan").table() is table
+    assert cache.get(data, 2) is not query
+    assert cache.get(data, 2, spacing=(2.0, 2.0)).spacing == (2.0, 2.0)
+
+
+def test_a_million_points_is_quick() -> None:
+    data = np.random.default_rng(5).normal(size=(200, 200))
+    query = HeightmapQuery(data, method="bicubic")
+    x, y = np.random.default_rng(6).uniform(0.0, 199.0, size=(2, 1_000_000))
+    query(x[:10], y[:10])
+    start = time.perf_counter()
+    query(x, y)
+    assert time.perf_counter() - start < 5.0
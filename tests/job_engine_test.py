@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any
+from typing import List
+
+import pytest
+
+from src.CNC_jobs.engine import DryRunMachine
+from src.CNC_jobs.engine import JobContext
+from src.CNC_jobs.engine import JobEngine
+from src.CNC_jobs.probe import probe_grid
+from src.CNC_jobs.probe_and_machine import probe_and_machine_grid
+from src.CNC_jobs.test_job import sample_grid
+from tests.client_test import StandInSensor
+
+
+@pytest.fixture
+def sensor() -> Any:
+    stand_in = StandInSensor(delay=0.01)
+    yield stand_in
+    stand_in.close()
+
+
+def run_job(engine: JobEngine, job: Any, timeout: float = 10.0) -> List[list]:
+    samples: List[list] = []
+    finished = threading.Event()
+    assert engine.start(job, samples.append, finished.set)
+    assert finished.wait(timeout)
+    return samples
+
+
+def connect(engine: JobEngine, port: int) -> None:
+    errors: List[Any] = []
+    connected = threading.Event()
+    engine.connect("127.0.0.1", port, lambda error: (errors.append(error), connected.set()))
+    assert connected.wait(5)
+    assert errors == [None]
+
+
+def test_probe_grid(sensor: StandInSensor) -> None:
+    machine = DryRunMachine(delay=0.002)
+    engine = JobEngine(machine)
+    try:
+        connect(engine, sensor.port)
+        samples = run_job(engine, lambda job: probe_grid(job, 3, 2, 15.0, 10.0, method="Raster"))
+    finally:
+        engine.close()
+
+    assert [sample[:2] for sample in samples] == [[0, 0], [1, 0], [2, 0], [0, 1], [1, 1], [2, 1]]
+    assert [sample[2] for sample in samples] == [1000.0 * value for value in range(1, 7)]  # in um
+    assert machine.commands[:6] == ["G64", "G53 G0 W0Z0", "G54 G0 X0Y0", "G0 W10.0", "G1 F2000 W0", "G0 W10.0"]
+    assert machine.commands[6:9] == ["G0 X0 Y0", "G1 F2000 W0", "G0 W10.0"]
+    assert machine.commands[-4] == "G0 X30 Y15"
+    assert machine.commands[-1] == "G53 G0 W0Z0"
+
+
+def test_sample_grid_cuts_nothing(sensor: StandInSensor) -> None:
+    machine = DryRunMachine(delay=0.0)
+    engine = JobEngine(machine)
+    try:
+        connect(engine, sensor.port)
+        samples = run_job(engine, lambda job: sample_grid(job, 3, 2, 5.0))
+    finally:
+        engine.close()
+
+    assert [sample[:2] for sample in samples] == [[0, 0], [1, 0], [2, 0], [0, 1], [1, 1], [2, 1]]
+    assert machine.commands == ["G64"] + [f"G0 X{x} Y{y}" for y in (0, 5) for x in (0, 5, 10)]
+
+
+def test_job_waits_without_spinning(sensor: StandInSensor) -> None:
+    sensor.delay = 0.05
+    engine = JobEngine(DryRunMachine(delay=0.05))
+    try:
+        connect(engine, sensor.port)
+        wall, cpu = time.perf_counter(), time.process_time()
+        run_job(engine, lambda job: probe_and_machine_grid(job, 2, 2, 1.0))
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    finally:
+        engine.close()
+
+    assert wall > 1.0  # 4 samples and 28 moves
+    assert cpu < 0.25 * wall
+
+
+def test_stop_and_restart(sensor: StandInSensor) -> None:
+    engine = JobEngine(DryRunMachine(delay=0.01))
+
+    async def forever(job: JobContext) -> None:
+        while True:
+            await job.move("G0 X0")
+
+    try:
+        connect(engine, sensor.port)
+        finished = threading.Event()
+        assert engine.start(forever, lambda _: None, finished.set)
+        assert not engine.start(forever, lambda _: None, finished.set)  # one job at a time
+        time.sleep(0.05)
+        engine.stop()
+        assert finished.wait(5)
+
+        assert len(run_job(engine, lambda job: probe_grid(job, 1, 1, 1.0, 1.0))) == 1
+    finally:
+        engine.close()
+
+
+def test_start_without_sensor() -> None:
+    engine = JobEngine(DryRunMachine())
+    try:
+        assert not engine.start(lambda job: probe_grid(job, 1, 1, 1.0, 1.0), lambda _: None, lambda: None)
+    finally:
+        engine.close()
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import io
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.frame_ops import find_line
+from src.frame_ops import to_sensor_pixels
+from src.jpeg_decode import decode_luma
+from src.jpeg_decode import decode_luma_sized
+from src.jpeg_decode import LumaDecodePool
+
+
+def make_jpeg(width: int = 64, height: int = 48) -> bytes:
+    rgb = np.zeros((height, width, 3), dtype=np.uint8)
+    rgb[:, 20:28] = (255, 40, 40)  # a red laser line
+    buffer = io.BytesIO()
+    Image.fromarray(rgb).save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def test_decode_luma_matches_full_decode() -> None:
+    data = make_jpeg()
+    luma = decode_luma(data)
+    full = np.asarray(Image.open(io.BytesIO(data)).convert("L"))
+
+    assert luma.shape == (48, 64)
+    assert luma.dtype == np.uint8
+    # Chroma upsampling in the full decode smears the colour into the pixel either side of the line, away from
+    # the edges both decodes agree
+    diff = np.abs(luma.astype(int) - full.astype(int))
+    diff[:, [19, 28]] = 0
+    assert diff.max() <= 2
+
+
+def test_decode_luma_scaled() -> None:
+    assert decode_luma(make_jpeg(), scale=4).shape == (12, 16)
+
+
+def test_pool_keeps_order() -> None:
+    frames = [make_jpeg(width=16 * (i + 1)) for i in range(4)]
+    pool = LumaDecodePool(workers=2)
+    done = threading.Semaphore(0)
+
+    for i, data in enumerate(frames):
+        pool.submit(data, done.release, timestamp=float(i))
+    for _ in frames:
+        assert done.acquire(timeout=10)
+
+    ready = pool.ready()
+    assert [frame.shape[1] for _, frame, _ in ready] == [16, 32, 48, 64]
+    assert [size for _, _, size in ready] == [(48, 16), (48, 32), (48, 48), (48, 64)]
+    assert [timestamp for timestamp, _, _ in ready] == [0.0, 1.0, 2.0, 3.0]
+    pool.shutdown()
+
+
+def make_line_jpeg(centre: float, width: int = 256, height: int = 40) -> bytes:
+    """A vertical Gaussian laser line across the width"""
+    x = np.arange(width)
+    profile = 20 + 200 * np.exp(-(((x - centre) / 6.0) ** 2))
+    gray = np.tile(profile, (height, 1)).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(gray).save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def test_decode_luma_sized_rounds_up() -> None:
+    gray, size = decode_luma_sized(make_line_jpeg(100.0, width=255, height=41), scale=2)
+    assert size == (41, 255)
+    assert gray.shape == (21, 128)
+
+
+@pytest.mark.parametrize("centre", [101.3, 133.7])
+@pytest.mark.parametrize("smoothing", [0, 2])
+def test_centres_agree_across_decode_scales(centre: float, smoothing: int) -> None:
+    data = make_line_jpeg(centre)
+    centres = {}
+    for scale in (1, 2):
+        gray, _ = decode_luma_sized(data, scale)
+        line = find_line(gray, smoothing, scale)
+        centres[scale] = to_sensor_pixels(line.centre, scale, smoothing)
+    # Positions are on the smoothed profile, which starts smoothing pixels in
+    assert centres[1] == pytest.approx(centre - smoothing, abs=0.05)
+    # Half a sensor pixel is the bias of mapping pixel i of the half size image to sensor pixel 2 * i
+    assert centres[2] == pytest.approx(centres[1], abs=0.1)
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.CNC_jobs.paths import estimate_time
+from src.CNC_jobs.paths import grid_points
+from src.CNC_jobs.paths import load_points_csv
+from src.CNC_jobs.paths import move_lengths
+from src.CNC_jobs.paths import move_time
+from src.CNC_jobs.paths import nearest_neighbour_order
+from src.CNC_jobs.paths import plan_path
+from src.CNC_jobs.paths import snap_to_grid
+from src.CNC_jobs.paths import two_opt
+
+
+def test_grid_orders() -> None:
+    points = grid_points(3, 2, 10.0)
+    indices, shape = snap_to_grid(points)
+
+    assert shape == (2, 3)
+    assert indices[plan_path(points, indices, "Raster")].tolist() == [[0, 0], [1, 0], [2, 0], [0, 1], [1, 1], [2, 1]]
+    assert indices[plan_path(points, indices, "Serpentine")].tolist() == [
+        [0, 0],
+        [1, 0],
+        [2, 0],
+        [2, 1],
+        [1, 1],
+        [0, 1],
+    ]
+
+
+def test_serpentine_beats_raster_on_20x20() -> None:
+    points = grid_points(20, 20, 15.0)
+    indices, _ = snap_to_grid(points)
+
+    raster = move_lengths(points, plan_path(points, indices, "Raster")).sum()
+    serpentine = move_lengths(points, plan_path(points, indices, "Serpentine")).sum()
+    shortest = move_lengths(points, plan_path(points, indices, "Shortest")).sum()
+
+    assert serpentine == pytest.approx(399 * 15.0)  # every move is one step
+    assert shortest == pytest.approx(serpentine)
+    assert raster > 1.8 * serpentine
+
+
+def test_two_opt_improves_nearest_neighbour() -> None:
+    points = np.random.default_rng(1).uniform(0, 300, (150, 2))
+    indices, _ = snap_to_grid(points)
+
+    greedy = nearest_neighbour_order(points)
+    improved = two_opt(points, greedy)
+    order = plan_path(points, indices, "Shortest")
+
+    assert sorted(improved.tolist()) == list(range(150))
+    assert move_lengths(points, improved).sum() < 0.95 * move_lengths(points, greedy).sum()
+    assert move_lengths(points, order).sum() < 0.25 * move_lengths(points, plan_path(points, indices, "Raster")).sum()
+
+
+def test_load_points_csv(tmp_path: Path) -> None:
+    path = tmp_path / "points.csv"
+    path.write_text("x,y,note\n0,0,corner\n10.5,0\n\n0,20\n10.5,20.00001\n")
+
+    points = load_points_csv(path)
+    indices, shape = snap_to_grid(points)
+
+    assert points.tolist() == [[0, 0], [10.5, 0], [0, 20], [10.5, 20.00001]]
+    assert shape == (2, 2)
+    assert indices.tolist() == [[0, 0], [1, 0], [0, 1], [1, 1]]
+
+    path.write_text("0,0\nbad\n")
+    with pytest.raises(ValueError):
+        load_points_csv(path)
+
+
+def test_estimate_time() -> None:
+    # 3000 mm/min is 50 mm/s, reached after 2.5 mm at 500 mm/s^2
+    assert move_time(100.0) == pytest.approx(100.0 / 50.0 + 0.1)
+    assert move_time(1.0) == pytest.approx(2.0 * np.sqrt(1.0 / 500.0))
+
+    points = grid_points(2, 1, 100.0)
+    length, traverse, touch = estimate_time(points, np.array([0, 1]), lift=10.0)
+    assert length == 100.0
+    assert traverse == pytest.approx(float(move_time(0.0) + move_time(100.0)))
+    assert touch > 0
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Any
+from typing import List
+
+import numpy as np
+import pytest
+
+from src.CNC_jobs.engine import JobEngine
+from src.CNC_jobs.paths import grid_points
+from src.CNC_jobs.paths import plan_path
+from src.CNC_jobs.paths import snap_to_grid
+from src.CNC_jobs.probe import probe_program
+from src.CNC_jobs.program import grid_program
+from src.CNC_jobs.program import points_program
+from src.CNC_jobs.program import program_header
+from src.CNC_jobs.program import ProgramAborted
+from src.CNC_jobs.simulator import Expressions
+from src.CNC_jobs.simulator import SimulatedController
+from tests.client_test import StandInSensor
+
+
+def run(controller: SimulatedController, program: str, delay: float = 0.0) -> List[int]:
+    requests: List[int] = []
+
+    async def on_request(index: int) -> None:
+        requests.append(index)
+        await asyncio.sleep(delay)
+
+    asyncio.run(asyncio.wait_for(controller.run_program(program, on_request), timeout=20))
+    return requests
+
+
+def test_expressions() -> None:
+    expressions = Expressions({"#<_lift>": 10.0}, {"#<row>": 3.0, "#1": 2.0})
+
+    assert expressions.evaluate("[#<row> * 4 + #1]") == 14.0
+    assert expressions.evaluate("[[#<row> MOD 2] EQ 1]") == 1.0
+    assert expressions.evaluate("[-#<_lift> + 2 ** 3 / 4]") == -8.0
+    assert expressions.evaluate("[#<row> LT 3 OR #1 GE 2]") == 1.0
+    with pytest.raises(ValueError):
+        expressions.evaluate("[#<missing>]")
+
+
+@pytest.mark.parametrize("serpentine", [True, False])
+def test_grid_program_visits_the_planned_path(serpentine: bool) -> None:
+    points = grid_points(4, 3, 15.0)
+    indices, _ = snap_to_grid(points)
+    order = plan_path(points, indices, "Serpentine" if serpentine else "Raster")
+    controller = SimulatedController()
+
+    requests = run(controller, grid_program(4, 3, 15.0, 10.0, serpentine))
+
+    assert requests == [-1] + order.tolist()
+    touches = [(x, y) for _, x, y, _, w in controller.positions[:-1] if w == 0.0]  # the last move is W0 Z0 home
+    assert touches == [(0.0, 0.0)] + [tuple(point) for point in points[order]]
+    assert controller.position["W"] == 0.0 and controller.log[-1][1] == "M2"
+
+
+def test_points_program_and_timing() -> None:
+    points = np.array([[0.0, 0.0], [30.0, 5.5], [12.5, 40.0]])
+    controller = SimulatedController()
+
+    requests = run(controller, points_program(points, np.array([2, 0, 1]), 5.0, dwell=0.5))
+
+    assert requests == [-1, 2, 0, 1]
+    dwells = [clock for clock, line in controller.log if line.startswith("G4")]
+    assert len(dwells) == 4
+    touch_downs = [clock for clock, x, y, z, w in controller.positions if w == 0.0]
+    # Every sample is taken after the dwell that follows touching down
+    assert all(dwell == pytest.approx(touch) for dwell, touch in zip(dwells, touch_downs))
+    assert controller.clock > 4 * 0.5
+
+
+def test_program_aborts_without_sample() -> None:
+    program = "\n".join(program_header(1.0, timeout=0.05) + ["M2"])
+    controller = SimulatedController()
+
+    with pytest.raises(ProgramAborted, match="no sample"):
+        run(controller, program, delay=0.5)
+
+
+def test_probe_program_job() -> None:
+    sensor = StandInSensor(delay=0.005)
+    controller = SimulatedController()
+    engine = JobEngine(controller)
+    points = grid_points(3, 2, 10.0)
+    indices, _ = snap_to_grid(points)
+    samples: List[Any] = []
+    try:
+        connected, finished = threading.Event(), threading.Event()
+        engine.connect("127.0.0.1", sensor.port, lambda _: connected.set())
+        assert connected.wait(5)
+        assert engine.start(
+            lambda job: probe_program(job, grid_program(3, 2, 10.0, 5.0), indices), samples.append, finished.set
+        )
+        assert finished.wait(20)
+    finally:
+        engine.close()
+        sensor.close()
+
+    assert [sample[:2] for sample in samples] == [[0, 0], [1, 0], [2, 0], [2, 1], [1, 1], [0, 1]]
+    assert [sample[2] for sample in samples] == [1000.0 * value for value in range(1, 7)]
+    # The program ran without any MDI commands from the driver
+    assert controller.log[0][1] == "G21 G90 G64"
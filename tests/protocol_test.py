@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import json
+import math
+from typing import List
+
+from src.protocol import CommandDispatcher
+from src.protocol import decode_frame
+from src.protocol import encode_frame
+from src.protocol import LineBuffer
+from src.protocol import parse_request
+from src.protocol import Session
+from src.protocol import STREAM_MARKER
+from src.sampling import FrameResult
+from src.sampling import SampleResult
+from src.sampling import SampleTiming
+
+
+def test_line_buffer_split_and_coalesced() -> None:
+    buffer = LineBuffer()
+
+    assert buffer.feed(b"TAKE_SAM") == []
+    assert buffer.feed(b"PLE\nZERO\r\n\nPI") == ["TAKE_SAMPLE", "ZERO"]
+    assert buffer.feed(b"NG\n") == ["PING"]
+
+
+def test_line_buffer_overflow() -> None:
+    buffer = LineBuffer(max_length=8)
+
+    assert buffer.feed(b"X" * 20) == []
+    assert buffer.overflowed
+    assert buffer.feed(b"X\nPING\n") == ["PING"]
+
+
+def test_parse_request() -> None:
+    request = parse_request("#12 take_samples 5")
+    assert (request.id, request.command, request.args) == ("12", "TAKE_SAMPLES", ["5"])
+
+    request = parse_request("ZERO")
+    assert (request.id, request.command, request.args) == ("", "ZERO", [])
+
+
+class FakeClient:
+    def __init__(self, name: str) -> None:
+        self.lines: List[str] = []
+        self.records: List[bytes] = []
+        self.backlog = 0
+        self.session = Session(name, self.receive, lambda: self.backlog)
+
+    def receive(self, data: bytes) -> None:
+        self.records.append(data)
+        if not data.startswith(STREAM_MARKER) and not data.startswith(b"{"):
+            self.lines.append(data.decode())
+
+
+class FakeSensor:
+    def __init__(self) -> None:
+        self.started: List[bool] = []
+        self.token = 0
+        self.dispatcher = CommandDispatcher(self.start_measurement, log=lambda _: None)
+
+    def start_measurement(self, zero: bool, token: int) -> None:
+        self.started.append(zero)
+        self.token = token
+
+    def finish(self, value: float) -> None:
+        self.dispatcher.measurement_complete(SampleResult(value, 0.0001, 10), self.token)
+
+
+def test_legacy_take_sample() -> None:
+    sensor = FakeSensor()
+    client = FakeClient("a")
+
+    sensor.dispatcher.feed(client.session, b"TAKE_SAMPLE\n")
+    assert sensor.started == [False]
+    sensor.finish(0.5)
+
+    assert client.lines[0].split(" ")[:2] == ["SAMPLE", "0.5"]
+    assert client.lines[0].endswith("\n")
+
+
+def test_measurements_it_did_not_start_are_ignored() -> None:
+    sensor = FakeSensor()
+    client = FakeClient("a")
+    sensor.dispatcher.feed(client.session, b"#1 TAKE_SAMPLES 2\n")
+
+    sensor.dispatcher.measurement_complete(SampleResult(9.0, 0.0001, 10))  # a sample from the GUI buttons
+    sensor.dispatcher.measurement_complete(SampleResult(9.0, 0.0001, 10), sensor.token - 1)  # an old one
+    assert client.lines == []
+    sensor.finish(1.0)
+    sensor.finish(2.0)
+    assert [line.split()[2] for line in client.lines] == ["1", "2"]
+
+
+def test_pipelined_requests_from_several_clients() -> None:
+    sensor = FakeSensor()
+    a = FakeClient("a")
+    b = FakeClient("b")
+
+    sensor.dispatcher.feed(a.session, b"#1 ZERO\n#2 TAKE_SAMPLE\n")
+    sensor.dispatcher.feed(b.session, b"#1 TAKE_SAMPLE\n")
+    sensor.dispatcher.feed(b.session, b"#2 PING\n")  # answered straight away, no measurement needed
+
+    assert b.lines == ["#2 PONG\n"]
+    assert sensor.started == [True]  # one measurement at a time
+
+    sensor.finish(0.0)
+    sensor.finish(1.0)
+    sensor.finish(2.0)
+
+    assert sensor.started == [True, False, False]
+    assert [line.split()[:3] for line in a.lines] == [["#1", "ZERO_COMPLETE", "unc=0.0001"], ["#2", "SAMPLE", "1"]]
+    assert b.lines[1].split()[:3] == ["#1", "SAMPLE", "2"]
+    assert "n=10" in b.lines[1].split()
+    assert not sensor.dispatcher.busy
+
+
+def test_batched_samples() -> None:
+    sensor = FakeSensor()
+    a = FakeClient("a")
+    b = FakeClient("b")
+
+    sensor.dispatcher.feed(a.session, b"#5 TAKE_SAMPLES 3\n")
+    sensor.dispatcher.feed(b.session, b"TAKE_SAMPLE\n")
+    for value in range(4):
+        sensor.finish(float(value))
+
+    assert [line.split()[-1] for line in a.lines] == ["i=1/3", "i=2/3", "i=3/3"]
+    assert b.lines[0].split()[1] == "3"
+
+
+def test_errors_and_disconnect() -> None:
+    sensor = FakeSensor()
+    a = FakeClient("a")
+    b = FakeClient("b")
+
+    sensor.dispatcher.feed(a.session, b"#3 BOGUS\n#4 TAKE_SAMPLES lots\n")
+    assert [line.split()[:2] for line in a.lines] == [["#3", "ERROR"], ["#4", "ERROR"]]
+
+    # a disconnects with a batch running, its queued work is dropped and b is served next
+    sensor.dispatcher.feed(a.session, b"TAKE_SAMPLES 5\n")
+    sensor.dispatcher.feed(b.session, b"TAKE_SAMPLE\n")
+    sensor.dispatcher.close(a.session)
+    sensor.finish(1.0)
+    sensor.finish(2.0)
+
+    assert len(a.lines) == 2
+    assert b.lines[0].split()[1] == "2"
+
+
+def frames(count: int, fps: float = 128.0) -> List[FrameResult]:
+    return [FrameResult(i, 10.0 + i / fps, 500.0 + i, 0.001 * i, 0.9) for i in range(count)]
+
+
+def test_encode_frame() -> None:
+    result = FrameResult(7, 12.5, 612.25, float("nan"), 0.5)
+
+    record = json.loads(encode_frame(result, "ndjson"))
+    assert record == {"frame": 7, "t": 12.5, "centre": 612.25, "value": None, "quality": 0.5}
+
+    data = encode_frame(result, "bin")
+    assert data.startswith(STREAM_MARKER)
+    decoded = decode_frame(data)
+    assert (decoded.frame, decoded.timestamp, decoded.centre) == (7, 12.5, 612.25)
+    assert math.isnan(decoded.value)
+
+
+def test_stream_rate_limit() -> None:
+    sensor = FakeSensor()
+    fast = FakeClient("fast")
+    slow = FakeClient("slow")
+
+    sensor.dispatcher.feed(fast.session, b"#1 STREAM\n")
+    sensor.dispatcher.feed(slow.session, b"#1 STREAM 16 bin\n")
+    assert fast.lines == ["#1 STREAMING rate=0 format=ndjson\n"]
+    assert slow.lines == ["#1 STREAMING rate=16 format=bin\n"]
+
+    for result in frames(128):  # one second of frames
+        sensor.dispatcher.publish(result)
+
+    assert [json.loads(r)["frame"] for r in fast.records[1:]] == list(range(128))
+    assert [decode_frame(r).frame for r in slow.records[1:]] == list(range(0, 128, 8))
+
+    # Sampling still works while streaming
+    sensor.dispatcher.feed(fast.session, b"#2 TAKE_SAMPLE\n")
+    sensor.finish(0.5)
+    assert fast.lines[-1].split()[:3] == ["#2", "SAMPLE", "0.5"]
+
+
+def test_stream_drops_for_slow_consumer() -> None:
+    sensor = FakeSensor()
+    client = FakeClient("a")
+    sensor.dispatcher.feed(client.session, b"STREAM\n")
+
+    results = frames(10)
+    for result in results[:3]:
+        sensor.dispatcher.publish(result)
+    client.backlog = 10**6  # the socket stopped draining
+    for result in results[3:6]:
+        sensor.dispatcher.publish(result)
+    client.backlog = 0
+    for result in results[6:]:
+        sensor.dispatcher.publish(result)
+
+    assert [json.loads(r)["frame"] for r in client.records[1:]] == [0, 1, 2, 6, 7, 8, 9]
+
+    sensor.dispatcher.feed(client.session, b"#9 STOP_STREAM\n")
+    assert client.lines[-1] == "#9 STREAM_STOPPED sent=7 dropped=3\n"
+    sensor.dispatcher.publish(results[0])
+    assert len(client.records) == 9
+
+    sensor.dispatcher.feed(client.session, b"STREAM fast\n")
+    assert client.lines[-1].startswith("ERROR")
+
+
+def test_timing_breakdown() -> None:
+    sensor = FakeSensor()
+    client = FakeClient("a")
+    sensor.dispatcher.feed(client.session, b"#1 TIMING ON\n#2 TAKE_SAMPLE\n")
+    assert client.lines == ["#1 TIMING ON\n"]
+
+    job = sensor.dispatcher.active
+    assert job is not None
+    job.queued, job.started = 100.0, 100.5
+    timing = SampleTiming(first_frame=100.52, last_frame=101.0, computed=101.01)
+    sensor.dispatcher.measurement_complete(SampleResult(0.25, 0.001, 10, timing), sensor.token)
+
+    fields = dict(field.split("=") for field in client.lines[-1].split()[3:])
+    assert float(fields["queue_ms"]) == 500.0
+    assert abs(float(fields["wait_ms"]) - 20.0) < 0.1
+    assert abs(float(fields["frames_ms"]) - 480.0) < 0.1
+    assert abs(float(fields["compute_ms"]) - 10.0) < 0.1
+
+    sensor.dispatcher.feed(client.session, b"#3 TIMING OFF\n#4 TAKE_SAMPLE\n")
+    sensor.finish(0.5)
+    assert "queue_ms" not in client.lines[-1]
+
+    sensor.dispatcher.feed(client.session, b"#5 TIMING_STATS\n")
+    stats = client.lines[-1].split()
+    assert stats[:3] == ["#5", "TIMING_STATS", "n=2"]
+    assert stats[3].startswith("queue_ms=")
+    assert any(field.startswith("frames_ms=480.0/") for field in stats)  # the nan timings are left out
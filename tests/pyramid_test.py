@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from src.pyramid import block_centres
+from src.pyramid import cells_for_view
+from src.pyramid import HeightmapPyramid
+from src.pyramid import PyramidCache
+from src.pyramid import reduce_blocks
+
+
+@pytest.fixture
+def heightmap() -> np.ndarray:
+    data = np.random.default_rng(0).normal(size=(301, 450))
+    data[::7, ::5] = np.nan
+    data[np.ix_(range(0, 4), range(0, 4))] = np.nan  # a whole block without values
+    return data
+
+
+def brute_level(data: np.ndarray, level: int) -> np.ndarray:
+    size = 2**level
+    rows, columns = -(-data.shape[0] // size), -(-data.shape[1] // size)
+    out = np.full((rows, columns), np.nan)
+    for r in range(rows):
+        for c in range(columns):
+            block = data[slice(r * size, (r + 1) * size), slice(c * size, (c + 1) * size)]
+            if np.isfinite(block).any():
+                out[r, c] = np.nanmean(block)
+    return out
+
+
+def test_reduce_blocks_and_centres() -> None:
+    assert reduce_blocks(np.arange(15).reshape(3, 5)).tolist() == [[12, 20, 13], [21, 25, 14]]
+    assert block_centres(5, 1).tolist() == [0.5, 2.5, 4.0]
+    assert block_centres(5, 0).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_levels_match_block_means(heightmap: np.ndarray) -> None:
+    pyramid = HeightmapPyramid(heightmap)
+    assert pyramid.levels == 9
+    assert max(pyramid.level(pyramid.levels - 1).shape) <= 2
+    assert np.array_equal(pyramid.level(0), heightmap, equal_nan=True)
+    for level in (1, 3, 5):
+        assert np.allclose(pyramid.level(level), brute_level(heightmap, level), equal_nan=True)
+    assert np.isnan(pyramid.level(2)[0, 0])
+
+
+def test_update(heightmap: np.ndarray) -> None:
+    pyramid = HeightmapPyramid(heightmap)
+    pyramid.level(4)  # cached levels are updated too
+    for row, column, value in [(0, 0, 3.0), (7, 5, 1.5), (100, 200, np.nan), (0, 0, -1.0)]:
+        heightmap[row, column] = value
+        pyramid.update(row, column, value)
+    for level in (0, 2, 4):
+        assert np.allclose(pyramid.level(level), brute_level(heightmap, level), equal_nan=True)
+
+
+def test_select(heightmap: np.ndarray) -> None:
+    pyramid = HeightmapPyramid(heightmap)
+    level, rows, columns = pyramid.select(10000)
+    assert level == 2 and (rows, columns) == (slice(0, 76), slice(0, 113))  # 76 * 113 cells
+    assert pyramid.select(10**6)[0] == 0
+
+    # Zoomed in the view gets full resolution for the cells in it
+    level, rows, columns = pyramid.select(10000, (100.0, 149.5, 20.0, 60.0))
+    assert level == 0 and (rows, columns) == (slice(20, 61), slice(100, 151))
+    assert pyramid.select(10000, (-50.0, 1000.0, -50.0, 1000.0)) == pyramid.select(10000)
+    assert pyramid.select(1)[0] == pyramid.levels - 1
+    assert cells_for_view(400, 400) == 10000
+
+
+def test_cache(heightmap: np.ndarray) -> None:
+    cache = PyramidCache()
+    first = cache.get(heightmap, 1)
+    assert cache.get(heightmap, 1) is first
+    assert cache.get(heightmap, 2) is not first
+    assert cache.get(heightmap[:10], 2).shape == (10, 450)
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import List
+
+from PySide6.QtNetwork import QHostAddress
+from PySide6.QtNetwork import QTcpSocket
+
+from src.protocol import decode_frame
+from src.protocol import STREAM_RECORD
+from src.s_server import MeasurementServer
+from src.sampling import FrameResult
+from src.sampling import SampleResult
+
+
+def test_measurement_server(qtbot: Any) -> None:
+    server = MeasurementServer()
+    values = iter([0.0, 0.25, 0.5])
+    server.zero.connect(lambda token: server.measurement_complete(SampleResult(next(values), 0.001, 5), token))
+    server.take_sample.connect(lambda token: server.measurement_complete(SampleResult(next(values), 0.001, 5), token))
+    assert server.listen("127.0.0.1", 0)
+
+    lines: List[bytes] = []
+    client = QTcpSocket()
+    client.readyRead.connect(lambda: lines.extend(client.readAll().data().splitlines()))
+    client.connectToHost(QHostAddress("127.0.0.1"), server.port())
+    assert client.waitForConnected(5000)
+
+    # A command split over two writes, then two coalesced into one
+    client.write(b"#1 ZE")
+    client.flush()
+    qtbot.wait(50)
+    client.write(b"RO\n#2 TAKE_SAMPLE\n#3 TAKE_SAMPLE\n")
+    qtbot.waitUntil(lambda: len(lines) == 3, timeout=5000)
+
+    assert lines[0].split()[:2] == [b"#1", b"ZERO_COMPLETE"]
+    assert lines[1].split()[:3] == [b"#2", b"SAMPLE", b"0.25"]
+    assert lines[2].split()[:3] == [b"#3", b"SAMPLE", b"0.5"]
+
+    client.disconnectFromHost()
+    server.close()
+
+
+def test_stream_subscription(qtbot: Any) -> None:
+    server = MeasurementServer()
+    assert server.listen("127.0.0.1", 0)
+
+    data = bytearray()
+    client = QTcpSocket()
+    client.readyRead.connect(lambda: data.extend(client.readAll().data()))
+    client.connectToHost(QHostAddress("127.0.0.1"), server.port())
+    assert client.waitForConnected(5000)
+
+    client.write(b"#1 STREAM bin\n")
+    qtbot.waitUntil(lambda: data.endswith(b"\n"), timeout=5000)
+    assert bytes(data) == b"#1 STREAMING rate=0 format=bin\n"
+    data.clear()
+
+    for i in range(3):
+        server.publish_frame(FrameResult(i, float(i), 100.0 + i, 0.0, 1.0))
+    size = STREAM_RECORD.size + 1
+    qtbot.waitUntil(lambda: len(data) == 3 * size, timeout=5000)
+    assert [decode_frame(bytes(data[i:][:size])).centre for i in range(0, len(data), size)] == [100.0, 101.0, 102.0]
+
+    client.disconnectFromHost()
+    server.close()
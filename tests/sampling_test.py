@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+import math
+
+from src.sampling import FrameResult
+from src.sampling import subsample
+from src.sampling import trimmed_mean
+
+
+def test_trimmed_mean() -> None:
+    stats = trimmed_mean([1.0, 2.0, 3.0, 100.0], 0.5)
+    assert (stats.mean, stats.std_err, stats.count) == (2.5, 0.5, 2)
+
+
+def test_trimmed_mean_single() -> None:
+    stats = trimmed_mean([4.0], 0.3)
+    assert (stats.mean, stats.std_err, stats.count) == (4.0, 0.0, 1)
+    assert math.isnan(trimmed_mean([], 0.0).mean)
+
+
+def test_subsample_keeps_fractions() -> None:
+    # Both the GUI and the headless daemon average these, a fraction of a pixel is microns on most sensors
+    assert subsample(FrameResult(1, 0.0, 120.6, float("nan"), 1.0)) == 120.6
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from typing import Any
+from typing import List
+
+import numpy as np
+import pytest
+
+from src.CNC_jobs.engine import JobEngine
+from src.CNC_jobs.scan import align
+from src.CNC_jobs.scan import bin_profile
+from src.CNC_jobs.scan import estimate_clock_offset
+from src.CNC_jobs.scan import scan_grid
+from src.CNC_jobs.scan import scan_lines
+from src.CNC_jobs.simulator import SimulatedController
+from src.sampling import FrameResult
+from tests.client_test import StandInSensor
+
+SENSOR_CLOCK = 1000.0  # the sensor's clock is this far ahead of the driver's
+
+
+def surface(x: float, y: float) -> float:
+    """Height in mm"""
+    return 0.001 * x + 0.002 * y
+
+
+def test_scan_lines_serpentine() -> None:
+    assert scan_lines(10.0, 3, 5.0) == [((0, 0), (10, 0)), ((10, 5), (0, 5)), ((0, 10), (10, 10))]
+
+
+def test_align_and_bin() -> None:
+    positions = np.array([[10.0, 0.0, 0.0, 0.0, 0.0], [12.0, 20.0, 0.0, 0.0, 0.0]])  # 10 mm/s from t=10
+    frame_times = np.arange(9.0, 13.0, 0.01) + SENSOR_CLOCK + 0.05  # 50 ms exposure lag
+    values = (frame_times - SENSOR_CLOCK - 0.05 - 10.0) * 10.0 * 0.001  # 1 um per mm along X
+    received = frame_times - SENSOR_CLOCK + np.random.default_rng(0).uniform(0.001, 0.01, len(frame_times))
+
+    offset = estimate_clock_offset(frame_times, received)
+    placed, kept = align(frame_times, values, positions, offset, lag=0.05)
+
+    assert offset == pytest.approx(-SENSOR_CLOCK, abs=0.0011)
+    assert placed[0, 0] >= 0.0 and placed[-1, 0] <= 20.0
+    assert np.allclose(kept * 1000, placed[:, 0], atol=0.02)
+
+    profile = bin_profile(placed[:, 0], kept, 1.0, 25)
+    assert np.allclose(profile[1:20] * 1000, np.arange(1, 20), atol=0.05)
+    assert np.allclose(profile[[0, 20]] * 1000, [0.25, 19.75], atol=0.1)  # the end columns only see half their span
+    assert np.isnan(profile[21:]).all()
+
+
+def test_scan_job_aligns_streamed_frames() -> None:
+    sensor = StandInSensor(delay=0.005)
+    controller = SimulatedController(time_scale=1.0)
+    engine = JobEngine(controller)
+    samples: List[Any] = []
+    streaming = threading.Event()
+
+    def stream() -> None:
+        # A camera at 200 fps looking at the surface under the machine's current position
+        for frame in itertools.count():
+            if streaming.is_set():
+                return
+            now = time.monotonic()
+            x, y, _, w = controller.position_at(now)
+            value = surface(x, y) if w == 0.0 else float("nan")
+            sensor.publish(FrameResult(frame, now + SENSOR_CLOCK, 600.0, value, 0.9))
+            time.sleep(0.005)
+
+    publisher = threading.Thread(target=stream, daemon=True)
+    publisher.start()
+    try:
+        connected, finished = threading.Event(), threading.Event()
+        engine.connect("127.0.0.1", sensor.port, lambda _: connected.set())
+        assert connected.wait(5)
+        assert engine.start(
+            lambda job: scan_grid(job, 10.0, 2, 5.0, 1.0, lift=1.0, feed=1200.0), samples.append, finished.set
+        )
+        assert finished.wait(30)
+    finally:
+        streaming.set()
+        engine.close()
+        sensor.close()
+
+    cells = {(column, row): value for column, row, value in samples}
+    assert len(cells) > 15  # 11 columns per line, the ends can be missed while speeding up
+    for (column, row), value in cells.items():
+        assert value == pytest.approx(1000 * surface(column * 1.0, row * 5.0), abs=0.5)
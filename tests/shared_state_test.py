@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import math
+import os
+import subprocess
+import sys
+import threading
+from typing import Iterator
+
+import pytest
+
+from src.sampling import FrameResult
+from src.shared_state import OWNER
+from src.shared_state import OWNER_OFFSET
+from src.shared_state import SharedStateReader
+from src.shared_state import SharedStateWriter
+
+
+@pytest.fixture
+def writer() -> Iterator[SharedStateWriter]:
+    writer = SharedStateWriter(f"llwc_test_{os.getpid()}", time_constant=1.0)
+    yield writer
+    writer.close()
+
+
+def test_publish_and_read(writer: SharedStateWriter) -> None:
+    reader = SharedStateReader(writer.name)
+    first = reader.read()
+    assert first is not None and first.frame == 0 and math.isnan(first.value)
+
+    writer.publish(FrameResult(1, 10.0, 612.5, 0.5, 0.8))
+    writer.publish(FrameResult(2, 11.0, 600.5, 1.5, 0.7))
+    latest = reader.read()
+    assert latest is not None
+    assert (latest.frame, latest.timestamp, latest.centre, latest.value, latest.quality) == (2, 11.0, 600.5, 1.5, 0.7)
+    assert abs(latest.filtered - (0.5 + (1.0 - math.exp(-1.0)))) < 1e-9  # one time constant after a step of 1
+
+    writer.publish(FrameResult(3, 12.0, 0.0, float("nan"), 0.0))
+    writer.publish(FrameResult(4, 13.0, 600.5, 2.0, 0.7))
+    latest = reader.read()
+    assert latest is not None and latest.filtered == 2.0  # the filter restarts after a frame without a value
+    reader.close()
+
+
+def test_reader_process_leaves_block(writer: SharedStateWriter) -> None:
+    writer.publish(FrameResult(7, 1.0, 2.0, 3.0, 0.5))
+    code = f"from src.shared_state import SharedStateReader; print(SharedStateReader({writer.name!r}).read().frame)"
+    for _ in range(2):  # the block must outlive the first reader
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        assert output.strip() == "7"
+
+
+def test_reads_are_consistent_while_writing(writer: SharedStateWriter) -> None:
+    reader = SharedStateReader(writer.name)
+    done = threading.Event()
+
+    def write() -> None:
+        frame = 0
+        while not done.is_set():
+            frame += 1
+            writer.publish(FrameResult(frame, float(frame), 2.0 * frame, 3.0 * frame, 0.5))
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        for _ in range(20000):
+            latest = reader.read()
+            if latest is not None:
+                assert latest.centre == 2.0 * latest.frame and latest.value == 3.0 * latest.frame
+    finally:
+        done.set()
+        thread.join()
+        reader.close()
+
+
+def test_one_writer_per_block(writer: SharedStateWriter) -> None:
+    with pytest.raises(FileExistsError):
+        SharedStateWriter(writer.name)
+
+    # A writer that died without closing leaves its block to the next one
+    exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    OWNER.pack_into(writer.buffer, OWNER_OFFSET, int(exited.stdout))
+    second = SharedStateWriter(writer.name)
+    second.publish(FrameResult(5, 1.0, 2.0, 3.0, 0.5))
+    reader = SharedStateReader(writer.name)
+    latest = reader.read()
+    assert latest is not None and latest.frame == 5
+    reader.close()
+    second.close()
+
+
+def test_close_leaves_a_block_it_lost() -> None:
+    writer = SharedStateWriter(f"llwc_test_lost_{os.getpid()}")
+    other = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        OWNER.pack_into(writer.buffer, OWNER_OFFSET, other.pid)  # as if the other process had taken it
+        with pytest.raises(FileExistsError):
+            SharedStateWriter(writer.name)
+        writer.close()
+        reader = SharedStateReader(writer.name)  # still there for its writer
+        reader.memory.unlink()
+        reader.close()
+    finally:
+        other.kill()
+        other.wait()
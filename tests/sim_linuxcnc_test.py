@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import threading
+from typing import Any
+from typing import List
+
+import pytest
+
+from src.CNC_jobs.engine import JobEngine
+from src.CNC_jobs.engine import LinuxCNCMachine
+from src.CNC_jobs.paths import grid_points
+from src.CNC_jobs.paths import move_time
+from src.CNC_jobs.paths import snap_to_grid
+from src.CNC_jobs.probe import probe_grid
+from src.CNC_jobs.probe import probe_program
+from src.CNC_jobs.program import grid_program
+from src.CNC_jobs.program import ProgramAborted
+from src.CNC_jobs.sim_linuxcnc import SimulatedLinuxCNC
+from src.CNC_jobs.sim_sensor import SimulatedSensorServer
+from src.CNC_jobs.simulator import SimulatedController
+
+
+@pytest.fixture
+def task() -> Any:
+    simulated = SimulatedLinuxCNC(command_latency=0.01)
+    yield simulated
+    simulated.close()
+
+
+def machine_for(task: SimulatedLinuxCNC) -> LinuxCNCMachine:
+    return LinuxCNCMachine(poll_interval=0.001, linuxcnc_module=task, hal_module=task.hal)
+
+
+def tilted(x: float, y: float) -> float:
+    return 0.001 * x - 0.002 * y
+
+
+def test_mdi_commands(task: SimulatedLinuxCNC) -> None:
+    machine = machine_for(task)
+    assert machine.ready()
+
+    async def job() -> None:
+        await machine.start()
+        await machine.run("G0 X30")
+        await machine.run("G1 F600 Y10")
+
+    asyncio.run(job())
+    machine.s.poll()
+    assert machine.s.actual_position[0:3] == (30.0, 10.0, 0.0)
+    assert machine.s.task_mode == task.MODE_MDI
+    assert machine.s.interp_state == task.INTERP_IDLE
+    expected = float(move_time(30.0, 3000.0, 500.0) + move_time(10.0, 600.0, 500.0)) + 2 * 0.01
+    assert task.clock == pytest.approx(expected)
+    assert machine.errors.poll() is None
+
+
+def test_commands_are_refused_outside_mdi_mode(task: SimulatedLinuxCNC) -> None:
+    machine = machine_for(task)
+    machine.c.mdi("G0 X10")
+    assert machine.c.wait_complete() == task.RCS_DONE
+    machine.s.poll()
+    assert machine.s.actual_position[0] == 0.0
+    kind, text = machine.errors.poll()
+    assert kind == task.OPERATOR_ERROR and "MDI mode" in text
+
+    machine.c.mode(task.MODE_AUTO)
+    machine.c.auto(task.AUTO_RUN, 0)
+    assert "none is open" in machine.errors.poll()[1]
+
+
+def test_queue_and_abort() -> None:
+    task = SimulatedLinuxCNC(time_scale=1.0, command_latency=0.0)
+    try:
+        machine = machine_for(task)
+        machine.c.mode(task.MODE_MDI)
+        for x in (100, 200, 300):
+            machine.c.mdi(f"G0 X{x}")
+        machine.s.poll()
+        assert machine.s.interp_state == task.INTERP_READING
+        # The mode doesn't change while the queue runs
+        machine.c.mode(task.MODE_MANUAL)
+        assert "Can't change modes" in machine.errors.poll()[1]
+
+        machine.c.abort()
+        machine.s.poll()
+        assert machine.s.interp_state == task.INTERP_IDLE
+        assert machine.s.actual_position[0] < 100.0
+    finally:
+        task.close()
+
+
+def test_axis_limits() -> None:
+    controller = SimulatedController(axis_limits={"X": (3000.0, 500.0), "Z": (600.0, 100.0)})
+    origin = {"X": 0.0, "Y": 0.0, "Z": 0.0, "W": 0.0}
+    along_x = controller.move_duration(origin, dict(origin, X=10.0), 3000.0)
+    diagonal = controller.move_duration(origin, dict(origin, X=10.0, Z=10.0), 3000.0)
+    assert along_x == pytest.approx(float(move_time(10.0, 3000.0, 500.0)))
+    # Z holds the move to 600 mm/min and 100 mm/s^2 along Z, so along the move to sqrt(2) times that
+    assert diagonal == pytest.approx(float(move_time(10.0 * math.sqrt(2), 600.0 * math.sqrt(2), 100.0 * math.sqrt(2))))
+
+
+def run_job(task: SimulatedLinuxCNC, sensor: SimulatedSensorServer, job: Any) -> List[list]:
+    engine = JobEngine(machine_for(task))
+    samples: List[list] = []
+    try:
+        connected, finished = threading.Event(), threading.Event()
+        engine.connect("127.0.0.1", sensor.port, lambda _: connected.set())
+        assert connected.wait(5)
+        assert engine.start(job, samples.append, finished.set)
+        assert finished.wait(30)
+    finally:
+        engine.close()
+    return samples
+
+
+def test_probe_job_on_the_simulated_machine(task: SimulatedLinuxCNC) -> None:
+    sensor = SimulatedSensorServer(task, tilted, measure_time=0.3)
+    try:
+        samples = run_job(task, sensor, lambda job: probe_grid(job, 3, 2, 10.0, 5.0, method="Serpentine"))
+    finally:
+        sensor.close()
+
+    assert len(samples) == 6
+    for column, row, value in samples:
+        assert value == pytest.approx(1000.0 * tilted(10.0 * column, 10.0 * row))  # um
+    # The samples (and the zero) are a good part of the predicted time
+    assert task.clock > 7 * 0.3
+    assert task.controller.log[0][1] == "G64"
+
+
+def test_probe_program_on_the_simulated_machine(task: SimulatedLinuxCNC) -> None:
+    sensor = SimulatedSensorServer(task, tilted, measure_time=0.1)
+    indices, _ = snap_to_grid(grid_points(3, 2, 10.0))
+    try:
+        program = grid_program(3, 2, 10.0, 5.0)
+        samples = run_job(task, sensor, lambda job: probe_program(job, program, indices))
+    finally:
+        sensor.close()
+
+    assert [sample[:2] for sample in samples] == [[0, 0], [1, 0], [2, 0], [2, 1], [1, 1], [0, 1]]
+    for column, row, value in samples:
+        assert value == pytest.approx(1000.0 * tilted(10.0 * column, 10.0 * row))
+    assert task.hal.signals["laser-level-probe-ack"] == ["laser-level-probe.ack", "motion.digital-in-00"]
+
+
+def test_program_errors_reach_the_error_channel(task: SimulatedLinuxCNC) -> None:
+    machine = machine_for(task)
+
+    async def request(index: int) -> None:
+        pass
+
+    with pytest.raises(ProgramAborted, match="broken"):
+        asyncio.run(machine.run_program("(abort, broken)\nM2\n", request))
@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+
+from src.startup import preload_modules
+
+
+def test_heavy_modules_not_imported() -> None:
+    code = "import sys, src.Widgets, src.curves; print(sorted(m for m in ('matplotlib', 'scipy') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+
+def test_preload_modules() -> None:
+    thread = preload_modules(["json", "this_module_does_not_exist"])
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert "json" in sys.modules
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import base64
+import json
+
+import numpy as np
+
+from src.surface_plot import encode_grid
+from src.surface_plot import plot_layout
+from src.surface_plot import set_point_call
+from src.surface_plot import set_surface_call
+from src.surface_plot import surface_page
+
+
+def test_encode_grid() -> None:
+    data = np.array([[1.0, np.nan, -2.5], [3.0, 4.0, 1e-6]])
+    decoded = np.frombuffer(base64.b64decode(encode_grid(data)), dtype="<f8").reshape(data.shape)
+    assert np.array_equal(decoded, data, equal_nan=True)
+    assert encode_grid(data.T) == encode_grid(np.ascontiguousarray(data.T))  # row major whatever the layout
+
+
+def test_calls() -> None:
+    call = set_surface_call(np.zeros((2, 3)))
+    assert call.startswith('setSurface("') and call.endswith(", [0.0, 2.0], [0.0, 1.0])")
+    x = np.array([0.5, 2.5])
+    assert f'"{encode_grid(x)}"' in set_surface_call(np.zeros((1, 2)), x, np.zeros(1), (0.0, 9.0, 0.0, 0.0))
+    assert set_surface_call(np.zeros((1, 2)), x, np.zeros(1), (0.0, 9.0, 0.0, 0.0)).endswith("[0.0, 9.0], [0.0, 0.0])")
+    assert set_point_call(np.int64(4), 2, 1.25) == "setPoint(4, 2, 1.25)"
+    assert set_point_call(0, 0, float("nan")) == "setPoint(0, 0, null)"
+
+
+def test_page() -> None:
+    layout = json.loads(plot_layout(600))
+    assert layout["uirevision"] == "keep"  # keeps the camera
+    assert layout["width"] == layout["height"] == 600
+    page = surface_page(600)
+    assert '<script src="plotly.js">' in page
+    assert "function setSurface(" in page and "function setPoint(" in page
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from src.surface import best_fit_plane
+from src.surface import bicubic
+from src.surface import fill_grid
+from src.surface import FlatnessTracker
+from src.surface import grid_points
+from src.surface import interpolator
+from src.surface import min_zone
+from src.surface import Plane
+from src.surface import plane_flatness
+
+
+def tilted_points(n: int, noise: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 300, (n, 2))
+    z = 0.01 * xy[:, 0] - 0.02 * xy[:, 1] + 5 + rng.uniform(-noise, noise, n)
+    return np.column_stack((xy, z))
+
+
+def test_grid_points() -> None:
+    data = np.array([[1.0, 2.0], [np.nan, 4.0]])
+    assert grid_points(data, (10.0, 5.0)).tolist() == [[0, 0, 1], [10, 0, 2], [10, 5, 4]]
+
+
+def test_best_fit_plane() -> None:
+    points = tilted_points(1000, 0.0)
+    plane = best_fit_plane(points)
+    assert (plane.a, plane.b, plane.c) == pytest.approx((0.01, -0.02, 5.0))
+    assert plane_flatness(points) == pytest.approx(0.0, abs=1e-9)
+
+
+def test_min_zone() -> None:
+    # A zone 0.02 thick around a tilted plane, with points touching both sides
+    points = tilted_points(20000, 0.01)
+    points[0, 2] = 0.01 * points[0, 0] - 0.02 * points[0, 1] + 5.01
+    points[1, 2] = 0.01 * points[1, 0] - 0.02 * points[1, 1] + 4.99
+    zone, plane = min_zone(points)
+    assert zone == pytest.approx(0.02, abs=1e-3)
+    assert zone <= plane_flatness(points) + 1e-12
+    assert (plane.a, plane.b, plane.c) == pytest.approx((0.01, -0.02, 5.0), abs=1e-4)
+    assert np.abs(plane.residuals(points)).max() <= zone / 2 + 1e-9
+
+
+def test_min_zone_beats_the_plane() -> None:
+    # A raised corner, tilting the zone to it beats the least squares plane
+    data = np.zeros((10, 10))
+    data[0, 0] = 1.0
+    points = grid_points(data)
+    assert min_zone(points)[0] == pytest.approx(17 / 18)  # the plane through the raised corner and the far edges
+    assert plane_flatness(points) == pytest.approx(0.99454545)
+    assert min_zone(np.zeros((0, 3)))[0] == 0.0
+
+
+def test_tracker_matches_a_full_solve() -> None:
+    points = tilted_points(500, 0.01, seed=3)
+    tracker = FlatnessTracker()
+    for point in points:
+        tracker.add(*point)
+        assert tracker.zone <= tracker.flatness + 1e-9
+
+    assert tracker.count == 500
+    assert tracker.flatness == pytest.approx(plane_flatness(points))
+    assert tracker.zone == pytest.approx(min_zone(points)[0])
+
+    assert len(tracker.hull) < 250  # only the points that can still be on the hull are kept
+    tracker.add(0.0, 0.0, np.nan)  # not probed
+    assert tracker.count == 500
+    tracker.reset()
+    assert tracker.count == 0 and tracker.flatness == 0.0
+
+
+@pytest.mark.parametrize("method", ["Linear", "Cubic", "Thin Plate"])
+def test_interpolators_reproduce_a_plane(method: str) -> None:
+    points = tilted_points(300, 0.0)
+    xi = np.random.default_rng(1).uniform(50, 250, (100, 2))
+    values = interpolator(points, method)(xi)
+    assert values == pytest.approx(Plane(0.01, -0.02, 5.0)(xi[:, 0], xi[:, 1]), abs=1e-6)
+
+
+def test_fill_grid() -> None:
+    rows, columns = np.indices((20, 30))
+    surface = 0.001 * (columns - 15) ** 2 + 0.002 * rows
+    data = surface.copy()
+    data[np.ix_(range(10, 12), range(3, 8))] = np.nan
+    for method in ["Cubic", "Thin Plate"]:
+        assert np.abs(fill_grid(data, method) - surface).max() < 0.002
+    assert np.isnan(fill_grid(data, "None")).sum() == 10
+
+
+def test_bicubic() -> None:
+    rows, columns = np.indices((20, 30))
+    spline = bicubic((0.1 * rows + 0.2 * columns) ** 2, (2.0, 1.0))
+    assert spline(np.array([5.0]), np.array([3.5])) == pytest.approx((0.35 + 0.5) ** 2)